@@ -2,7 +2,7 @@
 
 varying vec2 uv;
 
-int max_iter_count;
+uniform int max_iter_count = 1024; // diff 64
 uniform float zoom = 0.0065; // diff 0.0005
 uniform float x = -1.3730; // diff 0.1
 uniform float y = 0.0045; // diff 0.1
@@ -17,8 +17,6 @@ float sqr_norm_dZ;
 
 void
 main() {
-  max_iter_count = 1024;
-
   Z = uv;
   dZ = vec2(1., 0.);
 
@@ -0,0 +1,79 @@
+#version 130
+
+// Perturbation theory variant of julia.f.glsl for deep zooms.
+// The orbit of the view centre is iterated at high precision on the CPU by
+// deep_zoom.py and uploaded as a texture. Each pixel only iterates its (small)
+// offset from that reference orbit, which stays accurate in single precision.
+
+#define orbit_width 1024
+#define base_pixel 0.0078125
+
+uniform float zoom = 0.0078125;    // diff 0.0005
+uniform float x = -1.3730;         // diff 0.1
+uniform float y = 0.0045;          // diff 0.1
+uniform float cx = 0.0;            // diff 0.1
+uniform float cy = 0.0;            // diff 0.1
+uniform int max_iter_count = 1024; // diff 64
+
+uniform sampler2D orbit;  // reference orbit, one iteration per texel
+uniform vec4 orbit_info;  // orbit length, skipped iterations, viewport centre x, y
+uniform vec4 series_ab;   // series approximation coefficients A and B
+uniform vec4 series_cd;   // series coefficient C and derivative D
+uniform vec2 series_e;    // derivative coefficient E
+
+vec2 cmul(vec2 a, vec2 b);
+vec2 ref(int iter);
+
+void
+main() {
+  int ref_len = int(orbit_info.x);
+  int skip = int(orbit_info.y);
+  vec2 d0 = (gl_FragCoord.xy - orbit_info.zw) * zoom;
+
+  // Jump over the first iterations using the series approximation
+  vec2 d0_2 = cmul(d0, d0);
+  vec2 dz = cmul(series_ab.xy, d0) + cmul(series_ab.zw, d0_2) + cmul(series_cd.xy, cmul(d0_2, d0));
+  vec2 dZ = series_cd.zw + cmul(series_e, d0);
+  int ref_iter = skip;
+  vec2 Z = ref(ref_iter) + dz;
+
+  int iter_count;
+  for(iter_count = skip; iter_count < max_iter_count; ++iter_count) {
+    if (dot(Z, Z) > 1e7)
+      break;
+
+    dZ = 2. * cmul(Z, dZ) + vec2(1., 0.);
+    // d' = 2zd + d^2
+    dz = cmul(2. * ref(ref_iter) + dz, dz);
+    ++ref_iter;
+    Z = ref(ref_iter) + dz;
+
+    // Rebase on the start of the orbit once it's closer than the current reference,
+    // or when the reference orbit has escaped
+    vec2 from_start = Z - ref(0);
+    if (dot(from_start, from_start) < dot(dz, dz) || ref_iter >= ref_len - 1) {
+      dz = from_start;
+      ref_iter = 0;
+    }
+  }
+
+  float sqr_norm_Z = dot(Z, Z);
+  float sqr_norm_dZ = dot(dZ, dZ);
+  vec4 color0 = vec4(1.0, 0.0, 0.0, 1.0);
+  vec4 color1 = vec4(1.0, 1.0, 0.0, 1.0);
+
+  // Distance estimate is scaled to pixels so colouring doesn't fade out when zoomed
+  gl_FragColor = mix(
+    color0,
+    color1,
+    sqrt(sqrt(sqr_norm_Z / sqr_norm_dZ) * .5 * log(sqr_norm_Z) * base_pixel / zoom)
+  );
+}
+
+vec2 cmul(vec2 a, vec2 b) {
+  return vec2(a.x * b.x - a.y * b.y, a.x * b.y + a.y * b.x);
+}
+
+vec2 ref(int iter) {
+  return texelFetch(orbit, ivec2(iter % orbit_width, iter / orbit_width), 0).xy;
+}
@@ -0,0 +1,5 @@
+#version 110
+
+void main() {
+  gl_Position = gl_ModelViewProjectionMatrix * gl_Vertex;
+}
\ No newline at end of file
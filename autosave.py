@@ -0,0 +1,96 @@
+''' Write-behind saving of a controller's bindings. Changes only mark the bindings
+    dirty; a background thread coalesces them and rewrites the file atomically at
+    most once an interval, so the render loop never waits on the disk. '''
+
+from __future__ import print_function
+import os
+import atexit
+import tempfile
+import threading
+from metrics import REGISTRY
+
+DEFAULT_INTERVAL = 2.0
+
+BINDINGS_SAVES = REGISTRY.counter('bindings_saves_total', "Bindings files written")
+
+# os.rename doesn't replace an existing file on Windows under Python 2
+replace = getattr(os, 'replace', os.rename)
+
+def write_text(path, text):
+    '''
+    Replace the file at path with text, through a temporary file beside it, so a
+    crash or a reader never sees it half written.
+    '''
+    directory, name = os.path.split(path)
+    handle, temp_path = tempfile.mkstemp(prefix=name + '.', suffix='.tmp', dir=directory or '.')
+    try:
+        with os.fdopen(handle, 'w') as temp_file:
+            temp_file.write(text)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    BINDINGS_SAVES.inc()
+
+class Autosaver(object):
+    '''
+    Saves snapshot() to path some time after mark_dirty(), and on close() or exit.
+    snapshot returns the text to write and is called on the saving thread, so it
+    must cope with the bindings changing under it: a RuntimeError from it is
+    retried, and anything changed after mark_dirty() is written again later.
+    '''
+
+    def __init__(self, path, snapshot, interval=DEFAULT_INTERVAL):
+        self.path = path
+        self.snapshot = snapshot
+        self.interval = interval
+        self.dirty = threading.Event()
+        self.stopping = threading.Event()
+        # Set by changes and by close(), so the thread never sleeps through either
+        self.wake = threading.Event()
+        self.thread = None
+
+    def mark_dirty(self):
+        '''Note that the bindings changed, the thread is started on the first change'''
+        self.dirty.set()
+        self.wake.set()
+        if self.thread is None and not self.stopping.is_set():
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+            atexit.register(self.close)
+
+    def run(self):
+        while True:
+            self.wake.wait()
+            self.wake.clear()
+            # Let changes gather for an interval, close() cuts the wait short
+            if self.stopping.wait(self.interval):
+                return
+            self.save()
+
+    def save(self):
+        '''Write the bindings if they changed, returning whether they were written'''
+        if not self.dirty.is_set():
+            return False
+        # Cleared first, so a change during the snapshot is saved next time
+        self.dirty.clear()
+        try:
+            text = self.snapshot()
+        except RuntimeError:
+            # Changed mid snapshot, try again next interval
+            self.dirty.set()
+            return False
+        write_text(self.path, text)
+        return True
+
+    def close(self):
+        '''Stop the thread and write any outstanding change, safe to call twice'''
+        self.stopping.set()
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.save()
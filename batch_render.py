@@ -0,0 +1,100 @@
+''' Render many variations of one shader's bindings, for generating datasets.
+    The program stays bound and only the uniforms that change between items are
+    uploaded. Readback goes through a ring of pixel buffer objects, so one frame
+    renders while the frame before it is copied back. '''
+
+import collections
+import ctypes
+import numpy as np
+from pyglet import gl
+from offscreen import Framebuffer, draw_quad
+
+def uniform_changes(bindings, current, overrides):
+    '''
+    Return the uploads that take a program holding the bindings, with the current
+    overrides on top, to the bindings with the new overrides on top instead.
+    '''
+    changes = {}
+    for name, value in current.items():
+        if name not in overrides and value != bindings[name]['default']:
+            changes[name] = bindings[name]['default']
+    for name, value in overrides.items():
+        if name not in bindings:
+            raise ValueError("no binding named {}".format(name))
+        if value != current.get(name, bindings[name]['default']):
+            changes[name] = value
+    return changes
+
+class PixelPackRing(object):
+    ''' Pixel buffer objects that glReadPixels writes into without waiting, used in turn '''
+
+    def __init__(self, width, height, count=2):
+        self.width = width
+        self.height = height
+        self.size = 4 * width * height
+        buffer_ids = (gl.GLuint * count)()
+        gl.glGenBuffers(count, buffer_ids)
+        self.buffers = list(buffer_ids)
+        for buffer_id in self.buffers:
+            gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, buffer_id)
+            gl.glBufferData(gl.GL_PIXEL_PACK_BUFFER, self.size, None, gl.GL_STREAM_READ)
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, 0)
+
+    def start_read(self, index):
+        '''Queue a read of the bound framebuffer into buffer index, this returns at once'''
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, self.buffers[index])
+        gl.glPixelStorei(gl.GL_PACK_ALIGNMENT, 1)
+        gl.glReadPixels(0, 0, self.width, self.height, gl.GL_RGBA, gl.GL_UNSIGNED_BYTE, None)
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, 0)
+
+    def finish_read(self, index):
+        '''Wait for the read into buffer index and return a copy as a (height, width, 4) array'''
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, self.buffers[index])
+        address = gl.glMapBuffer(gl.GL_PIXEL_PACK_BUFFER, gl.GL_READ_ONLY)
+        try:
+            if not address:
+                raise RuntimeError("couldn't map pixel buffer {}".format(self.buffers[index]))
+            data = ctypes.cast(address, ctypes.POINTER(ctypes.c_ubyte * self.size)).contents
+            pixels = np.frombuffer(data, np.uint8).reshape(self.height, self.width, 4).copy()
+        finally:
+            if address:
+                gl.glUnmapBuffer(gl.GL_PIXEL_PACK_BUFFER)
+            gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, 0)
+        return pixels
+
+    def delete(self):
+        gl.glDeleteBuffers(len(self.buffers), (gl.GLuint * len(self.buffers))(*self.buffers))
+        self.buffers = []
+
+def render_batch(shader, controller, overrides, width, height, depth=2):
+    '''
+    Render the shader once for each dict of binding overrides in the iterable
+    overrides, yielding (height, width, 4) uint8 arrays, bottom row first.
+    Bindings not overridden keep their values. Items are read lazily and at most
+    depth frames are in flight, so memory doesn't grow with the number of items.
+    The shader and an offscreen framebuffer stay bound between items.
+    '''
+    framebuffer = Framebuffer(width, height)
+    ring = PixelPackRing(width, height, depth)
+    pending = collections.deque()
+    try:
+        framebuffer.bind()
+        shader.bind()
+        controller.set_uniforms()
+        current = {}
+        for index, values in enumerate(overrides):
+            controller.upload_uniforms(uniform_changes(controller.bindings, current, values))
+            current = dict(values)
+            draw_quad()
+            # Collect the oldest frame once its buffer is needed again
+            if len(pending) == depth:
+                yield ring.finish_read(pending.popleft())
+            ring.start_read(index % depth)
+            pending.append(index % depth)
+        while pending:
+            yield ring.finish_read(pending.popleft())
+    finally:
+        shader.unbind()
+        framebuffer.unbind()
+        ring.delete()
+        framebuffer.delete()
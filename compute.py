@@ -0,0 +1,323 @@
+''' Compute shader backend for offscreen exports. A fragment shader that places its
+    pixels with gl_FragCoord is rewritten as a compute shader: its main becomes a
+    function called once per invocation, with gl_FragCoord worked out from the
+    invocation and gl_FragColor stored into an image or a shader storage buffer.
+    Permutation and gradient tables can be copied into shared memory once per
+    workgroup. The uniforms are still uploaded from a ShaderController.
+
+> python compute.py tiled/tile_shader --sizes 256 512 1024 --frames 10
+'''
+
+from __future__ import print_function
+import re
+import time
+import ctypes
+import argparse
+from glsl_source import (find_uniform, replace_uniform, insert_after_header, replace_identifier,
+                         main_body_start, varyings)
+
+COMPUTE_VERSION = 430
+DEFAULT_LOCAL_SIZE = (8, 8)
+TARGETS = ('image', 'buffer')
+# Image layout qualifier and GL internal format name for each output format
+COMPUTE_FORMATS = {
+    'RGBA8': ('rgba8', 'GL_RGBA8'),
+    'RGBA32F': ('rgba32f', 'GL_RGBA32F'),
+}
+# Image unit or storage buffer binding the output is on
+OUTPUT_BINDING = 0
+
+def have_compute():
+    '''Whether the current context can run compute shaders'''
+    from pyglet import gl
+    return (gl.gl_info.have_version(4, 3) or
+            gl.gl_info.have_extension('GL_ARB_compute_shader'))
+
+def shared_tables(bindings):
+    '''Names of the permutation and gradient tables, which every invocation indexes at random'''
+    return sorted(name for name, binding in bindings.items()
+                  if isinstance(binding.get('default'), list) and ('loop' in binding or 'steps' in binding))
+
+def set_version(source, version=COMPUTE_VERSION):
+    '''Replace the #version line, or add one'''
+    pattern = re.compile(r'(?m)^[ \t]*#[ \t]*version[^\n]*')
+    if pattern.search(source):
+        return pattern.sub('#version {}'.format(version), source, count=1)
+    return '#version {}\n'.format(version) + source
+
+def share_table(source, name):
+    '''
+    Move every use of the uniform array name onto a shared copy of it. Returns the
+    source and the statements that fill the copy, to run before the barrier.
+    '''
+    declaration = find_uniform(source, name)
+    if declaration is None or declaration.group('size') is None:
+        raise ValueError("no uniform array {} declared".format(name))
+    var_type, size = declaration.group('type'), declaration.group('size')
+    shared = 'compute_shared_' + name
+    source = replace_identifier(source, name, shared)
+    source = replace_uniform(source, shared, declaration.group(0).strip() +
+                             "\nshared {} {}[{}];".format(var_type, shared, size))
+    fill = ("  for (uint i = gl_LocalInvocationIndex; i < uint({size}); i += compute_invocations)\n"
+            "    {shared}[i] = {name}[i];\n").format(size=size, shared=shared, name=name)
+    return source, fill
+
+def compute_source(fragment, local_size=DEFAULT_LOCAL_SIZE, target='image', pixel_format='RGBA8', shared=()):
+    '''
+    Rewrite a fragment shader as a compute shader, one invocation per pixel. The pixels
+    of a compute_size region go to an image at unit 0, or to a storage buffer at binding
+    0, row by row from the bottom, as glReadPixels gives them.
+    shared names uniform arrays to copy into shared memory for each workgroup.
+    '''
+    if target not in TARGETS:
+        raise ValueError("target must be one of {}".format(", ".join(TARGETS)))
+    if varyings(fragment):
+        raise ValueError("compute kernels only run shaders that place pixels with gl_FragCoord")
+    image_format, _ = COMPUTE_FORMATS[pixel_format]
+
+    source = set_version(fragment)
+    source = replace_identifier(source, 'gl_FragCoord', 'compute_FragCoord')
+    source = replace_identifier(source, 'gl_FragColor', 'compute_FragColor')
+    fills = []
+    for name in shared:
+        source, fill = share_table(source, name)
+        fills.append(fill)
+    # The shader's main runs as a function, its returns still end the pixel
+    start = main_body_start(source)
+    main = re.compile(r'\bvoid\s+main\b').search(source, 0, start)
+    source = source[:main.start()] + 'void compute_main' + source[main.end():]
+
+    if target == 'image':
+        output = "layout({}, binding = {}) writeonly uniform image2D compute_image;\n".format(
+            image_format, OUTPUT_BINDING)
+        store = "  imageStore(compute_image, compute_texel, compute_FragColor);\n"
+    elif pixel_format == 'RGBA8':
+        output = ("layout(std430, binding = {}) writeonly buffer ComputePixels {{ uint compute_pixels[]; }};\n"
+                  .format(OUTPUT_BINDING))
+        store = ("  compute_pixels[compute_texel.y * compute_size.x + compute_texel.x] ="
+                 " packUnorm4x8(compute_FragColor);\n")
+    else:
+        output = ("layout(std430, binding = {}) writeonly buffer ComputePixels {{ vec4 compute_pixels[]; }};\n"
+                  .format(OUTPUT_BINDING))
+        store = "  compute_pixels[compute_texel.y * compute_size.x + compute_texel.x] = compute_FragColor;\n"
+    header = ("layout(local_size_x = {}, local_size_y = {}) in;\n".format(*local_size) + output +
+              "uniform ivec2 compute_size;\n"
+              "vec4 compute_FragCoord;\n"
+              "vec4 compute_FragColor;\n")
+    source = insert_after_header(source, header)
+
+    kernel = ["\nvoid main()\n{\n"]
+    if fills:
+        kernel.append("  uint compute_invocations = gl_WorkGroupSize.x * gl_WorkGroupSize.y;\n")
+        kernel.extend(fills)
+        # Every invocation must reach the barrier, so pixels past the edge leave after it
+        kernel.append("  barrier();\n")
+    kernel.append("  ivec2 compute_texel = ivec2(gl_GlobalInvocationID.xy);\n"
+                  "  if (compute_texel.x >= compute_size.x || compute_texel.y >= compute_size.y)\n"
+                  "    return;\n"
+                  "  compute_FragCoord = vec4(vec2(compute_texel) + 0.5, 0.0, 1.0);\n"
+                  "  compute_FragColor = vec4(0.0);\n"
+                  "  compute_main();\n")
+    kernel.append(store)
+    kernel.append("}\n")
+    return source.rstrip() + "\n" + "".join(kernel)
+
+class ComputeKernel(object):
+    '''
+    A fragment shader run as a compute shader over a width x height region, with the
+    uniforms of controller. Needs a current context that has compute shaders.
+    '''
+
+    def __init__(self, fragment, controller, width, height, local_size=DEFAULT_LOCAL_SIZE,
+                 target='image', pixel_format='RGBA8', shared=()):
+        '''
+        fragment is the plain source, without a uniform block. shared names uniform
+        arrays to copy into shared memory, such as shared_tables(controller.bindings).
+        On llvmpipe the copy and barrier cost more than they save, uniforms are plain
+        memory there.
+        '''
+        from shader import ComputeShader
+
+        if not have_compute():
+            raise ValueError("compute shaders need GL 4.3 or GL_ARB_compute_shader")
+        self.controller = controller
+        self.width = width
+        self.height = height
+        self.local_size = local_size
+        self.target = target
+        self.pixel_format = pixel_format
+        self.source = compute_source(fragment, local_size, target, pixel_format, shared)
+        self.shader = ComputeShader(self.source)
+        if not self.shader.linked:
+            raise ValueError("compute kernel failed to link")
+        self.texture = None
+        self.buffer = None
+        if target == 'image':
+            self.create_image()
+        else:
+            self.create_buffer()
+
+    def create_image(self):
+        from pyglet import gl
+        texture = gl.GLuint(0)
+        gl.glGenTextures(1, ctypes.byref(texture))
+        self.texture = texture.value
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture)
+        gl.glTexStorage2D(gl.GL_TEXTURE_2D, 1, getattr(gl, COMPUTE_FORMATS[self.pixel_format][1]),
+                          self.width, self.height)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+
+    def create_buffer(self):
+        from pyglet import gl
+        buffer_id = gl.GLuint(0)
+        gl.glGenBuffers(1, ctypes.byref(buffer_id))
+        self.buffer = buffer_id.value
+        texel_bytes = 4 if self.pixel_format == 'RGBA8' else 16
+        gl.glBindBuffer(gl.GL_SHADER_STORAGE_BUFFER, self.buffer)
+        gl.glBufferData(gl.GL_SHADER_STORAGE_BUFFER, self.width * self.height * texel_bytes,
+                        None, gl.GL_DYNAMIC_READ)
+        gl.glBindBuffer(gl.GL_SHADER_STORAGE_BUFFER, 0)
+
+    def run(self, x=0, y=0):
+        '''
+        Compute the region of the view whose bottom left pixel is x, y, as draw_region
+        draws it. The uniforms are uploaded straight to the kernel's program.
+        '''
+        from pyglet import gl
+        controller = self.controller
+        self.shader.bind()
+        for name in controller.bindings:
+            controller.upload_uniform(name, controller.bindings[name]['default'], self.shader)
+        for name, value in controller.tile_uniforms(x, y).items():
+            controller.upload_uniform(name, value, self.shader)
+        self.shader.uniformi('compute_size', self.width, self.height)
+        if self.texture is not None:
+            gl.glBindImageTexture(OUTPUT_BINDING, self.texture, 0, gl.GL_FALSE, 0, gl.GL_WRITE_ONLY,
+                                  getattr(gl, COMPUTE_FORMATS[self.pixel_format][1]))
+        else:
+            gl.glBindBufferBase(gl.GL_SHADER_STORAGE_BUFFER, OUTPUT_BINDING, self.buffer)
+        groups_x = -(-self.width // self.local_size[0])
+        groups_y = -(-self.height // self.local_size[1])
+        gl.glDispatchCompute(groups_x, groups_y, 1)
+        self.shader.unbind()
+
+    def read_into(self, out=None, flip=False):
+        '''
+        Read the last result into out, an array or writable buffer as for
+        readback.read_pixels, or a new array. flip gives the top row first.
+        '''
+        from pyglet import gl
+        from readback import READ_FORMATS, as_pixels, readback_array
+
+        if out is None:
+            out = readback_array(self.width, self.height, self.pixel_format)
+        pixels = as_pixels(out, self.width, self.height, self.pixel_format)
+        pointer = pixels.ctypes.data_as(ctypes.c_void_p)
+        if self.texture is not None:
+            gl.glMemoryBarrier(gl.GL_TEXTURE_UPDATE_BARRIER_BIT)
+            gl_format, gl_type, _, _ = READ_FORMATS[self.pixel_format]
+            gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture)
+            gl.glPixelStorei(gl.GL_PACK_ALIGNMENT, 1)
+            gl.glGetTexImage(gl.GL_TEXTURE_2D, 0, getattr(gl, gl_format), getattr(gl, gl_type), pointer)
+            gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+        else:
+            gl.glMemoryBarrier(gl.GL_BUFFER_UPDATE_BARRIER_BIT)
+            gl.glBindBuffer(gl.GL_SHADER_STORAGE_BUFFER, self.buffer)
+            gl.glGetBufferSubData(gl.GL_SHADER_STORAGE_BUFFER, 0, pixels.nbytes, pointer)
+            gl.glBindBuffer(gl.GL_SHADER_STORAGE_BUFFER, 0)
+        return pixels[::-1] if flip else pixels
+
+    def delete(self):
+        from pyglet import gl
+        if self.texture is not None:
+            gl.glDeleteTextures(1, ctypes.byref(gl.GLuint(self.texture)))
+        if self.buffer is not None:
+            gl.glDeleteBuffers(1, ctypes.byref(gl.GLuint(self.buffer)))
+        gl.glDeleteProgram(self.shader.handle)
+
+def time_frames(frame, frames):
+    '''Seconds per call of frame, after one call to warm up, waiting for the GPU each time'''
+    from pyglet import gl
+    frame()
+    gl.glFinish()
+    started = time.time()
+    for _ in range(frames):
+        frame()
+        gl.glFinish()
+    return (time.time() - started) / frames
+
+def benchmark(shader_path, sizes, frames=10, local_size=DEFAULT_LOCAL_SIZE, target='image', share=False):
+    '''
+    Yield size, fragment seconds, compute seconds and the largest channel difference
+    between the two for a size x size render at each size. The fragment figures are
+    None where the context can't draw the quad, as in a core profile.
+    '''
+    from pyglet import gl
+    from procviewer import ShaderController, ShaderSource, read_shader_files
+    from readback import readback_array
+    from offscreen import Framebuffer, draw_shader
+    from shader import Shader
+
+    source = ShaderSource(*read_shader_files(shader_path))
+    controller = ShaderController(source, shader_path)
+    try:
+        fragment = Shader(source.vertex_shader, source.fragment_shader)
+    except (ValueError, gl.GLException) as error:
+        print("fragment path unavailable: {}".format(error))
+        fragment = None
+    else:
+        controller.shader = fragment
+    for size in sizes:
+        kernel = ComputeKernel(source.fragment_shader, controller, size, size, local_size, target,
+                               shared=shared_tables(controller.bindings) if share else ())
+        compute_seconds = time_frames(kernel.run, frames)
+        computed = kernel.read_into()
+        kernel.delete()
+
+        fragment_seconds = difference = None
+        if fragment is not None:
+            framebuffer = Framebuffer(size, size)
+            framebuffer.bind()
+            try:
+                fragment_seconds = time_frames(lambda: draw_shader(fragment, controller), frames)
+            except (AttributeError, gl.GLException) as error:
+                print("fragment path unavailable: {}".format(error))
+                fragment = None
+            else:
+                drawn = framebuffer.read_into(readback_array(size, size))
+                difference = int(abs(drawn.astype(int) - computed.astype(int)).max())
+            framebuffer.unbind()
+            framebuffer.delete()
+        yield size, fragment_seconds, compute_seconds, difference
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the compute and fragment paths for a shader.")
+    parser.add_argument('shader', help="path of the shader without extensions, such as tiled/tile_shader")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[256, 512, 1024])
+    parser.add_argument('--frames', type=int, default=10)
+    parser.add_argument('--local-size', type=int, nargs=2, default=list(DEFAULT_LOCAL_SIZE))
+    parser.add_argument('--target', choices=TARGETS, default='image')
+    parser.add_argument('--shared', action='store_true',
+                        help="copy the permutation and gradient tables into shared memory")
+    parser.add_argument('--window', action='store_true',
+                        help="use a hidden window rather than a headless context")
+    args = parser.parse_args(argv)
+
+    import pyglet
+    # Has to be chosen before pyglet.gl is first imported
+    pyglet.options['headless'] = not args.window
+    from offscreen import headless_context
+    context = headless_context()
+    print("{:>6} {:>12} {:>12} {:>8} {:>6}".format('size', 'fragment ms', 'compute ms', 'speedup', 'diff'))
+    for size, fragment_seconds, compute_seconds, difference in benchmark(
+            args.shader, args.sizes, args.frames, tuple(args.local_size), args.target, args.shared):
+        if fragment_seconds is None:
+            print("{:>6} {:>12} {:>12.2f} {:>8} {:>6}".format(size, '-', compute_seconds * 1000.0, '-', '-'))
+        else:
+            print("{:>6} {:>12.2f} {:>12.2f} {:>7.2f}x {:>6}".format(
+                size, fragment_seconds * 1000.0, compute_seconds * 1000.0,
+                fragment_seconds / compute_seconds, difference))
+    context.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+''' Contact sheet mode: a grid of variations of a shader's bindings drawn in one pass.
+    The fragment source is rewritten so each pixel finds its cell from gl_FragCoord,
+    reads the varied bindings for that cell from uniform arrays (or a texture, for
+    permutation tables) and sees the whole view scaled into its cell. Gradient tables
+    following a varied permutation are worked out from the cell's table. '''
+
+import ctypes
+import re
+from pyglet import gl
+from procviewer import update_permutation
+from glsl_source import (find_uniform, replace_uniform, insert_after_header, insert_at_main_start,
+                         replace_identifier, replace_indexing, varyings, global_initializers)
+from offscreen import draw_quad
+
+# First texture unit used for permutation tables, unit 0 is left to the shaders
+TABLE_UNIT = 1
+
+def is_table(binding):
+    '''Permutation tables vary by seed rather than by value'''
+    return 'seed' in binding and isinstance(binding.get('default'), list)
+
+def sweep(binding, count):
+    '''Return count values stepping by the binding's diff, centred on its current value'''
+    if is_table(binding):
+        return [binding['seed'] + i for i in range(count)]
+    if binding['type'] == 'bool':
+        return [bool(i % 2) != bool(binding['default']) for i in range(count)]
+    diff = binding.get('diff', 1)
+    return [binding['default'] + (i - count // 2) * diff for i in range(count)]
+
+def permutation(binding, seed):
+    '''
+    Return the table a cell with this seed shows: the live table for its own seed, or
+    else the live table reshuffled by update_permutation with this seed.
+    '''
+    if seed == binding['seed']:
+        return list(binding['default'])
+    table = dict(binding, seed=seed, default=list(binding['default']))
+    update_permutation(table)
+    return table['default']
+
+def default_axes(bindings):
+    '''
+    Pick the bindings to vary across and down: a permutation table if there is one, then
+    scalars in declaration order. Either is None if there aren't enough bindings.
+    '''
+    tables = [name for name, binding in bindings.items() if is_table(binding)]
+    scalars = [name for name, binding in bindings.items()
+               if binding.get('type') in ('float', 'int') and not isinstance(binding.get('default'), list)]
+    names = (tables[:1] + scalars + [None, None])[:2]
+    return names[0], names[1]
+
+def grid_variations(bindings, columns, rows, across, down=None):
+    '''
+    Return per cell values, vary across the columns and down the rows, every other
+    binding keeps its value. Cells run along rows, from the bottom left.
+    '''
+    variations = {}
+    for name, count, position in ((across, columns, lambda cell: cell % columns),
+                                  (down, rows, lambda cell: cell // columns)):
+        if name is None:
+            continue
+        values = sweep(bindings[name], count)
+        variations[name] = [values[position(cell)] for cell in range(columns * rows)]
+    return variations
+
+def derived_gradients(bindings, varied):
+    '''Return {name: (permutation, steps)} for the gradient tables following varied tables'''
+    return dict((name, (binding['from'], binding['steps'])) for name, binding in bindings.items()
+                if 'steps' in binding and binding['from'] in varied)
+
+def sheet_source(fragment, columns, rows, varied, gradients=None):
+    '''
+    Rewrite fragment source to draw a columns x rows sheet. varied lists the uniforms
+    given per cell: scalars become uniform arrays indexed by the cell, arrays become
+    integer textures with a row per cell. gl_FragCoord and the varyings are mapped so
+    each cell draws the whole view. gradients, from derived_gradients, are computed
+    from the cell's permutation rather than read from their uniform.
+    '''
+    cells = columns * rows
+    prologue = [
+        "  ivec2 sheet_cell_xy = ivec2(gl_FragCoord.xy * sheet_grid / sheet_window);",
+        "  sheet_cell = sheet_cell_xy.x + sheet_cell_xy.y * {};".format(columns),
+        "  vec2 sheet_offset = (sheet_grid - 1.0) * gl_FragCoord.xy - vec2(sheet_cell_xy) * sheet_window;",
+        "  sheet_frag_coord = vec4(gl_FragCoord.xy + sheet_offset, gl_FragCoord.zw);",
+    ]
+    header = [
+        "const vec2 sheet_grid = vec2({}.0, {}.0);".format(columns, rows),
+        "uniform vec2 sheet_window;",
+        "int sheet_cell;",
+        "vec4 sheet_frag_coord;",
+    ]
+
+    fragment = replace_identifier(fragment, 'gl_FragCoord', 'sheet_frag_coord')
+    # Varyings are affine over the window, so their derivatives move them into the cell
+    for var_type, name in varyings(fragment):
+        fragment = replace_identifier(fragment, name, 'sheet_' + name)
+        fragment = fragment.replace('{} sheet_{};'.format(var_type, name), '{} {};'.format(var_type, name))
+        header.append("{} sheet_{};".format(var_type, name))
+        prologue.append("  sheet_{0} = {0} + dFdx({0}) * sheet_offset.x + dFdy({0}) * sheet_offset.y;"
+                        .format(name))
+
+    for name in varied:
+        match = find_uniform(fragment, name)
+        if match is None:
+            raise ValueError("uniform {} is not declared in the fragment shader".format(name))
+        var_type = match.group('type')
+        if match.group('size'):
+            sampler = 'isampler2D' if var_type == 'int' else 'sampler2D'
+            fragment = replace_uniform(fragment, name, "uniform {} sheet_{};".format(sampler, name))
+            fragment = replace_indexing(
+                fragment, name,
+                lambda index, name=name: "texelFetch(sheet_{}, ivec2({}, sheet_cell), 0).r".format(name, index))
+        else:
+            fragment = replace_uniform(fragment, name, "uniform {0} sheet_{1}[{2}];\n{0} {1};"
+                                       .format(var_type, name, cells))
+            prologue.append("  {0} = sheet_{0}[sheet_cell];".format(name))
+
+    for name, (table, steps) in sorted((gradients or {}).items()):
+        # The same angles update_gradients gives, from the cell's permutation
+        fragment = replace_uniform(fragment, name)
+        lookup = "sheet_gradient(texelFetch(sheet_{}, ivec2({{}}, sheet_cell), 0).r, {})".format(table, steps)
+        fragment = replace_indexing(fragment, name, lambda index, lookup=lookup: lookup.format(index))
+    if gradients:
+        header.append("vec2 sheet_gradient(int value, int steps) {\n"
+                      "  float angle = 6.283185307179586 * float(value % steps) / float(steps);\n"
+                      "  return vec2(cos(angle), sin(angle));\n"
+                      "}")
+
+    # Globals initialised from varied bindings can only be set once the cell is known
+    deferred = [match for match in global_initializers(fragment)
+                if any(re.search(r'\b{}\b'.format(name), match.group('value')) for name in varied)]
+    for match in deferred:
+        prologue.append("  {} = {};".format(match.group('name'), match.group('value')))
+    for match in reversed(deferred):
+        fragment = (fragment[:match.start()] + "{} {};".format(match.group('type'), match.group('name')) +
+                    fragment[match.end():])
+
+    fragment = insert_at_main_start(fragment, "\n".join(prologue) + "\n")
+    return insert_after_header(fragment, "\n".join(header) + "\n")
+
+class ContactSheet(object):
+    '''
+    A columns x rows grid of variations of the controller's bindings. variations maps
+    binding names to a value per cell, seeds for permutation tables.
+    '''
+
+    def __init__(self, controller, source, columns, rows, variations, width, height):
+        self.controller = controller
+        self.columns = columns
+        self.rows = rows
+        self.variations = variations
+        self.width = width
+        self.height = height
+        self.vertex_shader = source.vertex_shader
+        self.fragment_shader = sheet_source(source.fragment_shader, columns, rows, variations,
+                                            derived_gradients(controller.bindings, variations))
+        self.shader = None
+        self.tables = {}
+        # Worked out once, so adopting a cell installs the table it was drawn with
+        self.cell_tables = dict((name, [permutation(controller.bindings[name], seed) for seed in seeds])
+                                for name, seeds in variations.items() if is_table(controller.bindings[name]))
+
+    def cell_at(self, x, y):
+        '''Return the cell under window position x, y'''
+        column = min(int(x * self.columns // self.width), self.columns - 1)
+        row = min(int(y * self.rows // self.height), self.rows - 1)
+        return row * self.columns + column
+
+    def cell_values(self, cell):
+        return dict((name, values[cell]) for name, values in self.variations.items())
+
+    def adopt(self, cell):
+        '''Copy a cell's values into the live bindings'''
+        for name, value in self.cell_values(cell).items():
+            binding = self.controller.bindings[name]
+            if is_table(binding):
+                binding['seed'] = value
+                binding['default'] = list(self.cell_tables[name][cell])
+                self.controller.refresh_gradients(binding)
+            else:
+                binding['default'] = value
+        self.controller.bindings_changed()
+
+    def compile(self):
+        '''Compile the sheet program and upload the permutation tables, needs a context'''
+        from shader import Shader
+
+        self.shader = Shader(self.vertex_shader, self.fragment_shader)
+        for name, rows in self.cell_tables.items():
+            self.tables[name] = self.upload_table(rows)
+
+    def upload_table(self, rows):
+        '''Upload per cell tables as an integer texture, one row per cell'''
+        width = len(rows[0])
+        texels = (gl.GLint * (width * len(rows)))(*[value for row in rows for value in row])
+        texture = gl.GLuint(0)
+        gl.glGenTextures(1, ctypes.byref(texture))
+        gl.glBindTexture(gl.GL_TEXTURE_2D, texture.value)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_NEAREST)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_NEAREST)
+        gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_R32I, width, len(rows), 0,
+                        gl.GL_RED_INTEGER, gl.GL_INT, texels)
+        return texture.value
+
+    def upload_array(self, name, var_type, values):
+        location = gl.glGetUniformLocation(self.shader.handle, name.encode())
+        if var_type == 'float':
+            gl.glUniform1fv(location, len(values), (gl.GLfloat * len(values))(*values))
+        else:
+            gl.glUniform1iv(location, len(values), (gl.GLint * len(values))(*[int(v) for v in values]))
+
+    def draw(self):
+        '''Draw every cell with one bind of the program and one quad'''
+        if self.shader is None:
+            self.compile()
+        self.shader.bind()
+        for name, binding in self.controller.bindings.items():
+            if name not in self.variations:
+                self.controller.upload_uniform(name, binding['default'], self.shader)
+        for unit, name in enumerate(sorted(self.tables), TABLE_UNIT):
+            gl.glActiveTexture(gl.GL_TEXTURE0 + unit)
+            gl.glBindTexture(gl.GL_TEXTURE_2D, self.tables[name])
+            self.shader.uniformi('sheet_' + name, unit)
+        gl.glActiveTexture(gl.GL_TEXTURE0)
+        for name, values in self.variations.items():
+            binding = self.controller.bindings[name]
+            if not is_table(binding):
+                self.upload_array('sheet_' + name, binding['type'], values)
+        self.shader.uniformf('sheet_window', self.width, self.height)
+        draw_quad()
+        self.shader.unbind()
+
+    def delete(self):
+        for texture in self.tables.values():
+            gl.glDeleteTextures(1, ctypes.byref(gl.GLuint(texture)))
+        self.tables = {}
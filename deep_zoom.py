@@ -0,0 +1,183 @@
+''' This contains the CPU side of the deep zoom Julia shader (Julia/julia_deep):
+    a high precision reference orbit, a series approximation to skip the first
+    iterations, and a ShaderController that uploads both every frame '''
+
+from __future__ import print_function
+import math
+import ctypes
+from decimal import Decimal, localcontext
+from pyglet import gl
+from procviewer import ShaderController
+
+# Texels per row of the orbit texture, must match orbit_width in julia_deep.f.glsl
+ORBIT_WIDTH = 1024
+# Squared magnitude the shaders treat as escaped
+ESCAPE = 1e7
+
+def digits_for_zoom(zoom, guard=12):
+    '''Return the decimal precision needed to resolve pixels at the given zoom'''
+    return max(20, int(-math.log10(abs(zoom))) + guard) if zoom else 20
+
+def exact_value(binding):
+    '''Return the high precision value of a binding, preferring the saved exact string'''
+    if binding is None:
+        return Decimal(0)
+    if 'exact' in binding and float(Decimal(binding['exact'])) == binding['default']:
+        return Decimal(binding['exact'])
+    return Decimal(repr(binding['default']))
+
+def reference_orbit(center, c, max_iter, digits):
+    '''
+    Iterate z = z^2 + c from the centre at the given decimal precision.
+    Returns the orbit rounded to float pairs, including the point that escaped,
+    so it always holds at least two iterations.
+    '''
+    orbit = []
+    with localcontext() as ctx:
+        ctx.prec = digits
+        zx, zy = Decimal(center[0]), Decimal(center[1])
+        cx, cy = Decimal(c[0]), Decimal(c[1])
+        for _ in range(max(max_iter, 1) + 1):
+            fx, fy = float(zx), float(zy)
+            orbit.append((fx, fy))
+            if fx * fx + fy * fy > ESCAPE:
+                break
+            zx, zy = zx * zx - zy * zy + cx, 2 * zx * zy + cy
+    return orbit
+
+def series_approximation(orbit, radius, pixel, tolerance=1e-3, limit=1e30):
+    '''
+    Find how many iterations every pixel within radius of the centre can skip.
+    The offset from the reference is approximated by d_n = A d0 + B d0^2 + C d0^3 and
+    the derivative by dZ_n = D + E d0, which stays valid while the cubic term is
+    below tolerance pixels at iteration n.
+    Returns (skip, A, B, C, D, E) with complex coefficients.
+    '''
+    a, b, c = complex(1), complex(0), complex(0)
+    d, e = complex(1), complex(0)
+    skip = 0
+    coefficients = (a, b, c, d, e)
+    # Leave the last orbit point for the shader to step onto
+    for n in range(len(orbit) - 2):
+        z = complex(*orbit[n])
+        # One assignment, so every term steps from the coefficients of iteration n
+        a, b, c, d, e = (2 * z * a, 2 * z * b + a * a, 2 * z * c + 2 * a * b,
+                         2 * z * d + 1, 2 * z * e + 2 * a * d)
+        if max(abs(a), abs(b), abs(c), abs(d), abs(e)) > limit:
+            break
+        if abs(c) * radius ** 3 > tolerance * abs(a) * pixel:
+            break
+        skip = n + 1
+        coefficients = (a, b, c, d, e)
+    return (skip,) + coefficients
+
+class DeepZoomController(ShaderController):
+    '''
+    ShaderController for Julia/julia_deep. The mouse pans the view centre (cx, cy),
+    which is held at high precision, and zooms geometrically. The reference orbit is
+    recomputed whenever the view changes.
+    '''
+
+    def __init__(self, shader, save_path, bindings=None):
+        super(DeepZoomController, self).__init__(shader, save_path, bindings)
+        self.center = [exact_value(self.bindings.get('cx')), exact_value(self.bindings.get('cy'))]
+        self.orbit_state = None
+        self.orbit_texture = None
+        self.orbit_uniforms = None
+
+    def bind_mouse_controls(self):
+        '''Bind the view centre and zoom to the mouse, x and y are the Julia constant here'''
+        if 'cx' in self.bindings:
+            self.mouse_x = self.bindings['cx']
+        if 'cy' in self.bindings:
+            self.mouse_y = self.bindings['cy']
+        if 'zoom' in self.bindings:
+            self.mouse_scroll = self.bindings['zoom']
+
+    def mouse_drag(self, diff_x, diff_y):
+        '''Pan the high precision centre by whole pixels'''
+        self.sync_center()
+        zoom = Decimal(repr(self.mouse_scroll['default']))
+        with localcontext() as ctx:
+            ctx.prec = digits_for_zoom(self.mouse_scroll['default'])
+            self.center[0] -= Decimal(diff_x) * zoom
+            self.center[1] -= Decimal(diff_y) * zoom
+        self.store_center()
+        self.bindings_changed()
+
+    def mouse_scroll_y(self, scroll_y):
+        '''Zoom geometrically, so the wheel keeps working far below the diff step'''
+        self.mouse_scroll['default'] *= 0.9 ** scroll_y
+        self.bindings_changed()
+
+    def tile_uniforms(self, offset_x, offset_y):
+        '''Pixels are placed around the viewport centre, so tiles only move the viewport'''
+        return {}
+
+    def sync_center(self):
+        '''Take up any change made to cx or cy through their key bindings'''
+        for axis, name in enumerate(('cx', 'cy')):
+            if name in self.bindings and float(self.center[axis]) != self.bindings[name]['default']:
+                self.center[axis] = Decimal(repr(self.bindings[name]['default']))
+
+    def store_center(self):
+        '''Write the centre back to the bindings, keeping the exact value for saving'''
+        for axis, name in enumerate(('cx', 'cy')):
+            if name in self.bindings:
+                self.bindings[name]['default'] = float(self.center[axis])
+                self.bindings[name]['exact'] = str(self.center[axis])
+
+    def set_uniforms(self):
+        '''Upload the bindings, then the reference orbit and series for the current view'''
+        super(DeepZoomController, self).set_uniforms()
+        self.sync_center()
+
+        viewport = (gl.GLint * 4)()
+        gl.glGetIntegerv(gl.GL_VIEWPORT, viewport)
+        half = (viewport[0] + viewport[2] / 2.0, viewport[1] + viewport[3] / 2.0)
+
+        zoom = self.bindings['zoom']['default']
+        c = (self.bindings['x']['default'], self.bindings['y']['default'])
+        max_iter = self.bindings['max_iter_count']['default']
+        state = (str(self.center[0]), str(self.center[1]), c, zoom, max_iter, half)
+        if state != self.orbit_state:
+            self.update_orbit(c, zoom, max_iter, viewport[2], viewport[3], half)
+            self.orbit_state = state
+
+        gl.glActiveTexture(gl.GL_TEXTURE0)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.orbit_texture)
+        self.shader.uniformi('orbit', 0)
+        for name, values in self.orbit_uniforms:
+            self.shader.uniformf(name, *values)
+
+    def update_orbit(self, c, zoom, max_iter, width, height, half):
+        '''Recompute the reference orbit and series approximation, and upload the orbit'''
+        orbit = reference_orbit(self.center, c, max_iter, digits_for_zoom(zoom))
+        radius = zoom * math.hypot(width / 2.0, height / 2.0)
+        skip, a, b, c3, d, e = series_approximation(orbit, radius, zoom)
+
+        self.orbit_uniforms = [
+            ('orbit_info', (len(orbit), skip, half[0], half[1])),
+            ('series_ab', (a.real, a.imag, b.real, b.imag)),
+            ('series_cd', (c3.real, c3.imag, d.real, d.imag)),
+            ('series_e', (e.real, e.imag)),
+        ]
+        self.upload_orbit(orbit)
+
+    def upload_orbit(self, orbit):
+        '''Upload the orbit as a two channel float texture, ORBIT_WIDTH texels per row'''
+        rows = -(-len(orbit) // ORBIT_WIDTH)
+        texels = (gl.GLfloat * (2 * ORBIT_WIDTH * rows))()
+        for i, (zx, zy) in enumerate(orbit):
+            texels[2 * i] = zx
+            texels[2 * i + 1] = zy
+
+        if self.orbit_texture is None:
+            texture = gl.GLuint(0)
+            gl.glGenTextures(1, ctypes.byref(texture))
+            self.orbit_texture = texture.value
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.orbit_texture)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_NEAREST)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_NEAREST)
+        gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_RG32F, ORBIT_WIDTH, rows, 0,
+                        gl.GL_RG, gl.GL_FLOAT, texels)
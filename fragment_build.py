@@ -0,0 +1,96 @@
+''' Rewriting a fragment shader's source for the viewer's optional features before it
+    is compiled. The rewrites only work in one order:
+
+    - the z search define, which only picks a path through main
+    - the noise basis, which replaces getHash where there is a table p to read
+    - the noise volume, which replaces getHash with a fetch from Perlin noise, so it is
+      skipped for other bases
+    - hashing whatever permutation table reads are left
+    - the optimiser, so it folds what the rewrites inserted
+    - the uniform block last, the optimiser can't read its interface block
+
+    Each import happens when its feature is first used, to keep startup short. '''
+
+from __future__ import print_function
+
+class FragmentOptions(object):
+    '''
+    The source rewrites the viewer makes.
+    z_search takes the faster z search of shaders with a Z_SEARCH path.
+    basis is the noise getHash evaluates, one of simplex.BASES.
+    noise_volume fetches getHash from a precomputed 3D texture, see noise_volume.
+    hash_tables hashes in place of reading the permutation tables, see hash_mode.
+    optimize runs glsl_optimizer, with glsl_optimizer.DEFAULT_PASSES if it's True or
+    else the passes it names.
+    '''
+
+    def __init__(self, z_search=False, basis='perlin', noise_volume=False, hash_tables=False,
+                 optimize=False):
+        self.z_search = z_search
+        self.basis = basis
+        self.noise_volume = noise_volume
+        self.hash_tables = hash_tables
+        self.optimize = optimize
+
+class BuiltFragment(object):
+    '''
+    The rewritten fragment source, with what drawing it needs: the NoiseVolume to bind,
+    the tables to mark hashed once it's compiled, and why any rewrite was skipped.
+    '''
+
+    def __init__(self, fragment):
+        self.fragment = fragment
+        self.noise_volume = None
+        self.hashed = ()
+        self.skipped = []
+
+def build_fragment(controller, fragment, options, block=None, keep_tables=False):
+    '''
+    Return a BuiltFragment of fragment rewritten as options ask, for the controller's
+    bindings. block is the controller's UniformBlock, if the bindings are packed in
+    one. keep_tables says another draw path, the octave cache or render graph, reads
+    the permutation tables, so they can't be hashed. A rewrite the source doesn't
+    suit is skipped, and the rest are still made.
+    '''
+    built = BuiltFragment(fragment)
+    if options.z_search:
+        from z_search import search_source
+        built.fragment = search_source(built.fragment)
+    basis = 'perlin'
+    if options.basis != 'perlin':
+        from simplex import basis_source
+        try:
+            built.fragment = basis_source(built.fragment, options.basis)
+            basis = options.basis
+        except ValueError as error:
+            built.skipped.append("keeping the perlin basis: {}".format(error))
+    if options.noise_volume and basis != 'perlin':
+        built.skipped.append("no noise volume, it holds the perlin basis rather than {}".format(basis))
+    elif options.noise_volume:
+        from noise_volume import NoiseVolume, volume_source
+        try:
+            built.fragment = volume_source(built.fragment)
+            built.noise_volume = NoiseVolume(controller)
+        except ValueError as error:
+            built.skipped.append("no noise volume: {}".format(error))
+    if options.hash_tables and keep_tables:
+        built.skipped.append("not hashing, the octave cache and render graph read the tables")
+    elif options.hash_tables:
+        from hash_mode import hash_source, hashed_tables
+        try:
+            tables = hashed_tables(controller.bindings, built.fragment)
+            built.fragment = hash_source(built.fragment, controller.bindings)
+            built.hashed = tuple(tables)
+        except ValueError as error:
+            built.skipped.append("not hashing: {}".format(error))
+    if options.optimize:
+        from glsl_numpy import GLSLError
+        from glsl_optimizer import optimize_source, DEFAULT_PASSES
+        try:
+            built.fragment = optimize_source(built.fragment,
+                                             DEFAULT_PASSES if options.optimize is True else options.optimize)
+        except GLSLError as error:
+            built.skipped.append("not optimising: {}".format(error))
+    if block is not None:
+        built.fragment = block.rewrite_source(built.fragment)
+    return built
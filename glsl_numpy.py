@@ -0,0 +1,1499 @@
+''' This contains a compiler from the subset of GLSL used by the project's fragment
+    shaders to vectorised NumPy. Every pixel is a lane of a NumPy array, divergent
+    branches and loops run under lane masks. It lets shaders render without GL and
+    lets their logic be profiled from Python. '''
+
+from __future__ import print_function
+import re
+import time
+import argparse
+import numpy as np
+
+class GLSLError(ValueError):
+    ''' Raised for source outside the supported subset, or for invalid source '''
+
+    def __init__(self, message, line=None):
+        if line is not None:
+            message = "line {}: {}".format(line, message)
+        super(GLSLError, self).__init__(message)
+
+#
+# Preprocessing and tokens
+#
+
+TOKEN = re.compile(r'''
+     (?P<float>(?:\d+\.\d*|\.\d+)(?:[eE][+-]?\d+)?[fF]?|\d+[eE][+-]?\d+[fF]?)
+    |(?P<int>0[xX][0-9a-fA-F]+[uU]?|\d+[uU]?)
+    |(?P<name>[A-Za-z_]\w*)
+    |(?P<op><<=|>>=|\+\+|--|\+=|-=|\*=|/=|%=|&=|\|=|\^=|==|!=|<=|>=|&&|\|\||\^\^|<<|>>
+          |[-+*/%<>=!~&|^?:;,.(){}\[\]])
+    |(?P<space>\s+)
+''', re.X)
+
+class Token(object):
+    ''' A source token, kind is float, int, name or op '''
+    __slots__ = ('kind', 'text', 'line')
+
+    def __init__(self, kind, text, line):
+        self.kind = kind
+        self.text = text
+        self.line = line
+
+    def __repr__(self):
+        return "Token({}, {!r}, {})".format(self.kind, self.text, self.line)
+
+def strip_comments(source):
+    '''Remove comments, keeping line breaks so line numbers still match the source'''
+    def blank(match):
+        return re.sub(r'[^\n]', ' ', match.group(0))
+    return re.sub(r'//[^\n]*|/\*.*?\*/', blank, source, flags=re.S)
+
+def tokenize_line(text, line):
+    tokens = []
+    pos = 0
+    while pos < len(text):
+        match = TOKEN.match(text, pos)
+        if match is None:
+            raise GLSLError("unexpected character {!r}".format(text[pos]), line)
+        if match.lastgroup != 'space':
+            tokens.append(Token(match.lastgroup, match.group(), line))
+        pos = match.end()
+    return tokens
+
+def preprocess(source, defines=None):
+    '''
+    Run the preprocessor over source and return its tokens.
+    Object-like #define and #undef, #ifdef/#ifndef/#if defined()/#else/#endif are
+    supported, #version, #extension and #pragma lines are dropped.
+    '''
+    macros = dict(defines or {})
+    macros = dict((name, tokenize_line(str(value), 0)) for name, value in macros.items())
+    tokens = []
+    # Stack of (this branch taken, any branch taken) for conditionals
+    conditions = []
+    for number, text in enumerate(strip_comments(source).split('\n'), 1):
+        stripped = text.strip()
+        active = all(taken for taken, _ in conditions)
+        if stripped.startswith('#'):
+            directive = stripped[1:].split(None, 1)
+            command = directive[0] if directive else ''
+            rest = directive[1].strip() if len(directive) > 1 else ''
+            if command in ('ifdef', 'ifndef'):
+                taken = (rest in macros) == (command == 'ifdef')
+                conditions.append((active and taken, taken))
+            elif command == 'if':
+                match = re.match(r'^(?:defined\s*\(\s*(\w+)\s*\)|defined\s+(\w+)|(\d+))$', rest)
+                if match is None:
+                    raise GLSLError("unsupported #if expression {!r}".format(rest), number)
+                if match.group(3) is not None:
+                    taken = int(match.group(3)) != 0
+                else:
+                    taken = (match.group(1) or match.group(2)) in macros
+                conditions.append((active and taken, taken))
+            elif command == 'else':
+                if not conditions:
+                    raise GLSLError("#else without #if", number)
+                _, taken = conditions.pop()
+                outer = all(t for t, _ in conditions)
+                conditions.append((outer and not taken, True))
+            elif command == 'endif':
+                if not conditions:
+                    raise GLSLError("#endif without #if", number)
+                conditions.pop()
+            elif not active:
+                continue
+            elif command == 'define':
+                match = re.match(r'^(\w+)(\()?\s*(.*)$', rest)
+                if match is None or match.group(2):
+                    raise GLSLError("only object-like macros are supported", number)
+                macros[match.group(1)] = tokenize_line(match.group(3), number)
+            elif command == 'undef':
+                macros.pop(rest, None)
+            elif command in ('version', 'extension', 'pragma', ''):
+                pass
+            else:
+                raise GLSLError("unsupported directive #{}".format(command), number)
+            continue
+        if active:
+            tokens.extend(expand_macros(tokenize_line(text, number), macros))
+    if conditions:
+        raise GLSLError("unterminated #if")
+    return tokens
+
+def expand_macros(tokens, macros, expanding=()):
+    expanded = []
+    for token in tokens:
+        if token.kind == 'name' and token.text in macros and token.text not in expanding:
+            body = [Token(t.kind, t.text, token.line) for t in macros[token.text]]
+            expanded.extend(expand_macros(body, macros, expanding + (token.text,)))
+        else:
+            expanded.append(token)
+    return expanded
+
+#
+# Syntax tree
+#
+
+class Node(object):
+    ''' Syntax tree node, kind names the construct and the other attributes depend on it '''
+
+    def __init__(self, kind, line=None, **fields):
+        self.kind = kind
+        self.line = line
+        self.__dict__.update(fields)
+
+    def __repr__(self):
+        fields = ", ".join("{}={!r}".format(k, v) for k, v in sorted(self.__dict__.items())
+                           if k not in ('kind', 'line'))
+        return "{}({})".format(self.kind, fields)
+
+VECTORS = {}
+for _n in (2, 3, 4):
+    VECTORS['vec%d' % _n] = ('float', _n)
+    VECTORS['ivec%d' % _n] = ('int', _n)
+    VECTORS['uvec%d' % _n] = ('uint', _n)
+    VECTORS['bvec%d' % _n] = ('bool', _n)
+SCALARS = ('float', 'int', 'uint', 'bool')
+SAMPLERS = ('sampler2D', 'isampler2D', 'sampler2DArray')
+TYPES = set(SCALARS) | set(VECTORS) | set(SAMPLERS) | set(['void'])
+QUALIFIERS = set(['uniform', 'varying', 'attribute', 'in', 'out', 'inout', 'const', 'flat',
+                  'smooth', 'noperspective', 'centroid', 'invariant', 'highp', 'mediump',
+                  'lowp'])
+PRECISIONS = set(['highp', 'mediump', 'lowp'])
+
+ASSIGN_OPS = ('=', '+=', '-=', '*=', '/=', '%=', '<<=', '>>=', '&=', '|=', '^=')
+BINARY_PRECEDENCE = [
+    ('||',), ('^^',), ('&&',), ('|',), ('^',), ('&',), ('==', '!='),
+    ('<', '>', '<=', '>='), ('<<', '>>'), ('+', '-'), ('*', '/', '%'),
+]
+
+class Parser(object):
+    ''' Recursive descent parser from tokens to a list of top level nodes '''
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self, offset=0):
+        pos = self.pos + offset
+        return self.tokens[pos] if pos < len(self.tokens) else None
+
+    def at(self, text, offset=0):
+        token = self.peek(offset)
+        return token is not None and token.kind in ('op', 'name') and token.text == text
+
+    def line(self):
+        token = self.peek()
+        return token.line if token is not None else (self.tokens[-1].line if self.tokens else 0)
+
+    def advance(self):
+        token = self.peek()
+        if token is None:
+            raise GLSLError("unexpected end of source", self.line())
+        self.pos += 1
+        return token
+
+    def expect(self, text):
+        token = self.advance()
+        if token.text != text:
+            raise GLSLError("expected {!r} but found {!r}".format(text, token.text), token.line)
+        return token
+
+    def expect_name(self):
+        token = self.advance()
+        if token.kind != 'name':
+            raise GLSLError("expected a name but found {!r}".format(token.text), token.line)
+        return token.text
+
+    def is_type(self, offset=0):
+        token = self.peek(offset)
+        return token is not None and token.kind == 'name' and token.text in TYPES
+
+    def parse(self):
+        '''Parse a whole translation unit'''
+        nodes = []
+        while self.peek() is not None:
+            node = self.external_declaration()
+            if node is not None:
+                nodes.append(node)
+        return nodes
+
+    def qualifiers(self):
+        found = []
+        while True:
+            token = self.peek()
+            if token is not None and token.kind == 'name' and token.text in QUALIFIERS:
+                found.append(self.advance().text)
+            elif self.at('layout'):
+                self.advance()
+                self.expect('(')
+                depth = 1
+                while depth:
+                    text = self.advance().text
+                    depth += {'(': 1, ')': -1}.get(text, 0)
+            else:
+                return [q for q in found if q not in PRECISIONS]
+
+    def external_declaration(self):
+        line = self.line()
+        if self.at(';'):
+            self.advance()
+            return None
+        if self.at('precision'):
+            while not self.at(';'):
+                self.advance()
+            self.advance()
+            return None
+        qualifiers = self.qualifiers()
+        if not self.is_type():
+            raise GLSLError("unsupported declaration starting {!r}".format(self.peek().text), line)
+        type_name = self.advance().text
+        if self.at('(', 1):
+            return self.function(type_name, line)
+        decl = self.declarators(type_name, qualifiers, line)
+        self.expect(';')
+        return Node('global', line, decl=decl)
+
+    def function(self, type_name, line):
+        name = self.expect_name()
+        self.expect('(')
+        params = []
+        if self.at('void') and self.at(')', 1):
+            self.advance()
+        while not self.at(')'):
+            qualifiers = self.qualifiers()
+            param_type = self.advance().text
+            if param_type not in TYPES:
+                raise GLSLError("unsupported parameter type {!r}".format(param_type), line)
+            param_name = self.expect_name() if self.peek().kind == 'name' else None
+            size = None
+            if self.at('['):
+                self.advance()
+                size = self.expression()
+                self.expect(']')
+            qualifier = 'in'
+            for q in qualifiers:
+                if q in ('out', 'inout'):
+                    qualifier = q
+            params.append(Node('param', line, qualifier=qualifier, type=param_type,
+                               name=param_name, size=size))
+            if not self.at(')'):
+                self.expect(',')
+        self.expect(')')
+        body = None
+        if self.at(';'):
+            self.advance()
+        else:
+            body = self.block()
+        return Node('function', line, type=type_name, name=name, params=params, body=body)
+
+    def declarators(self, type_name, qualifiers, line):
+        variables = []
+        while True:
+            name = self.expect_name()
+            size = None
+            init = None
+            if self.at('['):
+                self.advance()
+                size = self.expression()
+                self.expect(']')
+            if self.at('='):
+                self.advance()
+                init = self.assignment()
+            variables.append(Node('var', line, name=name, size=size, init=init))
+            if not self.at(','):
+                break
+            self.advance()
+        return Node('decl', line, type=type_name, qualifiers=qualifiers, vars=variables)
+
+    def block(self):
+        line = self.line()
+        self.expect('{')
+        body = []
+        while not self.at('}'):
+            body.append(self.statement())
+        self.expect('}')
+        return Node('block', line, body=body)
+
+    def starts_declaration(self):
+        token = self.peek()
+        if token is None or token.kind != 'name':
+            return False
+        if token.text in QUALIFIERS:
+            return True
+        return token.text in TYPES and token.text != 'void' and not self.at('(', 1)
+
+    def statement(self):
+        line = self.line()
+        if self.at('{'):
+            return self.block()
+        if self.at(';'):
+            self.advance()
+            return Node('block', line, body=[])
+        if self.at('if'):
+            self.advance()
+            self.expect('(')
+            cond = self.expression()
+            self.expect(')')
+            then = self.statement()
+            other = None
+            if self.at('else'):
+                self.advance()
+                other = self.statement()
+            return Node('if', line, cond=cond, then=then, other=other)
+        if self.at('for'):
+            self.advance()
+            self.expect('(')
+            init = self.simple_statement()
+            cond = None if self.at(';') else self.expression()
+            self.expect(';')
+            step = None if self.at(')') else self.expression()
+            self.expect(')')
+            return Node('for', line, init=init, cond=cond, step=step, body=self.statement())
+        if self.at('while'):
+            self.advance()
+            self.expect('(')
+            cond = self.expression()
+            self.expect(')')
+            return Node('while', line, cond=cond, body=self.statement())
+        if self.at('do'):
+            self.advance()
+            body = self.statement()
+            self.expect('while')
+            self.expect('(')
+            cond = self.expression()
+            self.expect(')')
+            self.expect(';')
+            return Node('do', line, body=body, cond=cond)
+        if self.at('return'):
+            self.advance()
+            value = None if self.at(';') else self.expression()
+            self.expect(';')
+            return Node('return', line, value=value)
+        for jump in ('break', 'continue', 'discard'):
+            if self.at(jump):
+                self.advance()
+                self.expect(';')
+                return Node(jump, line)
+        return self.simple_statement()
+
+    def simple_statement(self):
+        '''A declaration or expression statement, including its semicolon'''
+        line = self.line()
+        if self.at(';'):
+            self.advance()
+            return None
+        if self.starts_declaration():
+            qualifiers = self.qualifiers()
+            type_name = self.advance().text
+            decl = self.declarators(type_name, qualifiers, line)
+            self.expect(';')
+            return decl
+        expr = self.expression()
+        self.expect(';')
+        return Node('expr', line, expr=expr)
+
+    def expression(self):
+        expr = self.assignment()
+        if self.at(','):
+            raise GLSLError("the comma operator is not supported", self.line())
+        return expr
+
+    def assignment(self):
+        line = self.line()
+        left = self.ternary()
+        token = self.peek()
+        if token is not None and token.kind == 'op' and token.text in ASSIGN_OPS:
+            self.advance()
+            return Node('assign', line, op=token.text, target=left, value=self.assignment())
+        return left
+
+    def ternary(self):
+        line = self.line()
+        cond = self.binary(0)
+        if self.at('?'):
+            self.advance()
+            true = self.assignment()
+            self.expect(':')
+            false = self.assignment()
+            return Node('ternary', line, cond=cond, true=true, false=false)
+        return cond
+
+    def binary(self, level):
+        if level == len(BINARY_PRECEDENCE):
+            return self.unary()
+        line = self.line()
+        left = self.binary(level + 1)
+        while True:
+            token = self.peek()
+            if token is None or token.kind != 'op' or token.text not in BINARY_PRECEDENCE[level]:
+                return left
+            self.advance()
+            left = Node('binary', line, op=token.text, left=left, right=self.binary(level + 1))
+
+    def unary(self):
+        line = self.line()
+        token = self.peek()
+        if token is not None and token.kind == 'op':
+            if token.text in ('++', '--'):
+                self.advance()
+                return Node('prefix', line, op=token.text, operand=self.unary())
+            if token.text in ('-', '+', '!', '~'):
+                self.advance()
+                return Node('unary', line, op=token.text, operand=self.unary())
+        return self.postfix()
+
+    def postfix(self):
+        line = self.line()
+        expr = self.primary()
+        while True:
+            if self.at('['):
+                self.advance()
+                index = self.expression()
+                self.expect(']')
+                expr = Node('index', line, base=expr, index=index)
+            elif self.at('.'):
+                self.advance()
+                expr = Node('field', line, base=expr, name=self.expect_name())
+            elif self.at('++') or self.at('--'):
+                expr = Node('postfix', line, op=self.advance().text, operand=expr)
+            else:
+                return expr
+
+    def primary(self):
+        token = self.advance()
+        if token.kind == 'float':
+            return Node('literal', token.line, value=float(token.text.rstrip('fF')), type='float')
+        if token.kind == 'int':
+            text = token.text.rstrip('uU')
+            kind = 'uint' if token.text[-1] in 'uU' else 'int'
+            return Node('literal', token.line, value=int(text, 0), type=kind)
+        if token.kind == 'name':
+            if token.text in ('true', 'false'):
+                return Node('literal', token.line, value=token.text == 'true', type='bool')
+            if self.at('('):
+                self.advance()
+                args = []
+                if self.at('void') and self.at(')', 1):
+                    self.advance()
+                while not self.at(')'):
+                    args.append(self.assignment())
+                    if not self.at(')'):
+                        self.expect(',')
+                self.expect(')')
+                return Node('call', token.line, name=token.text, args=args)
+            return Node('name', token.line, name=token.text)
+        if token.text == '(':
+            expr = self.expression()
+            self.expect(')')
+            return expr
+        raise GLSLError("unexpected {!r}".format(token.text), token.line)
+
+def parse(source, defines=None):
+    '''Preprocess and parse GLSL source into a list of top level nodes'''
+    return Parser(preprocess(source, defines)).parse()
+
+#
+# Types and values
+#
+# Every value carries a lanes axis last: scalars are shaped (lanes,) and vectors
+# (components, lanes), where lanes is either the pixel count or 1 for values that
+# are the same for every pixel.
+#
+
+def base_type(type_name):
+    return VECTORS[type_name][0] if type_name in VECTORS else type_name
+
+def components(type_name):
+    return VECTORS[type_name][1] if type_name in VECTORS else 1
+
+def vector_type(base, size):
+    if size == 1:
+        return base
+    return {'float': 'vec', 'int': 'ivec', 'uint': 'uvec', 'bool': 'bvec'}[base] + str(size)
+
+SWIZZLES = ('xyzw', 'rgba', 'stpq')
+
+def swizzle_indices(name, size, line):
+    for letters in SWIZZLES:
+        if all(c in letters for c in name):
+            indices = [letters.index(c) for c in name]
+            if max(indices) >= size or len(indices) > 4:
+                break
+            return indices
+    raise GLSLError("invalid swizzle .{}".format(name), line)
+
+class Types(object):
+    ''' NumPy dtypes used for each GLSL base type '''
+
+    def __init__(self, float_dtype=np.float32):
+        self.dtypes = {'float': np.dtype(float_dtype), 'int': np.dtype(np.int32),
+                       'uint': np.dtype(np.uint32), 'bool': np.dtype(np.bool_)}
+
+    def dtype(self, type_name):
+        if type_name in SAMPLERS:
+            return self.dtypes['int' if type_name[0] == 'i' else 'float']
+        return self.dtypes[base_type(type_name)]
+
+    def convert(self, value, from_type, to_type):
+        '''Convert a value between base types the way GLSL constructors do'''
+        source = base_type(from_type)
+        target = base_type(to_type)
+        if source == target:
+            return value
+        if target == 'bool':
+            return value != 0
+        if source == 'float' and target in ('int', 'uint'):
+            value = np.trunc(np.nan_to_num(value))
+            if target == 'int':
+                value = np.clip(value, -2 ** 31, 2 ** 31 - 1)
+            else:
+                value = np.clip(value, -2 ** 31, 2 ** 32 - 1)
+                return value.astype(np.int64).astype(np.uint32)
+        return value.astype(self.dtypes[target])
+
+    def constant(self, value, type_name):
+        return np.array([value], dtype=self.dtype(type_name))
+
+    def zeros(self, type_name):
+        size = components(type_name)
+        if size == 1:
+            return np.zeros(1, dtype=self.dtype(type_name))
+        return np.zeros((size, 1), dtype=self.dtype(type_name))
+
+def arithmetic_type(left, right, line):
+    '''Result type of an arithmetic operator, promoting int to float'''
+    base = 'float' if 'float' in (base_type(left), base_type(right)) else base_type(left)
+    size_left, size_right = components(left), components(right)
+    if size_left != size_right and 1 not in (size_left, size_right):
+        raise GLSLError("mismatched vector sizes {} and {}".format(left, right), line)
+    return vector_type(base, max(size_left, size_right))
+
+#
+# Execution context
+#
+
+class Context(object):
+    ''' Lane state while a program runs: variable scopes, masks and profiling '''
+
+    def __init__(self, lanes, profile=None, max_iterations=1 << 20, width=None):
+        self.lanes = lanes
+        # Lanes are rows of width pixels, which derivatives need
+        self.width = width or lanes
+        self.globals = {}
+        self.scopes = [self.globals]
+        none = np.zeros(lanes, dtype=bool)
+        self.returned = none
+        self.broken = none
+        self.continued = none
+        self.return_value = None
+        self.discarded = none
+        self.profile = profile
+        self.max_iterations = max_iterations
+
+    def none(self):
+        return np.zeros(self.lanes, dtype=bool)
+
+    def live(self, mask):
+        return mask & ~(self.returned | self.broken | self.continued)
+
+    def lookup(self, name):
+        for scope in reversed(self.scopes):
+            if name in scope:
+                return scope
+        raise KeyError(name)
+
+    def load(self, name):
+        return self.lookup(name)[name]
+
+    def declare(self, name, value):
+        self.scopes[-1][name] = value
+
+    def store(self, name, value, mask):
+        scope = self.lookup(name)
+        if mask.all():
+            scope[name] = value
+        else:
+            scope[name] = np.where(mask, value, scope[name])
+
+def _component_list(value, type_name):
+    if components(type_name) == 1:
+        return [value]
+    return [value[i] for i in range(components(type_name))]
+
+def _stack(parts):
+    return np.stack(np.broadcast_arrays(*parts))
+
+#
+# Builtin functions
+#
+
+def _derivative(value, width, axis):
+    '''
+    Difference across each 2x2 pixel quad, along x (axis 1) or y (axis 0), as GPUs
+    compute coarse derivatives. Lanes must be whole rows, starting on an even row.
+    '''
+    if value.shape[-1] == 1:
+        return np.zeros_like(value)
+    shape = value.shape[:-1] + (value.shape[-1] // width, width)
+    grid = value.reshape(shape)
+    size = shape[-2 + axis]
+    if size == 1:
+        return np.zeros_like(value)
+    high = np.arange(size) | 1
+    high[high >= size] = size - 1
+    low = high - 1
+    if axis:
+        difference = grid[..., high] - grid[..., low]
+    else:
+        difference = grid[..., high, :] - grid[..., low, :]
+    return difference.reshape(value.shape)
+
+def _float_args(types, args, arg_types):
+    return [types.convert(a, t, 'float') for a, t in zip(args, arg_types)]
+
+def _gen_type(arg_types, base='float'):
+    size = max(components(t) for t in arg_types)
+    return vector_type(base, size)
+
+def _mod(x, y):
+    return x - y * np.floor(x / y)
+
+def _length(v, t):
+    return np.sqrt(np.sum(v * v, axis=0)) if components(t) > 1 else np.abs(v)
+
+def _dot(a, b, ta):
+    return np.sum(a * b, axis=0) if components(ta) > 1 else a * b
+
+def _clamp(x, lo, hi):
+    return np.minimum(np.maximum(x, lo), hi)
+
+def _smoothstep(e0, e1, x):
+    t = _clamp((x - e0) / (e1 - e0), 0.0, 1.0)
+    return t * t * (3.0 - 2.0 * t)
+
+FLOAT_UNARY = {
+    'radians': lambda x: x * np.float32(np.pi / 180.0).astype(x.dtype),
+    'degrees': lambda x: x * np.float32(180.0 / np.pi).astype(x.dtype),
+    'sin': np.sin, 'cos': np.cos, 'tan': np.tan,
+    'asin': np.arcsin, 'acos': np.arccos,
+    'exp': np.exp, 'log': np.log, 'exp2': np.exp2, 'log2': np.log2,
+    'sqrt': np.sqrt, 'inversesqrt': lambda x: 1.0 / np.sqrt(x),
+    'floor': np.floor, 'ceil': np.ceil, 'trunc': np.trunc,
+    'round': np.round, 'roundEven': np.round,
+    'fract': lambda x: x - np.floor(x),
+}
+
+def builtin(types, name, arg_types, line):
+    '''
+    Return (implementation, result type) for a builtin call with the given argument
+    types, or None if name isn't a supported builtin.
+    '''
+    count = len(arg_types)
+    floats = lambda args: _float_args(types, args, arg_types)
+    is_float = any(base_type(t) == 'float' for t in arg_types)
+    if name in FLOAT_UNARY and count == 1:
+        function = FLOAT_UNARY[name]
+        return (lambda args: function(floats(args)[0])), _gen_type(arg_types)
+    if name == 'atan' and count in (1, 2):
+        if count == 1:
+            return (lambda args: np.arctan(floats(args)[0])), _gen_type(arg_types)
+        return (lambda args: np.arctan2(*floats(args))), _gen_type(arg_types)
+    if name == 'pow' and count == 2:
+        return (lambda args: np.power(*floats(args))), _gen_type(arg_types)
+    if name == 'mod' and count == 2:
+        return (lambda args: _mod(*floats(args))), _gen_type(arg_types)
+    if name in ('abs', 'sign'):
+        function = np.abs if name == 'abs' else np.sign
+        return (lambda args: function(args[0])), arg_types[0]
+    if name in ('min', 'max', 'clamp') and count in (2, 3):
+        base = 'float' if is_float else base_type(arg_types[0])
+        function = {'min': np.minimum, 'max': np.maximum, 'clamp': _clamp}[name]
+        convert = lambda args: [types.convert(a, t, base) for a, t in zip(args, arg_types)]
+        return (lambda args: function(*convert(args))), _gen_type(arg_types, base)
+    if name == 'mix' and count == 3:
+        if base_type(arg_types[2]) == 'bool':
+            return (lambda args: np.where(args[2], args[1], args[0])), _gen_type(arg_types[:2])
+        def mix(args):
+            x, y, a = floats(args)
+            return x * (1.0 - a) + y * a
+        return mix, _gen_type(arg_types)
+    if name == 'step' and count == 2:
+        def step(args):
+            edge, x = floats(args)
+            return np.where(x < edge, 0.0, 1.0).astype(types.dtype('float'))
+        return step, _gen_type(arg_types)
+    if name == 'smoothstep' and count == 3:
+        return (lambda args: _smoothstep(*floats(args))), _gen_type(arg_types)
+    if name == 'length' and count == 1:
+        return (lambda args: _length(floats(args)[0], arg_types[0])), 'float'
+    if name == 'distance' and count == 2:
+        return (lambda args: _length(floats(args)[0] - floats(args)[1], arg_types[0])), 'float'
+    if name == 'dot' and count == 2:
+        return (lambda args: _dot(floats(args)[0], floats(args)[1], arg_types[0])), 'float'
+    if name == 'normalize' and count == 1:
+        def normalize(args):
+            v = floats(args)[0]
+            return v / _length(v, arg_types[0])
+        return normalize, arg_types[0]
+    if name in ('texelFetch', 'texture', 'texture2D') and arg_types and arg_types[0] in SAMPLERS:
+        def sample(args):
+            texture = args[0]
+            coord = args[1]
+            layers = texture.shape[0] if arg_types[0].endswith('Array') else None
+            if layers is not None:
+                # The layer is never normalised, and is rounded for texture()
+                layer = coord[2] if name == 'texelFetch' else np.floor(coord[2] + 0.5)
+                layer = np.clip(layer, 0, layers - 1).astype(np.intp)
+                coord = coord[:2]
+            height, width = texture.shape[-3:-1]
+            if name != 'texelFetch':
+                # Nearest filtering with clamped coordinates
+                coord = np.floor(coord * np.array([[width], [height]]))
+            x = np.clip(coord[0], 0, width - 1).astype(np.intp)
+            y = np.clip(coord[1], 0, height - 1).astype(np.intp)
+            texels = (texture[y, x] if layers is None else texture[layer, y, x]).T
+            rgba = np.zeros((4,) + texels.shape[1:], dtype=types.dtype(arg_types[0]))
+            rgba[3] = 1
+            rgba[:len(texels)] = texels
+            return rgba
+        return sample, 'ivec4' if arg_types[0][0] == 'i' else 'vec4'
+    if name == 'cross' and count == 2:
+        def cross(args):
+            a, b = floats(args)
+            return np.stack([a[1] * b[2] - a[2] * b[1], a[2] * b[0] - a[0] * b[2],
+                             a[0] * b[1] - a[1] * b[0]])
+        return cross, 'vec3'
+    return None
+
+#
+# Compiler
+#
+
+class Function(object):
+    ''' A user function: signature, and its body once compiled '''
+
+    def __init__(self, node):
+        self.name = node.name
+        self.type = node.type
+        self.params = node.params
+        self.body = None
+
+class Program(object):
+    '''
+    A compiled fragment shader. render() runs it over a width x height block of pixels
+    and returns gl_FragColor for each, shaped (height, width, 4) with the bottom row
+    first, as glReadPixels returns them.
+    '''
+
+    def __init__(self, source, float_dtype=np.float32, defines=None):
+        self.types = Types(float_dtype)
+        self.functions = {}
+        self.uniforms = {}
+        self.varyings = {}
+        self.outputs = []
+        self.global_code = []
+        self.scopes = []
+        self.profile = None
+        self.compile_unit(parse(source, defines))
+
+    # Symbol table used while compiling, mapping names to (type, array size)
+
+    def declare_symbol(self, name, type_name, size=None):
+        self.scopes[-1][name] = (type_name, size)
+
+    def symbol(self, name, line):
+        for scope in reversed(self.scopes):
+            if name in scope:
+                return scope[name]
+        raise GLSLError("undeclared identifier {!r}".format(name), line)
+
+    def constant_int(self, node):
+        if node.kind != 'literal' or node.type not in ('int', 'uint'):
+            raise GLSLError("array sizes must be integer literals", node.line)
+        return node.value
+
+    def compile_unit(self, nodes):
+        self.scopes = [{
+            'gl_FragCoord': ('vec4', None),
+            'gl_FragColor': ('vec4', None),
+        }]
+        # Signatures first, so calls can refer to functions defined later
+        for node in nodes:
+            if node.kind == 'function':
+                function = self.functions.get(node.name)
+                if function is None or node.body is not None:
+                    self.functions[node.name] = Function(node)
+        for node in nodes:
+            if node.kind == 'global':
+                self.compile_global(node.decl)
+            elif node.kind == 'function' and node.body is not None:
+                self.compile_function(self.functions[node.name], node)
+        if 'main' not in self.functions or self.functions['main'].body is None:
+            raise GLSLError("no main function")
+
+    def compile_global(self, decl):
+        qualifiers = decl.qualifiers
+        for var in decl.vars:
+            size = self.constant_int(var.size) if var.size is not None else None
+            self.declare_symbol(var.name, decl.type, size)
+            if 'uniform' in qualifiers:
+                default = None
+                if var.init is not None:
+                    default = self.compile_expression(var.init)
+                self.uniforms[var.name] = (decl.type, size, default)
+            elif 'varying' in qualifiers or 'in' in qualifiers:
+                self.varyings[var.name] = decl.type
+            else:
+                if 'out' in qualifiers:
+                    self.outputs.append(var.name)
+                if size is not None:
+                    raise GLSLError("only uniform arrays are supported", decl.line)
+                self.global_code.append(self.compile_declaration(decl.type, var, decl.line))
+
+    def compile_function(self, function, node):
+        self.scopes.append({})
+        for param in node.params:
+            if param.size is not None:
+                raise GLSLError("array parameters are not supported", node.line)
+            self.declare_symbol(param.name, param.type)
+        self.return_type = node.type
+        function.body = self.compile_statement(node.body)
+        self.scopes.pop()
+
+    # Statements compile to functions of (context, mask)
+
+    def compile_statement(self, node):
+        if node is None:
+            return lambda ctx, mask: None
+        method = getattr(self, 'statement_' + node.kind, None)
+        if method is None:
+            raise GLSLError("unsupported statement {}".format(node.kind), node.line)
+        return method(node)
+
+    def statement_block(self, node):
+        self.scopes.append({})
+        body = [self.compile_statement(statement) for statement in node.body]
+        self.scopes.pop()
+
+        def block(ctx, mask):
+            ctx.scopes.append({})
+            try:
+                for statement in body:
+                    live = ctx.live(mask)
+                    if not live.any():
+                        break
+                    statement(ctx, live)
+            finally:
+                ctx.scopes.pop()
+        return block
+
+    def statement_decl(self, node):
+        if 'uniform' in node.qualifiers:
+            raise GLSLError("uniforms must be declared globally", node.line)
+        parts = [self.compile_declaration(node.type, var, node.line) for var in node.vars]
+
+        def decl(ctx, mask):
+            for part in parts:
+                part(ctx, mask)
+        return decl
+
+    def compile_declaration(self, type_name, var, line):
+        if var.size is not None:
+            raise GLSLError("only uniform arrays are supported", line)
+        init = None
+        if var.init is not None:
+            init = self.compile_converted(var.init, type_name)
+        self.declare_symbol(var.name, type_name)
+        name = var.name
+        zeros = self.types.zeros(type_name)
+
+        def declare(ctx, mask):
+            ctx.declare(name, init(ctx, mask) if init is not None else zeros)
+        return declare
+
+    def statement_expr(self, node):
+        expr, _ = self.compile_expression(node.expr)
+
+        def statement(ctx, mask):
+            expr(ctx, mask)
+        return statement
+
+    def statement_if(self, node):
+        cond = self.compile_converted(node.cond, 'bool')
+        then = self.compile_statement(node.then)
+        other = self.compile_statement(node.other) if node.other is not None else None
+
+        def if_statement(ctx, mask):
+            test = cond(ctx, mask)
+            taken = mask & test
+            if taken.any():
+                then(ctx, taken)
+            if other is not None:
+                skipped = mask & ~test
+                if skipped.any():
+                    other(ctx, skipped)
+        return if_statement
+
+    def compile_loop(self, node, cond, step, body, test_first):
+        def loop(ctx, mask):
+            saved = ctx.broken, ctx.continued
+            ctx.broken = ctx.none()
+            running = mask
+            iterations = 0
+            try:
+                while True:
+                    if test_first and cond is not None:
+                        running = running & cond(ctx, running)
+                    if not running.any():
+                        break
+                    ctx.continued = ctx.none()
+                    body(ctx, running)
+                    ctx.continued = ctx.none()
+                    running = running & ~(ctx.broken | ctx.returned)
+                    if step is not None and running.any():
+                        step(ctx, running)
+                    if not test_first:
+                        running = running & cond(ctx, running)
+                    iterations += 1
+                    if iterations > ctx.max_iterations:
+                        raise GLSLError("loop ran more than {} iterations"
+                                        .format(ctx.max_iterations), node.line)
+            finally:
+                ctx.broken, ctx.continued = saved
+        return loop
+
+    def statement_for(self, node):
+        self.scopes.append({})
+        init = self.compile_statement(node.init)
+        cond = self.compile_converted(node.cond, 'bool') if node.cond is not None else None
+        step = None
+        if node.step is not None:
+            step_expr, _ = self.compile_expression(node.step)
+            step = lambda ctx, mask: step_expr(ctx, mask)
+        body = self.compile_statement(node.body)
+        self.scopes.pop()
+        loop = self.compile_loop(node, cond, step, body, True)
+
+        def for_statement(ctx, mask):
+            ctx.scopes.append({})
+            try:
+                init(ctx, mask)
+                loop(ctx, mask)
+            finally:
+                ctx.scopes.pop()
+        return for_statement
+
+    def statement_while(self, node):
+        cond = self.compile_converted(node.cond, 'bool')
+        return self.compile_loop(node, cond, None, self.compile_statement(node.body), True)
+
+    def statement_do(self, node):
+        body = self.compile_statement(node.body)
+        cond = self.compile_converted(node.cond, 'bool')
+        return self.compile_loop(node, cond, None, body, False)
+
+    def statement_return(self, node):
+        value = None
+        if node.value is not None:
+            value = self.compile_converted(node.value, self.return_type)
+
+        def return_statement(ctx, mask):
+            if value is not None:
+                result = value(ctx, mask)
+                if ctx.return_value is None:
+                    ctx.return_value = result
+                else:
+                    ctx.return_value = np.where(mask, result, ctx.return_value)
+            ctx.returned = ctx.returned | mask
+        return return_statement
+
+    def statement_break(self, node):
+        def break_statement(ctx, mask):
+            ctx.broken = ctx.broken | mask
+        return break_statement
+
+    def statement_continue(self, node):
+        def continue_statement(ctx, mask):
+            ctx.continued = ctx.continued | mask
+        return continue_statement
+
+    def statement_discard(self, node):
+        def discard(ctx, mask):
+            ctx.discarded = ctx.discarded | mask
+            ctx.returned = ctx.returned | mask
+        return discard
+
+    # Expressions compile to (function of (context, mask), type)
+
+    def compile_expression(self, node):
+        method = getattr(self, 'expression_' + node.kind, None)
+        if method is None:
+            raise GLSLError("unsupported expression {}".format(node.kind), node.line)
+        return method(node)
+
+    def compile_converted(self, node, type_name):
+        expr, expr_type = self.compile_expression(node)
+        if components(expr_type) != components(type_name) and components(expr_type) != 1:
+            raise GLSLError("cannot convert {} to {}".format(expr_type, type_name), node.line)
+        return self.converter(expr, expr_type, type_name)
+
+    def converter(self, expr, from_type, to_type):
+        if base_type(from_type) == base_type(to_type) and components(from_type) == components(to_type):
+            return expr
+        types = self.types
+        size = components(to_type)
+        widen = components(from_type) == 1 and size > 1
+
+        def convert(ctx, mask):
+            value = types.convert(expr(ctx, mask), from_type, to_type)
+            if widen:
+                value = np.stack([value] * size)
+            return value
+        return convert
+
+    def expression_literal(self, node):
+        value = self.types.constant(node.value, node.type)
+        return (lambda ctx, mask: value), node.type
+
+    def expression_name(self, node):
+        type_name, size = self.symbol(node.name, node.line)
+        name = node.name
+        if size is not None:
+            return (lambda ctx, mask: ctx.load(name)), (type_name, size)
+        return (lambda ctx, mask: ctx.load(name)), type_name
+
+    def expression_binary(self, node):
+        left, left_type = self.compile_expression(node.left)
+        right, right_type = self.compile_expression(node.right)
+        op = node.op
+        types = self.types
+        if op in ('&&', '||', '^^'):
+            function = {'&&': np.logical_and, '||': np.logical_or, '^^': np.logical_xor}[op]
+            return (lambda ctx, mask: function(left(ctx, mask), right(ctx, mask))), 'bool'
+        if op in ('==', '!=', '<', '>', '<=', '>='):
+            operand = arithmetic_type(left_type, right_type, node.line)
+            left = self.converter(left, left_type, vector_type(base_type(operand), components(left_type)))
+            right = self.converter(right, right_type, vector_type(base_type(operand), components(right_type)))
+            function = {'==': np.equal, '!=': np.not_equal, '<': np.less, '>': np.greater,
+                        '<=': np.less_equal, '>=': np.greater_equal}[op]
+            if components(operand) > 1:
+                if op == '==':
+                    return (lambda ctx, mask: np.all(left(ctx, mask) == right(ctx, mask), axis=0)), 'bool'
+                if op == '!=':
+                    return (lambda ctx, mask: np.any(left(ctx, mask) != right(ctx, mask), axis=0)), 'bool'
+                raise GLSLError("relational operators need scalars", node.line)
+            return (lambda ctx, mask: function(left(ctx, mask), right(ctx, mask))), 'bool'
+        result = arithmetic_type(left_type, right_type, node.line)
+        base = base_type(result)
+        if op in ('<<', '>>', '&', '|', '^', '%') and base not in ('int', 'uint'):
+            raise GLSLError("operator {} needs integer operands".format(op), node.line)
+        left = self.converter(left, left_type, vector_type(base, components(left_type)))
+        right = self.converter(right, right_type, vector_type(base, components(right_type)))
+        function = self.arithmetic(op, base)
+        dtype = types.dtype(base)
+
+        def binary(ctx, mask):
+            return function(left(ctx, mask), right(ctx, mask)).astype(dtype, copy=False)
+        return binary, result
+
+    def arithmetic(self, op, base):
+        if op == '/' and base == 'int':
+            def divide(a, b):
+                safe = np.where(b == 0, 1, b)
+                quotient = np.abs(a) // np.abs(safe)
+                return np.where((a < 0) != (safe < 0), -quotient, quotient)
+            return divide
+        if op == '/' and base == 'uint':
+            return lambda a, b: a // np.where(b == 0, 1, b)
+        if op == '%':
+            return lambda a, b: np.fmod(a, np.where(b == 0, 1, b))
+        return {'+': np.add, '-': np.subtract, '*': np.multiply, '/': np.divide,
+                '<<': np.left_shift, '>>': np.right_shift, '&': np.bitwise_and,
+                '|': np.bitwise_or, '^': np.bitwise_xor}[op]
+
+    def expression_unary(self, node):
+        operand, operand_type = self.compile_expression(node.operand)
+        if node.op == '+':
+            return operand, operand_type
+        if node.op == '-':
+            return (lambda ctx, mask: -operand(ctx, mask)), operand_type
+        if node.op == '!':
+            return (lambda ctx, mask: ~operand(ctx, mask)), 'bool'
+        return (lambda ctx, mask: ~operand(ctx, mask)), operand_type
+
+    def expression_ternary(self, node):
+        cond = self.compile_converted(node.cond, 'bool')
+        true, true_type = self.compile_expression(node.true)
+        false, false_type = self.compile_expression(node.false)
+        result = true_type
+        if true_type != false_type:
+            result = arithmetic_type(true_type, false_type, node.line)
+            true = self.converter(true, true_type, result)
+            false = self.converter(false, false_type, result)
+
+        def ternary(ctx, mask):
+            return np.where(cond(ctx, mask), true(ctx, mask), false(ctx, mask))
+        return ternary, result
+
+    def expression_index(self, node):
+        base, base_type_name = self.compile_expression(node.base)
+        index, index_type = self.compile_expression(node.index)
+        if base_type(index_type) not in ('int', 'uint'):
+            raise GLSLError("indices must be integers", node.line)
+        if isinstance(base_type_name, tuple):
+            element, size = base_type_name
+
+            def array_index(ctx, mask):
+                value = base(ctx, mask)
+                # Vector elements come out (components, lanes)
+                return value.take(index(ctx, mask), axis=value.ndim - 1, mode='clip')
+            return array_index, element
+        size = components(base_type_name)
+        if size == 1:
+            raise GLSLError("cannot index a scalar", node.line)
+        element = base_type(base_type_name)
+        if node.index.kind == 'literal':
+            component = node.index.value
+            if component >= size:
+                raise GLSLError("index out of range", node.line)
+            return (lambda ctx, mask: base(ctx, mask)[component]), element
+
+        def vector_index(ctx, mask):
+            value = base(ctx, mask)
+            chosen = np.clip(index(ctx, mask), 0, size - 1)
+            value, chosen = np.broadcast_arrays(value, chosen[np.newaxis])
+            return np.take_along_axis(value, chosen[:1], axis=0)[0]
+        return vector_index, element
+
+    def expression_field(self, node):
+        base, base_type_name = self.compile_expression(node.base)
+        if isinstance(base_type_name, tuple) or base_type_name not in VECTORS:
+            raise GLSLError("cannot swizzle {}".format(base_type_name), node.line)
+        indices = swizzle_indices(node.name, components(base_type_name), node.line)
+        result = vector_type(base_type(base_type_name), len(indices))
+        if len(indices) == 1:
+            component = indices[0]
+            return (lambda ctx, mask: base(ctx, mask)[component]), result
+        return (lambda ctx, mask: base(ctx, mask)[indices]), result
+
+    def expression_call(self, node):
+        compiled = [self.compile_expression(arg) for arg in node.args]
+        args = [expr for expr, _ in compiled]
+        arg_types = [t for _, t in compiled]
+        if node.name in TYPES:
+            return self.constructor(node, args, arg_types)
+        if node.name in self.functions:
+            return self.user_call(node, args, arg_types)
+        if node.name in ('dFdx', 'dFdy', 'fwidth') and len(args) == 1:
+            return self.derivative(node.name, args[0], arg_types[0])
+        found = builtin(self.types, node.name, arg_types, node.line)
+        if found is None:
+            raise GLSLError("unsupported function {}".format(node.name), node.line)
+        implementation, result = found
+        dtype = self.types.dtype(result)
+
+        def call(ctx, mask):
+            return implementation([arg(ctx, mask) for arg in args]).astype(dtype, copy=False)
+        return call, result
+
+    def derivative(self, name, arg, arg_type):
+        types = self.types
+        result = vector_type('float', components(arg_type))
+
+        def derivative(ctx, mask):
+            value = types.convert(arg(ctx, mask), arg_type, 'float')
+            if name == 'dFdx':
+                return _derivative(value, ctx.width, 1)
+            if name == 'dFdy':
+                return _derivative(value, ctx.width, 0)
+            return np.abs(_derivative(value, ctx.width, 1)) + np.abs(_derivative(value, ctx.width, 0))
+        return derivative, result
+
+    def constructor(self, node, args, arg_types):
+        target = node.name
+        size = components(target)
+        types = self.types
+        if size == 1:
+            if len(args) != 1:
+                raise GLSLError("{}() takes one argument".format(target), node.line)
+            arg, arg_type = args[0], arg_types[0]
+            if components(arg_type) > 1:
+                return (lambda ctx, mask: types.convert(arg(ctx, mask)[0], arg_type, target)), target
+            return (lambda ctx, mask: types.convert(arg(ctx, mask), arg_type, target)), target
+
+        if len(args) == 1 and components(arg_types[0]) == 1:
+            arg, arg_type = args[0], arg_types[0]
+            return (lambda ctx, mask: np.stack([types.convert(arg(ctx, mask), arg_type, target)] * size)), target
+        if sum(components(t) for t in arg_types) < size:
+            raise GLSLError("not enough components for {}".format(target), node.line)
+
+        def construct(ctx, mask):
+            parts = []
+            for arg, arg_type in zip(args, arg_types):
+                parts.extend(_component_list(types.convert(arg(ctx, mask), arg_type, target), arg_type))
+            return _stack(parts[:size])
+        return construct, target
+
+    def user_call(self, node, args, arg_types):
+        function = self.functions[node.name]
+        if len(args) != len(function.params):
+            raise GLSLError("{} takes {} arguments".format(node.name, len(function.params)), node.line)
+        params = []
+        for arg, arg_type, param, arg_node in zip(args, arg_types, function.params, node.args):
+            convert = self.converter(arg, arg_type, param.type)
+            writeback = None
+            if param.qualifier in ('out', 'inout'):
+                writeback = self.compile_store(arg_node, param.type)
+            params.append((param.name, param.qualifier, convert, writeback, self.types.zeros(param.type)))
+        name = node.name
+
+        def call(ctx, mask):
+            values = {}
+            for param_name, qualifier, convert, _, zeros in params:
+                values[param_name] = convert(ctx, mask) if qualifier != 'out' else zeros
+            saved = (ctx.scopes, ctx.returned, ctx.broken, ctx.continued, ctx.return_value)
+            ctx.scopes = [ctx.globals, values]
+            ctx.returned = ctx.broken = ctx.continued = ctx.none()
+            ctx.return_value = None
+            started = time.time() if ctx.profile is not None else None
+            try:
+                function.body(ctx, mask)
+                result = ctx.return_value
+            finally:
+                ctx.scopes, ctx.returned, ctx.broken, ctx.continued, ctx.return_value = saved
+            if started is not None:
+                record = ctx.profile.setdefault(name, [0, 0, 0.0])
+                record[0] += 1
+                record[1] += int(np.count_nonzero(mask))
+                record[2] += time.time() - started
+            for param_name, qualifier, _, writeback, _ in params:
+                if writeback is not None:
+                    writeback(ctx, mask, values[param_name])
+            return result
+        return call, function.type
+
+    # Assignment
+
+    def compile_store(self, target, value_type):
+        '''Return a function of (context, mask, value) writing value into target'''
+        types = self.types
+        if target.kind == 'name':
+            target_type, size = self.symbol(target.name, target.line)
+            if size is not None:
+                raise GLSLError("cannot assign to an array", target.line)
+            name = target.name
+            convert = lambda value: types.convert(value, value_type, target_type)
+            return lambda ctx, mask, value: ctx.store(name, convert(value), mask)
+
+        if target.kind in ('field', 'index') and target.base.kind == 'name':
+            target_type, size = self.symbol(target.base.name, target.line)
+            if size is not None or target_type not in VECTORS:
+                raise GLSLError("unsupported assignment target", target.line)
+            if target.kind == 'field':
+                indices = swizzle_indices(target.name, components(target_type), target.line)
+            elif target.index.kind == 'literal':
+                indices = [target.index.value]
+            else:
+                raise GLSLError("vector components must be assigned with constant indices", target.line)
+            name = target.base.name
+
+            def store(ctx, mask, value):
+                value = types.convert(value, value_type, target_type)
+                old = ctx.load(name)
+                new = np.array(np.broadcast_to(old, (old.shape[0], ctx.lanes)))
+                parts = _component_list(value, value_type)
+                for i, component in enumerate(indices):
+                    part = parts[i] if len(parts) > 1 else parts[0]
+                    new[component] = np.where(mask, part, new[component])
+                ctx.lookup(name)[name] = new
+            return store
+        raise GLSLError("unsupported assignment target", target.line)
+
+    def expression_assign(self, node):
+        target, target_type = self.compile_expression(node.target)
+        if node.op == '=':
+            value, value_type = self.compile_expression(node.value)
+        else:
+            operation = Node('binary', node.line, op=node.op[:-1], left=node.target, right=node.value)
+            value, value_type = self.compile_expression(operation)
+        store = self.compile_store(node.target, value_type)
+
+        def assign(ctx, mask):
+            new = value(ctx, mask)
+            store(ctx, mask, new)
+            return target(ctx, mask)
+        return assign, target_type
+
+    def expression_prefix(self, node):
+        return self.increment(node, True)
+
+    def expression_postfix(self, node):
+        return self.increment(node, False)
+
+    def increment(self, node, prefix):
+        target, target_type = self.compile_expression(node.operand)
+        one = self.types.constant(1, target_type)
+        store = self.compile_store(node.operand, target_type)
+        add = np.add if node.op == '++' else np.subtract
+        dtype = self.types.dtype(target_type)
+
+        def increment(ctx, mask):
+            old = target(ctx, mask)
+            new = add(old, one).astype(dtype, copy=False)
+            store(ctx, mask, new)
+            return new if prefix else old
+        return increment, target_type
+
+    # Running
+
+    def render(self, width, height, uniforms=None, varyings=None, origin=(0, 0),
+               chunk_lanes=1 << 16, profile=False):
+        '''
+        Run the shader for every pixel of a width x height block whose bottom left pixel
+        is at origin in window coordinates. uniforms maps names to values (lists for
+        arrays), varyings maps names to arrays shaped (components, height * width).
+        Returns float RGBA shaped (height, width, 4).
+        '''
+        uniforms = uniforms or {}
+        varyings = varyings or {}
+        self.profile = {} if profile else None
+        output = np.zeros((height * width, 4), dtype=self.types.dtype('float'))
+        # Chunks start on even rows so derivatives see whole pixel quads
+        rows_per_chunk = max(2, chunk_lanes // max(width, 1) // 2 * 2)
+        with np.errstate(all='ignore'):
+            for first_row in range(0, height, rows_per_chunk):
+                rows = range(first_row, min(first_row + rows_per_chunk, height))
+                start, stop = rows.start * width, rows.stop * width
+                chunk_varyings = dict((name, np.asarray(value)[..., start:stop])
+                                      for name, value in varyings.items())
+                output[start:stop] = self.run(width, rows, origin, uniforms, chunk_varyings).T
+        return output.reshape(height, width, 4)
+
+    def run(self, width, rows, origin, uniforms, varyings):
+        lanes = len(rows) * width
+        ctx = Context(lanes, self.profile, width=width)
+        types = self.types
+        columns = np.tile(np.arange(width), len(rows))
+        lines = np.repeat(np.arange(rows.start, rows.stop), width)
+        frag_coord = np.zeros((4, lanes), dtype=types.dtype('float'))
+        frag_coord[0] = columns + origin[0] + 0.5
+        frag_coord[1] = lines + origin[1] + 0.5
+        frag_coord[2] = 0.5
+        frag_coord[3] = 1.0
+        ctx.globals['gl_FragCoord'] = frag_coord
+        ctx.globals['gl_FragColor'] = types.zeros('vec4')
+
+        everything = np.ones(lanes, dtype=bool)
+        for name, (type_name, size, default) in self.uniforms.items():
+            ctx.globals[name] = self.uniform_value(name, type_name, size, default, uniforms, ctx)
+        for name, type_name in self.varyings.items():
+            if name not in varyings:
+                raise GLSLError("no value given for varying {!r}".format(name))
+            value = np.asarray(varyings[name], dtype=types.dtype(type_name))
+            ctx.globals[name] = value
+        for code in self.global_code:
+            code(ctx, everything)
+
+        self.functions['main'].body(ctx, everything)
+
+        color_name = self.outputs[0] if self.outputs else 'gl_FragColor'
+        color = np.broadcast_to(ctx.globals[color_name], (4, lanes))
+        return np.where(ctx.discarded, 0.0, color)
+
+    def uniform_value(self, name, type_name, size, default, uniforms, ctx):
+        types = self.types
+        if type_name in SAMPLERS:
+            # Textures are given as arrays shaped (height, width, channels), with the
+            # layers first for arrays
+            dimensions = 3 if type_name.endswith('Array') else 2
+            texture = np.asarray(uniforms.get(name, np.zeros((1,) * dimensions + (4,))),
+                                 dtype=types.dtype(type_name))
+            return texture.reshape(texture.shape[:dimensions] + (-1,))
+        if name in uniforms:
+            value = uniforms[name]
+            if size is not None:
+                value = np.asarray(value, dtype=types.dtype(type_name))
+                # Arrays of vectors are held (components, size)
+                return value.reshape(-1, components(type_name)).T if components(type_name) > 1 else value
+            value = np.asarray(value, dtype=types.dtype(type_name))
+            if components(type_name) > 1:
+                return value.reshape(components(type_name), 1)
+            return value.reshape(1)
+        if default is not None:
+            expr, expr_type = default
+            return types.convert(expr(ctx, np.ones(1, dtype=bool)), expr_type, type_name)
+        if size is not None:
+            if components(type_name) > 1:
+                return np.zeros((components(type_name), size), dtype=types.dtype(type_name))
+            return np.zeros(size, dtype=types.dtype(type_name))
+        return types.zeros(type_name)
+
+def compile_fragment(source, float_dtype=np.float32, defines=None):
+    '''Compile fragment shader source into a Program'''
+    return Program(source, float_dtype, defines)
+
+def quad_texcoords(width, height):
+    '''
+    Return gl_MultiTexCoord0 as the viewer's quad interpolates it, shaped (2, pixels).
+    s runs down the window from 2 to -2 and t runs across it from 2 to -2.
+    '''
+    fx = (np.arange(width) + 0.5) / width
+    fy = (np.arange(height) + 0.5) / height
+    return np.stack([np.repeat(2.0 - 4.0 * fy, width), np.tile(2.0 - 4.0 * fx, height)])
+
+def bindings_uniforms(bindings):
+    '''Return the uniform values held in a ShaderController's bindings'''
+    return dict((name, binding['default']) for name, binding in bindings.items()
+                if 'default' in binding)
+
+def to_rgba8(color):
+    '''Quantise float colours to bytes the way a normalised framebuffer does'''
+    return np.rint(np.clip(np.nan_to_num(color), 0.0, 1.0) * 255.0).astype(np.uint8)
+
+def render_shader(shader_path, width, height, profile=False, float_dtype=np.float32):
+    '''
+    Render the shader at shader_path with the values from its bindings file.
+    Returns the Program (for its profile) and the RGBA bytes, bottom row first.
+    '''
+    from procviewer import ShaderController, ShaderSource, read_shader_files
+
+    source = ShaderSource(*read_shader_files(shader_path))
+    controller = ShaderController(source, shader_path)
+    program = compile_fragment(source.fragment_shader, float_dtype)
+    varyings = {}
+    for name, type_name in program.varyings.items():
+        if type_name == 'vec2':
+            varyings[name] = quad_texcoords(width, height)
+    color = program.render(width, height, bindings_uniforms(controller.bindings), varyings,
+                           profile=profile)
+    return program, to_rgba8(color)
+
+def main(argv=None):
+    '''Render a project shader on the CPU and save it as a PNG'''
+    from png_writer import write_png
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('shader', help="shader path without extension, e.g. tiled/tile_shader")
+    parser.add_argument('--width', type=int, default=256)
+    parser.add_argument('--height', type=int, default=256)
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--profile', action='store_true',
+                        help="print calls, lanes evaluated and time for each user function")
+    args = parser.parse_args(argv)
+
+    started = time.time()
+    program, image = render_shader(args.shader, args.width, args.height, args.profile)
+    print("rendered {}x{} in {:.2f}s".format(args.width, args.height, time.time() - started))
+    if args.profile:
+        pixels = float(args.width * args.height)
+        for name, (calls, lanes, seconds) in sorted(program.profile.items(),
+                                                    key=lambda item: -item[1][2]):
+            print("{:>16}: {:8d} calls {:10.2f} per pixel {:8.3f}s".format(
+                name, calls, lanes / pixels, seconds))
+    if args.output:
+        write_png(args.output, image[::-1], args.width, args.height)
+        print("saved to {}".format(args.output))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1003 @@
+''' Source level optimisation of fragment shaders, run between loading a shader and
+    compiling it. Software rasterisers (llvmpipe, OSMesa) do little optimisation of
+    their own, so the source is parsed with glsl_numpy's parser, rewritten and
+    printed back as GLSL:
+
+    - constant folding, including chains of multiplies and divides by constants
+    - pow with a small whole exponent expanded to multiplications
+    - common subexpressions within a run of statements moved into temporaries
+    - dead code dropped: constant branches, statements after a return, unused
+      locals, globals and functions
+
+    Comments and preprocessor directives don't survive, so the controller should
+    keep parsing the original source for its bindings. '''
+
+from __future__ import print_function
+import time
+import argparse
+import numpy as np
+from glsl_numpy import (parse, Node, GLSLError, TYPES, VECTORS, BINARY_PRECEDENCE,
+                        base_type, components, vector_type)
+from glsl_source import header_end
+
+#
+# Printing
+#
+
+ASSIGN_LEVEL = 1
+TERNARY_LEVEL = 2
+BINARY_LEVELS = dict((op, level + 3) for level, ops in enumerate(BINARY_PRECEDENCE) for op in ops)
+UNARY_LEVEL = 3 + len(BINARY_PRECEDENCE)
+POSTFIX_LEVEL = UNARY_LEVEL + 1
+PRIMARY_LEVEL = UNARY_LEVEL + 2
+
+def format_literal(value, type_name):
+    if type_name == 'bool':
+        return 'true' if value else 'false'
+    if type_name == 'float':
+        text = repr(float(value))
+        return text if ('.' in text or 'e' in text) else text + '.0'
+    return str(value) + ('u' if type_name == 'uint' else '')
+
+def _emit(node):
+    '''Return the text of an expression and its precedence level'''
+    kind = node.kind
+    if kind == 'literal':
+        level = UNARY_LEVEL if node.type != 'bool' and node.value < 0 else PRIMARY_LEVEL
+        return format_literal(node.value, node.type), level
+    if kind == 'name':
+        return node.name, PRIMARY_LEVEL
+    if kind == 'call':
+        return "{}({})".format(node.name, ", ".join(emit_expr(arg, ASSIGN_LEVEL) for arg in node.args)), \
+            POSTFIX_LEVEL
+    if kind == 'index':
+        return "{}[{}]".format(emit_expr(node.base, POSTFIX_LEVEL), emit_expr(node.index)), POSTFIX_LEVEL
+    if kind == 'field':
+        return "{}.{}".format(emit_expr(node.base, POSTFIX_LEVEL), node.name), POSTFIX_LEVEL
+    if kind == 'postfix':
+        return emit_expr(node.operand, POSTFIX_LEVEL) + node.op, POSTFIX_LEVEL
+    if kind in ('prefix', 'unary'):
+        operand = emit_expr(node.operand, UNARY_LEVEL)
+        # Keep - -x from reading as a decrement
+        separator = ' ' if operand[:1] in ('-', '+') else ''
+        return node.op + separator + operand, UNARY_LEVEL
+    if kind == 'binary':
+        level = BINARY_LEVELS[node.op]
+        return "{} {} {}".format(emit_expr(node.left, level), node.op, emit_expr(node.right, level + 1)), level
+    if kind == 'ternary':
+        return "{} ? {} : {}".format(emit_expr(node.cond, TERNARY_LEVEL + 1), emit_expr(node.true, TERNARY_LEVEL),
+                                     emit_expr(node.false, TERNARY_LEVEL)), TERNARY_LEVEL
+    if kind == 'assign':
+        return "{} {} {}".format(emit_expr(node.target, UNARY_LEVEL), node.op,
+                                 emit_expr(node.value, ASSIGN_LEVEL)), ASSIGN_LEVEL
+    raise GLSLError("can't print a {} expression".format(kind), node.line)
+
+def emit_expr(node, minimum=0):
+    '''Print an expression, in brackets if it binds less tightly than minimum'''
+    text, level = _emit(node)
+    return "(" + text + ")" if level < minimum else text
+
+def emit_decl(decl):
+    parts = []
+    for var in decl.vars:
+        text = var.name
+        if var.size is not None:
+            text += "[{}]".format(emit_expr(var.size))
+        if var.init is not None:
+            text += " = " + emit_expr(var.init, ASSIGN_LEVEL)
+        parts.append(text)
+    return " ".join(decl.qualifiers + [decl.type, ", ".join(parts)])
+
+def _simple(node):
+    '''Text of a for loop's init statement, without its semicolon'''
+    if node is None:
+        return ""
+    return emit_decl(node) if node.kind == 'decl' else emit_expr(node.expr)
+
+def emit_statement(node, indent, lines):
+    pad = "  " * indent
+    kind = node.kind
+    if kind == 'block':
+        lines.append(pad + "{")
+        for statement in node.body:
+            emit_statement(statement, indent + 1, lines)
+        lines.append(pad + "}")
+    elif kind == 'decl':
+        lines.append(pad + emit_decl(node) + ";")
+    elif kind == 'expr':
+        lines.append(pad + emit_expr(node.expr) + ";")
+    elif kind == 'if':
+        lines.append(pad + "if ({})".format(emit_expr(node.cond)))
+        emit_statement(as_block(node.then), indent, lines)
+        if node.other is not None:
+            lines.append(pad + "else")
+            emit_statement(as_block(node.other), indent, lines)
+    elif kind == 'for':
+        lines.append(pad + "for ({}; {}; {})".format(
+            _simple(node.init), emit_expr(node.cond) if node.cond is not None else "",
+            emit_expr(node.step) if node.step is not None else ""))
+        emit_statement(as_block(node.body), indent, lines)
+    elif kind == 'while':
+        lines.append(pad + "while ({})".format(emit_expr(node.cond)))
+        emit_statement(as_block(node.body), indent, lines)
+    elif kind == 'do':
+        lines.append(pad + "do")
+        emit_statement(as_block(node.body), indent, lines)
+        lines.append(pad + "while ({});".format(emit_expr(node.cond)))
+    elif kind == 'return':
+        lines.append(pad + ("return {};".format(emit_expr(node.value)) if node.value is not None else "return;"))
+    elif kind in ('break', 'continue', 'discard'):
+        lines.append(pad + kind + ";")
+    else:
+        raise GLSLError("can't print a {} statement".format(kind), node.line)
+
+def emit_unit(nodes):
+    '''Print top level nodes as GLSL'''
+    lines = []
+    for node in nodes:
+        if node.kind == 'global':
+            lines.append(emit_decl(node.decl) + ";")
+            continue
+        params = []
+        for param in node.params:
+            text = " ".join(([param.qualifier] if param.qualifier != 'in' else []) + [param.type])
+            if param.name is not None:
+                text += " " + param.name
+            if param.size is not None:
+                text += "[{}]".format(emit_expr(param.size))
+            params.append(text)
+        signature = "{} {}({})".format(node.type, node.name, ", ".join(params))
+        if node.body is None:
+            lines.append(signature + ";")
+        else:
+            lines.append(signature)
+            emit_statement(node.body, 0, lines)
+            lines.append("")
+    return "\n".join(lines).rstrip("\n") + "\n"
+
+def as_block(statement):
+    if statement.kind == 'block':
+        return statement
+    return Node('block', statement.line, body=[statement])
+
+#
+# Walking the tree
+#
+
+EXPRESSION_FIELDS = {
+    'index': ('base', 'index'), 'field': ('base',), 'postfix': ('operand',), 'prefix': ('operand',),
+    'unary': ('operand',), 'binary': ('left', 'right'), 'ternary': ('cond', 'true', 'false'),
+    'assign': ('target', 'value'),
+}
+
+def children(node):
+    '''Sub-expressions of an expression'''
+    if node.kind == 'call':
+        return list(node.args)
+    return [getattr(node, field) for field in EXPRESSION_FIELDS.get(node.kind, ())]
+
+def rebuild(node, function):
+    '''Return a copy of node with function applied to each child expression'''
+    if node.kind == 'call':
+        return Node('call', node.line, name=node.name, args=[function(arg) for arg in node.args])
+    fields = dict((key, value) for key, value in node.__dict__.items() if key not in ('kind', 'line'))
+    for field in EXPRESSION_FIELDS.get(node.kind, ()):
+        fields[field] = function(fields[field])
+    return Node(node.kind, node.line, **fields)
+
+def subexpressions(node):
+    '''Yield node and every expression inside it'''
+    yield node
+    for child in children(node):
+        for sub in subexpressions(child):
+            yield sub
+
+def statement_expressions(node):
+    '''The expressions a simple statement evaluates, or None for compound statements'''
+    if node.kind == 'expr':
+        return [node.expr]
+    if node.kind == 'decl':
+        return [var.init for var in node.vars if var.init is not None]
+    if node.kind == 'return':
+        return [node.value] if node.value is not None else []
+    if node.kind in ('break', 'continue', 'discard'):
+        return []
+    return None
+
+def all_expressions(node):
+    '''Yield every expression in a statement, nested statements included'''
+    kind = node.kind
+    if kind == 'block':
+        for statement in node.body:
+            for expr in all_expressions(statement):
+                yield expr
+        return
+    roots = statement_expressions(node)
+    if roots is None:
+        roots = [getattr(node, field) for field in ('cond', 'step') if getattr(node, field, None) is not None]
+        for field in ('init', 'then', 'other', 'body'):
+            statement = getattr(node, field, None)
+            if statement is not None:
+                for expr in all_expressions(statement):
+                    yield expr
+    for var in getattr(node, 'vars', None) or []:
+        if var.size is not None:
+            roots.append(var.size)
+    for root in roots:
+        for expr in subexpressions(root):
+            yield expr
+
+def map_statement_expressions(node, function):
+    '''Apply function to each top level expression of a statement, nested statements included'''
+    kind = node.kind
+    if kind == 'block':
+        node.body = [map_statement_expressions(statement, function) for statement in node.body]
+    elif kind == 'expr':
+        node.expr = function(node.expr)
+    elif kind == 'decl':
+        for var in node.vars:
+            if var.init is not None:
+                var.init = function(var.init)
+    elif kind == 'return':
+        if node.value is not None:
+            node.value = function(node.value)
+    elif kind in ('if', 'for', 'while', 'do'):
+        for field in ('cond', 'step'):
+            if getattr(node, field, None) is not None:
+                setattr(node, field, function(getattr(node, field)))
+        for field in ('init', 'then', 'other', 'body'):
+            if getattr(node, field, None) is not None:
+                setattr(node, field, map_statement_expressions(getattr(node, field), function))
+    return node
+
+#
+# Types
+#
+
+# Builtins returning the type of their widest argument
+GENERIC_FUNCTIONS = set([
+    'radians', 'degrees', 'sin', 'cos', 'tan', 'asin', 'acos', 'atan', 'sinh', 'cosh', 'tanh',
+    'pow', 'exp', 'log', 'exp2', 'log2', 'sqrt', 'inversesqrt', 'abs', 'sign', 'floor', 'trunc',
+    'round', 'roundEven', 'ceil', 'fract', 'mod', 'min', 'max', 'clamp', 'mix', 'step',
+    'smoothstep', 'normalize', 'faceforward', 'reflect', 'refract', 'dFdx', 'dFdy', 'fwidth',
+])
+SCALAR_FUNCTIONS = set(['length', 'distance', 'dot'])
+SAMPLING_FUNCTIONS = set(['texture', 'texture2D', 'texelFetch'])
+PURE_FUNCTIONS = GENERIC_FUNCTIONS | SCALAR_FUNCTIONS | SAMPLING_FUNCTIONS | set(['cross', 'any', 'all', 'not'])
+
+class Symbols(object):
+    ''' Types of the names in a function, its locals over the globals, and the functions '''
+
+    def __init__(self, globals_, functions, locals_=None):
+        self.globals = globals_
+        self.functions = functions
+        self.locals = locals_ or {}
+
+    def lookup(self, name):
+        return self.locals.get(name) or self.globals.get(name)
+
+    def is_local(self, name):
+        return name in self.locals
+
+def declared_names(decl):
+    return dict((var.name, (decl.type, var.size)) for var in decl.vars)
+
+def function_locals(function):
+    '''Return the parameters and locals of a function, names declared twice are left out'''
+    names = {}
+    repeated = set()
+    declarations = [(param.name, (param.type, param.size)) for param in function.params if param.name]
+
+    def collect(node):
+        if node.kind == 'decl':
+            declarations.extend(declared_names(node).items())
+        for field in ('init', 'then', 'other', 'body'):
+            statement = getattr(node, field, None)
+            if isinstance(statement, list):
+                for sub in statement:
+                    collect(sub)
+            elif statement is not None and hasattr(statement, 'kind'):
+                collect(statement)
+    collect(function.body)
+    for name, declared in declarations:
+        if name in names:
+            repeated.add(name)
+        names[name] = declared
+    for name in repeated:
+        del names[name]
+    return names, repeated
+
+def expr_type(node, symbols):
+    '''Return the GLSL type of an expression, or None when it isn't worked out here'''
+    kind = node.kind
+    if kind == 'literal':
+        return node.type
+    if kind == 'name':
+        found = symbols.lookup(node.name)
+        return found[0] if found is not None and found[1] is None else None
+    if kind == 'index':
+        if node.base.kind == 'name':
+            found = symbols.lookup(node.base.name)
+            if found is not None and found[1] is not None:
+                return found[0]
+        base = expr_type(node.base, symbols)
+        return VECTORS[base][0] if base in VECTORS else None
+    if kind == 'field':
+        base = expr_type(node.base, symbols)
+        return vector_type(base_type(base), len(node.name)) if base in VECTORS or base in ('float', 'int') else None
+    if kind == 'call':
+        return call_type(node, symbols)
+    if kind == 'binary':
+        if node.op in ('==', '!=', '<', '>', '<=', '>=', '&&', '||', '^^'):
+            return 'bool'
+        left = expr_type(node.left, symbols)
+        right = expr_type(node.right, symbols)
+        if left is None or right is None:
+            return None
+        if node.op in ('<<', '>>') or left == right:
+            return left
+        base = 'float' if 'float' in (base_type(left), base_type(right)) else base_type(left)
+        return vector_type(base, max(components(left), components(right)))
+    if kind == 'unary':
+        return 'bool' if node.op == '!' else expr_type(node.operand, symbols)
+    if kind in ('prefix', 'postfix'):
+        return expr_type(node.operand, symbols)
+    if kind == 'ternary':
+        return expr_type(node.true, symbols)
+    if kind == 'assign':
+        return expr_type(node.target, symbols)
+    return None
+
+def call_type(node, symbols):
+    name = node.name
+    if name in TYPES:
+        return name
+    if name in symbols.functions:
+        return symbols.functions[name].type
+    arg_types = [expr_type(arg, symbols) for arg in node.args]
+    if name in SAMPLING_FUNCTIONS:
+        return 'ivec4' if arg_types and arg_types[0] == 'isampler2D' else 'vec4'
+    if name in SCALAR_FUNCTIONS:
+        return 'float'
+    if name == 'cross':
+        return 'vec3'
+    if name in ('any', 'all'):
+        return 'bool'
+    if name in GENERIC_FUNCTIONS and arg_types and None not in arg_types:
+        return max(arg_types, key=components)
+    return None
+
+def is_pure(node, symbols):
+    '''True if evaluating the expression has no side effects'''
+    for sub in subexpressions(node):
+        if sub.kind in ('assign', 'prefix', 'postfix'):
+            return False
+        if sub.kind == 'call' and sub.name not in TYPES and sub.name not in PURE_FUNCTIONS:
+            return False
+    return True
+
+def names_read(node):
+    return set(sub.name for sub in subexpressions(node) if sub.kind == 'name')
+
+def root_name(node):
+    while node.kind in ('index', 'field'):
+        node = node.base
+    return node.name if node.kind == 'name' else None
+
+ALL_GLOBALS = '*'
+
+def names_written(node, symbols):
+    '''
+    Names a statement may write. Calls to the shader's own functions
+    may write any global, which is marked by ALL_GLOBALS.
+    '''
+    written = set()
+    if node.kind == 'decl':
+        written.update(var.name for var in node.vars)
+    for sub in all_expressions(node):
+        if sub.kind == 'assign':
+            written.add(root_name(sub.target))
+        elif sub.kind in ('prefix', 'postfix'):
+            written.add(root_name(sub.operand))
+        elif sub.kind == 'call' and sub.name in symbols.functions:
+            written.add(ALL_GLOBALS)
+            for param, arg in zip(symbols.functions[sub.name].params, sub.args):
+                if param.qualifier in ('out', 'inout'):
+                    written.add(root_name(arg))
+    if node.kind in ('for', 'while', 'do', 'if', 'block'):
+        def declarations(statement):
+            if statement.kind == 'decl':
+                written.update(var.name for var in statement.vars)
+            for field in ('init', 'then', 'other', 'body'):
+                sub = getattr(statement, field, None)
+                if isinstance(sub, list):
+                    for item in sub:
+                        declarations(item)
+                elif sub is not None and hasattr(sub, 'kind'):
+                    declarations(sub)
+        declarations(node)
+    written.discard(None)
+    return written
+
+#
+# Constant folding and pow expansion
+#
+
+FLOAT_FUNCTIONS = {
+    'sin': np.sin, 'cos': np.cos, 'tan': np.tan, 'sqrt': np.sqrt, 'abs': np.abs, 'floor': np.floor,
+    'ceil': np.ceil, 'exp': np.exp, 'exp2': np.exp2, 'log': np.log, 'log2': np.log2,
+    'fract': lambda x: x - np.floor(x), 'radians': lambda x: x * np.float32(np.pi / 180.0),
+    'degrees': lambda x: x * np.float32(180.0 / np.pi), 'pow': np.power, 'min': np.minimum,
+    'max': np.maximum,
+}
+# Largest whole exponent pow is expanded for
+MAX_POW_EXPANSION = 8
+
+def literal(value, type_name, line=None):
+    return Node('literal', line, value=value, type=type_name)
+
+def is_literal(node, *types):
+    return node.kind == 'literal' and (not types or node.type in types)
+
+def to_int32(value):
+    return int(np.array(value, dtype=np.int64).astype(np.int32))
+
+def float_literal(value, line):
+    '''A float literal for a float32 result, or None if it isn't finite'''
+    value = np.float32(value)
+    if not np.isfinite(value):
+        return None
+    return literal(float(value), 'float', line)
+
+def fold_binary(node):
+    '''Fold a binary operation on two literals, returning None if it can't be'''
+    op, left, right = node.op, node.left, node.right
+    if left.type == 'bool' or right.type == 'bool':
+        if left.type == right.type == 'bool' and op in ('&&', '||', '^^', '==', '!='):
+            value = {'&&': left.value and right.value, '||': left.value or right.value,
+                     '^^': left.value != right.value, '==': left.value == right.value,
+                     '!=': left.value != right.value}[op]
+            return literal(value, 'bool', node.line)
+        return None
+    if left.type == right.type == 'int':
+        a, b = left.value, right.value
+        if op in ('/', '%') and b == 0:
+            return None
+        if op == '%' and (a < 0 or b < 0):
+            return None
+        if op in ('<<', '>>') and not 0 <= b < 32:
+            return None
+        values = {
+            '+': lambda: a + b, '-': lambda: a - b, '*': lambda: a * b, '&': lambda: a & b,
+            '|': lambda: a | b, '^': lambda: a ^ b, '<<': lambda: a << b, '>>': lambda: a >> b,
+            '/': lambda: abs(a) // abs(b) * (1 if (a < 0) == (b < 0) else -1), '%': lambda: a % b,
+        }
+        if op in values:
+            return literal(to_int32(values[op]()), 'int', node.line)
+    if set((left.type, right.type)) <= set(('int', 'float')):
+        a, b = np.float32(left.value), np.float32(right.value)
+        comparisons = {'<': a < b, '>': a > b, '<=': a <= b, '>=': a >= b, '==': a == b, '!=': a != b}
+        if op in comparisons:
+            return literal(bool(comparisons[op]), 'bool', node.line)
+        with np.errstate(all='ignore'):
+            values = {'+': lambda: a + b, '-': lambda: a - b, '*': lambda: a * b, '/': lambda: a / b}
+            if op in values:
+                return float_literal(values[op](), node.line)
+    return None
+
+def fold_call(node):
+    '''Fold a constructor or builtin of literals, or expand pow, returning None if it can't be'''
+    name, args = node.name, node.args
+    if len(args) == 1 and is_literal(args[0], 'int', 'float', 'bool'):
+        value = args[0].value
+        if name == 'float':
+            return float_literal(value, node.line)
+        if name == 'int' and args[0].type != 'bool':
+            return literal(to_int32(np.trunc(value)), 'int', node.line)
+    if name in FLOAT_FUNCTIONS and args and all(is_literal(arg, 'float') for arg in args):
+        with np.errstate(all='ignore'):
+            return float_literal(FLOAT_FUNCTIONS[name](*[np.float32(arg.value) for arg in args]), node.line)
+    if name == 'pow' and len(args) == 2 and is_literal(args[1], 'float'):
+        exponent = args[1].value
+        if exponent == 1.0:
+            return args[0]
+        if exponent == int(exponent) and 2 <= exponent <= MAX_POW_EXPANSION:
+            product = args[0]
+            for _ in range(int(exponent) - 1):
+                product = Node('binary', node.line, op='*', left=product, right=args[0])
+            return product
+    return None
+
+def fold(node, symbols):
+    '''Return the expression with constants folded, bottom up'''
+    node = rebuild(node, lambda child: fold(child, symbols))
+    kind = node.kind
+    if kind == 'binary':
+        if is_literal(node.left) and is_literal(node.right):
+            return fold_binary(node) or node
+        return fold_identity(fold_chain(node, symbols), symbols)
+    if kind == 'unary' and is_literal(node.operand):
+        value = node.operand.value
+        if node.op == '-' and node.operand.type in ('int', 'float'):
+            return literal(-value if node.operand.type == 'float' else to_int32(-value), node.operand.type,
+                           node.line)
+        if node.op == '+':
+            return node.operand
+        if node.op == '!' and node.operand.type == 'bool':
+            return literal(not value, 'bool', node.line)
+    if kind == 'call':
+        folded = fold_call(node)
+        if folded is not None:
+            return fold(folded, symbols) if folded.kind == 'binary' else folded
+    if kind == 'ternary' and is_literal(node.cond, 'bool'):
+        return node.true if node.cond.value else node.false
+    return node
+
+def fold_chain(node, symbols):
+    '''
+    Combine float constants multiplying or dividing the same term, so
+    x * 2.0 * pi / 256.0 becomes x * 0.0245... This can change the last bit.
+    '''
+    left = node.left
+    if node.op not in ('*', '/') or not is_literal(node.right, 'float') or left.kind != 'binary' \
+            or left.op not in ('*', '/') or not is_literal(left.right, 'float'):
+        return node
+    if base_type(expr_type(left.left, symbols) or '') != 'float':
+        return node
+    first, second = np.float32(left.right.value), np.float32(node.right.value)
+    with np.errstate(all='ignore'):
+        if left.op == '/' and node.op == '/':
+            op, factor = '/', first * second
+        elif left.op == '*' and node.op == '*':
+            op, factor = '*', first * second
+        elif left.op == '*':
+            op, factor = '*', first / second
+        else:
+            op, factor = '*', second / first
+    factor = float_literal(factor, node.line)
+    if factor is None:
+        return node
+    return Node('binary', node.line, op=op, left=left.left, right=factor)
+
+def fold_identity(node, symbols):
+    '''Drop additions of zero and multiplications by one that don't change the type'''
+    if node.kind != 'binary':
+        return node
+    term = None
+    if node.op in ('+', '-') and is_literal(node.right, 'float') and node.right.value == 0.0:
+        term = node.left
+    elif node.op in ('*', '/') and is_literal(node.right, 'float') and node.right.value == 1.0:
+        term = node.left
+    elif node.op == '*' and is_literal(node.left, 'float') and node.left.value == 1.0:
+        term = node.right
+    if term is not None and expr_type(term, symbols) == expr_type(node, symbols) is not None:
+        return term
+    return node
+
+#
+# Common subexpressions
+#
+
+def expression_size(node):
+    return sum(1 for _ in subexpressions(node))
+
+def is_trivial(node):
+    '''Expressions no cheaper to read from a temporary'''
+    if node.kind in ('literal', 'name'):
+        return True
+    if node.kind in ('field', 'unary') and children(node)[0].kind in ('literal', 'name'):
+        return True
+    return False
+
+def guarded_subexpressions(node, guarded=False):
+    '''Yield (expression, guarded), guarded when it is only evaluated on some paths'''
+    yield node, guarded
+    if node.kind == 'ternary':
+        for sub in guarded_subexpressions(node.cond, guarded):
+            yield sub
+        for branch in (node.true, node.false):
+            for sub in guarded_subexpressions(branch, True):
+                yield sub
+        return
+    if node.kind == 'binary' and node.op in ('&&', '||'):
+        for sub in guarded_subexpressions(node.left, guarded):
+            yield sub
+        for sub in guarded_subexpressions(node.right, True):
+            yield sub
+        return
+    for child in children(node):
+        for sub in guarded_subexpressions(child, guarded):
+            yield sub
+
+def replace_expression(node, key, replacement):
+    if emit_expr(node) == key:
+        return replacement
+    return rebuild(node, lambda child: replace_expression(child, key, replacement))
+
+class CommonSubexpressions(object):
+    ''' Moves repeated pure expressions in a run of statements into temporaries '''
+
+    def __init__(self, symbols, prefix='_cse'):
+        self.symbols = symbols
+        self.prefix = prefix
+        self.count = 0
+
+    def reads_globals(self, names):
+        return any(not self.symbols.is_local(name) for name in names)
+
+    def candidates(self, statements):
+        '''Return {key: [groups]}, a group lists the statement indices of each occurrence'''
+        groups = {}
+        current = {}
+        for index, statement in enumerate(statements):
+            roots = statement_expressions(statement)
+            written = names_written(statement, self.symbols)
+            value = None
+            if statement.kind == 'expr' and statement.expr.kind == 'assign' and \
+                    is_pure(statement.expr.value, self.symbols):
+                # The value is read before the assignment writes
+                value = statement.expr.value
+            found = []
+            for root in roots or []:
+                for sub, guarded in guarded_subexpressions(root):
+                    if guarded or is_trivial(sub) or not is_pure(sub, self.symbols):
+                        continue
+                    var_type = expr_type(sub, self.symbols)
+                    if var_type is None or var_type in ('sampler2D', 'isampler2D', 'void'):
+                        continue
+                    found.append(sub)
+            keys_here = {}
+            for sub in found:
+                keys_here.setdefault(emit_expr(sub), sub)
+            # Close the groups whose inputs this statement changes
+            for key in list(current):
+                reads = current[key][1]
+                if reads & written or (ALL_GLOBALS in written and self.reads_globals(reads)):
+                    group = current.pop(key)
+                    if key in keys_here and value is not None and \
+                            any(emit_expr(sub) == key for sub in subexpressions(value)):
+                        group[0].extend([index] * sum(1 for sub in found if emit_expr(sub) == key))
+                    groups.setdefault(key, []).append(group)
+            for key, sub in keys_here.items():
+                reads = names_read(sub)
+                occurrences = [index] * sum(1 for other in found if emit_expr(other) == key)
+                if reads & written or (ALL_GLOBALS in written and self.reads_globals(reads)):
+                    if key not in current and value is not None and \
+                            any(emit_expr(v) == key for v in subexpressions(value)) and len(occurrences) > 1:
+                        groups.setdefault(key, []).append((occurrences, reads, sub))
+                    continue
+                if key in current:
+                    current[key][0].extend(occurrences)
+                else:
+                    current[key] = (occurrences, reads, sub)
+        for key, group in current.items():
+            groups.setdefault(key, []).append(group)
+        return groups
+
+    def best(self, statements):
+        '''Return the largest repeated expression as (key, node, first, last), or None'''
+        chosen = None
+        for key, groups in self.candidates(statements).items():
+            for occurrences, _, sub in groups:
+                if len(occurrences) < 2:
+                    continue
+                size = expression_size(sub)
+                if chosen is None or size > chosen[0]:
+                    chosen = (size, key, sub, occurrences[0], occurrences[-1])
+        return chosen[1:] if chosen else None
+
+    def run(self, statements):
+        '''Return the statements with repeated expressions moved into temporaries'''
+        statements = list(statements)
+        while True:
+            chosen = self.best(statements)
+            if chosen is None:
+                return statements
+            key, sub, first, last = chosen
+            name = "{}{}".format(self.prefix, self.count)
+            self.count += 1
+            var_type = expr_type(sub, self.symbols)
+            self.symbols.locals[name] = (var_type, None)
+            replacement = Node('name', sub.line, name=name)
+            for index in range(first, last + 1):
+                statement = statements[index]
+                if index == last and statement.kind == 'expr' and statement.expr.kind == 'assign' and \
+                        names_written(statement, self.symbols) & names_read(sub):
+                    statement.expr.value = replace_expression(statement.expr.value, key, replacement)
+                elif statement_expressions(statement) is not None:
+                    map_statement_expressions(statement, lambda expr: replace_expression(expr, key, replacement))
+            declaration = Node('decl', sub.line, type=var_type, qualifiers=[],
+                               vars=[Node('var', sub.line, name=name, size=None, init=sub)])
+            statements.insert(first, declaration)
+
+#
+# Passes over functions
+#
+
+ENDS_BLOCK = ('return', 'break', 'continue', 'discard')
+
+def simplify_statements(statements, symbols):
+    '''Fold constant branches and drop statements after a jump'''
+    result = []
+    for statement in statements:
+        statement = simplify_statement(statement, symbols)
+        if statement is None:
+            continue
+        if statement.kind == 'block' and not any(sub.kind == 'decl' for sub in statement.body):
+            # Blocks without declarations can be merged into their parent
+            result.extend(statement.body)
+        else:
+            result.append(statement)
+        if result and result[-1].kind in ENDS_BLOCK:
+            break
+    return result
+
+def simplify_statement(statement, symbols):
+    kind = statement.kind
+    if kind == 'block':
+        statement.body = simplify_statements(statement.body, symbols)
+        return statement
+    if kind == 'if':
+        statement.then = simplify_statement(statement.then, symbols) or Node('block', statement.line, body=[])
+        if statement.other is not None:
+            statement.other = simplify_statement(statement.other, symbols)
+        if is_literal(statement.cond, 'bool'):
+            taken = statement.then if statement.cond.value else statement.other
+            return as_block(taken) if taken is not None else None
+        return statement
+    if kind in ('for', 'while', 'do'):
+        statement.body = simplify_statement(statement.body, symbols) or Node('block', statement.line, body=[])
+        if kind == 'while' and is_literal(statement.cond, 'bool') and not statement.cond.value:
+            return None
+        return statement
+    return statement
+
+def eliminate_common_subexpressions(statement, cse):
+    '''Run common subexpression elimination over every block in a statement'''
+    kind = statement.kind
+    if kind == 'block':
+        for sub in statement.body:
+            eliminate_common_subexpressions(sub, cse)
+        statement.body = cse.run(statement.body)
+    else:
+        for field in ('then', 'other', 'body'):
+            sub = getattr(statement, field, None)
+            if sub is not None:
+                setattr(statement, field, as_block(sub))
+                eliminate_common_subexpressions(getattr(statement, field), cse)
+
+def count_names(nodes):
+    counts = {}
+    for node in nodes:
+        for expr in all_expressions(node):
+            if expr.kind == 'name':
+                counts[expr.name] = counts.get(expr.name, 0) + 1
+            elif expr.kind == 'call':
+                counts[expr.name] = counts.get(expr.name, 0) + 1
+    return counts
+
+def remove_unused_locals(body, symbols, repeated):
+    '''Drop local variables that are never used and whose initialisers are pure'''
+    while True:
+        counts = count_names([body])
+        removed = [False]
+
+        def prune(statement):
+            if statement.kind == 'block':
+                kept = []
+                for sub in statement.body:
+                    if sub.kind == 'decl':
+                        sub.vars = [var for var in sub.vars
+                                    if var.name in repeated or counts.get(var.name, 0) or
+                                    (var.init is not None and not is_pure(var.init, symbols))]
+                        if not sub.vars:
+                            removed[0] = True
+                            continue
+                    prune(sub)
+                    kept.append(sub)
+                if len(kept) != len(statement.body):
+                    removed[0] = True
+                statement.body = kept
+            else:
+                for field in ('then', 'other', 'body'):
+                    sub = getattr(statement, field, None)
+                    if sub is not None and hasattr(sub, 'kind'):
+                        prune(sub)
+        prune(body)
+        if not removed[0]:
+            return
+
+def reachable_functions(nodes):
+    '''Names of the functions main calls, directly or not'''
+    bodies = dict((node.name, node) for node in nodes if node.kind == 'function' and node.body is not None)
+    reached = set()
+    pending = ['main']
+    while pending:
+        name = pending.pop()
+        if name in reached or name not in bodies:
+            continue
+        reached.add(name)
+        for expr in all_expressions(bodies[name].body):
+            if expr.kind == 'call' and expr.name in bodies:
+                pending.append(expr.name)
+    return reached
+
+# Globals kept whether or not the shader reads them
+INTERFACE_QUALIFIERS = set(['uniform', 'varying', 'attribute', 'in', 'out'])
+
+def optimize_unit(nodes, passes=None):
+    '''Optimise parsed top level nodes in place and return the nodes to keep'''
+    passes = set(passes or PASSES)
+    functions = dict((node.name, node) for node in nodes if node.kind == 'function')
+    globals_ = {}
+    for node in nodes:
+        if node.kind == 'global':
+            globals_.update(declared_names(node.decl))
+
+    global_symbols = Symbols(globals_, functions)
+    for node in nodes:
+        if node.kind == 'global' and 'fold' in passes:
+            for var in node.decl.vars:
+                if var.init is not None:
+                    var.init = fold(var.init, global_symbols)
+
+    for node in nodes:
+        if node.kind != 'function' or node.body is None:
+            continue
+        locals_, repeated = function_locals(node)
+        symbols = Symbols(globals_, functions, locals_)
+        if 'fold' in passes:
+            map_statement_expressions(node.body, lambda expr: fold(expr, symbols))
+        if 'dead' in passes:
+            simplify_statement(node.body, symbols)
+        if 'cse' in passes:
+            eliminate_common_subexpressions(node.body, CommonSubexpressions(symbols))
+        if 'dead' in passes:
+            remove_unused_locals(node.body, symbols, repeated)
+
+    if 'dead' not in passes:
+        return nodes
+    reached = reachable_functions(nodes)
+    kept = [node for node in nodes if node.kind != 'function' or node.name in reached]
+    while True:
+        # Global initialisers count too, wrapped as statements for count_names
+        counts = count_names([node.body for node in kept if node.kind == 'function' and node.body] +
+                             [Node('expr', var.init.line, expr=var.init) for node in kept
+                              if node.kind == 'global' for var in node.decl.vars if var.init is not None])
+        pruned = []
+        for node in kept:
+            if node.kind == 'global' and not INTERFACE_QUALIFIERS & set(node.decl.qualifiers):
+                node.decl.vars = [var for var in node.decl.vars if counts.get(var.name, 0) or
+                                  (var.init is not None and not is_pure(var.init, global_symbols))]
+                if not node.decl.vars:
+                    continue
+            pruned.append(node)
+        if len(pruned) == len(kept):
+            return kept
+        kept = pruned
+
+PASSES = ('fold', 'cse', 'dead')
+# What the viewer runs when asked to optimise. The CSE temporaries were no faster on
+# llvmpipe for any project shader and slower for Julia/julia through the harness, so
+# they're left for callers to name.
+DEFAULT_PASSES = ('fold', 'dead')
+
+def optimize_source(source, passes=None, defines=None):
+    '''
+    Return optimised GLSL for fragment source, keeping its #version and #extension
+    lines. passes picks from 'fold', 'cse' and 'dead', all by default. Raises
+    GLSLError for source outside the subset the parser reads.
+    '''
+    nodes = parse(source, defines)
+    nodes = optimize_unit(nodes, passes)
+    header = "\n".join(line.strip() for line in source[:header_end(source)].splitlines() if line.strip())
+    return (header + "\n" if header else "") + emit_unit(nodes)
+
+#
+# Checking against the render harness
+#
+
+PROJECT_SHADERS = ('perlin_reference/proc_shader', 'tiled/tile_shader', 'scrappy_grid/scrap_grid',
+                   'blobs/blobs_shader', 'spike/working_shader', 'Julia/julia')
+# Views to compare at in place of the bindings, where those show a solid fill.
+# The tile shader's default view is all outside its bounds.
+COMPARE_UNIFORMS = {
+    'tiled/tile_shader': {'x': 0.25, 'y': 0.25},
+}
+
+def compare(shader_path, width=64, height=64, passes=None, repeats=3):
+    '''
+    Render a project shader and its optimised source with glsl_numpy. Returns whether
+    the RGBA bytes match, how many differ, and the best of repeats seconds each render
+    took, taking turns so load on the machine falls on both.
+    '''
+    from procviewer import ShaderController, ShaderSource, read_shader_files
+    from glsl_numpy import compile_fragment, quad_texcoords, bindings_uniforms, to_rgba8
+
+    source = ShaderSource(*read_shader_files(shader_path))
+    uniforms = bindings_uniforms(ShaderController(source, shader_path).bindings)
+    uniforms.update(COMPARE_UNIFORMS.get(shader_path, {}))
+    programs = [compile_fragment(fragment)
+                for fragment in (source.fragment_shader, optimize_source(source.fragment_shader, passes))]
+    images = [None, None]
+    seconds = [float('inf'), float('inf')]
+    for _ in range(repeats):
+        for index, program in enumerate(programs):
+            varyings = dict((name, quad_texcoords(width, height))
+                            for name, type_name in program.varyings.items() if type_name == 'vec2')
+            started = time.time()
+            images[index] = to_rgba8(program.render(width, height, uniforms, varyings))
+            seconds[index] = min(seconds[index], time.time() - started)
+    differing = int(np.count_nonzero(np.any(images[0] != images[1], axis=-1)))
+    return differing == 0, differing, seconds[0], seconds[1]
+
+def time_compute(shader_path, size, frames, passes=None, rounds=5):
+    '''
+    Return the best seconds per size x size frame of the shader and its optimised
+    source compiled by the GL driver, on the compute path, over rounds taken in turn.
+    '''
+    from procviewer import ShaderController, ShaderSource, read_shader_files
+    from compute import ComputeKernel, time_frames
+
+    source = ShaderSource(*read_shader_files(shader_path))
+    controller = ShaderController(source, shader_path)
+    for name, value in COMPARE_UNIFORMS.get(shader_path, {}).items():
+        controller.bindings[name]['default'] = value
+    kernels = [ComputeKernel(fragment, controller, size, size)
+               for fragment in (source.fragment_shader, optimize_source(source.fragment_shader, passes))]
+    seconds = [float('inf'), float('inf')]
+    for _ in range(rounds):
+        for index, kernel in enumerate(kernels):
+            seconds[index] = min(seconds[index], time_frames(kernel.run, frames))
+    for kernel in kernels:
+        kernel.delete()
+    return seconds
+
+def main(argv=None):
+    '''Optimise shaders, check them pixel for pixel and report the NumPy render speedup'''
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('shaders', nargs='*', default=list(PROJECT_SHADERS),
+                        help="shader paths without extension, all project shaders by default")
+    parser.add_argument('--passes', nargs='*', choices=PASSES, default=None)
+    parser.add_argument('--size', type=int, default=64)
+    parser.add_argument('--show', action='store_true', help="print the optimised source")
+    parser.add_argument('--compute-size', type=int, default=256,
+                        help="size of the GL compute renders timed, 0 to only time the NumPy renders")
+    parser.add_argument('--frames', type=int, default=3, help="compute frames per timing round")
+    args = parser.parse_args(argv)
+
+    from procviewer import read_shader_files
+    context = None
+    if args.compute_size > 0:
+        import pyglet
+        # Has to be chosen before pyglet.gl is first imported
+        pyglet.options['headless'] = True
+        from offscreen import headless_context
+        from compute import have_compute
+        context = headless_context()
+        if not have_compute():
+            print("no compute shaders, only timing the NumPy renders")
+            context.close()
+            context = None
+
+    print("{:32} {:18} {:>10} {:>10}".format('shader', 'pixels', 'numpy', 'gl'))
+    for shader_path in args.shaders:
+        if args.show:
+            print(optimize_source(read_shader_files(shader_path)[1], args.passes))
+        identical, differing, before, after = compare(shader_path, args.size, args.size, args.passes)
+        gl_speedup = '-'
+        if context is not None:
+            try:
+                gl_before, gl_after = time_compute(shader_path, args.compute_size, args.frames, args.passes)
+                gl_speedup = "{:.2f}x".format(gl_before / gl_after)
+            except ValueError:
+                # Shaders placing pixels by their varyings have no compute kernel
+                pass
+        print("{:32} {:18} {:>9.2f}x {:>10}".format(
+            shader_path, "identical" if identical else "{} pixels differ".format(differing),
+            before / after, gl_speedup))
+    if context is not None:
+        context.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+''' Helpers for rewriting GLSL source text: finding and replacing declarations,
+    identifiers and indexing, and inserting code at the top of the file or of main.
+    These work on the text (brackets and words), not a full parse, so comments and
+    formatting survive the rewrite. '''
+
+import re
+
+def uniform_pattern(name):
+    '''Regex for the declaration of the uniform name, with its default and trailing comment'''
+    return re.compile(r'(?m)^[ \t]*uniform\s+(?P<type>\w+)\s+' + re.escape(name) +
+                      r'\b\s*(?:\[\s*(?P<size>\w+)\s*\])?\s*(?:=\s*(?P<default>[^;]*))?;[^\n]*')
+
+def find_uniform(source, name):
+    '''Return the match for the declaration of the uniform name, or None'''
+    return uniform_pattern(name).search(source)
+
+def replace_uniform(source, name, replacement=''):
+    '''Replace the declaration of the uniform name, keeping the line's indentation'''
+    match = find_uniform(source, name)
+    if match is None:
+        raise ValueError("no uniform {} declared".format(name))
+    indent = re.match(r'[ \t]*', match.group(0)).group(0)
+    return source[:match.start()] + indent + replacement + source[match.end():]
+
+def header_end(source):
+    '''Return the offset just after the #version and #extension lines'''
+    end = 0
+    for match in re.finditer(r'(?m)^[ \t]*#[ \t]*(?:version|extension)\b[^\n]*\n?', source):
+        end = match.end()
+    return end
+
+def insert_after_header(source, text):
+    '''Insert text after the #version and #extension lines, where directives may go'''
+    end = header_end(source)
+    if end and source[end - 1] != '\n':
+        text = '\n' + text
+    return source[:end] + text + source[end:]
+
+def replace_identifier(source, name, replacement):
+    '''Replace every use of the identifier name, but not longer names containing it'''
+    return re.sub(r'(?<![\w.])' + re.escape(name) + r'\b', replacement, source)
+
+def matching_bracket(source, start):
+    '''Return the index of the bracket closing the one at start'''
+    pairs = {'(': ')', '[': ']', '{': '}'}
+    stack = []
+    for index in range(start, len(source)):
+        char = source[index]
+        if char in pairs:
+            stack.append(pairs[char])
+        elif stack and char == stack[-1]:
+            stack.pop()
+            if not stack:
+                return index
+    raise ValueError("unbalanced bracket at {}".format(start))
+
+def replace_indexing(source, name, function):
+    '''
+    Replace every name[index] with function(index), where index is the source text
+    between the brackets. Nested brackets and indexing inside index are handled.
+    '''
+    pattern = re.compile(r'(?<![\w.])' + re.escape(name) + r'\s*\[')
+    result = []
+    pos = 0
+    while True:
+        match = pattern.search(source, pos)
+        if match is None:
+            break
+        close = matching_bracket(source, match.end() - 1)
+        index = replace_indexing(source[match.end():close], name, function)
+        result.append(source[pos:match.start()])
+        result.append(function(index.strip()))
+        pos = close + 1
+    result.append(source[pos:])
+    return ''.join(result)
+
+def global_initializers(source):
+    '''
+    Return matches for the initialised global variables, outside any braces, with
+    groups type, name and value. Uniforms and constants are left out.
+    '''
+    pattern = re.compile(r'(?m)^[ \t]*(?P<type>\w+)\s+(?P<name>\w+)\s*=\s*(?P<value>[^;]*);')
+    depth = 0
+    pos = 0
+    matches = []
+    for match in pattern.finditer(source):
+        depth += source.count('{', pos, match.start()) - source.count('}', pos, match.start())
+        pos = match.start()
+        if depth == 0 and match.group('type') not in ('uniform', 'const', 'return'):
+            matches.append(match)
+    return matches
+
+def main_body_start(source):
+    '''Return the offset just inside the opening brace of main'''
+    match = re.search(r'\bvoid\s+main\s*\(\s*(?:void\s*)?\)\s*\{', source)
+    if match is None:
+        raise ValueError("no main function found")
+    return match.end()
+
+def insert_at_main_start(source, text):
+    '''Insert statements at the start of main'''
+    start = main_body_start(source)
+    return source[:start] + '\n' + text + source[start:]
+
+def varyings(source):
+    '''Return (type, name) for the inputs of a fragment shader'''
+    return re.findall(r'(?m)^[ \t]*(?:varying|in)\s+(?:(?:flat|smooth|highp|mediump|lowp)\s+)*'
+                      r'(\w+)\s+(\w+)\s*;', source)
@@ -0,0 +1,169 @@
+''' Arithmetic hashing in place of the permutation tables. Every p[...] read becomes
+    hash_permute(key, index, size), a PCG hash of the index keyed by the table, and
+    reads of the gradient tables following it work their gradient out from that. The
+    nested p[p[p[X] + Y] + Z] reads turn from dependent loads into arithmetic, and the
+    512 int table (and its gradients) is never uploaded, only its key. The key is the
+    CRC of the controller's table, so reshuffling it still changes the noise.
+
+    A hash maps the indices onto the table's range at random rather than shuffling
+    them, so about a third of the values repeat. quality compares the tables either
+    way makes, and main times both on the compute path. '''
+
+from __future__ import print_function
+import zlib
+import struct
+import argparse
+import numpy as np
+from glsl_source import find_uniform, replace_uniform, replace_indexing, insert_after_header
+
+HASH_PREFIX = 'hash_'
+HASH_SHADERS = ('perlin_reference/proc_shader', 'tiled/tile_shader', 'spike/working_shader',
+                'scrappy_grid/scrap_grid')
+
+HASH_FUNCTIONS = '''
+uint hash_pcg(uint value) {
+  uint state = value * 747796405u + 2891336453u;
+  uint word  = ((state >> ((state >> 28u) + 4u)) ^ state) * 277803737u;
+  return (word >> 22u) ^ word;
+}
+
+int hash_permute(int key, int index, int size) {
+  return int(hash_pcg((uint(index) % uint(size)) ^ uint(key)) % uint(size));
+}
+
+vec2 hash_gradient(int value, int steps) {
+  float angle = 6.283185307179586 * float(value % steps) / float(steps);
+  return vec2(cos(angle), sin(angle));
+}
+'''
+
+def hashed_tables(bindings, fragment=None):
+    '''Return the names of the permutation tables, those fragment declares if given, sorted'''
+    return sorted(name for name, binding in bindings.items()
+                  if 'seed' in binding and isinstance(binding.get('default'), list)
+                  and (fragment is None or find_uniform(fragment, name) is not None))
+
+def table_key(table):
+    '''Return the hash key for a permutation table, as the signed int uploaded for it'''
+    key = zlib.crc32(struct.pack('<{}i'.format(len(table)), *table)) & 0xFFFFFFFF
+    return key - (1 << 32) if key >= (1 << 31) else key
+
+def hash_source(fragment, bindings):
+    '''
+    Return fragment source reading hash_permute in place of its permutation tables and
+    hash_gradient in place of the gradient tables following them.
+    '''
+    tables = hashed_tables(bindings, fragment)
+    if not tables:
+        raise ValueError("no permutation tables to hash")
+    lookups = {}
+    for name in tables:
+        lookups[name] = "hash_permute({}{}, {{}}, {})".format(HASH_PREFIX, name, bindings[name]['loop'])
+        fragment = replace_uniform(fragment, name, "uniform int {}{};".format(HASH_PREFIX, name))
+        fragment = replace_indexing(fragment, name, lambda index, name=name: lookups[name].format(index))
+    for name, binding in sorted(bindings.items()):
+        if binding.get('from') in lookups and find_uniform(fragment, name) is not None:
+            # The same angles update_gradients gives, from the hashed permutation
+            lookup = "hash_gradient({}, {})".format(lookups[binding['from']], binding['steps'])
+            fragment = replace_uniform(fragment, name)
+            fragment = replace_indexing(fragment, name, lambda index, lookup=lookup: lookup.format(index))
+    return insert_after_header(fragment, HASH_FUNCTIONS.lstrip('\n'))
+
+def hashed_program(controller, program, tables):
+    '''Mark program as compiled from hash_source, so the controller uploads keys for the tables'''
+    controller.hashed_tables[program] = tuple(tables)
+    return program
+
+def pcg(values):
+    '''The hash_pcg of an array of uint32 values'''
+    state = values.astype(np.uint32) * np.uint32(747796405) + np.uint32(2891336453)
+    word = ((state >> ((state >> np.uint32(28)) + np.uint32(4))) ^ state) * np.uint32(277803737)
+    return (word >> np.uint32(22)) ^ word
+
+def permute(key, index, size):
+    '''What hash_permute(key, index, size) reads for an array of indices'''
+    index = np.asarray(index).astype(np.int64).astype(np.uint32) % np.uint32(size)
+    return (pcg(index ^ np.uint32(key & 0xFFFFFFFF)) % np.uint32(size)).astype(np.int32)
+
+def quality(table, size):
+    '''
+    Return statistics of a table of size values: the fraction of values that occur,
+    the correlation of neighbouring entries and the chi-squared per degree of freedom
+    of the 16 gradients grad picks from its entries. Random tables give about 0.63, 0
+    and 1; a shuffle covers every value, and every gradient evenly.
+    '''
+    table = np.asarray(table)[:size]
+    counts = np.bincount(table & 15, minlength=16)
+    expected = size / 16.0
+    return {
+        'coverage': len(np.unique(table)) / float(size),
+        'serial': float(np.corrcoef(table[:-1], table[1:])[0, 1]),
+        'gradients': float(((counts - expected) ** 2 / expected).sum() / 15.0),
+    }
+
+def avalanche(samples=4096, seed=0):
+    '''Return the mean fraction of hash_pcg's output bits flipped by flipping one input bit'''
+    values = np.random.RandomState(seed).randint(0, 1 << 32, samples, dtype=np.uint64).astype(np.uint32)
+    hashed = pcg(values)
+    flipped = [np.unpackbits((hashed ^ pcg(values ^ np.uint32(1 << bit))).view(np.uint8)).mean()
+               for bit in range(32)]
+    return float(np.mean(flipped))
+
+def time_modes(shader_path, size, frames):
+    '''Seconds per size x size frame of the shader with its tables and hashed, on the compute path'''
+    from procviewer import ShaderController, ShaderSource, read_shader_files
+    from compute import ComputeKernel, time_frames
+
+    source = ShaderSource(*read_shader_files(shader_path))
+    controller = ShaderController(source, shader_path)
+    seconds = []
+    for hashed in (False, True):
+        fragment = source.fragment_shader
+        if hashed:
+            fragment = hash_source(fragment, controller.bindings)
+        kernel = ComputeKernel(fragment, controller, size, size)
+        if hashed:
+            hashed_program(controller, kernel.shader, hashed_tables(controller.bindings, source.fragment_shader))
+        seconds.append(time_frames(kernel.run, frames))
+        kernel.delete()
+    return seconds
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare permutation tables with the arithmetic hash.")
+    parser.add_argument('shaders', nargs='*', default=list(HASH_SHADERS))
+    parser.add_argument('--size', type=int, default=512)
+    parser.add_argument('--frames', type=int, default=10, help="compute frames to time, 0 for none")
+    parser.add_argument('--seed', type=int, default=1, help="seed of the table to compare")
+    args = parser.parse_args(argv)
+
+    from procviewer import update_permutation
+    binding = {'default': list(range(512)), 'loop': 256, 'seed': args.seed}
+    update_permutation(binding)
+    print("{:<8} {:>9} {:>9} {:>10}".format('table', 'coverage', 'serial', 'gradients'))
+    for name, table in (('shuffle', binding['default']),
+                        ('hash', permute(table_key(binding['default']), np.arange(256), 256))):
+        stats = quality(table, 256)
+        print("{:<8} {:>9.3f} {:>9.3f} {:>10.2f}".format(name, stats['coverage'], stats['serial'],
+                                                         stats['gradients']))
+    print("hash_pcg avalanche {:.3f}".format(avalanche()))
+
+    if args.frames <= 0:
+        return
+    import pyglet
+    # Has to be chosen before pyglet.gl is first imported
+    pyglet.options['headless'] = True
+    from offscreen import headless_context
+    from compute import have_compute
+    context = headless_context()
+    if not have_compute():
+        print("no compute shaders to time the hash with")
+    else:
+        print("{:<28} {:>10} {:>10} {:>8}".format('shader', 'table ms', 'hash ms', 'speedup'))
+        for shader_path in args.shaders:
+            table, hashed = time_modes(shader_path, args.size, args.frames)
+            print("{:<28} {:>10.2f} {:>10.2f} {:>7.2f}x".format(
+                shader_path, table * 1000.0, hashed * 1000.0, table / hashed))
+    context.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+''' Renders a noise shader's height into a single channel float target (GL_R32F or
+    GL_R16F) rather than 8 bit colour, and exports it at full precision as .npy, raw
+    float32 or a 16 bit greyscale PNG. Maps are rendered in bands of rows from the top,
+    so only one band is held in memory and PNG rows can be written as they arrive.
+    Shaders with a HEIGHTMAP path (perlin, tile, scrappy) write the unquantised height
+    to red under the define, spike and blobs already do. '''
+
+from __future__ import print_function
+import os
+import time
+import argparse
+import numpy as np
+from procviewer import ShaderController, ShaderSource, read_shader_files
+from glsl_source import insert_after_header
+from png_writer import PNGWriter, GREY
+
+HEIGHTMAP_DEFINE = 'HEIGHTMAP'
+# Float render target formats, read back as 32 bit floats whatever the storage
+TARGET_FORMATS = ('R32F', 'R16F')
+
+def heightmap_source(fragment):
+    '''Return fragment source with the HEIGHTMAP define set'''
+    return insert_after_header(fragment, "#define {}\n".format(HEIGHTMAP_DEFINE))
+
+def split_bands(width, height, band_height, tile_size):
+    '''
+    Return the bands of an image, top first, as (top, rows, tiles). top counts rows from
+    the top of the image and tiles are (x, y, width, height) in GL coordinates.
+    '''
+    bands = []
+    for top in range(0, height, band_height):
+        rows = min(band_height, height - top)
+        bottom = height - top - rows
+        tiles = []
+        for y in range(bottom, bottom + rows, tile_size):
+            for x in range(0, width, tile_size):
+                tiles.append((x, y, min(tile_size, width - x), min(tile_size, bottom + rows - y)))
+        bands.append((top, rows, tiles))
+    return bands
+
+class NpyHeightmap(object):
+    ''' Writes rows into a memory mapped .npy file of float32 heights, top row first '''
+
+    def __init__(self, path, width, height):
+        self.heights = np.lib.format.open_memmap(path, 'w+', np.float32, (height, width))
+
+    def write_rows(self, top, rows):
+        self.heights[top:top + len(rows)] = rows
+
+    def close(self):
+        self.heights.flush()
+        del self.heights
+
+class RawHeightmap(NpyHeightmap):
+    ''' Writes rows into a headerless file of native float32 heights, top row first '''
+
+    def __init__(self, path, width, height):
+        self.heights = np.memmap(path, np.float32, 'w+', shape=(height, width))
+
+class PNGHeightmap(object):
+    '''
+    Writes rows as a 16 bit greyscale PNG, mapping heights from low to high onto the
+    full 16 bit range. Heights outside it are clipped.
+    '''
+
+    def __init__(self, path, width, height, low=0.0, high=1.0):
+        self.writer = PNGWriter(path, width, height, GREY, 16)
+        self.low = low
+        self.scale = 65535.0 / (high - low)
+
+    def write_rows(self, top, rows):
+        levels = np.clip((np.asarray(rows) - self.low) * self.scale + 0.5, 0, 65535)
+        for row in levels.astype('>u2'):
+            self.writer.write_row(row)
+
+    def close(self):
+        self.writer.close()
+
+def open_heightmap(path, width, height, low=0.0, high=1.0):
+    '''Return a writer for path, picking the export from the extension'''
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.npy':
+        return NpyHeightmap(path, width, height)
+    if extension == '.png':
+        return PNGHeightmap(path, width, height, low, high)
+    return RawHeightmap(path, width, height)
+
+def render_heightmap(shader, controller, width, height, writer, tile_size=512,
+                     target_format='R32F', band_height=None):
+    '''
+    Render the shader's red channel as a width x height float heightmap into writer,
+    one band of rows at a time. The shader should be compiled from heightmap_source.
+    writer.write_rows(top, rows) is passed a reused buffer, so has to copy what it keeps.
+    '''
+    from pyglet import gl
+    from offscreen import Framebuffer, draw_region
+    from readback import read_pixels, readback_array
+
+    if target_format not in TARGET_FORMATS:
+        raise ValueError("heightmaps render to {}, not {}".format(' or '.join(TARGET_FORMATS), target_format))
+    framebuffer = Framebuffer(tile_size, tile_size, getattr(gl, 'GL_' + target_format))
+    band = np.empty((band_height or tile_size, width), np.float32)
+    try:
+        for top, rows, tiles in split_bands(width, height, band_height or tile_size, tile_size):
+            bottom = height - top - rows
+            for x, y, tile_width, tile_height in tiles:
+                framebuffer.bind()
+                draw_region(shader, controller, x, y, width, height)
+                gl.glBindFramebuffer(gl.GL_READ_FRAMEBUFFER, framebuffer.fbo)
+                pixels = read_pixels(readback_array(tile_width, tile_height, 'R32F'),
+                                     pixel_format='R32F', flip=True)
+                # Band rows run top down, tile rows are flipped to match
+                start = rows - (y - bottom) - tile_height
+                band[start:start + tile_height, x:x + tile_width] = pixels
+            framebuffer.unbind()
+            writer.write_rows(top, band[:rows])
+    finally:
+        framebuffer.delete()
+
+def main(argv=None):
+    '''Render a shader's height at full precision as .npy, .png (16 bit) or raw float32'''
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('shader', help="shader path without extension, e.g. perlin_reference/proc_shader")
+    parser.add_argument('--width', type=int, default=4096)
+    parser.add_argument('--height', type=int, default=4096)
+    parser.add_argument('--tile', type=int, default=512)
+    parser.add_argument('--format', choices=TARGET_FORMATS, default='R32F')
+    parser.add_argument('--low', type=float, default=0.0, help="height at black in a PNG")
+    parser.add_argument('--high', type=float, default=1.0, help="height at white in a PNG")
+    parser.add_argument('--output', default='heightmap.npy')
+    parser.add_argument('--window', action='store_true',
+                        help="use a hidden window rather than a headless context")
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help="serve render metrics on localhost at this port while rendering")
+    args = parser.parse_args(argv)
+
+    import pyglet
+    # Has to be chosen before pyglet.gl is first imported
+    pyglet.options['headless'] = not args.window
+    from shader import Shader
+    from offscreen import headless_context
+    from metrics import serve
+
+    if args.metrics_port is not None:
+        serve(args.metrics_port)
+    vertex_shader, fragment_shader = read_shader_files(args.shader)
+    controller = ShaderController(ShaderSource(vertex_shader, fragment_shader), args.shader)
+    context = headless_context()
+    shader = Shader(vertex_shader, heightmap_source(fragment_shader))
+    controller.shader = shader
+
+    started = time.time()
+    writer = open_heightmap(args.output, args.width, args.height, args.low, args.high)
+    render_heightmap(shader, controller, args.width, args.height, writer, args.tile, args.format)
+    writer.close()
+    context.close()
+    print("saved to {} in {:.1f}s".format(args.output, time.time() - started))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+''' CPU fallback for Julia/julia.f.glsl on machines without a GPU.
+    The escape time loop is vectorised with NumPy over blocks of rows, and the
+    blocks are shared across a process pool that writes into a shared array. '''
+
+from __future__ import print_function
+import argparse
+from multiprocessing import Pool, RawArray, cpu_count
+import numpy as np
+from procviewer import ShaderController, ShaderSource, read_shader_files
+
+SHADER_PATH = 'Julia/julia'
+# Matches julia.f.glsl
+MAX_ITER = 1024
+ESCAPE = 1e7
+
+# State of a worker process, set up once by _init_worker
+_worker = {}
+
+def julia_uv(width, height, rows, dtype=np.float32):
+    '''
+    Return the uv varying for pixel centres in the given rows (bottom row is 0).
+    This follows the viewer's quad, where uv.x runs down the window from 2 to -2 and
+    uv.y runs across it from 2 to -2.
+    '''
+    fx = (np.arange(width, dtype=np.float64) + 0.5) / width
+    fy = (np.arange(rows.start, rows.stop, dtype=np.float64) + 0.5) / height
+    uv_x = np.repeat(2.0 - 4.0 * fy, width)
+    uv_y = np.tile(2.0 - 4.0 * fx, len(fy))
+    return uv_x.astype(dtype), uv_y.astype(dtype)
+
+def escape_time(z_x, z_y, c, max_iter=MAX_ITER):
+    '''
+    Iterate Z = Z^2 + C with the derivative dZ = 2 Z dZ + 1 for every start point.
+    Escaped points leave the active set as soon as they escape.
+    Returns the squared norms of Z and dZ where each point stopped.
+    '''
+    dtype = z_x.dtype
+    c_x, c_y = dtype.type(c[0]), dtype.type(c[1])
+    two, one = dtype.type(2.0), dtype.type(1.0)
+
+    z_x, z_y = z_x.copy(), z_y.copy()
+    dz_x = np.ones_like(z_x)
+    dz_y = np.zeros_like(z_x)
+    active = np.arange(len(z_x))
+    out_z = np.empty_like(z_x)
+    out_dz = np.empty_like(z_x)
+
+    with np.errstate(over='ignore', invalid='ignore'):
+        for _ in range(max_iter):
+            sqr_x = z_x * z_x
+            sqr_y = z_y * z_y
+            escaped = sqr_x + sqr_y > ESCAPE
+            if escaped.any():
+                done = active[escaped]
+                out_z[done] = sqr_x[escaped] + sqr_y[escaped]
+                out_dz[done] = dz_x[escaped] * dz_x[escaped] + dz_y[escaped] * dz_y[escaped]
+                keep = ~escaped
+                active = active[keep]
+                z_x, z_y, dz_x, dz_y = z_x[keep], z_y[keep], dz_x[keep], dz_y[keep]
+                sqr_x, sqr_y = sqr_x[keep], sqr_y[keep]
+                if not len(active):
+                    break
+
+            dz_x, dz_y = (two * (z_x * dz_x - z_y * dz_y) + one,
+                          two * (z_x * dz_y + z_y * dz_x))
+            z_x, z_y = sqr_x - sqr_y + c_x, two * z_x * z_y + c_y
+
+        out_z[active] = z_x * z_x + z_y * z_y
+        out_dz[active] = dz_x * dz_x + dz_y * dz_y
+    return out_z, out_dz
+
+def julia_colour(sqr_norm_z, sqr_norm_dz):
+    '''Return RGBA bytes for the red to yellow mix on the distance estimate'''
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        mix = np.sqrt(np.sqrt(sqr_norm_z / sqr_norm_dz) * 0.5 * np.log(sqr_norm_z))
+    # Points at the origin divide by a zero derivative, and points inside never escape
+    mix = np.where(np.isfinite(mix), mix, np.where(mix == np.inf, 1.0, 0.0))
+    rgba = np.empty(sqr_norm_z.shape + (4,), dtype=np.uint8)
+    rgba[..., 0] = 255
+    rgba[..., 1] = np.rint(np.clip(mix, 0.0, 1.0) * 255.0)
+    rgba[..., 2] = 0
+    rgba[..., 3] = 255
+    return rgba
+
+def render_rows(width, height, rows, c, max_iter=MAX_ITER, dtype=np.float32):
+    '''Render a block of rows to RGBA bytes, shaped (rows, width, 4)'''
+    z_x, z_y = julia_uv(width, height, rows, dtype)
+    sqr_norm_z, sqr_norm_dz = escape_time(z_x, z_y, c, max_iter)
+    return julia_colour(sqr_norm_z, sqr_norm_dz).reshape(len(rows), width, 4)
+
+def _init_worker(shared, width, height):
+    '''Pool initialiser, view the shared output as this worker's image'''
+    _worker['output'] = np.frombuffer(shared, dtype=np.uint8).reshape(height, width, 4)
+
+def _render_block(task):
+    '''Pool worker, renders a block straight into the shared output'''
+    width, height, start, stop, c, max_iter, dtype = task
+    _worker['output'][start:stop] = render_rows(width, height, range(start, stop), c, max_iter, dtype)
+    return stop - start
+
+def render_julia(width, height, c, max_iter=MAX_ITER, processes=None, block_rows=8,
+                 dtype=np.float32):
+    '''
+    Render the Julia set for the constant c as the GPU would. Returns RGBA bytes
+    shaped (height, width, 4) with the bottom row first, as glReadPixels returns them.
+    '''
+    if processes == 1:
+        return render_rows(width, height, range(height), c, max_iter, dtype)
+
+    # Handed to the workers as they start, it can't be pickled into a task
+    shared = RawArray('B', width * height * 4)
+    tasks = [(width, height, start, min(start + block_rows, height), c, max_iter, dtype)
+             for start in range(0, height, block_rows)]
+    pool = Pool(processes or cpu_count(), _init_worker, (shared, width, height))
+    try:
+        # Small blocks handed out on demand keep the pool busy, as the cost of
+        # a block depends on how quickly its points escape
+        for _ in pool.imap_unordered(_render_block, tasks):
+            pass
+    finally:
+        pool.close()
+        pool.join()
+    return np.frombuffer(shared, dtype=np.uint8).reshape(height, width, 4).copy()
+
+def julia_constant(shader_path=SHADER_PATH):
+    '''Return the Julia constant (x, y) and zoom from the shader's bindings file'''
+    controller = ShaderController(ShaderSource(*read_shader_files(shader_path)), shader_path)
+    bindings = controller.bindings
+    return (bindings['x']['default'], bindings['y']['default']), bindings['zoom']['default']
+
+def main(argv=None):
+    '''Render the Julia shader on the CPU and save it as a PNG'''
+    from png_writer import write_png
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--width', type=int, default=512)
+    parser.add_argument('--height', type=int, default=512)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--max-iter', type=int, default=MAX_ITER)
+    parser.add_argument('--output', default='julia_cpu.png')
+    args = parser.parse_args(argv)
+
+    # julia.f.glsl doesn't use zoom, the view is always the viewer quad's uv range
+    c, _ = julia_constant()
+    image = render_julia(args.width, args.height, c, args.max_iter, args.processes)
+    # PNG rows run top down
+    write_png(args.output, image[::-1], args.width, args.height)
+    print("saved to {}".format(args.output))
+
+if __name__ == '__main__':
+    main()
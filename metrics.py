@@ -0,0 +1,162 @@
+''' Counters and histograms for the render and controller hot paths, served in the
+    Prometheus text format from an optional localhost endpoint. Metrics are updated
+    without locking: each is written from one thread (the one owning the GL context)
+    and the endpoint reads whatever it finds, so a scrape can land mid observation
+    and see a histogram's count one ahead of its buckets. '''
+
+from __future__ import print_function
+import time
+import bisect
+import functools
+import threading
+
+clock = getattr(time, 'perf_counter', time.time)
+
+PREFIX = 'pyglsl_'
+# Seconds, from a tenth of a millisecond to ten seconds
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter(object):
+    ''' A count that only goes up '''
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        return [(self.name, '', self.value)]
+
+class Histogram(object):
+    '''
+    Counts observations into buckets by upper bound. Counts are kept per bucket and
+    made cumulative when read, so an observation is one bisect and two additions.
+    '''
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.bounds = list(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def samples(self):
+        samples = []
+        total = 0
+        for bound, count in zip(self.bounds + [float('inf')], list(self.counts)):
+            total += count
+            samples.append((self.name + '_bucket', '{{le="{}"}}'.format(format_value(bound)), total))
+        samples.append((self.name + '_sum', '', self.sum))
+        samples.append((self.name + '_count', '', total))
+        return samples
+
+class Registry(object):
+    ''' The metrics of a process, by name '''
+
+    def __init__(self, prefix=PREFIX):
+        self.prefix = prefix
+        self.metrics = {}
+        # Only taken when metrics are created, never when they are updated
+        self.lock = threading.Lock()
+
+    def _metric(self, cls, name, help_text, *args):
+        name = self.prefix + name
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help_text, *args)
+            elif not isinstance(metric, cls):
+                raise ValueError("{} is already a {}".format(name, metric.kind))
+        return metric
+
+    def counter(self, name, help_text):
+        '''Return the counter called name, creating it the first time'''
+        return self._metric(Counter, name, help_text)
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        '''Return the histogram called name, creating it the first time'''
+        return self._metric(Histogram, name, help_text, buckets)
+
+    def render(self):
+        '''Return every metric in the Prometheus text exposition format'''
+        lines = []
+        for name in sorted(self.metrics):
+            metric = self.metrics[name]
+            lines.append("# HELP {} {}".format(name, metric.help))
+            lines.append("# TYPE {} {}".format(name, metric.kind))
+            for sample, labels, value in metric.samples():
+                lines.append("{}{} {}".format(sample, labels, format_value(value)))
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+def timed(histogram):
+    '''Decorate a function to observe the seconds each call takes in histogram'''
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            started = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                histogram.observe(clock() - started)
+        return wrapper
+    return decorate
+
+def serve(port=9464, host='127.0.0.1', registry=REGISTRY):
+    '''
+    Serve registry at http://host:port/metrics from a daemon thread. Returns the
+    server, whose shutdown() stops it. Port 0 picks a free port, see server_port.
+    '''
+    # http.server takes tens of milliseconds to import, only pay for it when serving
+    try:
+        from http.server import HTTPServer, BaseHTTPRequestHandler
+    except ImportError:
+        from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        ''' Serves the server's registry at /metrics '''
+
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = self.server.registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Scrapes every few seconds would drown the viewer's output
+            pass
+
+    server = HTTPServer((host, port), MetricsHandler)
+    server.registry = registry
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
@@ -0,0 +1,241 @@
+''' Precomputed noise: getHash is rendered once into a tileable 3D texture, and the
+    shaders read it back with one filtered fetch per octave in place of hashing the 8
+    corners of a cell. The volume holds the reference noise with its lattice wrapped
+    every VOLUME_PERIOD cells, sampled at texel centres, so repeating linear filtering
+    reconstructs it between them. It is generated from the shader's permutation table
+    and again whenever that changes, as the shuffle key does.
+
+    getHash wraps every 256 cells, and a volume that did too would need 2048^3 texels,
+    so the volume draws a different field of the same noise rather than an
+    approximation of the shader's: the view changes. fidelity measures both the
+    filtering, against the wrapped noise, and the change, against getHash. '''
+
+from __future__ import print_function
+import time
+import ctypes
+import argparse
+import numpy as np
+from glsl_source import find_uniform, insert_after_header
+from simplex import replace_get_hash
+from metrics import REGISTRY
+
+VOLUME_SIZE = 128
+# Lattice cells the volume tiles over on each axis, 8 texels a cell at VOLUME_SIZE
+VOLUME_PERIOD = 16
+# Texture unit for the volume, unit 0 is left to the shaders
+VOLUME_UNIT = 1
+VOLUME_SHADERS = ('perlin_reference/proc_shader', 'spike/working_shader', 'blobs/blobs_shader',
+                  'scrappy_grid/scrap_grid')
+
+NOISE_VOLUMES = REGISTRY.counter('noise_volumes_generated_total', "Noise volumes generated and uploaded")
+
+def fade(t):
+    return t * t * t * (t * (t * 6.0 - 15.0) + 10.0)
+
+def grad(hsh, x, y, z):
+    '''The reference's grad, over arrays'''
+    h = hsh & 15
+    u = np.where(h < 8, x, y)
+    v = np.where(h < 4, y, np.where((h == 12) | (h == 14), x, z))
+    return np.where(h & 1, -u, u) + np.where(h & 2, -v, v)
+
+def perlin(x, y, z, table, period=256):
+    '''getHash at arrays of points, with the lattice wrapped every period cells'''
+    if not 0 < period <= 256:
+        raise ValueError("period must be between 1 and 256 cells")
+    p = np.asarray(table)
+    cells = [np.floor(c) for c in (x, y, z)]
+    X, Y, Z = [cell.astype(np.int64) % period for cell in cells]
+    x, y, z = x - cells[0], y - cells[1], z - cells[2]
+    u, v, w = fade(x), fade(y), fade(z)
+
+    def corner(dx, dy, dz):
+        hsh = p[p[p[(X + dx) % period] + (Y + dy) % period] + (Z + dz) % period]
+        return grad(hsh, x - dx, y - dy, z - dz)
+
+    def lerp(t, a, b):
+        return a + t * (b - a)
+
+    return lerp(w, lerp(v, lerp(u, corner(0, 0, 0), corner(1, 0, 0)),
+                           lerp(u, corner(0, 1, 0), corner(1, 1, 0))),
+                   lerp(v, lerp(u, corner(0, 0, 1), corner(1, 0, 1)),
+                           lerp(u, corner(0, 1, 1), corner(1, 1, 1))))
+
+def volume(table, size=VOLUME_SIZE, period=VOLUME_PERIOD):
+    '''Return the size^3 float32 noise volume over period^3 cells, indexed [z, y, x]'''
+    centres = (np.arange(size) + 0.5) * period / float(size)
+    y, x = np.meshgrid(centres, centres, indexing='ij')
+    data = np.empty((size, size, size), dtype=np.float32)
+    for index, z in enumerate(centres):
+        data[index] = perlin(x, y, np.full_like(x, z), table, period)
+    return data
+
+def sample(data, x, y, z, period=VOLUME_PERIOD):
+    '''What the shader's fetch reads from the volume at arrays of points: trilinear, repeating'''
+    size = data.shape[0]
+    coords = [c * size / float(period) - 0.5 for c in (x, y, z)]
+    low = [np.floor(c) for c in coords]
+    (fx, fy, fz) = [c - l for c, l in zip(coords, low)]
+    (x0, y0, z0) = [l.astype(np.int64) % size for l in low]
+    (x1, y1, z1) = [(i + 1) % size for i in (x0, y0, z0)]
+
+    def plane(zi):
+        return ((data[zi, y0, x0] * (1 - fx) + data[zi, y0, x1] * fx) * (1 - fy) +
+                (data[zi, y1, x0] * (1 - fx) + data[zi, y1, x1] * fx) * fy)
+
+    return plane(z0) * (1 - fz) + plane(z1) * fz
+
+def fidelity(table, size=VOLUME_SIZE, period=VOLUME_PERIOD, samples=20000, seed=0, reference_period=256):
+    '''
+    Return the RMS and the worst difference between the volume's fetch and the noise
+    wrapped every reference_period cells at random points, with the volume held as half
+    floats like its texture. getHash wraps every 256 cells, pass period to measure only
+    the filtering.
+    '''
+    points = np.random.RandomState(seed).uniform(0.0, reference_period, (3, samples))
+    data = volume(table, size, period).astype(np.float16).astype(np.float32)
+    error = sample(data, *points, period=period) - perlin(*points, table=table, period=reference_period)
+    return float(np.sqrt((error ** 2).mean())), float(np.abs(error).max())
+
+def volume_source(fragment, period=VOLUME_PERIOD, table='p'):
+    '''Return fragment source with getHash fetching from the noise_volume texture'''
+    match = find_uniform(fragment, table)
+    if match is None or match.group('type') != 'int' or match.group('size') is None:
+        raise ValueError("no permutation table {} declared".format(table))
+    body = "\n  return textureLod(noise_volume, vec3(x, y, z) / {!r}, 0.0).r;\n".format(float(period))
+    return insert_after_header(replace_get_hash(fragment, body), "uniform sampler3D noise_volume;\n")
+
+class NoiseVolume(object):
+    '''
+    The noise volume texture for the controller's permutation table named table,
+    generated again when the table changes.
+    '''
+
+    def __init__(self, controller, table='p', size=VOLUME_SIZE, period=VOLUME_PERIOD):
+        if table not in controller.bindings:
+            raise ValueError("no permutation table {} bound".format(table))
+        self.controller = controller
+        self.table = table
+        self.size = size
+        self.period = period
+        self.texture = None
+        # The table the volume was last generated from
+        self.generated = None
+
+    def update(self):
+        '''Generate and upload the volume if the table changed, returning whether it did'''
+        table = self.controller.bindings[self.table]['default']
+        if table == self.generated:
+            return False
+        self.upload(volume(table, self.size, self.period))
+        self.generated = list(table)
+        NOISE_VOLUMES.inc()
+        return True
+
+    def upload(self, data):
+        from pyglet import gl
+
+        if self.texture is None:
+            texture = gl.GLuint(0)
+            gl.glGenTextures(1, ctypes.byref(texture))
+            self.texture = texture.value
+        gl.glBindTexture(gl.GL_TEXTURE_3D, self.texture)
+        for wrap in (gl.GL_TEXTURE_WRAP_S, gl.GL_TEXTURE_WRAP_T, gl.GL_TEXTURE_WRAP_R):
+            gl.glTexParameteri(gl.GL_TEXTURE_3D, wrap, gl.GL_REPEAT)
+        gl.glTexParameteri(gl.GL_TEXTURE_3D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_LINEAR)
+        gl.glTexParameteri(gl.GL_TEXTURE_3D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_LINEAR)
+        data = np.ascontiguousarray(data, dtype=np.float32)
+        gl.glTexImage3D(gl.GL_TEXTURE_3D, 0, gl.GL_R16F, self.size, self.size, self.size, 0,
+                        gl.GL_RED, gl.GL_FLOAT, data.ctypes.data_as(ctypes.POINTER(gl.GLfloat)))
+        gl.glBindTexture(gl.GL_TEXTURE_3D, 0)
+
+    def bind(self, shader):
+        '''Bring the volume up to date and point the bound shader's noise_volume at it'''
+        from pyglet import gl
+
+        self.update()
+        gl.glActiveTexture(gl.GL_TEXTURE0 + VOLUME_UNIT)
+        gl.glBindTexture(gl.GL_TEXTURE_3D, self.texture)
+        gl.glActiveTexture(gl.GL_TEXTURE0)
+        shader.uniformi('noise_volume', VOLUME_UNIT)
+
+    def delete(self):
+        from pyglet import gl
+
+        if self.texture is not None:
+            gl.glDeleteTextures(1, ctypes.byref(gl.GLuint(self.texture)))
+        self.texture = None
+        self.generated = None
+
+def time_modes(shader_path, size, frames):
+    '''
+    Seconds per size x size frame of the shader hashing and fetching the volume, on the
+    compute path, and the mean and worst difference between their frames in 8 bit levels
+    '''
+    from procviewer import ShaderController, ShaderSource, read_shader_files
+    from compute import ComputeKernel, time_frames
+
+    source = ShaderSource(*read_shader_files(shader_path))
+    controller = ShaderController(source, shader_path)
+    noise = NoiseVolume(controller)
+    seconds = []
+    frames_read = []
+    for fragment in (source.fragment_shader, volume_source(source.fragment_shader)):
+        kernel = ComputeKernel(fragment, controller, size, size)
+        if fragment is not source.fragment_shader:
+            kernel.shader.bind()
+            noise.bind(kernel.shader)
+        seconds.append(time_frames(kernel.run, frames))
+        frames_read.append(kernel.read_into()[..., :3].astype(np.int64))
+        kernel.delete()
+    noise.delete()
+    difference = np.abs(frames_read[1] - frames_read[0])
+    return seconds, (float(difference.mean()), int(difference.max()))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare hashing the noise with fetching it from a volume.")
+    parser.add_argument('shaders', nargs='*', default=list(VOLUME_SHADERS))
+    parser.add_argument('--size', type=int, default=512, help="size of the compute renders")
+    parser.add_argument('--frames', type=int, default=10, help="compute frames to time, 0 for none")
+    parser.add_argument('--volumes', type=int, nargs='*', default=[32, 64, VOLUME_SIZE],
+                        help="volume sizes to measure the fidelity of")
+    args = parser.parse_args(argv)
+
+    from procviewer import update_permutation
+    binding = {'default': list(range(512)), 'loop': 256, 'seed': 1}
+    update_permutation(binding)
+    print("{:>8} {:>12} {:>10} {:>10} {:>10} {:>10}".format(
+        'volume', 'generate s', 'rms', 'worst', 'hash rms', 'hash worst'))
+    for size in args.volumes:
+        started = time.time()
+        volume(binding['default'], size)
+        generate = time.time() - started
+        rms, worst = fidelity(binding['default'], size, reference_period=VOLUME_PERIOD)
+        hash_rms, hash_worst = fidelity(binding['default'], size)
+        print("{:>7}^3 {:>12.2f} {:>10.4f} {:>10.4f} {:>10.4f} {:>10.4f}".format(
+            size, generate, rms, worst, hash_rms, hash_worst))
+    print("difference from the noise wrapped every {} cells, then from getHash, which both range "
+          "over about -1 to 1".format(VOLUME_PERIOD))
+
+    if args.frames <= 0:
+        return
+    import pyglet
+    # Has to be chosen before pyglet.gl is first imported
+    pyglet.options['headless'] = True
+    from offscreen import headless_context
+    from compute import have_compute
+    context = headless_context()
+    if not have_compute():
+        print("no compute shaders to time the volume with")
+    else:
+        print("{:<28} {:>10} {:>10} {:>8} {:>10} {:>10}".format(
+            'shader', 'hash ms', 'volume ms', 'speedup', 'mean diff', 'worst diff'))
+        for shader_path in args.shaders:
+            (hashed, fetched), (mean, worst) = time_modes(shader_path, args.size, args.frames)
+            print("{:<28} {:>10.2f} {:>10.2f} {:>7.2f}x {:>10.1f} {:>10}".format(
+                shader_path, hashed * 1000.0, fetched * 1000.0, hashed / fetched, mean, worst))
+        print("difference between the hashed and the volume's frames, in levels out of 255")
+    context.close()
+
+if __name__ == '__main__':
+    main()
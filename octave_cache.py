@@ -0,0 +1,160 @@
+''' Caches the octaves of fractal noise between frames. Each octave's raw noise is
+    rendered once into a layer of a float texture array, and a cheap compose pass sums
+    the layers with the current amplitudes. The layers only depend on where the view is
+    and the permutation, so changing the amplitudes or adding an octave renders at most
+    the new layer. Shaders opt in with an OCTAVE_LAYER path, drawing octave_layer's raw
+    noise to red, and an OCTAVE_COMPOSE path reading the octaves from octave_layers.
+    Both uniforms are declared with the define, to keep them out of the bindings. '''
+
+from __future__ import print_function
+import copy
+import ctypes
+from pyglet import gl
+from glsl_source import insert_after_header
+from offscreen import draw_quad
+from metrics import REGISTRY
+
+LAYER_DEFINE = 'OCTAVE_LAYER'
+COMPOSE_DEFINE = 'OCTAVE_COMPOSE'
+# Bindings only the compose pass reads, changing them never renders a layer
+COMPOSE_BINDINGS = ('freq',)
+COUNT_BINDING = 'octives'
+# Texture unit for the layers, unit 0 is left to the shaders
+LAYER_UNIT = 1
+
+OCTAVE_LAYERS = REGISTRY.counter('octave_layers_rendered_total', "Octave layers rendered into the cache")
+
+def supports_octave_cache(fragment):
+    '''Whether the fragment source has both the layer and compose paths'''
+    return all('#ifdef ' + define in fragment for define in (LAYER_DEFINE, COMPOSE_DEFINE))
+
+def layer_source(fragment):
+    '''Return fragment source drawing the raw noise of the octave_layer uniform's octave'''
+    return insert_after_header(fragment, "#define {}\nuniform int octave_layer;\n"
+                                         .format(LAYER_DEFINE))
+
+def compose_source(fragment):
+    '''Return fragment source summing the octaves held in the octave_layers array'''
+    return insert_after_header(fragment, "#define {}\nuniform sampler2DArray octave_layers;\n"
+                                         .format(COMPOSE_DEFINE))
+
+def layer_key(bindings, compose=COMPOSE_BINDINGS, count=COUNT_BINDING):
+    '''
+    Return the binding values the layers are rendered from: everything but the
+    amplitudes and the octave count. Copied, as tables are changed in place.
+    '''
+    return dict((name, copy.deepcopy(binding['default'])) for name, binding in bindings.items()
+                if name not in compose and name != count)
+
+class OctaveCache(object):
+    '''
+    Draws the controller's shader as a sum of cached octave layers, width x height
+    pixels each. compose names the bindings applied to the layers, and count the
+    binding holding the number of octaves.
+    '''
+
+    def __init__(self, controller, source, width, height, compose=COMPOSE_BINDINGS, count=COUNT_BINDING):
+        if not supports_octave_cache(source.fragment_shader):
+            raise ValueError("no {} and {} paths in the shader".format(LAYER_DEFINE, COMPOSE_DEFINE))
+        self.controller = controller
+        self.width = width
+        self.height = height
+        self.compose = compose
+        self.count = count
+        self.vertex_shader = source.vertex_shader
+        self.fragment_shader = source.fragment_shader
+        self.layer_shader = None
+        self.compose_shader = None
+        self.texture = None
+        self.framebuffer = None
+        # Layers allocated, and how many of them hold octaves for key
+        self.capacity = 0
+        self.cached = 0
+        self.key = None
+
+    def octaves(self):
+        return int(self.controller.bindings[self.count]['default'])
+
+    def update(self):
+        '''Render the layers the bindings need that aren't cached, returning how many'''
+        key = layer_key(self.controller.bindings, self.compose, self.count)
+        if key != self.key:
+            self.key = key
+            self.cached = 0
+        octaves = self.octaves()
+        if octaves > self.capacity:
+            # Layers can't be added to a texture array, so it's made over, and refilled
+            self.allocate(max(octaves, self.capacity * 2))
+            self.cached = 0
+        first = self.cached
+        if octaves > first:
+            self.render_layers(first, octaves)
+            self.cached = octaves
+        return max(octaves - first, 0)
+
+    def compile(self):
+        '''Compile the layer and compose programs, needs a context'''
+        from shader import Shader
+
+        self.layer_shader = Shader(self.vertex_shader, layer_source(self.fragment_shader))
+        self.compose_shader = Shader(self.vertex_shader, compose_source(self.fragment_shader))
+
+    def allocate(self, layers):
+        '''Make the float texture array for layers octaves, and the framebuffer to fill it'''
+        if self.texture is not None:
+            gl.glDeleteTextures(1, ctypes.byref(gl.GLuint(self.texture)))
+        texture = gl.GLuint(0)
+        gl.glGenTextures(1, ctypes.byref(texture))
+        self.texture = texture.value
+        gl.glBindTexture(gl.GL_TEXTURE_2D_ARRAY, self.texture)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D_ARRAY, gl.GL_TEXTURE_MIN_FILTER, gl.GL_NEAREST)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D_ARRAY, gl.GL_TEXTURE_MAG_FILTER, gl.GL_NEAREST)
+        gl.glTexImage3D(gl.GL_TEXTURE_2D_ARRAY, 0, gl.GL_R32F, self.width, self.height, layers, 0,
+                        gl.GL_RED, gl.GL_FLOAT, None)
+        gl.glBindTexture(gl.GL_TEXTURE_2D_ARRAY, 0)
+        if self.framebuffer is None:
+            framebuffer = gl.GLuint(0)
+            gl.glGenFramebuffers(1, ctypes.byref(framebuffer))
+            self.framebuffer = framebuffer.value
+        self.capacity = layers
+
+    def render_layers(self, first, last):
+        '''Render octaves first to last - 1 into their layers'''
+        shader = self.layer_shader
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, self.framebuffer)
+        gl.glViewport(0, 0, self.width, self.height)
+        shader.bind()
+        for name, binding in self.controller.bindings.items():
+            self.controller.upload_uniform(name, binding['default'], shader)
+        for octave in range(first, last):
+            gl.glFramebufferTextureLayer(gl.GL_FRAMEBUFFER, gl.GL_COLOR_ATTACHMENT0, self.texture, 0, octave)
+            shader.uniformi('octave_layer', octave)
+            draw_quad()
+            OCTAVE_LAYERS.inc()
+        shader.unbind()
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, 0)
+
+    def draw(self):
+        '''Bring the layers up to date and draw their sum over the viewport'''
+        if self.compose_shader is None:
+            self.compile()
+        self.update()
+        shader = self.compose_shader
+        shader.bind()
+        for name, binding in self.controller.bindings.items():
+            self.controller.upload_uniform(name, binding['default'], shader)
+        gl.glActiveTexture(gl.GL_TEXTURE0 + LAYER_UNIT)
+        gl.glBindTexture(gl.GL_TEXTURE_2D_ARRAY, self.texture)
+        shader.uniformi('octave_layers', LAYER_UNIT)
+        gl.glActiveTexture(gl.GL_TEXTURE0)
+        draw_quad()
+        shader.unbind()
+
+    def delete(self):
+        if self.texture is not None:
+            gl.glDeleteTextures(1, ctypes.byref(gl.GLuint(self.texture)))
+        if self.framebuffer is not None:
+            gl.glDeleteFramebuffers(1, ctypes.byref(gl.GLuint(self.framebuffer)))
+        self.texture = self.framebuffer = None
+        self.capacity = self.cached = 0
+        self.key = None
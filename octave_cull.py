@@ -0,0 +1,96 @@
+''' Culling the octaves too fine to see. Octave oct of getSumFreq and fBm has 2^oct
+    lattice cells per unit, and zoom is the units per pixel, so its cells are
+    1 / (zoom * 2^oct) pixels wide. Once they are narrower than CULL_PIXELS (twice per
+    cycle, the Nyquist limit) an octave only adds aliasing. Bindings marked with
+    "cull": "<zoom binding>" in the bindings file upload no more octaves than are
+    wider than that. The noise averages 0, so a skipped octave is its expected value. '''
+
+from __future__ import print_function
+import math
+import argparse
+
+CULL_KEY = 'cull'
+# Narrowest lattice cell, in pixels, an octave is evaluated for
+CULL_PIXELS = 2.0
+# The octave count and zoom bindings the project shaders share
+OCTAVE_BINDING = 'octives'
+ZOOM_BINDING = 'zoom'
+CULL_SHADERS = ('perlin_reference/proc_shader', 'spike/working_shader', 'blobs/blobs_shader',
+                'tiled/tile_shader')
+
+def octave_limit(zoom, pixels=CULL_PIXELS):
+    '''Return how many octaves, from the first, have cells at least pixels wide at a non-zero zoom'''
+    return max(int(math.floor(math.log(1.0 / (pixels * abs(zoom)), 2))) + 1, 1)
+
+def culled_value(bindings, name, value):
+    '''Return the octave count to upload for the binding name holding value'''
+    binding = bindings[name]
+    if CULL_KEY not in binding or binding[CULL_KEY] not in bindings:
+        return value
+    zoom = bindings[binding[CULL_KEY]]['default']
+    # Zoomed in without limit, every octave shows
+    return min(value, octave_limit(zoom)) if zoom else value
+
+def culled_names(bindings):
+    '''Return the names of the bindings marked for culling, sorted'''
+    return sorted(name for name, binding in bindings.items() if CULL_KEY in binding)
+
+def cull_octaves(bindings, name=OCTAVE_BINDING, zoom=ZOOM_BINDING):
+    '''Mark the binding name to be culled by the binding zoom, returning whether both exist'''
+    if name not in bindings or zoom not in bindings:
+        return False
+    bindings[name][CULL_KEY] = zoom
+    return True
+
+def time_culling(shader_path, size, frames, zoom=None):
+    '''
+    Return the seconds per size x size frame of the shader with every octave and
+    culled, on the compute path, and the mean and worst difference between the frames.
+    '''
+    import numpy as np
+    from procviewer import ShaderController, ShaderSource, read_shader_files
+    from compute import ComputeKernel, time_frames
+
+    source = ShaderSource(*read_shader_files(shader_path))
+    controller = ShaderController(source, shader_path)
+    if zoom is not None:
+        controller.bindings[ZOOM_BINDING]['default'] = zoom
+    kernel = ComputeKernel(source.fragment_shader, controller, size, size, pixel_format='RGBA32F')
+    seconds = []
+    frames_drawn = []
+    for cull in (False, True):
+        if cull:
+            cull_octaves(controller.bindings)
+        seconds.append(time_frames(kernel.run, frames))
+        frames_drawn.append(kernel.read_into()[..., :3])
+    kernel.delete()
+    difference = np.abs(frames_drawn[1] - frames_drawn[0])
+    return seconds, float(difference.mean()), float(difference.max())
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare drawing every octave with culling the finest.")
+    parser.add_argument('shaders', nargs='*', default=list(CULL_SHADERS))
+    parser.add_argument('--size', type=int, default=512)
+    parser.add_argument('--frames', type=int, default=10)
+    parser.add_argument('--zoom', type=float, help="zoom to draw at, rather than each shader's own")
+    args = parser.parse_args(argv)
+
+    import pyglet
+    # Has to be chosen before pyglet.gl is first imported
+    pyglet.options['headless'] = True
+    from offscreen import headless_context
+    from compute import have_compute
+    context = headless_context()
+    if not have_compute():
+        print("no compute shaders to time the culling with")
+    else:
+        print("{:<28} {:>10} {:>10} {:>8} {:>10} {:>10}".format(
+            'shader', 'all ms', 'culled ms', 'speedup', 'mean diff', 'worst'))
+        for shader_path in args.shaders:
+            (full, culled), mean, worst = time_culling(shader_path, args.size, args.frames, args.zoom)
+            print("{:<28} {:>10.2f} {:>10.2f} {:>7.2f}x {:>10.4f} {:>10.4f}".format(
+                shader_path, full * 1000.0, culled * 1000.0, full / culled, mean, worst))
+    context.close()
+
+if __name__ == '__main__':
+    main()
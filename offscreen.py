@@ -0,0 +1,115 @@
+''' This contains helpers to draw shaders away from the viewer window: a hidden
+    context, framebuffer objects to render into and the quad every shader is drawn on '''
+
+import ctypes
+import pyglet
+from pyglet import gl
+
+def headless_context(width=1, height=1):
+    '''
+    Return a hidden window whose GL context is current. Set pyglet.options['headless']
+    before pyglet.gl is first imported to get a context without a display.
+    '''
+    window = pyglet.window.Window(width, height, visible=False)
+    window.switch_to()
+    return window
+
+class Framebuffer(object):
+    ''' A framebuffer object with a single colour renderbuffer '''
+
+    def __init__(self, width, height, internal_format=None):
+        self.width = width
+        self.height = height
+        if internal_format is None:
+            internal_format = gl.GL_RGBA8
+        self.internal_format = internal_format
+
+        fbo = gl.GLuint(0)
+        gl.glGenFramebuffers(1, ctypes.byref(fbo))
+        self.fbo = fbo.value
+        renderbuffer = gl.GLuint(0)
+        gl.glGenRenderbuffers(1, ctypes.byref(renderbuffer))
+        self.renderbuffer = renderbuffer.value
+
+        gl.glBindRenderbuffer(gl.GL_RENDERBUFFER, self.renderbuffer)
+        gl.glRenderbufferStorage(gl.GL_RENDERBUFFER, internal_format, width, height)
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, self.fbo)
+        gl.glFramebufferRenderbuffer(gl.GL_FRAMEBUFFER, gl.GL_COLOR_ATTACHMENT0,
+                                     gl.GL_RENDERBUFFER, self.renderbuffer)
+        status = gl.glCheckFramebufferStatus(gl.GL_FRAMEBUFFER)
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, 0)
+        if status != gl.GL_FRAMEBUFFER_COMPLETE:
+            self.delete()
+            raise ValueError("framebuffer incomplete, status 0x{:x}".format(status))
+
+    def bind(self):
+        '''Render into this framebuffer, with the viewport covering all of it'''
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, self.fbo)
+        gl.glViewport(0, 0, self.width, self.height)
+
+    def unbind(self):
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, 0)
+
+    def read_pixels(self, width=None, height=None, pixels=None):
+        '''
+        Read RGBA bytes from the bottom left of the framebuffer, bottom row first.
+        pixels can be a ctypes buffer to reuse, a new one is returned otherwise.
+        '''
+        width = width or self.width
+        height = height or self.height
+        if pixels is None:
+            pixels = (gl.GLubyte * (4 * width * height))()
+        gl.glBindFramebuffer(gl.GL_READ_FRAMEBUFFER, self.fbo)
+        gl.glPixelStorei(gl.GL_PACK_ALIGNMENT, 1)
+        gl.glReadPixels(0, 0, width, height, gl.GL_RGBA, gl.GL_UNSIGNED_BYTE, pixels)
+        return pixels
+
+    def read_into(self, out, pixel_format='RGBA8', flip=False):
+        '''Read the framebuffer into out, an array or writable buffer, see readback.read_pixels'''
+        import readback
+        gl.glBindFramebuffer(gl.GL_READ_FRAMEBUFFER, self.fbo)
+        return readback.read_pixels(out, 0, 0, self.width, self.height, pixel_format, flip)
+
+    def delete(self):
+        gl.glDeleteFramebuffers(1, ctypes.byref(gl.GLuint(self.fbo)))
+        gl.glDeleteRenderbuffers(1, ctypes.byref(gl.GLuint(self.renderbuffer)))
+
+def draw_quad():
+    '''Draw the quad every shader is drawn on, with the viewer's texture coordinates'''
+    gl.glMatrixMode(gl.GL_PROJECTION)
+    gl.glLoadIdentity()
+    gl.glOrtho(-1., 1., 1., -1., 0., 1.)
+
+    gl.glMatrixMode(gl.GL_MODELVIEW)
+    gl.glLoadIdentity()
+
+    # Each texture coordinate is set before its corner, so the first quad drawn in a fresh
+    # context gets the same ones as every later quad. s runs down the window from 2 to -2
+    # and t runs across it from 2 to -2.
+    gl.glBegin(gl.GL_QUADS)
+    gl.glTexCoord2i(-2, 2)
+    gl.glVertex2i(-1, -1)
+    gl.glTexCoord2i(-2, -2)
+    gl.glVertex2i(1, -1)
+    gl.glTexCoord2i(2, -2)
+    gl.glVertex2i(1, 1)
+    gl.glTexCoord2i(2, 2)
+    gl.glVertex2i(-1, 1)
+    gl.glEnd()
+
+def draw_shader(shader, controller, overrides=None):
+    '''Draw the shader over the viewport with the controller's uniforms and any overrides'''
+    shader.bind()
+    controller.set_uniforms()
+    for name, value in (overrides or {}).items():
+        controller.upload_uniform(name, value)
+    draw_quad()
+    shader.unbind()
+
+def draw_region(shader, controller, x, y, view_width, view_height):
+    '''
+    Draw the part of a view_width x view_height view whose bottom left pixel is at x, y
+    into the bottom left of the bound framebuffer.
+    '''
+    gl.glViewport(-x, -y, view_width, view_height)
+    draw_shader(shader, controller, controller.tile_uniforms(x, y))
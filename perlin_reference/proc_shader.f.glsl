@@ -21,14 +21,24 @@ float grad(int hsh, float x, float y, float z);
 
 void main() {
 
-  // getHash is not normalised to 0.0 <-> 1.0
-  // it's really somewhere between -1.0 and +1.0
-  float fb = (getSumFreq(
+  float sum = getSumFreq(
       x + gl_FragCoord[0] * zoom, 
       y + gl_FragCoord[1] * zoom, 
       z
-  ) * 0.5) + 0.5;
+  );
+#ifdef OCTAVE_LAYER
+  gl_FragColor = vec4(sum, 0.0, 0.0, 1.0);
+  return;
+#endif
+
+  // getHash is not normalised to 0.0 <-> 1.0
+  // it's really somewhere between -1.0 and +1.0
+  float fb = (sum * 0.5) + 0.5;
 
+#ifdef HEIGHTMAP
+  // Float targets keep the whole range, out of range values included
+  gl_FragColor = vec4(fb, fb, fb, 1.0);
+#else
   if (fb < 0.0) {
     gl_FragColor = vec4(0.0, 1.0, 0.0, 1.0);
   } else if (fb > 1.0) {
@@ -36,14 +46,27 @@ void main() {
   } else {
     gl_FragColor = vec4(fb, fb, fb, 1.0);
   }
+#endif
 }
 
 float getSumFreq(float x, float y, float z) {
+#ifdef OCTAVE_LAYER
+  // octave_cache renders each octave's raw noise on its own, declaring octave_layer,
+  // then sums them with the current amplitudes from its octave_layers
+  float scale = float(1 << octave_layer);
+  return getHash(x * scale, y * scale, z * scale);
+#else
   float totalHash = 0;
   for (int oct = 0; oct < octives; oct++) {
-    totalHash += getHash(x * float(1 << oct), y * float(1 << oct), z  * float(1 << oct)) * pow(freq, float(oct + 1));
+#ifdef OCTAVE_COMPOSE
+    float hash = texelFetch(octave_layers, ivec3(gl_FragCoord.xy, oct), 0).r;
+#else
+    float hash = getHash(x * float(1 << oct), y * float(1 << oct), z  * float(1 << oct));
+#endif
+    totalHash += hash * pow(freq, float(oct + 1));
   }
   return totalHash;
+#endif
 }
 
 float getHash(float x, float y, float z) {
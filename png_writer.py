@@ -0,0 +1,69 @@
+''' Minimal streaming PNG encoder, so images can be written on machines without pyglet
+    or a GL context, and at bit depths pyglet's encoder doesn't offer '''
+
+import struct
+import zlib
+
+# PNG colour types and their channel counts
+GREY = 0
+RGB = 2
+RGBA = 6
+CHANNELS = {GREY: 1, RGB: 3, RGBA: 4}
+
+def _chunk(png_file, kind, data):
+    png_file.write(struct.pack(">I", len(data)))
+    png_file.write(kind)
+    png_file.write(data)
+    png_file.write(struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff))
+
+class PNGWriter(object):
+    '''
+    Writes a PNG one row at a time, top row first. Rows are bytes-like objects holding
+    width * channels samples, 8 bit samples as bytes and 16 bit samples big endian.
+    '''
+
+    def __init__(self, path, width, height, color_type=RGBA, bit_depth=8, level=6):
+        if color_type not in CHANNELS or bit_depth not in (8, 16):
+            raise ValueError("unsupported PNG colour type {} at {} bits".format(color_type, bit_depth))
+        self.row_bytes = width * CHANNELS[color_type] * bit_depth // 8
+        self.rows_left = height
+        self.compressor = zlib.compressobj(level)
+        self.png_file = open(path, "wb")
+        self.png_file.write(b"\x89PNG\r\n\x1a\n")
+        _chunk(self.png_file, b"IHDR",
+               struct.pack(">IIBBBBB", width, height, bit_depth, color_type, 0, 0, 0))
+
+    def write_row(self, row):
+        '''Append the next row, unfiltered'''
+        row = memoryview(row).cast('B')
+        if len(row) != self.row_bytes:
+            raise ValueError("row is {} bytes, expected {}".format(len(row), self.row_bytes))
+        if self.rows_left <= 0:
+            raise ValueError("all rows have already been written")
+        data = self.compressor.compress(b"\0") + self.compressor.compress(row)
+        if data:
+            _chunk(self.png_file, b"IDAT", data)
+        self.rows_left -= 1
+
+    def close(self):
+        '''Finish the image, every row must have been written'''
+        if self.rows_left:
+            raise ValueError("{} rows were never written".format(self.rows_left))
+        _chunk(self.png_file, b"IDAT", self.compressor.flush())
+        _chunk(self.png_file, b"IEND", b"")
+        self.png_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        if kind is None:
+            self.close()
+        else:
+            self.png_file.close()
+
+def write_png(path, rows, width, height, color_type=RGBA, bit_depth=8):
+    '''Write an iterable of rows, top row first, as a PNG'''
+    with PNGWriter(path, width, height, color_type, bit_depth) as writer:
+        for row in rows:
+            writer.write_row(row)
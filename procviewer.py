@@ -2,42 +2,97 @@
     and generate key bindings to provide some key and mouse controls '''
 
 from __future__ import print_function
+import io
 import os
+import copy
 import json
 import re
+import math
 from random import Random
+from metrics import REGISTRY, timed
+from autosave import Autosaver, write_text, DEFAULT_INTERVAL
+from octave_cull import CULL_KEY, culled_value, culled_names
 # from shader import Shader
 
+PARSE_SECONDS = REGISTRY.histogram('parse_bindings_seconds', "Seconds to parse bindings from shader source")
+SET_UNIFORMS_SECONDS = REGISTRY.histogram('set_uniforms_seconds', "Seconds to set a frame's uniforms")
+UNIFORM_UPLOADS = REGISTRY.counter('uniform_uploads_total', "Plain uniform values uploaded")
+
 class ShaderController():
     ''' This class provides a control binding wrapper to a GLSL shader'''
 
-    def __init__(self, shader, save_path):
+    def __init__(self, shader, save_path, bindings=None):
+        '''
+        Control the shader, with bindings loaded from and saved next to save_path.
+        If bindings are given, a copy of them is used instead and nothing is saved,
+        which lets other processes share one controller's values.
+        '''
         # Load shader code
         self.shader = shader
+        self.uniform_block = None
+        self.uploaded = {}
+        # Program to the permutation tables it hashes in place of reading, see hash_mode.py
+        self.hashed_tables = {}
+        self.bindings_file = None
+        self.autosave = None
 
         # Load and update key bindings
         self.set_key_order()
         self.used_keys = {}
-        self.load_key_bindings("{}.bindings.json".format(save_path))
-        self.parse_bindings_from_uniforms(shader.vertex_shader)
-        self.parse_bindings_from_uniforms(shader.fragment_shader)
-        self.save_key_bindings("{}.bindings.json".format(save_path))
+        if bindings is None:
+            bindings_file = "{}.bindings.json".format(save_path)
+            self.load_key_bindings(bindings_file)
+            self.parse_bindings_from_uniforms(shader.vertex_shader)
+            self.parse_bindings_from_uniforms(shader.fragment_shader)
+            self.refresh_gradients()
+            # Compared as JSON would load them, so tuples match the lists they're saved as
+            if json.loads(json.dumps(self.bindings)) != self.loaded_bindings:
+                self.save_key_bindings(bindings_file)
+            self.bindings_file = bindings_file
+        else:
+            self.bindings = copy.deepcopy(bindings)
+            self.setup_used_keys()
         self.bind_mouse_controls()
 
     def load_key_bindings(self, file):
         ''' Load pre-saved key bindings if they exist '''
+        # None when there's no file, so the bindings are always saved the first time
+        self.loaded_bindings = None
         if os.path.isfile(file):
             with open(file, "r") as json_file:
                 self.bindings = json.load(json_file)
+            self.loaded_bindings = copy.deepcopy(self.bindings)
         else:
             self.bindings = {}
         self.setup_used_keys()
 
     def save_key_bindings(self, key_bindings_files):
         ''' Save the latest bindings to file '''
-        with open(key_bindings_files, "w") as json_file:
-            json.dump(self.bindings, json_file)
+        write_text(key_bindings_files, self.bindings_json())
+
+    def bindings_json(self):
+        ''' The bindings as saved '''
+        return json.dumps(self.bindings)
+
+    def enable_autosave(self, interval=DEFAULT_INTERVAL):
+        '''
+        Save changed bindings on a background thread, at most every interval seconds,
+        and on close(). Controllers given their bindings have no file to save to.
+        '''
+        if self.bindings_file is not None and self.autosave is None:
+            self.autosave = Autosaver(self.bindings_file, self.bindings_json, interval)
+
+    def bindings_changed(self):
+        ''' Note that binding values changed, an enabled autosave writes them out later '''
+        if self.autosave is not None:
+            self.autosave.mark_dirty()
+
+    def close(self):
+        ''' Write out any changed bindings now, call on exit '''
+        if self.autosave is not None:
+            self.autosave.close()
 
+    @timed(PARSE_SECONDS)
     def parse_bindings_from_uniforms(self, shader):
         ''' Parse the shader and look for unbound uniforms to bind '''
         found = False
@@ -107,6 +162,16 @@ class ShaderController():
                 r'(?:'+ com + perm_size + seed + r')?' + r'(?:' + line_size + r')?'
         pattern = re.compile(regex)
 
+        for uniform in re.finditer(pattern, shader):
+            self.update_binding(uniform)
+            found = True
+
+        # Gradient tables, derived from a permutation declared before them
+        vec_typ = r'uniform' + mws + r'(?P<type>vec2)' + mws
+        source = r'(?:from' + ows + r'(?P<source>\w+)' + ows + r')?'
+        grads = com + r'gradients' + ows + r'(?P<grads>[0-9]+)' + ows + source
+        pattern = re.compile(vec_typ + name + size + r';' + ows + grads)
+
         for uniform in re.finditer(pattern, shader):
             self.update_binding(uniform)
             found = True
@@ -244,8 +309,21 @@ class ShaderController():
         raise NotImplementedError
 
     def init_vec2_array_binding(self, binding_dict, uniform):
-        '''Insert a default vec2 array (To Be Implemented)'''
-        raise NotImplementedError
+        '''Insert a gradient table following a permutation (other vec2 arrays To Be Implemented)'''
+        if uniform.group('grads') is None:
+            raise NotImplementedError
+        source = uniform.group('source')
+        if source is None:
+            # The first permutation in the shader
+            tables = [name for name in self.bindings if 'seed' in self.bindings[name]]
+            source = tables[0] if tables else None
+        if source not in self.bindings or 'seed' not in self.bindings[source]:
+            raise ValueError("gradients for '{}' need a permutation declared before them"
+                             .format(uniform.group('name')))
+        binding_dict['from'] = source
+        binding_dict['steps'] = int(uniform.group('grads'))
+        binding_dict['default'] = [[0.0, 0.0]] * int(uniform.group('size'))
+        update_gradients(binding_dict, self.bindings[source])
 
     def init_vec3_array_binding(self, binding_dict, uniform):
         '''Insert a default vec3 (To Be Implemented)'''
@@ -261,6 +339,7 @@ class ShaderController():
             self.check_key_binding(self.bindings[binding], 'inc_key')
             self.check_key_binding(self.bindings[binding], 'dec_key')
             self.check_key_binding(self.bindings[binding], 'toggle_key')
+            self.check_key_binding(self.bindings[binding], 'shuffle_key')
 
     def check_key_binding(self, binding, key_use):
         '''Set the key to perform bound operation'''
@@ -286,39 +365,145 @@ class ShaderController():
         binding = self.used_keys[symbol]
         if 'toggle_key' in binding and binding['toggle_key'] == symbol:
             binding['default'] = not binding['default']
-            return True
-        if 'inc_key' in binding and binding['inc_key'] == symbol:
+        elif 'inc_key' in binding and binding['inc_key'] == symbol:
             binding['default'] += binding['diff']
-            return True
-        if 'dec_key'in binding and binding['dec_key'] == symbol:
+        elif 'dec_key'in binding and binding['dec_key'] == symbol:
             binding['default'] -= binding['diff']
-            return True
-        if 'shuffle_key' in binding and binding['shuffle_key'] == symbol:
+        elif 'shuffle_key' in binding and binding['shuffle_key'] == symbol:
             update_permutation(binding)
-            return True
-        # Key was bound, but not to any action
-        raise ValueError("symbol {} used but not bound to an action".format(symbol))
+            self.refresh_gradients(binding)
+        else:
+            # Key was bound, but not to any action
+            raise ValueError("symbol {} used but not bound to an action".format(symbol))
+        self.bindings_changed()
+        return True
+
+    def refresh_gradients(self, permutation=None):
+        '''Regenerate the gradient tables following permutation, or all of them'''
+        for binding in self.bindings.values():
+            if 'steps' not in binding:
+                continue
+            source = self.bindings[binding['from']]
+            if permutation is None or source is permutation:
+                update_gradients(binding, source)
+
+    def create_uniform_block(self):
+        '''
+        Move the scalar and vector bindings into a std140 UniformBlock. The bindings
+        keep working as dicts, writing through to the block. Returns the block, whose
+        rewrite_source gives the shader source to compile and bind to use it.
+        '''
+        # Imported here as it imports pyglet.gl, which creates the GL context
+        from uniform_block import UniformBlock
+        self.uniform_block = UniformBlock(self.bindings)
+        replaced = self.uniform_block.wrap_bindings()
+        for symbol, binding in self.used_keys.items():
+            self.used_keys[symbol] = replaced.get(id(binding), binding)
+        self.bind_mouse_controls()
+        return self.uniform_block
 
+    @timed(SET_UNIFORMS_SECONDS)
     def set_uniforms(self):
         '''Define the uniforms we're going to use in the shader'''
+        block = self.uniform_block
+        if block is None:
+            for name in self.bindings:
+                self.upload_uniform(name, self.bindings[name]['default'])
+            return
+        # The block goes up in one call if it changed, and the remaining (array)
+        # uniforms only when their value has been replaced, as programs keep them
+        block.restore()
+        for name in culled_names(self.bindings):
+            if name in block.members:
+                block.override(name, culled_value(self.bindings, name, self.bindings[name]['default']))
+        block.upload()
         for name in self.bindings:
-            var_type = self.bindings[name]['type']
-            var_default = self.bindings[name]['default']
-            if not isinstance(var_default, list):
-                # Wrap scalars
-                var_default = [var_default]
-            # Switch on type
-            {
-                'int'   : self.shader.uniformi,
-                'bool'  : self.shader.uniformi,
-                'float' : self.shader.uniformf,
-                'vec2'  : self.shader.uniformf,
-                'vec3'  : self.shader.uniformf,
-                'vec4'  : self.shader.uniformf,
-                'ivec2' : self.shader.uniformi,
-                'ivec3' : self.shader.uniformi,
-                'ivec4' : self.shader.uniformi,
-            }[var_type](name, *var_default)
+            value = self.bindings[name]['default']
+            if name not in block.members and self.uploaded.get(name) is not value:
+                self.upload_uniform(name, value)
+                self.uploaded[name] = value
+
+    def upload_uniform(self, name, value, shader=None):
+        '''
+        Upload a value for the bound uniform name, without changing its binding.
+        Passing another shader uploads straight to that program instead. Octave counts
+        marked for culling are capped to the octaves visible at the zoom, see octave_cull.py.
+        '''
+        block = self.uniform_block
+        value = culled_value(self.bindings, name, value)
+        if shader is None:
+            shader = self.shader
+            if block is not None:
+                if name in block.members:
+                    block.override(name, value)
+                    block.upload()
+                    return
+                self.uploaded.pop(name, None)
+        var_type = self.bindings[name]['type']
+        hashed = self.hashed_tables.get(shader, ())
+        if name in hashed:
+            # Only the table's key goes up
+            from hash_mode import HASH_PREFIX, table_key
+            name, value, var_type = HASH_PREFIX + name, table_key(value), 'int'
+        elif self.bindings[name].get('from') in hashed:
+            # Worked out from the hash
+            return
+        UNIFORM_UPLOADS.inc()
+        if isinstance(value, list) and value and isinstance(value[0], list):
+            # Arrays of vectors go up in one call
+            shader.uniform_vectorsf(name, value)
+            return
+        if not isinstance(value, list):
+            # Wrap scalars
+            value = [value]
+        # Switch on type
+        {
+            'int'   : shader.uniformi,
+            'bool'  : shader.uniformi,
+            'float' : shader.uniformf,
+            'vec2'  : shader.uniformf,
+            'vec3'  : shader.uniformf,
+            'vec4'  : shader.uniformf,
+            'ivec2' : shader.uniformi,
+            'ivec3' : shader.uniformi,
+            'ivec4' : shader.uniformi,
+        }[var_type](name, *value)
+
+    def use_shader(self, shader):
+        '''Switch to another program for the same bindings, which holds none of their values yet'''
+        if shader is not self.shader:
+            self.shader = shader
+            self.uploaded = {}
+
+    def upload_uniforms(self, values):
+        '''Upload several values as upload_uniform does, with one block upload for them all'''
+        block = self.uniform_block
+        for name, value in values.items():
+            if block is not None and name in block.members:
+                block.override(name, value)
+            else:
+                self.upload_uniform(name, value)
+        if block is not None:
+            block.upload()
+
+    def tile_uniforms(self, offset_x, offset_y):
+        '''
+        Return uniform values to upload, over the bindings, when drawing the part of the
+        view whose bottom left pixel is offset_x, offset_y pixels from the view's.
+        Shaders that place pixels with gl_FragCoord are moved with the mouse bound x and
+        y, others are placed by the viewport alone.
+        '''
+        overrides = {}
+        if 'gl_FragCoord' not in self.shader.fragment_shader:
+            return overrides
+        zoom = 1
+        if getattr(self, 'mouse_scroll', None):
+            zoom = self.mouse_scroll['default']
+        for name, binding, offset in (('x', getattr(self, 'mouse_x', None), offset_x),
+                                      ('y', getattr(self, 'mouse_y', None), offset_y)):
+            if binding and offset:
+                overrides[name] = binding['default'] + offset * zoom
+        return overrides
 
     def get_html_help(self, key):
         '''Return html description of key bindings'''
@@ -343,6 +528,9 @@ class ShaderController():
                 status = binding['default']
             if isinstance(status, list):
                 status = "[{},{},{},...,{}]".format(status[0], status[1], status[2], status[-1])
+            elif CULL_KEY in binding and status is not None:
+                # The octaves evaluated at the current zoom
+                status = "{} of {}".format(culled_value(self.bindings, name, status), status)
             yield "<b>{}</b>={}".format(name, status)
 
     def bind_mouse_controls(self):
@@ -363,11 +551,13 @@ class ShaderController():
             self.mouse_x['default'] -= diff_x * zoom
         if getattr(self, 'mouse_y', None):
             self.mouse_y['default'] -= diff_y * zoom
+        self.bindings_changed()
 
     def mouse_scroll_y(self, scroll_y):
         '''Perform mouse wheel action and update uniforms appropriately'''
         if getattr(self, 'mouse_scroll', None):
             self.mouse_scroll['default'] -= scroll_y * self.mouse_scroll['diff']
+            self.bindings_changed()
 
     def set_key_order(self, new_key_order=[113, 97, 119, 115, 101, 100, 114, 102, 116, 103,\
                                            121, 104, 117, 106, 105, 107, 111, 108, 112, 122,\
@@ -379,6 +569,25 @@ class ShaderController():
         '''
         self.key_order = new_key_order
 
+class ShaderSource(object):
+    '''
+    Vertex and fragment source without a compiled program. This is enough for a
+    ShaderController to parse and save bindings before (or without) a GL context.
+    '''
+
+    def __init__(self, vertex_shader="", fragment_shader=""):
+        self.vertex_shader = vertex_shader
+        self.fragment_shader = fragment_shader
+
+def read_shader_files(shader_path):
+    '''Return the vertex and fragment source for the shader at shader_path'''
+    vspath = '%s.v.glsl' % shader_path
+    fspath = '%s.f.glsl' % shader_path
+    with io.open(vspath) as vstrm, io.open(fspath) as fstrm:
+        vertexshader = ' '.join(vstrm)
+        fragmentshader = ' '.join(fstrm)
+    return vertexshader, fragmentshader
+
 def update_permutation(binding):
     '''
     This takes an list of values in binding['default'] and shuffles them.
@@ -396,3 +605,18 @@ def update_permutation(binding):
     binding['default'] = []
     for i in range(size):
         binding['default'].append(perm[i % perm_size])
+
+def update_gradients(binding, permutation):
+    '''
+    Fill binding['default'] with unit gradients following a permutation binding.
+    Entry i points at the angle permutation[i] / binding['steps'] of a turn, so a
+    shader can look up grads[i] instead of taking the cos and sin of perm[i], and the
+    table changes with every shuffle of the permutation.
+    '''
+    steps = binding['steps']
+    table = permutation['default']
+    gradients = []
+    for i in range(len(binding['default'])):
+        angle = 2.0 * math.pi * (table[i % len(table)] % steps) / steps
+        gradients.append([math.cos(angle), math.sin(angle)])
+    binding['default'] = gradients
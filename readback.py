@@ -0,0 +1,61 @@
+''' Read pixels from the bound read framebuffer straight into NumPy arrays or other
+    writable buffers the caller owns, with no intermediate ctypes array or ImageData.
+    Flipping to top row first is a view onto the same memory, not a copy. '''
+
+import ctypes
+import numpy as np
+from pyglet import gl
+from metrics import REGISTRY, timed
+
+READ_SECONDS = REGISTRY.histogram('readback_seconds', "Seconds glReadPixels stalls for, finishing the frame")
+
+# GL format and type names, NumPy sample type and channels for each readback format.
+# The names are looked up when reading, as touching gl needs a context.
+READ_FORMATS = {
+    'RGBA8': ('GL_RGBA', 'GL_UNSIGNED_BYTE', np.uint8, 4),
+    'R8': ('GL_RED', 'GL_UNSIGNED_BYTE', np.uint8, 1),
+    'RGBA32F': ('GL_RGBA', 'GL_FLOAT', np.float32, 4),
+    'R32F': ('GL_RED', 'GL_FLOAT', np.float32, 1),
+}
+
+def pixel_shape(width, height, pixel_format='RGBA8'):
+    '''Shape of the array for a readback, single channel formats have no channel axis'''
+    channels = READ_FORMATS[pixel_format][3]
+    return (height, width) if channels == 1 else (height, width, channels)
+
+def readback_array(width, height, pixel_format='RGBA8'):
+    '''Allocate an array to read a width x height region into'''
+    return np.empty(pixel_shape(width, height, pixel_format), READ_FORMATS[pixel_format][2])
+
+def as_pixels(out, width, height, pixel_format='RGBA8'):
+    '''
+    Return a NumPy view of out, shaped for the readback, sharing its memory.
+    out can be an array or anything with a writable contiguous buffer, like a memoryview.
+    '''
+    _, _, dtype, _ = READ_FORMATS[pixel_format]
+    shape = pixel_shape(width, height, pixel_format)
+    if not isinstance(out, np.ndarray):
+        out = np.frombuffer(out, np.uint8)
+    if not out.flags.c_contiguous or not out.flags.writeable:
+        raise ValueError("readback needs a writable contiguous buffer")
+    needed = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    if out.nbytes != needed:
+        raise ValueError("buffer is {} bytes, a {}x{} {} readback needs {}"
+                         .format(out.nbytes, width, height, pixel_format, needed))
+    return out.reshape(-1).view(np.uint8).view(dtype).reshape(shape)
+
+@timed(READ_SECONDS)
+def read_pixels(out, x=0, y=0, width=None, height=None, pixel_format='RGBA8', flip=False):
+    '''
+    Read a region of the bound read framebuffer into out and return it as an array.
+    width and height default to out's shape. GL gives the bottom row first, flip
+    returns a view with the top row first instead.
+    '''
+    if width is None or height is None:
+        height, width = np.shape(out)[:2]
+    pixels = as_pixels(out, width, height, pixel_format)
+    gl_format, gl_type, _, _ = READ_FORMATS[pixel_format]
+    gl.glPixelStorei(gl.GL_PACK_ALIGNMENT, 1)
+    gl.glReadPixels(x, y, width, height, getattr(gl, gl_format), getattr(gl, gl_type),
+                    pixels.ctypes.data_as(ctypes.c_void_p))
+    return pixels[::-1] if flip else pixels
@@ -0,0 +1,329 @@
+''' This contains a content addressed, memory mapped store for rendered pixel data,
+    so exports, tiles and baselines can be reused rather than rendered again '''
+
+from __future__ import print_function
+import os
+import json
+import mmap
+import time
+import hashlib
+from metrics import REGISTRY
+
+try:
+    import fcntl
+except ImportError:
+    # No cross process locking available (e.g. Windows), single process use only
+    fcntl = None
+
+# Pixel formats: struct item code and channel count
+FORMATS = {
+    'RGBA8'   : ('B', 4),
+    'R8'      : ('B', 1),
+    'R16'     : ('H', 1),
+    'R32F'    : ('f', 1),
+    'RGBA32F' : ('f', 4),
+}
+
+# Payloads start on this boundary so float views are always aligned
+ALIGNMENT = 64
+# Segments with less than this fraction of their bytes still live are rewritten
+COMPACT_FRACTION = 0.5
+
+CACHE_HITS = REGISTRY.counter('render_cache_hits_total', "Render cache lookups found")
+CACHE_MISSES = REGISTRY.counter('render_cache_misses_total', "Render cache lookups missed")
+
+INDEX_FILE = "index.json"
+LOCK_FILE = "lock"
+
+def hash_source(*sources):
+    '''Return a hash of the given shader source strings'''
+    digest = hashlib.sha1()
+    for source in sources:
+        digest.update(source.encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def hash_bindings(bindings):
+    '''Return a hash of the values in a bindings dictionary, ignoring key assignments'''
+    snapshot = {}
+    for name in bindings:
+        snapshot[name] = [bindings[name].get('type'), bindings[name].get('default')]
+    return hashlib.sha1(json.dumps(snapshot, sort_keys=True).encode()).hexdigest()
+
+def make_key(source_hash, bindings_hash, region, resolution, fmt):
+    '''Build the cache key for a render of region at resolution in the given format'''
+    if fmt not in FORMATS:
+        raise ValueError("unknown pixel format {}".format(fmt))
+    parts = [source_hash, bindings_hash, list(region), list(resolution), fmt]
+    return hashlib.sha1(json.dumps(parts).encode()).hexdigest()
+
+class RenderCache(object):
+    '''
+    Store of raw pixel payloads in large append only segment files, which together
+    stay under max_bytes on disk. Segments mostly holding evicted entries have their
+    live entries copied to the newest segment and are deleted.
+    Lookups return memoryviews straight onto the mapped segments, so nothing is copied
+    or decoded. The index is shared between processes through the cache directory,
+    writers take an exclusive lock and readers a shared one.
+    '''
+
+    def __init__(self, path, max_bytes=256 << 20, segment_bytes=64 << 20):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        self.index = {'entries': {}, 'segments': {}, 'next_segment': 0}
+        self.index_stamp = None
+        self.maps = {}
+        self.touched = {}
+        self.hits = 0
+        self.misses = 0
+        self.puts = 0
+        self.evictions = 0
+        self.compactions = 0
+
+        self.lock_file = open(os.path.join(path, LOCK_FILE), "a+")
+        self.refresh_index()
+
+    def close(self):
+        '''Persist pending access times and release the mapped segments'''
+        if self.touched:
+            with self.locked(exclusive=True):
+                self.read_index()
+                self.write_index()
+        # Views handed out keep their own reference to the mapping, so just drop ours
+        self.maps = {}
+        self.lock_file.close()
+
+    def locked(self, exclusive=False):
+        '''Return a context manager holding the cache directory lock'''
+        return _DirectoryLock(self.lock_file, exclusive)
+
+    def index_path(self):
+        return os.path.join(self.path, INDEX_FILE)
+
+    def segment_path(self, segment):
+        return os.path.join(self.path, "seg_{:05d}.bin".format(int(segment)))
+
+    def refresh_index(self):
+        '''Reload the index only if another writer has replaced it'''
+        try:
+            stat = os.stat(self.index_path())
+        except OSError:
+            return
+        stamp = (stat.st_mtime, stat.st_size, stat.st_ino)
+        if stamp != self.index_stamp:
+            with self.locked():
+                self.read_index()
+
+    def read_index(self):
+        '''Load the index from disk, caller must hold the lock'''
+        try:
+            stat = os.stat(self.index_path())
+            with open(self.index_path(), "r") as index_file:
+                self.index = json.load(index_file)
+            self.index_stamp = (stat.st_mtime, stat.st_size, stat.st_ino)
+        except (OSError, ValueError):
+            self.index = {'entries': {}, 'segments': {}, 'next_segment': 0}
+
+    def write_index(self):
+        '''Atomically replace the index on disk, caller must hold the exclusive lock'''
+        entries = self.index['entries']
+        for key, atime in self.touched.items():
+            if key in entries:
+                entries[key]['atime'] = max(entries[key]['atime'], atime)
+        self.touched = {}
+
+        temp_path = self.index_path() + ".{}.tmp".format(os.getpid())
+        with open(temp_path, "w") as index_file:
+            json.dump(self.index, index_file)
+        os.replace(temp_path, self.index_path())
+        stat = os.stat(self.index_path())
+        self.index_stamp = (stat.st_mtime, stat.st_size, stat.st_ino)
+
+    def segment_map(self, segment, end):
+        '''Return a read only mapping of segment covering at least end bytes'''
+        current = self.maps.get(segment)
+        if current is None or len(current) < end:
+            with open(self.segment_path(segment), "rb") as seg_file:
+                current = mmap.mmap(seg_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[segment] = current
+        return current
+
+    def __contains__(self, key):
+        self.refresh_index()
+        return key in self.index['entries']
+
+    def info(self, key):
+        '''Return the index metadata for key, or None if it is not cached'''
+        self.refresh_index()
+        entry = self.index['entries'].get(key)
+        return dict(entry) if entry is not None else None
+
+    def get(self, key):
+        '''
+        Return a memoryview shaped (height, width, channels) onto the cached payload,
+        or None on a miss. The view stays valid after eviction or close.
+        '''
+        self.refresh_index()
+        entry = self.index['entries'].get(key)
+        if entry is None:
+            self.misses += 1
+            CACHE_MISSES.inc()
+            return None
+        try:
+            segment = self.segment_map(str(entry['seg']), entry['offset'] + entry['size'])
+        except (OSError, ValueError):
+            # Evicted by another process between the index read and the map
+            self.misses += 1
+            CACHE_MISSES.inc()
+            return None
+        self.hits += 1
+        CACHE_HITS.inc()
+        self.touched[key] = time.time()
+
+        item, channels = FORMATS[entry['format']]
+        width, height = entry['resolution']
+        view = memoryview(segment)[entry['offset']:entry['offset'] + entry['size']]
+        return view.cast(item, [height, width, channels])
+
+    def put(self, key, data, resolution, fmt):
+        '''Store the bytes-like data for key, evicting old entries to keep the segments under max_bytes'''
+        item, channels = FORMATS[fmt]
+        width, height = resolution
+        payload = memoryview(data).cast('B')
+        expected = width * height * channels * memoryview(b'').cast(item).itemsize
+        if payload.nbytes != expected:
+            raise ValueError("payload is {} bytes, {}x{} {} needs {}"
+                             .format(payload.nbytes, width, height, fmt, expected))
+        if payload.nbytes > self.max_bytes:
+            raise ValueError("payload larger than the whole cache")
+
+        with self.locked(exclusive=True):
+            self.read_index()
+            if key in self.index['entries']:
+                return
+            segment, offset = self.write_payload(payload)
+            self.index['entries'][key] = {
+                'seg': segment,
+                'offset': offset,
+                'size': payload.nbytes,
+                'resolution': [width, height],
+                'format': fmt,
+                'atime': time.time(),
+            }
+            self.puts += 1
+            self.evict()
+            self.write_index()
+
+    def allocate(self, size):
+        '''Find space for size bytes at the end of the newest segment, or start a new one'''
+        segments = self.index['segments']
+        if segments:
+            segment = max(segments, key=int)
+            offset = -(-segments[segment] // ALIGNMENT) * ALIGNMENT
+            if offset + size <= self.segment_bytes:
+                return segment, offset
+        return self.new_segment(), 0
+
+    def new_segment(self):
+        '''Start an empty segment, which later allocations fill'''
+        segment = str(self.index['next_segment'])
+        self.index['next_segment'] += 1
+        open(self.segment_path(segment), "wb").close()
+        self.index['segments'][segment] = 0
+        return segment
+
+    def write_payload(self, payload):
+        '''Append payload to the segments, returning the segment and offset it went to'''
+        segment, offset = self.allocate(len(payload))
+        with open(self.segment_path(segment), "r+b") as seg_file:
+            seg_file.seek(offset)
+            seg_file.write(payload)
+        self.index['segments'][segment] = offset + len(payload)
+        return segment, offset
+
+    def live_bytes(self):
+        return sum(entry['size'] for entry in self.index['entries'].values())
+
+    def disk_bytes(self):
+        return sum(self.index['segments'].values())
+
+    def evict(self):
+        '''Drop least recently used entries until the segments are under max_bytes'''
+        entries = self.index['entries']
+        for key, atime in self.touched.items():
+            if key in entries:
+                entries[key]['atime'] = max(entries[key]['atime'], atime)
+        self.compact()
+        for key in sorted(entries, key=lambda k: entries[k]['atime']):
+            if self.live_bytes() <= self.max_bytes and self.disk_bytes() <= self.max_bytes:
+                break
+            del entries[key]
+            self.evictions += 1
+            self.compact()
+
+    def compact(self):
+        '''
+        Copy the live entries out of segments they fill less than COMPACT_FRACTION of,
+        and delete those segments. Views already handed out keep their own mapping.
+        '''
+        entries = self.index['entries']
+        segments = self.index['segments']
+        for segment in sorted(segments, key=int):
+            # Found afresh, as entries copied earlier in the loop land in later segments
+            keys = [key for key, entry in entries.items() if str(entry['seg']) == segment]
+            size = sum(entries[key]['size'] for key in keys)
+            if size >= COMPACT_FRACTION * segments[segment]:
+                continue
+            if keys:
+                if segment == max(segments, key=int):
+                    # The copies can't go to the end of the segment they leave
+                    self.new_segment()
+                with open(self.segment_path(segment), "rb") as seg_file:
+                    for key in keys:
+                        entry = entries[key]
+                        seg_file.seek(entry['offset'])
+                        entry['seg'], entry['offset'] = self.write_payload(seg_file.read(entry['size']))
+                self.compactions += 1
+            del segments[segment]
+            self.maps.pop(segment, None)
+            try:
+                os.remove(self.segment_path(segment))
+            except OSError:
+                pass
+
+    def stats(self):
+        '''Return hit, miss and size statistics for this cache handle'''
+        self.refresh_index()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+            'puts': self.puts,
+            'evictions': self.evictions,
+            'entries': len(self.index['entries']),
+            'compactions': self.compactions,
+            'live_bytes': self.live_bytes(),
+            'disk_bytes': self.disk_bytes(),
+            'segments': len(self.index['segments']),
+        }
+
+class _DirectoryLock(object):
+    '''Advisory lock on the cache lock file, a no-op where fcntl is unavailable'''
+
+    def __init__(self, lock_file, exclusive):
+        self.lock_file = lock_file
+        self.exclusive = exclusive
+
+    def __enter__(self):
+        if fcntl is not None:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH)
+        return self
+
+    def __exit__(self, *args):
+        if fcntl is not None:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
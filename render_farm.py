@@ -0,0 +1,144 @@
+''' Renders large images as tiles spread over a pool of worker processes. Each worker
+    has its own headless GL context, compiled Shader and copy of the bindings, which
+    keeps every core busy on software GL (llvmpipe, OSMesa) where one context can't.
+    Tiles are written into one memory mapped file of raw RGBA rows. '''
+
+from __future__ import print_function
+import os
+import sys
+import time
+import mmap
+import ctypes
+import argparse
+import multiprocessing
+from procviewer import ShaderController, ShaderSource, read_shader_files
+from png_writer import PNGWriter
+
+# State of a worker process, set up once by _init_worker
+_worker = {}
+
+def split_tiles(width, height, tile_size):
+    '''Return (x, y, width, height) tiles covering the image, from the bottom left'''
+    tiles = []
+    for y in range(0, height, tile_size):
+        for x in range(0, width, tile_size):
+            tiles.append((x, y, min(tile_size, width - x), min(tile_size, height - y)))
+    return tiles
+
+def create_output(path, width, height):
+    '''Create the raw output file, width * height RGBA pixels with the bottom row first'''
+    with open(path, 'wb') as output_file:
+        output_file.truncate(width * height * 4)
+
+def write_tile(output, width, tile, pixels):
+    '''Copy a tile's pixels, bottom row first, into its place in the output'''
+    x, y, tile_width, tile_height = tile
+    pixels = memoryview(pixels).cast('B')
+    row_bytes = tile_width * 4
+    for row in range(tile_height):
+        start = ((y + row) * width + x) * 4
+        output[start:start + row_bytes] = pixels[row * row_bytes:(row + 1) * row_bytes]
+
+def save_png(raw_path, png_path, width, height):
+    '''Write the raw output as a PNG, which stores the top row first'''
+    with open(raw_path, 'rb') as raw_file:
+        raw = mmap.mmap(raw_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            with PNGWriter(png_path, width, height) as writer:
+                row_bytes = width * 4
+                for row in reversed(range(height)):
+                    writer.write_row(raw[row * row_bytes:(row + 1) * row_bytes])
+        finally:
+            raw.close()
+
+def print_progress(done, total, tile, seconds):
+    '''Default progress report, one line per finished tile'''
+    print("tile {}/{} at {},{} took {:.2f}s".format(done, total, tile[0], tile[1], seconds))
+    sys.stdout.flush()
+
+def _init_worker(shader_path, controller_class, bindings, raw_path, width, height,
+                 tile_size, headless):
+    '''Pool initialiser, create this worker's context, shader, controller and output map'''
+    import pyglet
+    # Has to be chosen before pyglet.gl is first imported
+    pyglet.options['headless'] = headless
+    from shader import Shader
+    from offscreen import headless_context, Framebuffer
+
+    _worker['context'] = headless_context()
+    shader = Shader(*read_shader_files(shader_path))
+    _worker['shader'] = shader
+    _worker['controller'] = controller_class(shader, shader_path, bindings)
+    _worker['framebuffer'] = Framebuffer(tile_size, tile_size)
+    # Big enough for any tile, edge tiles only fill the start of it
+    _worker['pixels'] = (ctypes.c_ubyte * (4 * tile_size * tile_size))()
+    _worker['size'] = (width, height)
+    output_file = open(raw_path, 'r+b')
+    _worker['output'] = mmap.mmap(output_file.fileno(), 0)
+    output_file.close()
+
+def _render_tile(tile):
+    '''Pool worker, render one tile straight into the shared output'''
+    from offscreen import draw_region
+
+    started = time.time()
+    x, y, tile_width, tile_height = tile
+    width, height = _worker['size']
+    framebuffer = _worker['framebuffer']
+    framebuffer.bind()
+    draw_region(_worker['shader'], _worker['controller'], x, y, width, height)
+    framebuffer.read_pixels(tile_width, tile_height, _worker['pixels'])
+    framebuffer.unbind()
+    write_tile(_worker['output'], width, tile, _worker['pixels'])
+    return tile, time.time() - started
+
+def render_tiled(shader_path, width, height, raw_path, processes=None, tile_size=256,
+                 controller_class=ShaderController, progress=print_progress, headless=True):
+    '''
+    Render the shader at shader_path as a width x height image into raw_path.
+    The bindings are read once here and copied to every worker. Tiles are handed out
+    one at a time from a shared queue, so a worker that finishes cheap tiles takes
+    more of them while another is stuck on an expensive region.
+    '''
+    controller = controller_class(ShaderSource(*read_shader_files(shader_path)), shader_path)
+    create_output(raw_path, width, height)
+    tiles = split_tiles(width, height, tile_size)
+
+    # Fresh processes, a forked GL context isn't usable
+    context = multiprocessing.get_context('spawn')
+    pool = context.Pool(processes or multiprocessing.cpu_count(), _init_worker,
+                        (shader_path, controller_class, controller.bindings, raw_path,
+                         width, height, tile_size, headless))
+    try:
+        for done, (tile, seconds) in enumerate(pool.imap_unordered(_render_tile, tiles), 1):
+            if progress:
+                progress(done, len(tiles), tile, seconds)
+    finally:
+        pool.close()
+        pool.join()
+
+def main(argv=None):
+    '''Render a shader as tiles across worker processes and save it as a PNG'''
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('shader', help="shader path without extension, e.g. blobs/blobs_shader")
+    parser.add_argument('--width', type=int, default=4096)
+    parser.add_argument('--height', type=int, default=4096)
+    parser.add_argument('--tile', type=int, default=256)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--output', default='render.png')
+    parser.add_argument('--raw', default=None, help="raw RGBA output, kept after saving")
+    parser.add_argument('--window', action='store_true',
+                        help="use hidden windows rather than headless contexts")
+    args = parser.parse_args(argv)
+
+    raw_path = args.raw or args.output + '.rgba'
+    started = time.time()
+    render_tiled(args.shader, args.width, args.height, raw_path, args.processes, args.tile,
+                 headless=not args.window)
+    save_png(raw_path, args.output, args.width, args.height)
+    if args.raw is None:
+        os.remove(raw_path)
+    print("saved to {} in {:.1f}s".format(args.output, time.time() - started))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+''' Draws a shader as a pipeline of stages, each its own program rendering into a
+    texture that later stages read. A stage is the shader's source under a
+    STAGE_<NAME> define and owns the uniforms it declares there, so it only runs
+    again when one of those or a stage it reads changed. Changing the bindings of a
+    cheap last stage, like scrappy_grid's threshold, then costs that one pass rather
+    than the noise under it. '''
+
+from __future__ import print_function
+import copy
+import ctypes
+from pyglet import gl
+from glsl_source import insert_after_header
+from glsl_numpy import preprocess, QUALIFIERS
+from offscreen import draw_quad
+from metrics import REGISTRY
+
+# Texture unit for a stage's first input, unit 0 is left to the shaders
+INPUT_UNIT = 1
+
+# Stage targets as the pyglet.gl names of (internal format, format, type)
+TARGET_FORMATS = {
+    'R32F': ('GL_R32F', 'GL_RED', 'GL_FLOAT'),
+    'RGBA8': ('GL_RGBA8', 'GL_RGBA', 'GL_UNSIGNED_BYTE'),
+}
+
+STAGE_RUNS = REGISTRY.counter('render_graph_stage_runs_total', "Render graph stages drawn")
+STAGE_SKIPS = REGISTRY.counter('render_graph_stage_skips_total', "Render graph stages kept from an earlier frame")
+
+class Stage(object):
+    '''
+    A step of a pipeline: the shader under STAGE_<NAME>, reading the stages named in
+    inputs as stage_<name> textures, and rendering into a pixel_format texture.
+    '''
+
+    def __init__(self, name, inputs=(), pixel_format='R32F'):
+        if pixel_format not in TARGET_FORMATS:
+            raise ValueError("pixel_format must be one of " + ", ".join(sorted(TARGET_FORMATS)))
+        self.name = name
+        self.inputs = tuple(inputs)
+        self.pixel_format = pixel_format
+
+    @property
+    def define(self):
+        return 'STAGE_' + self.name.upper()
+
+# The project shaders split into stages, by shader path
+PIPELINES = {
+    'scrappy_grid/scrap_grid': [Stage('noise'), Stage('grid', ['noise'], 'RGBA8')],
+}
+
+def stage_source(fragment, stage):
+    '''Return fragment source for the stage, declaring the textures it reads'''
+    header = ["#define " + stage.define]
+    header += ["uniform sampler2D stage_{};".format(name) for name in stage.inputs]
+    return insert_after_header(fragment, "\n".join(header) + "\n")
+
+def declared_uniforms(fragment):
+    '''Return the names of the uniforms fragment declares once preprocessed, in order'''
+    tokens = preprocess(fragment)
+    names = []
+    for index, token in enumerate(tokens):
+        if token.kind == 'name' and token.text == 'uniform':
+            index += 1
+            while tokens[index].text in QUALIFIERS:
+                index += 1
+            # Past the type
+            names.append(tokens[index + 1].text)
+    return names
+
+class RenderGraph(object):
+    '''
+    Draws the controller's shader as the stages, width x height pixels each. The last
+    stage draws to the bound framebuffer every frame, the others are kept in textures.
+    '''
+
+    def __init__(self, controller, source, stages, width, height):
+        seen = set()
+        for stage in stages:
+            unknown = [name for name in stage.inputs if name not in seen]
+            if unknown:
+                raise ValueError("stage {} reads {} before it is drawn".format(stage.name, ", ".join(unknown)))
+            seen.add(stage.name)
+        self.controller = controller
+        self.stages = stages
+        self.width = width
+        self.height = height
+        self.vertex_shader = source.vertex_shader
+        self.sources = [stage_source(source.fragment_shader, stage) for stage in stages]
+        self.uniforms = [[name for name in declared_uniforms(fragment) if name in controller.bindings]
+                         for fragment in self.sources]
+        self.programs = None
+        # Stage name to its (texture, framebuffer), and the values it was last drawn with
+        self.targets = {}
+        self.drawn = {}
+
+    def update(self):
+        '''Draw the stages whose uniforms or inputs changed, and the last, returning their names'''
+        bindings = self.controller.bindings
+        last = len(self.stages) - 1
+        run = []
+        for index, (stage, uniforms) in enumerate(zip(self.stages, self.uniforms)):
+            values = dict((name, copy.deepcopy(bindings[name]['default'])) for name in uniforms)
+            if index == last or values != self.drawn.get(stage.name) or set(stage.inputs) & set(run):
+                self.run(index)
+                self.drawn[stage.name] = values
+                run.append(stage.name)
+                STAGE_RUNS.inc()
+            else:
+                STAGE_SKIPS.inc()
+        return run
+
+    def compile(self):
+        '''Compile the stage programs and make the textures they draw into, needs a context'''
+        from shader import Shader
+
+        self.programs = [Shader(self.vertex_shader, fragment) for fragment in self.sources]
+        for stage in self.stages[:-1]:
+            self.targets[stage.name] = self.create_target(stage.pixel_format)
+
+    def create_target(self, pixel_format):
+        internal_format, data_format, data_type = [getattr(gl, name) for name in TARGET_FORMATS[pixel_format]]
+        texture = gl.GLuint(0)
+        gl.glGenTextures(1, ctypes.byref(texture))
+        gl.glBindTexture(gl.GL_TEXTURE_2D, texture.value)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_NEAREST)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_NEAREST)
+        gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, internal_format, self.width, self.height, 0,
+                        data_format, data_type, None)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+        framebuffer = gl.GLuint(0)
+        gl.glGenFramebuffers(1, ctypes.byref(framebuffer))
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, framebuffer.value)
+        gl.glFramebufferTexture2D(gl.GL_FRAMEBUFFER, gl.GL_COLOR_ATTACHMENT0, gl.GL_TEXTURE_2D,
+                                  texture.value, 0)
+        status = gl.glCheckFramebufferStatus(gl.GL_FRAMEBUFFER)
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, 0)
+        if status != gl.GL_FRAMEBUFFER_COMPLETE:
+            raise ValueError("framebuffer incomplete, status 0x{:x}".format(status))
+        return texture.value, framebuffer.value
+
+    def run(self, index):
+        '''Draw one stage, into its texture unless it is the last'''
+        stage = self.stages[index]
+        program = self.programs[index]
+        target = self.targets.get(stage.name)
+        if target is not None:
+            gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, target[1])
+            gl.glViewport(0, 0, self.width, self.height)
+        program.bind()
+        for name in self.uniforms[index]:
+            self.controller.upload_uniform(name, self.controller.bindings[name]['default'], program)
+        for unit, name in enumerate(stage.inputs, INPUT_UNIT):
+            gl.glActiveTexture(gl.GL_TEXTURE0 + unit)
+            gl.glBindTexture(gl.GL_TEXTURE_2D, self.targets[name][0])
+            program.uniformi('stage_' + name, unit)
+        gl.glActiveTexture(gl.GL_TEXTURE0)
+        draw_quad()
+        program.unbind()
+        if target is not None:
+            gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, 0)
+
+    def draw(self):
+        '''Bring the stages up to date and draw the last over the viewport'''
+        if self.programs is None:
+            self.compile()
+        self.update()
+
+    def delete(self):
+        for texture, framebuffer in self.targets.values():
+            gl.glDeleteTextures(1, ctypes.byref(gl.GLuint(texture)))
+            gl.glDeleteFramebuffers(1, ctypes.byref(gl.GLuint(framebuffer)))
+        self.targets = {}
+        self.drawn = {}
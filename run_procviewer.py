@@ -1,144 +1,199 @@
 '''
-This is the run file. Run this file to load a shader and attempt to get it to draw.abs
-To pick a shader, change the window creation line below to:
-`window = TextureWindow('path/file')`
+This is the run file. Run it with the path of a shader, without its extensions, to
+load the shader and draw it:
+
+> python run_procviewer.py tiled/tile_shader --width 800 --height 600
+
+Nothing happens on import, and pyglet isn't imported until main() needs it. The
+bindings are read and parsed on a thread while the GL context is created.
 '''
 
 from __future__ import print_function
-import os
-import time
-import io
-import pyglet
-from pyglet import gl
-from pyglet.window import key
-from procviewer import ShaderController
-from shader import Shader
-
-class TextureWindow(pyglet.window.Window):
-    '''
-    Concrete draw window. This uses the ShaderController to load and operate the shader at the path
-    passed to the constructor.
-    '''
-
-    def __init__(self, shader_path):
+import argparse
+import threading
+from metrics import clock
+from simplex import BASES
+from fragment_build import FragmentOptions
+
+SHADERS = (
+    'perlin_reference/proc_shader',
+    'tiled/tile_shader',
+    'scrappy_grid/scrap_grid',
+    'blobs/blobs_shader',
+    'spike/working_shader',
+    'Julia/julia',
+    'Julia/julia_deep',
+)
+DEFAULT_SHADER = 'Julia/julia'
+# Shaders that need more than the plain ShaderController
+DEEP_ZOOM_SHADERS = ('Julia/julia_deep',)
+
+class StartupProfile(object):
+    ''' Wall clock time of each startup phase, in the order they happened '''
+
+    def __init__(self, clock=clock):
+        self.clock = clock
+        self.phases = []
+        self.started = self.last = clock()
+
+    def mark(self, phase, less=0.0, background=None):
         '''
-        Load and attempt to run the shader at shader_path.
+        End phase now, less any seconds of it reported as other phases. background is
+        the seconds another thread spent on the phase, most of it hidden by earlier ones.
         '''
-        self.w = 512
-        self.h = 512
-
-        # Load shader code
-        vspath = '%s.v.glsl' % shader_path
-        fspath = '%s.f.glsl' % shader_path
-        with io.open(vspath) as vstrm, io.open(fspath) as fstrm:
-            vertexshader = ' '.join(vstrm)
-            fragmentshader = ' '.join(fstrm)
-
-        self.shader = Shader(vertexshader, fragmentshader)
-        self.shader_controller = ShaderController(self.shader, shader_path)
-        super(TextureWindow, self).__init__(caption=shader_path, width=self.w, height=self.h)
-
-        self.create_key_help_labels()
+        now = self.clock()
+        self.phases.append((phase, now - self.last - less, background))
+        self.last = now
+
+    def add(self, phase, seconds):
+        '''Report seconds spent on phase, measured by the caller'''
+        self.phases.append((phase, seconds, None))
+
+    def report(self):
+        lines = []
+        for phase, seconds, background in self.phases:
+            line = "{:<12}{:>9.1f} ms".format(phase, seconds * 1000.0)
+            if background is not None:
+                line += "  ({:.1f} ms in the background)".format(background * 1000.0)
+            lines.append(line)
+        lines.append("{:<12}{:>9.1f} ms".format('total', (self.last - self.started) * 1000.0))
+        return "\n".join(lines)
+
+class ControllerLoader(threading.Thread):
+    '''
+    Reads a shader's files and builds its controller, which parses the bindings and
+    saves them. Nothing here touches GL, so it can run while the context is created.
+    '''
 
-    def create_key_help_labels(self):
-        '''
-        Create the help labels to display overlaying the drawn shader
-        '''
-        self.helpLabels = []
-        y = self.height
-        for labelText in self.shader_controller.get_html_help(key):
-            self.helpLabels.append(pyglet.text.HTMLLabel(
-                    "<font face='Courier New' color='white'>{}</font>".format(labelText),
-                    x=0, y=y,
-                    anchor_x='left', anchor_y='top'))
-            y -= 20
-    
-    def updateStatusLabels(self):
-        self.statusLabels = []
-        y = 20
-        label = 0
-        for labelText in self.shader_controller.get_statuses():
-            # Create a new label if we need one (suddenly)
-            if label >= len(self.statusLabels):
-                self.statusLabels.append(pyglet.text.HTMLLabel("",
-                    x=0, y=y,
-                    anchor_x='left', anchor_y='top'))
-            # Modify an existing label to give it status text
-            self.statusLabels[label].text = "<font face='Courier New' color='white'>{}</font>".format(labelText)
-            y += 20
-            label += 1
-
-    def on_mouse_drag(self, x, y, dx, dy, buttons, modifiers):
-        self.shader_controller.mouse_drag(dx, dy)
-
-    def on_mouse_scroll(self, x, y, scroll_x, scroll_y):
-        self.shader_controller.mouse_scroll_y(scroll_y)
-
-    def on_key_release(self, symbol, modifiers):
-        self.shader_controller.binding_trigger(symbol)
-
-    def saveFromShader(self):
-        a = (gl.GLubyte * (4 * self.w * self.h))(0)
-        # Save without any GUI elements
-        self.drawGenerated()
-        gl.glReadPixels(0, 0, self.w, self.h, gl.GL_RGBA, gl.GL_UNSIGNED_BYTE, a)
-        image = pyglet.image.ImageData(self.w, self.h, 'RGBA', a)
-        scriptPath = os.path.dirname(os.path.realpath(__file__))
-        filePath = scriptPath + "/TESTSAVE_" + time.strftime("%Y%m%d_%H%M%S") + ".png"
-        print ("saved to {}".format(filePath))
-        image.save(filePath)
-
-    def on_draw(self):
-        self.drawGenerated()
-        self.updateStatusLabels()
-        self.drawGUI()
-        
-    def drawGenerated(self):
-        gl.glMatrixMode(gl.GL_PROJECTION)
-        gl.glLoadIdentity()
-        gl.glOrtho(-1., 1., 1., -1., 0., 1.)
-
-        gl.glMatrixMode(gl.GL_MODELVIEW)
-        gl.glLoadIdentity()
-
-        self.shader.bind()
-
-        self.shader_controller.set_uniforms()
-
-        gl.glBegin(gl.GL_QUADS)
-        gl.glVertex2i(-1, -1)
-        gl.glTexCoord2i(-2, -2)
-        gl.glVertex2f(1, -1)
-        gl.glTexCoord2i(2, -2)
-        gl.glVertex2i(1, 1)
-        gl.glTexCoord2i(2, 2)
-        gl.glVertex2i(-1, 1)
-        gl.glTexCoord2i(-2, 2)
-        gl.glEnd()
-
-        self.shader.unbind()
-
-    def drawGUI(self):
-        gl.glMatrixMode(gl.GL_PROJECTION)
-        gl.glLoadIdentity()
-        gl.glOrtho(0, self.w, 0, self.h, -1, 1)
-
-        for label in self.helpLabels:
-            label.draw()
-        for label in self.statusLabels:
-            label.draw()
-
-if not pyglet.gl.gl_info.have_extension('GL_EXT_gpu_shader4'):
-    print("GL_EXT_gpu_shader4 is not supported in this environment, but is required by the shader. "
-          "Display may be corrupted!")
-
-# Comment all but one of the following calls to TextureWindow to select a shader:
-
-# window = TextureWindow('perlin_reference/proc_shader')
-# window = TextureWindow('tiled/tile_shader')
-# window = TextureWindow('scrappy_grid/scrap_grid')
-# window = TextureWindow('blobs/blobs_shader')
-# window = TextureWindow('spike/working_shader')
-window = TextureWindow('julia/julia')
-
-pyglet.app.run()
+    def __init__(self, shader_path, controller_class):
+        super(ControllerLoader, self).__init__()
+        self.daemon = True
+        self.shader_path = shader_path
+        self.controller_class = controller_class
+        self.controller = None
+        self.error = None
+        self.seconds = 0.0
+
+    def run(self):
+        from procviewer import ShaderSource, read_shader_files
+        started = clock()
+        try:
+            source = ShaderSource(*read_shader_files(self.shader_path))
+            self.controller = self.controller_class(source, self.shader_path)
+        except Exception as error:
+            self.error = error
+        self.seconds = clock() - started
+
+    def result(self):
+        '''Wait for the controller, raising whatever building it raised'''
+        self.join()
+        if self.error is not None:
+            raise self.error
+        return self.controller
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Draw a procedural shader with its bindings on keys.")
+    parser.add_argument('shader', nargs='?', default=DEFAULT_SHADER,
+                        help="path of the shader without extensions, such as " + ", ".join(SHADERS))
+    parser.add_argument('--width', type=int, default=512)
+    parser.add_argument('--height', type=int, default=512)
+    parser.add_argument('--headless', action='store_true',
+                        help="draw without a display and exit, see --frames and --output")
+    parser.add_argument('--frames', type=int, default=1, help="frames to draw when headless")
+    parser.add_argument('--output', help="save the last headless frame to this PNG")
+    parser.add_argument('--deep-zoom', action='store_true',
+                        help="use the DeepZoomController, the default for " + ", ".join(DEEP_ZOOM_SHADERS))
+    parser.add_argument('--optimize', action='store_true', help="run the source through glsl_optimizer")
+    # glsl_optimizer.PASSES, written out as importing it brings in numpy
+    parser.add_argument('--optimize-passes', nargs='+', choices=('fold', 'cse', 'dead'),
+                        help="glsl_optimizer passes to run in place of its defaults, implies --optimize")
+    parser.add_argument('--specialize', nargs='*', default=[], help="bindings to compile in as constants")
+    parser.add_argument('--octave-cache', action='store_true',
+                        help="cache each octave's noise, so amplitude and octave changes only recompose")
+    parser.add_argument('--render-graph', action='store_true',
+                        help="draw in stages, rerunning only those whose bindings changed")
+    parser.add_argument('--z-search', action='store_true',
+                        help="skip the z levels the noise can't reach the threshold at, for spike and blobs")
+    parser.add_argument('--basis', choices=BASES, default='perlin',
+                        help="noise getHash evaluates, for shaders built on the Perlin reference")
+    parser.add_argument('--hash', action='store_true',
+                        help="hash in place of reading the permutation tables, which are then never uploaded")
+    parser.add_argument('--cull-octaves', action='store_true',
+                        help="skip the octaves finer than two pixels at the zoom, marking them in the bindings file")
+    parser.add_argument('--noise-volume', action='store_true',
+                        help="fetch the noise from a precomputed 3D texture, faster but a different field of noise")
+    parser.add_argument('--metrics-port', type=int)
+    parser.add_argument('--profile-startup', action='store_true',
+                        help="print how long each phase took up to the first frame")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    profile = StartupProfile()
+
+    import pyglet
+    if args.headless:
+        # Must be set before pyglet.gl is imported
+        pyglet.options['headless'] = True
+    from procviewer import ShaderController
+    profile.mark('imports')
+
+    loader = None
+    deep_zoom = args.deep_zoom or args.shader in DEEP_ZOOM_SHADERS
+    if not deep_zoom:
+        # procviewer doesn't import pyglet.gl, so the context is still made on this thread
+        loader = ControllerLoader(args.shader, ShaderController)
+        loader.start()
+
+    # Importing pyglet.gl creates pyglet's shadow window and its context
+    from pyglet import gl
+    from shader import COMPILE_SECONDS, LINK_SECONDS
+    from texture_window import TextureWindow
+    if not gl.gl_info.have_extension('GL_EXT_gpu_shader4'):
+        print("GL_EXT_gpu_shader4 is not supported in this environment, but is required by the shader. "
+              "Display may be corrupted!")
+    if deep_zoom:
+        # deep_zoom imports pyglet.gl, so its bindings can't be read any sooner
+        from deep_zoom import DeepZoomController
+        loader = ControllerLoader(args.shader, DeepZoomController)
+        loader.start()
+    profile.mark('context')
+
+    controller = loader.result()
+    profile.mark('bindings', background=loader.seconds)
+
+    compiled, linked = COMPILE_SECONDS.sum, LINK_SECONDS.sum
+    options = FragmentOptions(z_search=args.z_search, basis=args.basis, noise_volume=args.noise_volume,
+                              hash_tables=args.hash,
+                              optimize=tuple(args.optimize_passes or ()) or args.optimize)
+    window = TextureWindow(args.shader, specialize=args.specialize, metrics_port=args.metrics_port,
+                           width=args.width, height=args.height, controller=controller,
+                           visible=not args.headless, octave_cache=args.octave_cache,
+                           render_graph=args.render_graph, cull_octaves=args.cull_octaves,
+                           fragment_options=options)
+    compiled, linked = COMPILE_SECONDS.sum - compiled, LINK_SECONDS.sum - linked
+    profile.add('compile', compiled)
+    profile.add('link', linked)
+    profile.mark('window', compiled + linked)
+
+    # The first frame is the shader on screen, the GUI follows with the next one
+    window.drawGenerated()
+    if not args.headless:
+        window.flip()
+    gl.glFinish()
+    profile.mark('first frame')
+    if args.profile_startup:
+        print(profile.report())
+
+    if not args.headless:
+        pyglet.app.run()
+        return
+    for _ in range(args.frames - 1):
+        window.drawGenerated()
+    if args.output:
+        window.saveFromShader(args.output)
+    gl.glFinish()
+    window.close()
+
+if __name__ == '__main__':
+    main()
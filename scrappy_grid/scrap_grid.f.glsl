@@ -2,16 +2,23 @@
 
 #define p_range 256.0
 
-uniform int p[512];               // permutation 256
+// render_graph draws this in two stages, the noise into a float texture under
+// STAGE_NOISE, then the grid over it under STAGE_GRID, reading stage_noise.
+// Each stage declares only the uniforms it reads.
 uniform float x          = -5.4;  // diff 0.1
 uniform float y          = -5.4;  // diff 0.1
-uniform float z          = 0.0;   // diff 0.1
 uniform float zoom       = 0.005; // diff 0.0005
-uniform float grid       = 0.1;   // diff 0.01
-uniform float gridWeigth = 0.01;  // diff 0.001
+#ifndef STAGE_GRID
+uniform int p[512];               // permutation 256
+uniform float z          = 0.0;   // diff 0.1
 uniform int octives      = 2;
 uniform float freq       = 0.73;  // diff 0.01
+#endif
+#ifndef STAGE_NOISE
+uniform float grid       = 0.1;   // diff 0.01
+uniform float gridWeigth = 0.01;  // diff 0.001
 uniform float threshold  = 0.55;  // diff 0.01
+#endif
 
 float getSumFreq(float x, float y, float z);
 float getHash(float x, float y, float z); 
@@ -26,7 +33,15 @@ void main() {
   float fragX = x + gl_FragCoord[0] * zoom;
   float fragY = y + gl_FragCoord[1] * zoom;
 
+#ifdef STAGE_GRID
+  float sumFreq = texelFetch(stage_noise, ivec2(gl_FragCoord.xy), 0).r;
+#else
   float sumFreq = (getSumFreq(fragX, fragY, z) * 0.5) + 0.5;
+#endif
+
+#ifdef STAGE_NOISE
+  gl_FragColor = vec4(sumFreq, 0.0, 0.0, 1.0);
+#else
   float fb = 0.0; 
 
   if (abs(mod(fragX, grid)) < gridWeigth || abs(mod(fragY, grid)) < gridWeigth) {
@@ -38,10 +53,17 @@ void main() {
   float fr = fb;
   float fg = fb;
 
+#ifdef HEIGHTMAP
+  // The grid is only drawn over the noise, the height is the noise itself
+  gl_FragColor = vec4(sumFreq, sumFreq, sumFreq, 1.0);
+#else
   gl_FragColor = vec4(fr, fg, fb, 1.0);
+#endif
+#endif
   
 }
 
+#ifndef STAGE_GRID
 float getSumFreq(float x, float y, float z) {
   float totalHash = 0;
   for (int oct = 0; oct < octives; oct++) {
@@ -90,4 +112,5 @@ float grad(int hsh, float x, float y, float z) {
   float u = (h < 8) ? x : y;                // INTO 12 GRADIENT DIRECTIONS.
   float v = (h < 4) ? y : (h == 12 || h == 14) ? x : z;
   return (((h & 1) == 0) ? u : -u) + (((h & 2) == 0) ? v : -v);
-}
\ No newline at end of file
+}
+#endif
\ No newline at end of file
@@ -9,7 +9,11 @@ import ctypes
 # (see https://swiftcoder.wordpress.com/2008/12/19/simple-glsl-wrapper-for-pyglet/)
 
 from pyglet.gl import *
-from ctypes import c_char_p, cast, pointer, POINTER, c_char, c_int, byref, create_string_buffer, c_float, c_long
+from ctypes import c_char_p, cast, pointer, POINTER, c_char, c_int, byref, create_string_buffer, c_float
+from metrics import REGISTRY, timed
+
+COMPILE_SECONDS = REGISTRY.histogram('shader_compile_seconds', "Seconds to compile one shader stage")
+LINK_SECONDS = REGISTRY.histogram('shader_link_seconds', "Seconds to link a program")
 
 class Shader(object):
     # vert, frag and geom take arrays of source strings
@@ -35,26 +39,14 @@ class Shader(object):
         # attempt to link the program
         self.link()
 
+    @timed(COMPILE_SECONDS)
     def createShader(self, strings, type):
         count = len(strings)
         # if we have no source code, ignore this shader
         if count < 1:
             return
 
-        # create the shader handle
-        shader = glCreateShader(type)
-
-        # convert the source strings into a ctypes pointer-to-char array, and upload them
-        # this is deep, dark, dangerous black magick - don't try stuff like this at home!
-
-        src_buffer = ctypes.create_string_buffer(strings.encode())
-        buf_pointer = ctypes.cast(ctypes.pointer(ctypes.pointer(src_buffer)),
-                                ctypes.POINTER(ctypes.POINTER(ctypes.c_char)))
-        length = ctypes.byref(ctypes.c_int(len(strings) + 1))
-        glShaderSource(shader, 1, buf_pointer, length)
-
-        # compile the shader
-        glCompileShader(shader)
+        shader = self.compileShader(strings, type)
 
         temp = c_int(0)
         # retrieve the compile status
@@ -74,6 +66,24 @@ class Shader(object):
             # all is well, so attach the shader to the program
             glAttachShader(self.handle, shader)
 
+    def compileShader(self, strings, type):
+        # create the shader handle
+        shader = glCreateShader(type)
+
+        # convert the source strings into a ctypes pointer-to-char array, and upload them
+        # this is deep, dark, dangerous black magick - don't try stuff like this at home!
+
+        src_buffer = ctypes.create_string_buffer(strings.encode())
+        buf_pointer = ctypes.cast(ctypes.pointer(ctypes.pointer(src_buffer)),
+                                ctypes.POINTER(ctypes.POINTER(ctypes.c_char)))
+        length = ctypes.byref(ctypes.c_int(len(strings) + 1))
+        glShaderSource(shader, 1, buf_pointer, length)
+
+        # compile the shader, the driver may finish this later
+        glCompileShader(shader)
+        return shader
+
+    @timed(LINK_SECONDS)
     def link(self):
         # link the program
         glLinkProgram(self.handle)
@@ -137,7 +147,17 @@ class Shader(object):
             }[len(vals)](data_loc, *vals)
         else:
             # Allow data arrays greater than 4 values
-            glUniform1iv(data_loc, len(vals), (c_long * len(vals))(*vals))
+            glUniform1iv(data_loc, len(vals), (GLint * len(vals))(*vals))
+
+    # upload an array of floating point vectors, given as a list of lists
+    # this program must be currently bound
+    def uniform_vectorsf(self, name, vectors):
+        data_loc = glGetUniformLocation(self.handle, name.encode())
+        flat = [value for vector in vectors for value in vector]
+        {   2 : glUniform2fv,
+            3 : glUniform3fv,
+            4 : glUniform4fv
+        }[len(vectors[0])](data_loc, len(vectors), (c_float * len(flat))(*flat))
 
     # upload a uniform matrix
     # works with matrices stored as lists,
@@ -147,3 +167,69 @@ class Shader(object):
         loc = glGetUniformLocation(self.handle, name.encode())
         # upload the 4x4 floating point matrix
         glUniformMatrix4fv(loc, 1, False, (c_float * 16)(*mat))
+
+class ComputeShader(Shader):
+    # A program with only a compute stage, dispatched with glDispatchCompute rather
+    # than drawn. Needs GL 4.3 or GL_ARB_compute_shader
+    def __init__(self, comp = []):
+        self.handle = glCreateProgram()
+        self.linked = False
+
+        self.vertex_shader = []
+        self.fragment_shader = []
+        self.geometry_shader = []
+        self.compute_shader = comp
+
+        self.createShader(comp, GL_COMPUTE_SHADER)
+        self.link()
+
+# GL_COMPLETION_STATUS_ARB, from GL_ARB_parallel_shader_compile
+COMPLETION_STATUS = 0x91B1
+
+class PendingShader(Shader):
+    # A Shader that doesn't wait for its compile and link. With parallel shader
+    # compiles the driver works on them in the background until ready() is True,
+    # then finish() checks them as Shader does
+    def __init__(self, vert = [], frag = [], geom = [], parallel = False):
+        self.stages = []
+        self.parallel = parallel
+        super(PendingShader, self).__init__(vert, frag, geom)
+
+    def createShader(self, strings, type):
+        if len(strings) < 1:
+            return
+        shader = self.compileShader(strings, type)
+        glAttachShader(self.handle, shader)
+        self.stages.append(shader)
+
+    def link(self):
+        # only start the link, finish() checks it
+        glLinkProgram(self.handle)
+
+    def ready(self):
+        # without parallel compiles, asking for the status is what waits
+        if not self.parallel:
+            return True
+        temp = c_int(0)
+        glGetProgramiv(self.handle, COMPLETION_STATUS, byref(temp))
+        return bool(temp.value)
+
+    def finish(self):
+        temp = c_int(0)
+        for shader in self.stages:
+            glGetShaderiv(shader, GL_COMPILE_STATUS, byref(temp))
+            if not temp:
+                glGetShaderiv(shader, GL_INFO_LOG_LENGTH, byref(temp))
+                buffer = create_string_buffer(temp.value)
+                glGetShaderInfoLog(shader, temp, None, buffer)
+                raise ValueError(buffer.value)
+        glGetProgramiv(self.handle, GL_LINK_STATUS, byref(temp))
+        if not temp:
+            glGetProgramiv(self.handle, GL_INFO_LOG_LENGTH, byref(temp))
+            buffer = create_string_buffer(temp.value)
+            glGetProgramInfoLog(self.handle, temp, None, buffer)
+            raise ValueError(buffer.value)
+        self.linked = True
+
+    def delete(self):
+        glDeleteProgram(self.handle)
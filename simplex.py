@@ -0,0 +1,172 @@
+''' Simplex noise as an alternative basis for the shaders built on the Perlin reference's
+    getHash(x, y, z). Perlin noise blends the gradients of the 8 corners of the cube
+    around a point, simplex noise sums falloffs from the 4 corners of the tetrahedron
+    around it (the 3 of a triangle in 2D). It reads the shader's own permutation table,
+    so reseeding it still shuffles the noise, and the shader's grad for the 12 gradient
+    directions. The basis is swapped by rewriting getHash's body, see basis_source. '''
+
+from __future__ import print_function
+import re
+import time
+import argparse
+from glsl_source import find_uniform, matching_bracket
+
+# perlin2 is the reference's z = 0 slice: the 4 corners of a square rather than 8 of a cube
+BASES = ('perlin', 'perlin2', 'simplex', 'simplex2')
+BENCHMARK_SHADER = 'perlin_reference/proc_shader'
+
+ENTRY_POINT = re.compile(r'float\s+getHash\s*\(\s*float\s+x\s*,\s*float\s+y\s*,\s*float\s+z\s*\)\s*\{')
+
+SIMPLEX_SOURCE = '''
+float simplexCorner(int hsh, vec3 d, float radius) {
+  float t = max(radius - dot(d, d), 0.0);
+  t *= t;
+  return t * t * grad(hsh, d.x, d.y, d.z);
+}
+
+float simplex3(float x, float y, float z) {
+  // Skew to find the cube, unskew to find the distance to its first corner
+  vec3 at  = vec3(x, y, z);
+  vec3 i   = floor(at + dot(at, vec3(1.0 / 3.0)));
+  vec3 d0  = at - i + dot(i, vec3(1.0 / 6.0));
+  // The tetrahedron is picked by the order of the distances, without branching
+  vec3 g   = step(d0.yzx, d0.xyz);
+  vec3 l   = 1.0 - g;
+  ivec3 o1 = ivec3(min(g, l.zxy));
+  ivec3 o2 = ivec3(max(g, l.zxy));
+  vec3 d1  = d0 - vec3(o1) + 1.0 / 6.0;
+  vec3 d2  = d0 - vec3(o2) + 2.0 / 6.0;
+  vec3 d3  = d0 - 1.0 + 3.0 / 6.0;
+  int X    = int(i.x) & 255;
+  int Y    = int(i.y) & 255;
+  int Z    = int(i.z) & 255;
+  return 32.0 * (
+    simplexCorner(TABLE[X +        TABLE[Y +        TABLE[Z       ]]], d0, 0.6) +
+    simplexCorner(TABLE[X + o1.x + TABLE[Y + o1.y + TABLE[Z + o1.z]]], d1, 0.6) +
+    simplexCorner(TABLE[X + o2.x + TABLE[Y + o2.y + TABLE[Z + o2.z]]], d2, 0.6) +
+    simplexCorner(TABLE[X + 1 +    TABLE[Y + 1 +    TABLE[Z + 1   ]]], d3, 0.6));
+}
+
+float simplex2(float x, float y) {
+  // Skew and unskew factors, (sqrt(3) - 1) / 2 and (3 - sqrt(3)) / 6
+  float s  = (x + y) * 0.36602540378;
+  float i  = floor(x + s);
+  float j  = floor(y + s);
+  float t  = (i + j) * 0.21132486540;
+  vec2 d0  = vec2(x - i + t, y - j + t);
+  ivec2 o1 = d0.x > d0.y ? ivec2(1, 0) : ivec2(0, 1);
+  vec2 d1  = d0 - vec2(o1) + 0.21132486540;
+  vec2 d2  = d0 - 1.0 + 2.0 * 0.21132486540;
+  int X    = int(i) & 255;
+  int Y    = int(j) & 255;
+  return 70.0 * (
+    simplexCorner(TABLE[X +        TABLE[Y       ]], vec3(d0, 0.0), 0.5) +
+    simplexCorner(TABLE[X + o1.x + TABLE[Y + o1.y]], vec3(d1, 0.0), 0.5) +
+    simplexCorner(TABLE[X + 1 +    TABLE[Y + 1   ]], vec3(d2, 0.0), 0.5));
+}
+
+float perlin2(float x, float y) {
+  int X    = int(floor(x)) & 255;
+  int Y    = int(floor(y)) & 255;
+  x       -= floor(x);
+  y       -= floor(y);
+  float u  = fade(x);
+  float v  = fade(y);
+  int A    = TABLE[X  ]+Y;
+  int B    = TABLE[X+1]+Y;
+  return lerp(v, lerp(u, grad(TABLE[TABLE[A  ]], x    , y    , 0.0),
+                         grad(TABLE[TABLE[B  ]], x-1.0, y    , 0.0)),
+                 lerp(u, grad(TABLE[TABLE[A+1]], x    , y-1.0, 0.0),
+                         grad(TABLE[TABLE[B+1]], x-1.0, y-1.0, 0.0)));
+}
+
+'''
+
+CALLS = {
+    'perlin2': 'perlin2(x, y)',
+    'simplex': 'simplex3(x, y, z)',
+    'simplex2': 'simplex2(x, y)',
+}
+
+def replace_get_hash(fragment, body, functions=''):
+    '''Return fragment source with getHash's body replaced, and functions defined before it'''
+    entry = ENTRY_POINT.search(fragment)
+    if entry is None:
+        raise ValueError("no getHash(float x, float y, float z) to replace")
+    end = matching_bracket(fragment, entry.end() - 1)
+    return fragment[:entry.start()] + functions + fragment[entry.start():entry.end()] + body + fragment[end:]
+
+def basis_source(fragment, basis='simplex', table='p'):
+    '''
+    Return fragment source with getHash evaluating basis, reading the permutation
+    table named table. The 2D bases ignore z, so suit views that don't move through it.
+    '''
+    if basis not in BASES:
+        raise ValueError("basis must be one of " + ", ".join(BASES))
+    if basis == 'perlin':
+        return fragment
+    match = find_uniform(fragment, table)
+    if match is None or match.group('type') != 'int' or match.group('size') is None:
+        raise ValueError("no permutation table {} declared".format(table))
+    functions = re.sub(r'\bTABLE\b', table, SIMPLEX_SOURCE)
+    return replace_get_hash(fragment, "\n  return {};\n".format(CALLS[basis]), functions.lstrip('\n'))
+
+def time_bases(shader_path, size, frames, bases=BASES):
+    '''
+    Yield each basis with the seconds per size x size frame of the shader on the
+    compute path, in a GL context that has compute shaders.
+    '''
+    from procviewer import ShaderController, ShaderSource, read_shader_files
+    from compute import ComputeKernel, time_frames
+
+    source = ShaderSource(*read_shader_files(shader_path))
+    controller = ShaderController(source, shader_path)
+    for basis in bases:
+        kernel = ComputeKernel(basis_source(source.fragment_shader, basis), controller, size, size)
+        yield basis, time_frames(kernel.run, frames)
+        kernel.delete()
+
+def time_harness(shader_path, size, bases=BASES):
+    '''Yield each basis with the seconds for a size x size render through the NumPy harness'''
+    from procviewer import ShaderController, ShaderSource, read_shader_files
+    from glsl_numpy import compile_fragment, bindings_uniforms
+
+    source = ShaderSource(*read_shader_files(shader_path))
+    uniforms = bindings_uniforms(ShaderController(source, shader_path).bindings)
+    for basis in bases:
+        program = compile_fragment(basis_source(source.fragment_shader, basis))
+        started = time.time()
+        program.render(size, size, uniforms)
+        yield basis, time.time() - started
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the cost of the noise bases per pixel.")
+    parser.add_argument('shader', nargs='?', default=BENCHMARK_SHADER)
+    parser.add_argument('--size', type=int, default=512)
+    parser.add_argument('--frames', type=int, default=10)
+    parser.add_argument('--harness', action='store_true',
+                        help="time renders through the NumPy harness rather than the compute path")
+    args = parser.parse_args(argv)
+
+    if args.harness:
+        timings = list(time_harness(args.shader, args.size))
+    else:
+        import pyglet
+        # Has to be chosen before pyglet.gl is first imported
+        pyglet.options['headless'] = True
+        from offscreen import headless_context
+        from compute import have_compute
+        context = headless_context()
+        if not have_compute():
+            print("no compute shaders, try --harness")
+            return
+        timings = list(time_bases(args.shader, args.size, args.frames))
+        context.close()
+    seconds = dict(timings)
+    print("{:<10} {:>12} {:>10}".format('basis', 'ns/pixel', 'vs perlin'))
+    for basis, taken in timings:
+        baseline = seconds['perlin2' if basis.endswith('2') else 'perlin']
+        print("{:<10} {:>12.1f} {:>9.2f}x".format(basis, taken * 1e9 / (args.size * args.size), baseline / taken))
+
+if __name__ == '__main__':
+    main()
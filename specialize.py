@@ -0,0 +1,198 @@
+''' Compile-time specialisation of bindings that rarely change. Bindings marked with
+    "specialize": true in the bindings file (loop bounds like octives, levels, tile or
+    max_iter_count) are compiled in as constants, so the GLSL compiler can unroll and
+    fold the loops that use them. A program is kept per tuple of their values and new
+    ones compile in the background while the generic program keeps drawing. '''
+
+from __future__ import print_function
+import time
+import argparse
+import collections
+from procviewer import ShaderController, ShaderSource, read_shader_files
+from glsl_source import find_uniform, replace_uniform
+from octave_cull import CULL_KEY
+
+SPECIALIZE_KEY = 'specialize'
+SPECIALIZABLE = ('int', 'float', 'bool')
+
+def specialized_names(bindings):
+    '''
+    Return the names of the scalar bindings marked for specialisation, sorted. Culled
+    octave counts change with the zoom, so are left as uniforms.
+    '''
+    return sorted(name for name, binding in bindings.items()
+                  if binding.get(SPECIALIZE_KEY) and binding.get('type') in SPECIALIZABLE
+                  and not isinstance(binding.get('default'), list) and CULL_KEY not in binding)
+
+def glsl_literal(value, var_type):
+    '''Return value as a GLSL literal of var_type'''
+    if var_type == 'bool':
+        return 'true' if value else 'false'
+    if var_type == 'int':
+        return str(int(value))
+    return repr(float(value))
+
+def specialize_source(source, bindings, names):
+    '''
+    Replace the uniform declarations of names with constants holding their current
+    values. Constants rather than #defines, so parameters sharing a name (x, y and z
+    in the noise functions) are left alone.
+    '''
+    for name in names:
+        if find_uniform(source, name) is None:
+            continue
+        var_type = bindings[name]['type']
+        source = replace_uniform(source, name, "const {} {} = {};".format(
+            var_type, name, glsl_literal(bindings[name]['default'], var_type)))
+    return source
+
+def pending_compiler(parallel=None):
+    '''
+    Return a function compiling (vertex, fragment) into a PendingShader, using
+    parallel shader compiles when the driver has them. Needs a context.
+    '''
+    from pyglet import gl
+    from shader import PendingShader
+
+    if parallel is None:
+        parallel = (gl.gl_info.have_extension('GL_ARB_parallel_shader_compile') or
+                    gl.gl_info.have_extension('GL_KHR_parallel_shader_compile'))
+    if parallel:
+        set_threads = (getattr(gl, 'glMaxShaderCompilerThreadsARB', None) or
+                       getattr(gl, 'glMaxShaderCompilerThreadsKHR', None))
+        if set_threads is not None:
+            # As many as the driver likes
+            set_threads(0xFFFFFFFF)
+    return lambda vertex_shader, fragment_shader: PendingShader(vertex_shader, fragment_shader,
+                                                                parallel=parallel)
+
+class Specializer(object):
+    '''
+    Picks the program to draw the controller's bindings with. Once the specialised
+    values have settled for settle seconds, a variant with them as constants starts
+    compiling. The generic program is used until it is ready, and variants are kept
+    for the last max_variants value tuples. prepare(program) is called on each variant
+    once it has linked, to attach uniform blocks and the like.
+    '''
+
+    def __init__(self, controller, vertex_shader, fragment_shader, generic, compile_shader,
+                 prepare=None, max_variants=8, settle=0.25):
+        self.controller = controller
+        self.vertex_shader = vertex_shader
+        self.fragment_shader = fragment_shader
+        self.generic = generic
+        self.compile_shader = compile_shader
+        self.prepare = prepare
+        self.max_variants = max_variants
+        self.settle = settle
+        self.clock = time.time
+        self.names = specialized_names(controller.bindings)
+        # value tuple: [program, linked]
+        self.variants = collections.OrderedDict()
+        self.last_key = None
+        self.changed = None
+
+    def key(self):
+        return tuple(self.controller.bindings[name]['default'] for name in self.names)
+
+    def program(self):
+        '''Return the program to draw with now, starting or checking a compile as needed'''
+        if not self.names:
+            return self.generic
+        key = self.key()
+        now = self.clock()
+        if key != self.last_key:
+            self.last_key = key
+            self.changed = now
+
+        variant = self.variants.get(key)
+        if variant is None:
+            if now - self.changed >= self.settle:
+                self.start(key)
+            return self.generic
+        self.variants.move_to_end(key)
+        program, linked = variant
+        if not linked:
+            if not program.ready():
+                return self.generic
+            self.finish(key, program)
+        return self.variants[key][0]
+
+    def start(self, key):
+        '''Start compiling the variant for key, dropping the least recently used'''
+        fragment_shader = specialize_source(self.fragment_shader, self.controller.bindings, self.names)
+        self.variants[key] = [self.compile_shader(self.vertex_shader, fragment_shader), False]
+        while len(self.variants) > self.max_variants:
+            _, (program, _) = self.variants.popitem(last=False)
+            if program is not self.generic:
+                program.delete()
+
+    def finish(self, key, program):
+        try:
+            program.finish()
+        except ValueError as error:
+            # Keep drawing with the generic program rather than retrying every frame
+            print("specialised shader for {} failed: {}".format(dict(zip(self.names, key)), error))
+            program.delete()
+            self.variants[key] = [self.generic, True]
+            return
+        if self.prepare is not None:
+            self.prepare(program)
+        self.variants[key] = [program, True]
+
+def time_frames(shader, controller, framebuffer, frames):
+    '''Return the mean seconds to draw and finish a frame'''
+    from pyglet import gl
+    from offscreen import draw_shader
+
+    controller.use_shader(shader)
+    framebuffer.bind()
+    # The first frame pays for any lazy driver work
+    draw_shader(shader, controller)
+    gl.glFinish()
+    started = time.time()
+    for _ in range(frames):
+        draw_shader(shader, controller)
+    gl.glFinish()
+    framebuffer.unbind()
+    return (time.time() - started) / frames
+
+def main(argv=None):
+    '''Compare frame times of a shader's generic and specialised programs'''
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('shader', help="shader path without extension, e.g. tiled/tile_shader")
+    parser.add_argument('--names', nargs='*', default=None,
+                        help="bindings to specialise, those marked in the bindings file by default")
+    parser.add_argument('--width', type=int, default=1024)
+    parser.add_argument('--height', type=int, default=1024)
+    parser.add_argument('--frames', type=int, default=50)
+    parser.add_argument('--window', action='store_true',
+                        help="use a hidden window rather than a headless context")
+    args = parser.parse_args(argv)
+
+    import pyglet
+    # Has to be chosen before pyglet.gl is first imported
+    pyglet.options['headless'] = not args.window
+    from shader import Shader
+    from offscreen import headless_context, Framebuffer
+
+    vertex_shader, fragment_shader = read_shader_files(args.shader)
+    controller = ShaderController(ShaderSource(vertex_shader, fragment_shader), args.shader)
+    names = args.names if args.names is not None else specialized_names(controller.bindings)
+    context = headless_context()
+    framebuffer = Framebuffer(args.width, args.height)
+    generic = Shader(vertex_shader, fragment_shader)
+    specialized = Shader(vertex_shader, specialize_source(fragment_shader, controller.bindings, names))
+
+    generic_time = time_frames(generic, controller, framebuffer, args.frames)
+    specialized_time = time_frames(specialized, controller, framebuffer, args.frames)
+    print("specialised {}".format(', '.join("{}={}".format(name, controller.bindings[name]['default'])
+                                             for name in names)))
+    print("generic     {:8.2f} ms/frame".format(generic_time * 1000))
+    print("specialised {:8.2f} ms/frame ({:.2f}x)".format(specialized_time * 1000,
+                                                        generic_time / specialized_time))
+    framebuffer.delete()
+    context.close()
+
+if __name__ == '__main__':
+    main()
@@ -21,6 +21,7 @@ float getHash(float x, float y, float z);
 float fade(float t);
 float lerp(float t, float a, float b);
 float grad(int hsh, float x, float y, float z);
+float searchZ(float fragX, float fragY, float dz);
 
 void main() {
 
@@ -32,15 +33,70 @@ void main() {
   float sumFreq = 0.0;
   float z = zmax + zdiff;
 
+#ifdef Z_SEARCH
+  z = searchZ(fragX, fragY, zdiff);
+#else
   do {
     z -= zdiff;
     sumFreq = (getSumFreq(fragX, fragY, z) * 0.5) + 0.5;
   } while (sumFreq < threshold && z > zmin);
+#endif
 
   gl_FragColor = vec4(z, 0.0, 1.0, 1.0);
   
 }
 
+#ifdef Z_SEARCH
+// The most the shortfall changes per unit of z, as a fraction of shortfallScale(),
+// measured with z_search.py
+#ifndef Z_SEARCH_SLOPE
+#define Z_SEARCH_SLOPE 1.0
+#endif
+
+// How far the value at z falls short of where the linear search stops
+float shortfall(float fragX, float fragY, float z) {
+  return threshold - ((getSumFreq(fragX, fragY, z) * 0.5) + 0.5);
+}
+
+// How fast the shortfall would change if every octave's noise changed by one per
+// unit of its own z, at the live bindings
+float shortfallScale() {
+  float scale = 0.0;
+  for (int oct = 0; oct < octives; oct++) {
+    scale += float(1 << oct) * pow(freq, float(oct + 1));
+  }
+  return 0.5 * scale;
+}
+
+// The z the linear search stops at, stepping down the same levels, but skipping
+// those the shortfall can't reach zero by at Z_SEARCH_SLOPE. A skip that lands past
+// the threshold walks back to the first level that reached it.
+float searchZ(float fragX, float fragY, float dz) {
+  // Without octaves the shortfall never changes, so nothing stops a skip
+  float close = max(Z_SEARCH_SLOPE * shortfallScale() * dz, 1e-6);
+  float z = zmax + dz;
+  z -= dz;
+  float gap = shortfall(fragX, fragY, z);
+  while (gap > 0.0 && z > zmin) {
+    float from = z;
+    int skip = max(int(ceil(gap / close)), 1);
+    for (int level = 0; level < skip && z > zmin; level++) {
+      z -= dz;
+    }
+    gap = shortfall(fragX, fragY, z);
+    if (gap <= 0.0) {
+      float landed = z;
+      for (z = from - dz; z != landed; z -= dz) {
+        if (shortfall(fragX, fragY, z) <= 0.0) {
+          break;
+        }
+      }
+    }
+  }
+  return z;
+}
+#endif
+
 float getSumFreq(float x, float y, float z) {
   float totalHash = 0;
   for (int oct = 0; oct < octives; oct++) {
@@ -1,6 +1,36 @@
 import unittest
 
 from test_procviewer import *
+from test_render_cache import *
+from test_deep_zoom import *
+from test_png_writer import *
+from test_julia_cpu import *
+from test_glsl_numpy import *
+from test_render_farm import *
+from test_uniform_block import *
+from test_glsl_source import *
+from test_contact_sheet import *
+from test_batch_render import *
+from test_readback import *
+from test_heightmap import *
+from test_world import *
+from test_specialize import *
+from test_glsl_optimizer import *
+from test_metrics import *
+from test_run_procviewer import *
+from test_autosave import *
+from test_compute import *
+from test_octave_cache import *
+from test_render_graph import *
+from test_z_search import *
+from test_simplex import *
+from test_hash_mode import *
+from test_noise_volume import *
+from test_octave_cull import *
+from test_fragment_build import *
+from test_gl_render import *
 # from test_shader import *
 
-unittest.main()
\ No newline at end of file
+# Guarded, the GL tests' spawned processes import this as their main module
+if __name__ == '__main__':
+    unittest.main()
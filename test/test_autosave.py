@@ -0,0 +1,89 @@
+import unittest
+import json
+import time
+from test_base import *
+
+# Pull in the autosave for testing
+from autosave import Autosaver, write_text
+from procviewer import ShaderController
+
+savefile = "bindings/autosave.json"
+
+class AutosaveCase(BaseCase):
+
+    def tearDown(self):
+        super(AutosaveCase, self).tearDown()
+        try:
+            os.remove(savefile)
+        except OSError:
+            pass
+
+class TestWriteText(AutosaveCase):
+
+    def test_replaces_without_leftovers(self):
+        write_text(savefile, "first")
+        write_text(savefile, "second")
+        with open(savefile) as saved:
+            self.assertEqual(saved.read(), "second")
+        self.assertEqual([name for name in os.listdir("bindings") if name.endswith(".tmp")], [])
+
+class TestAutosaver(AutosaveCase):
+
+    def test_changes_are_coalesced(self):
+        snapshot = Mock(return_value="{}")
+        saver = Autosaver(savefile, snapshot, interval=60)
+        for _ in range(3):
+            saver.mark_dirty()
+        self.assertFalse(os.path.isfile(savefile))
+        saver.close()
+        self.assertEqual(snapshot.call_count, 1)
+        self.assertTrue(os.path.isfile(savefile))
+        # Nothing changed since, so nothing more is written
+        saver.close()
+        self.assertEqual(snapshot.call_count, 1)
+
+    def test_saves_in_the_background(self):
+        saver = Autosaver(savefile, lambda: '{"a": 1}', interval=0.01)
+        saver.mark_dirty()
+        deadline = time.time() + 5
+        while not os.path.isfile(savefile) and time.time() < deadline:
+            time.sleep(0.01)
+        saver.close()
+        with open(savefile) as saved:
+            self.assertEqual(json.load(saved), {"a": 1})
+
+    def test_snapshot_races_are_retried(self):
+        snapshot = Mock(side_effect=[RuntimeError("dictionary changed size during iteration"), "{}"])
+        saver = Autosaver(savefile, snapshot)
+        saver.dirty.set()
+        self.assertFalse(saver.save())
+        self.assertTrue(saver.save())
+        self.assertTrue(os.path.isfile(savefile))
+
+class TestControllerAutosave(AutosaveCase):
+
+    def controller(self):
+        shader = Mock(vertex_shader="", fragment_shader="uniform float a = 1.0; // diff 0.5")
+        return ShaderController(shader, "blank/blank_shader")
+
+    def test_unchanged_bindings_are_not_rewritten(self):
+        self.tearDown()
+        self.controller()
+        self.assertTrue(os.path.isfile("blank/blank_shader.bindings.json"))
+        with patch('procviewer.write_text') as write:
+            self.controller()
+            self.assertFalse(write.called)
+
+    def test_changes_saved_on_close(self):
+        controller = self.controller()
+        # Not enabled, as for batch and farm controllers
+        controller.binding_trigger(controller.bindings['a']['inc_key'])
+        self.assertIsNone(controller.autosave)
+        controller.enable_autosave(interval=60)
+        controller.binding_trigger(controller.bindings['a']['inc_key'])
+        controller.close()
+        with open("blank/blank_shader.bindings.json") as saved:
+            self.assertEqual(json.load(saved)['a']['default'], 2.0)
+
+if __name__ == '__main__':
+    unittest.main()
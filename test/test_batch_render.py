@@ -0,0 +1,88 @@
+import unittest
+import numpy as np
+from test_base import *
+
+# Pull in the batch renderer for testing
+import batch_render
+from batch_render import uniform_changes, render_batch
+from procviewer import ShaderController
+
+def make_bindings():
+    return {
+        'zoom': {'type': 'float', 'default': 0.5},
+        'octives': {'type': 'int', 'default': 9},
+        'p': {'type': 'int', 'default': [0, 1, 2]},
+    }
+
+class TestUniformChanges(BaseCase):
+
+    def test_only_changes_uploaded(self):
+        bindings = make_bindings()
+        self.assertEqual(uniform_changes(bindings, {}, {'zoom': 0.5, 'octives': 3}), {'octives': 3})
+        self.assertEqual(uniform_changes(bindings, {'octives': 3}, {'octives': 3}), {})
+
+    def test_dropped_overrides_restored(self):
+        bindings = make_bindings()
+        changes = uniform_changes(bindings, {'octives': 3, 'p': [2, 1, 0]}, {'zoom': 1.0})
+        self.assertEqual(changes, {'octives': 9, 'p': [0, 1, 2], 'zoom': 1.0})
+
+    def test_unknown_binding(self):
+        with self.assertRaises(ValueError):
+            uniform_changes(make_bindings(), {}, {'zom': 1.0})
+
+class FakeRing(object):
+    ''' Records the order of reads, frames are filled with the item number '''
+
+    def __init__(self, log, width, height, depth):
+        self.log = log
+        self.frames = {}
+        self.drawn = 0
+
+    def start_read(self, index):
+        self.log.append(('start', index))
+        self.frames[index] = np.full((1, 1, 4), self.drawn, np.uint8)
+        self.drawn += 1
+
+    def finish_read(self, index):
+        self.log.append(('finish', index))
+        return self.frames.pop(index)
+
+    def delete(self):
+        self.log.append(('delete',))
+
+class TestRenderBatch(BaseCase):
+
+    def setUp(self):
+        self.log = []
+        self.shader = Mock(vertex_shader="", fragment_shader="")
+        self.controller = ShaderController(self.shader, "blank/blank_shader", make_bindings())
+        patches = [
+            patch.object(batch_render, 'Framebuffer'),
+            patch.object(batch_render, 'draw_quad', lambda: self.log.append(('draw',))),
+            patch.object(batch_render, 'PixelPackRing',
+                         lambda width, height, depth: FakeRing(self.log, width, height, depth)),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_pipelined_readback(self):
+        batch = render_batch(self.shader, self.controller, iter([{}, {}, {}]), 1, 1)
+        frames = [frame[0, 0, 0] for frame in batch]
+        self.assertEqual(frames, [0, 1, 2])
+        # The next frame is drawn before the previous one is collected
+        self.assertEqual(self.log, [('draw',), ('start', 0), ('draw',), ('start', 1),
+                                    ('draw',), ('finish', 0), ('start', 0),
+                                    ('finish', 1), ('finish', 0), ('delete',)])
+
+    def test_only_changed_uniforms_uploaded(self):
+        items = [{'octives': 3}, {'octives': 3}, {'zoom': 0.25}]
+        list(render_batch(self.shader, self.controller, items, 1, 1))
+        self.shader.bind.assert_called_once_with()
+        uploads = [c[0] for c in self.shader.uniformi.call_args_list if c[0][0] == 'octives']
+        self.assertEqual(uploads, [('octives', 9), ('octives', 3), ('octives', 9)])
+        self.assertEqual(self.shader.uniformf.call_args_list, [call('zoom', 0.5), call('zoom', 0.25)])
+        self.assertEqual(self.controller.bindings['octives']['default'], 9)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import unittest
+import ctypes
+import pyglet
+from test_base import *
+from test_glsl_numpy import shader_source
+
+# Pull in the compute backend for testing
+from compute import compute_source, set_version, shared_tables, ComputeKernel
+from procviewer import ShaderController
+
+def kernel_main(source):
+    return source.split("\nvoid main()\n{\n", 1)[1]
+
+class TestComputeSource(BaseCase):
+
+    def setUp(self):
+        self.perlin = shader_source('perlin_reference/proc_shader.f.glsl')
+
+    def test_version(self):
+        self.assertEqual(set_version("#version 130\nvoid main() {}"), "#version 430\nvoid main() {}")
+        self.assertEqual(set_version("void main() {}"), "#version 430\nvoid main() {}")
+
+    def test_fragment_builtins_replaced(self):
+        source = compute_source(self.perlin, (16, 4))
+        self.assertTrue(source.startswith("#version 430\nlayout(local_size_x = 16, local_size_y = 4) in;\n"
+                                          "layout(rgba8, binding = 0) writeonly uniform image2D compute_image;\n"))
+        self.assertNotIn("gl_FragCoord", source)
+        self.assertNotIn("gl_FragColor", source)
+        self.assertIn("x + compute_FragCoord[0] * zoom", source)
+        self.assertIn("void compute_main() {", source)
+        self.assertEqual(kernel_main(source), (
+            "  ivec2 compute_texel = ivec2(gl_GlobalInvocationID.xy);\n"
+            "  if (compute_texel.x >= compute_size.x || compute_texel.y >= compute_size.y)\n"
+            "    return;\n"
+            "  compute_FragCoord = vec4(vec2(compute_texel) + 0.5, 0.0, 1.0);\n"
+            "  compute_FragColor = vec4(0.0);\n"
+            "  compute_main();\n"
+            "  imageStore(compute_image, compute_texel, compute_FragColor);\n"
+            "}\n"))
+
+    def test_buffer_target(self):
+        source = compute_source(self.perlin, target='buffer')
+        self.assertIn("buffer ComputePixels { uint compute_pixels[]; };", source)
+        self.assertIn("= packUnorm4x8(compute_FragColor);", source)
+        source = compute_source(self.perlin, target='buffer', pixel_format='RGBA32F')
+        self.assertIn("buffer ComputePixels { vec4 compute_pixels[]; };", source)
+
+    def test_shared_tables(self):
+        source = compute_source(self.perlin, shared=['p'])
+        # The uniform stays for the controller to upload, the code reads the shared copy
+        self.assertIn("uniform int p[512];         // permutation 256\nshared int compute_shared_p[512];", source)
+        self.assertIn("int A    = compute_shared_p[X  ]+Y;", source)
+        body = kernel_main(source)
+        self.assertTrue(body.startswith(
+            "  uint compute_invocations = gl_WorkGroupSize.x * gl_WorkGroupSize.y;\n"
+            "  for (uint i = gl_LocalInvocationIndex; i < uint(512); i += compute_invocations)\n"
+            "    compute_shared_p[i] = p[i];\n"
+            "  barrier();\n"))
+        # Invocations past the edge only leave after the barrier
+        self.assertLess(body.index("barrier()"), body.index("return;"))
+        self.assertEqual(shared_tables({
+            'perm': {'type': 'int', 'default': [0, 1], 'loop': 2, 'seed': 1},
+            'grads': {'type': 'vec2', 'default': [[1.0, 0.0]], 'steps': 2, 'from': 'perm'},
+            'p': {'type': 'int', 'default': [0, 1]},
+            'x': {'type': 'float', 'default': 0.0},
+        }), ['grads', 'perm'])
+
+    def test_unsupported(self):
+        with self.assertRaises(ValueError):
+            compute_source(shader_source('Julia/julia.f.glsl'))
+        with self.assertRaises(ValueError):
+            compute_source(self.perlin, shared=['zoom'])
+        with self.assertRaises(ValueError):
+            compute_source(self.perlin, target='texture')
+
+class TestComputeKernel(BaseCase):
+
+    def setUp(self):
+        self.fragment = "#version 130\nuniform float x = 1.0; // diff 0.5\nuniform float zoom = 0.5;\n" \
+                        "void main() { gl_FragColor = vec4(x + gl_FragCoord[0] * zoom); }\n"
+        self.controller = ShaderController(Mock(vertex_shader="", fragment_shader=self.fragment),
+                                           "blank/blank_shader")
+
+    @patch('compute.have_compute', return_value=True)
+    def test_run(self, have_compute):
+        # shader needs a real GL context to import
+        program = Mock()
+        program.return_value.linked = True
+        gl = Mock(GLuint=ctypes.c_uint)
+        with patch.dict(sys.modules, {'shader': Mock(ComputeShader=program)}), patch.object(pyglet, 'gl', gl):
+            kernel = ComputeKernel(self.fragment, self.controller, 100, 30)
+            with patch.object(self.controller, 'upload_uniform') as upload:
+                kernel.run(10, 0)
+        self.assertIn("layout(local_size_x = 8, local_size_y = 8) in;", program.call_args[0][0])
+        self.assertEqual(gl.glTexStorage2D.call_args[0][3:], (100, 30))
+        shader = program.return_value
+        # Uniforms go straight to the kernel's program, moved for the region as draw_region does
+        upload.assert_any_call('zoom', 0.5, shader)
+        upload.assert_any_call('x', 6.0, shader)
+        shader.uniformi.assert_called_with('compute_size', 100, 30)
+        gl.glDispatchCompute.assert_called_with(13, 4, 1)
+
+    @patch('compute.have_compute', return_value=False)
+    def test_needs_compute(self, have_compute):
+        with patch.dict(sys.modules, {'shader': Mock()}):
+            self.assertRaises(ValueError, ComputeKernel, self.fragment, self.controller, 8, 8)
+
+if __name__ == '__main__':
+    unittest.main()
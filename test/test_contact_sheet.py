@@ -0,0 +1,131 @@
+import unittest
+import os
+import numpy as np
+from test_base import *
+
+# Pull in the contact sheet for testing
+from contact_sheet import (ContactSheet, default_axes, grid_variations, sheet_source, permutation, sweep,
+                           derived_gradients)
+from procviewer import ShaderController, ShaderSource, update_permutation, update_gradients
+from glsl_numpy import compile_fragment, quad_texcoords
+from test_glsl_numpy import shader_source
+
+def bindings():
+    table = {'type': 'int', 'default': [0, 1, 2, 3] * 2, 'loop': 4, 'seed': 5, 'shuffle_key': 101}
+    update_permutation(table)
+    return {
+        'octives': {'type': 'int', 'default': 9, 'diff': 1, 'inc_key': 113, 'dec_key': 97},
+        'freq': {'type': 'float', 'default': 0.5, 'diff': 0.25, 'inc_key': 119, 'dec_key': 115},
+        'p': table,
+    }
+
+class TestVariations(BaseCase):
+
+    def test_sweep(self):
+        self.assertEqual(sweep(bindings()['freq'], 3), [0.25, 0.5, 0.75])
+        self.assertEqual(sweep(bindings()['p'], 2), [5, 6])
+
+    def test_permutation_matches_seed(self):
+        self.assertEqual(permutation(bindings()['p'], 5), bindings()['p']['default'])
+
+    def test_default_axes(self):
+        self.assertEqual(default_axes(bindings()), ('p', 'octives'))
+        self.assertEqual(default_axes({'freq': bindings()['freq']}), ('freq', None))
+        self.assertEqual(default_axes({}), (None, None))
+
+    def test_grid(self):
+        variations = grid_variations(bindings(), 3, 2, 'freq', 'octives')
+        self.assertEqual(variations['freq'], [0.25, 0.5, 0.75] * 2)
+        self.assertEqual(variations['octives'], [8, 8, 8, 9, 9, 9])
+
+class TestContactSheet(BaseCase):
+
+    def setUp(self):
+        self.controller = ShaderController(Mock(vertex_shader="", fragment_shader=""),
+                                           "blank/blank_shader", bindings())
+        self.source = ShaderSource("", "uniform int octives = 9;\nuniform float freq = 0.5;\n"
+                                       "uniform int p[8];\nvoid main() {}\n")
+        variations = grid_variations(self.controller.bindings, 2, 2, 'p', 'freq')
+        self.sheet = ContactSheet(self.controller, self.source, 2, 2, variations, 100, 50)
+
+    def test_cell_at(self):
+        self.assertEqual(self.sheet.cell_at(0, 0), 0)
+        self.assertEqual(self.sheet.cell_at(99, 0), 1)
+        self.assertEqual(self.sheet.cell_at(10, 30), 2)
+        self.assertEqual(self.sheet.cell_at(100, 50), 3)
+
+    def test_adopt(self):
+        self.sheet.adopt(3)
+        self.assertEqual(self.controller.bindings['freq']['default'], 0.5)
+        self.assertEqual(self.controller.bindings['p']['seed'], 6)
+        self.assertEqual(self.controller.bindings['p']['default'], permutation(bindings()['p'], 6))
+        self.sheet.adopt(0)
+        self.assertEqual(self.controller.bindings['freq']['default'], 0.25)
+
+    def test_cells_follow_live_table(self):
+        # Reshuffled by the shuffle key, which keeps the seed
+        binding = self.controller.bindings['p']
+        update_permutation(binding)
+        live = list(binding['default'])
+        variations = grid_variations(self.controller.bindings, 2, 2, 'p', 'freq')
+        sheet = ContactSheet(self.controller, self.source, 2, 2, variations, 100, 50)
+        self.assertEqual(sheet.cell_tables['p'][0], live)
+        reshuffled = dict(binding, seed=6, default=list(live))
+        update_permutation(reshuffled)
+        self.assertEqual(sheet.cell_tables['p'][1], reshuffled['default'])
+        sheet.adopt(1)
+        self.assertEqual(binding['default'], reshuffled['default'])
+        self.assertEqual(binding['seed'], 6)
+
+class TestSheetSource(BaseCase):
+
+    def test_perlin_cells_match_plain_renders(self):
+        plain_source = shader_source('perlin_reference/proc_shader.f.glsl')
+        table = {'type': 'int', 'default': list(range(256)) * 2, 'loop': 256, 'seed': 1}
+        variations = {'p': [1, 2, 3, 4], 'octives': [1, 1, 2, 2]}
+        sheet = compile_fragment(sheet_source(plain_source, 2, 2, variations), np.float64)
+        plain = compile_fragment(plain_source, np.float64)
+        uniforms = {'x': 0.5, 'y': 1.5, 'z': 0.25, 'zoom': 0.1, 'freq': 0.7, 'sheet_window': (16, 16),
+                    'sheet_octives': variations['octives'],
+                    'sheet_p': np.array([permutation(table, seed) for seed in variations['p']])[..., None]}
+        image = sheet.render(16, 16, uniforms)
+        for cell in range(4):
+            row, column = divmod(cell, 2)
+            # Each cell draws the whole view, so it has half the resolution
+            cell_uniforms = dict(uniforms, zoom=0.2, octives=variations['octives'][cell],
+                                 p=permutation(table, variations['p'][cell]))
+            expected = plain.render(8, 8, cell_uniforms)
+            self.assertTrue(np.allclose(image[row * 8:row * 8 + 8, column * 8:column * 8 + 8], expected))
+
+    def test_tile_gradients_follow_cell_tables(self):
+        plain_source = shader_source('tiled/tile_shader.f.glsl')
+        table = {'type': 'int', 'default': list(range(256)) * 2, 'loop': 256, 'seed': 1}
+        grads = {'type': 'vec2', 'default': [[0.0, 0.0]] * 512, 'from': 'perm', 'steps': 256}
+        variations = {'perm': [1, 2, 3, 4]}
+        gradients = derived_gradients({'perm': table, 'grads': grads}, variations)
+        self.assertEqual(gradients, {'grads': ('perm', 256)})
+        sheet = compile_fragment(sheet_source(plain_source, 2, 2, variations, gradients), np.float64)
+        plain = compile_fragment(plain_source, np.float64)
+        uniforms = {'x': 0.5, 'y': 1.5, 'zoom': 0.1, 'sheet_window': (16, 16),
+                    'sheet_perm': np.array([permutation(table, seed) for seed in variations['perm']])[..., None]}
+        image = sheet.render(16, 16, uniforms)
+        for cell in range(4):
+            row, column = divmod(cell, 2)
+            perm = dict(table, default=permutation(table, variations['perm'][cell]))
+            update_gradients(grads, perm)
+            expected = plain.render(8, 8, dict(uniforms, zoom=0.2, perm=perm['default'], grads=grads['default']))
+            self.assertTrue(np.allclose(image[row * 8:row * 8 + 8, column * 8:column * 8 + 8], expected))
+
+    def test_varyings_follow_cells(self):
+        # Julia is placed by its texture coordinates rather than gl_FragCoord
+        plain_source = shader_source('Julia/julia.f.glsl')
+        sheet = compile_fragment(sheet_source(plain_source, 2, 2, {'x': [-0.8, -0.7, -0.6, -0.5]}),
+                                 np.float64)
+        plain = compile_fragment(plain_source, np.float64)
+        image = sheet.render(16, 16, {'sheet_x': [-0.8, -0.7, -0.6, -0.5], 'y': 0.156,
+                                      'sheet_window': (16, 16)}, {'uv': quad_texcoords(16, 16)})
+        expected = plain.render(8, 8, {'x': -0.5, 'y': 0.156}, {'uv': quad_texcoords(8, 8)})
+        self.assertTrue(np.allclose(image[8:, 8:], expected, atol=1e-6, equal_nan=True))
+
+if __name__ == '__main__':
+    unittest.main()
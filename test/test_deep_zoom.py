@@ -0,0 +1,83 @@
+import unittest
+from decimal import Decimal
+from test_base import *
+
+# Pull in the deep zoom file for testing
+from deep_zoom import reference_orbit, series_approximation, digits_for_zoom, exact_value
+
+class TestReferenceOrbit(BaseCase):
+
+    def test_matches_float_iteration(self):
+        orbit = reference_orbit(("0.1", "0.2"), (-0.8, 0.156), 20, 30)
+        z, c = complex(0.1, 0.2), complex(-0.8, 0.156)
+        for point in orbit[:20]:
+            self.assertAlmostEqual(point[0], z.real)
+            self.assertAlmostEqual(point[1], z.imag)
+            z = z * z + c
+
+    def test_escaped_point_kept(self):
+        orbit = reference_orbit(("2", "2"), (0.0, 0.0), 100, 30)
+        self.assertGreaterEqual(len(orbit), 2)
+        self.assertGreater(orbit[-1][0] ** 2 + orbit[-1][1] ** 2, 1e7)
+
+    def test_max_iter(self):
+        orbit = reference_orbit(("0", "0"), (0.0, 0.0), 10, 30)
+        self.assertEqual(len(orbit), 11)
+
+class TestSeriesApproximation(BaseCase):
+
+    def test_skip_matches_perturbation(self):
+        c = (-0.8, 0.156)
+        orbit = reference_orbit(("0.3", "0.1"), c, 200, 30)
+        pixel = 1e-9
+        radius = pixel * 400
+        skip, a, b, c3, d, e = series_approximation(orbit, radius, pixel)
+        self.assertGreater(skip, 0)
+        # Iterate one corner offset directly, d' = 2zd + d^2
+        d0 = complex(radius, 0) * complex(0.6, 0.8)
+        dz = d0
+        for n in range(skip):
+            dz = (2 * complex(*orbit[n]) + dz) * dz
+        approx = a * d0 + b * d0 ** 2 + c3 * d0 ** 3
+        self.assertLess(abs(dz - approx), 1e-3 * abs(a) * pixel)
+
+    def test_derivative_matches_iteration(self):
+        pixel = 1e-6
+        radius = pixel * 400
+        for centre, c in ((("0.3", "0.1"), (-0.8, 0.156)), (("0.05", "-0.2"), (-0.4, 0.6)),
+                          (("-0.1", "0.25"), (0.285, 0.01))):
+            orbit = reference_orbit(centre, c, 200, 30)
+            skip, a, b, c3, d, e = series_approximation(orbit, radius, pixel)
+            self.assertGreater(skip, 0)
+            # Iterate the derivative as the shader does, dZ' = 2ZdZ + 1
+            d0 = complex(radius, 0) * complex(0.6, 0.8)
+            dz, dZ = d0, complex(1)
+            for n in range(skip):
+                dZ = 2 * (complex(*orbit[n]) + dz) * dZ + 1
+                dz = (2 * complex(*orbit[n]) + dz) * dz
+            # The first order term makes it closer than D alone
+            self.assertLess(abs(dZ - (d + e * d0)), 1e-5 * abs(dZ))
+            self.assertLess(abs(dZ - (d + e * d0)), 0.01 * abs(dZ - d))
+
+    def test_wide_view_skips_little(self):
+        orbit = reference_orbit(("0.3", "0.1"), (-0.8, 0.156), 200, 30)
+        shallow = series_approximation(orbit, 2.0, 0.01)[0]
+        deep = series_approximation(orbit, 1e-10, 1e-12)[0]
+        self.assertLess(shallow, deep)
+
+class TestPrecision(BaseCase):
+
+    def test_digits_grow_with_zoom(self):
+        self.assertEqual(digits_for_zoom(0.01), 20)
+        self.assertGreater(digits_for_zoom(1e-30), 30)
+
+    def test_exact_value(self):
+        self.assertEqual(exact_value(None), Decimal(0))
+        self.assertEqual(exact_value({'default': 0.5}), Decimal("0.5"))
+        exact = "0.1000000000000000000000001"
+        self.assertEqual(exact_value({'default': float(exact), 'exact': exact}), Decimal(exact))
+        # A key binding changed the float, so the exact value is stale
+        self.assertEqual(exact_value({'default': 0.2, 'exact': exact}), Decimal("0.2"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+from test_base import *
+from test_glsl_numpy import shader_source
+
+# Pull in the fragment rewrites for testing
+from fragment_build import FragmentOptions, build_fragment
+from procviewer import ShaderController
+from noise_volume import NoiseVolume
+from glsl_numpy import compile_fragment
+
+def controller_for(path):
+    fragment = shader_source(path)
+    return fragment, ShaderController(Mock(vertex_shader="", fragment_shader=fragment), "blank/blank_shader")
+
+class TestBuildFragment(BaseCase):
+
+    def setUp(self):
+        self.fragment, self.controller = controller_for('spike/working_shader.f.glsl')
+
+    def build(self, block=None, keep_tables=False, **options):
+        return build_fragment(self.controller, self.fragment, FragmentOptions(**options), block, keep_tables)
+
+    def test_nothing_asked(self):
+        built = self.build()
+        self.assertEqual(built.fragment, self.fragment)
+        self.assertIsNone(built.noise_volume)
+        self.assertEqual(built.hashed, ())
+        self.assertEqual(built.skipped, [])
+
+    def test_every_rewrite_in_order(self):
+        built = self.build(z_search=True, basis='simplex', hash_tables=True, optimize=True)
+        self.assertEqual(built.skipped, [])
+        self.assertEqual(built.hashed, ('p',))
+        # The basis reads p before it's hashed, and the optimiser keeps what both call
+        self.assertNotIn('p[', built.fragment)
+        self.assertIn('simplex3(', built.fragment)
+        self.assertIn('hash_permute(hash_p, ', built.fragment)
+        # The optimiser reads the z search define, so only that path is left
+        self.assertIn('shortfall(', built.fragment)
+        self.assertNotIn('#define', built.fragment)
+        compile_fragment(built.fragment)
+
+    def test_volume_before_hash(self):
+        built = self.build(noise_volume=True, hash_tables=True)
+        self.assertIsInstance(built.noise_volume, NoiseVolume)
+        self.assertIn("textureLod(noise_volume, ", built.fragment)
+        self.assertEqual(built.hashed, ('p',))
+        self.assertNotIn('p[', built.fragment)
+
+    def test_volume_skipped_for_other_bases(self):
+        built = self.build(basis='simplex', noise_volume=True)
+        self.assertIsNone(built.noise_volume)
+        self.assertIn('simplex3(', built.fragment)
+        self.assertEqual(built.skipped, ["no noise volume, it holds the perlin basis rather than simplex"])
+
+    def test_hash_skipped_for_tables_read_elsewhere(self):
+        built = self.build(hash_tables=True, keep_tables=True)
+        self.assertEqual(built.fragment, self.fragment)
+        self.assertEqual(built.hashed, ())
+        self.assertEqual(len(built.skipped), 1)
+
+    def test_unsuited_rewrites_skipped(self):
+        # The bases and the volume read a table named p, the tile shader's is perm
+        self.fragment, self.controller = controller_for('tiled/tile_shader.f.glsl')
+        built = self.build(basis='simplex', noise_volume=True, hash_tables=True)
+        self.assertEqual(built.skipped[0], "keeping the perlin basis: no permutation table p declared")
+        self.assertTrue(built.skipped[1].startswith("no noise volume: "))
+        self.assertEqual(built.hashed, ('perm',))
+        built = build_fragment(self.controller, "#version 130\nvoid main() { @ }\n", FragmentOptions(optimize=True))
+        self.assertTrue(built.skipped[0].startswith("not optimising: "))
+
+    def test_optimiser_passes(self):
+        everything = self.build(optimize=('fold', 'cse', 'dead')).fragment
+        self.assertIn('_cse', everything)
+        self.assertNotIn('_cse', self.build(optimize=True).fragment)
+
+    def test_block_last(self):
+        block = self.controller.create_uniform_block()
+        built = self.build(block=block, hash_tables=True, optimize=True)
+        lines = built.fragment.split('\n')
+        self.assertEqual(lines[1], "#extension GL_ARB_uniform_buffer_object : enable")
+        self.assertIn("uniform ProcBindings {", built.fragment)
+        self.assertNotIn("uniform float zoom", built.fragment)
+
+if __name__ == '__main__':
+    unittest.main()
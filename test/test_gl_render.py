@@ -0,0 +1,119 @@
+import unittest
+import glob
+import tempfile
+import multiprocessing
+import numpy as np
+from test_base import *
+
+# Renders that need a real GL context. Each one runs in a fresh process, as pyglet
+# has to be told it's headless before pyglet.gl is first imported.
+
+def _headless_gl():
+    import pyglet
+    pyglet.options['headless'] = True
+    from pyglet import gl
+    return gl
+
+def _can_draw():
+    '''Whether this process can make a headless context and draw the viewer's quad'''
+    try:
+        gl = _headless_gl()
+        from offscreen import headless_context
+        headless_context().close()
+    except Exception:
+        return False
+    # draw_quad is fixed function, which newer pyglets don't wrap
+    return hasattr(gl, 'glMatrixMode')
+
+def _render_window(shader_path, size, uniform_block):
+    '''Draw one frame of a hidden viewer window and return its pixels'''
+    _headless_gl()
+    from texture_window import TextureWindow
+    from readback import read_pixels, readback_array
+    window = TextureWindow(shader_path, uniform_block=uniform_block, width=size, height=size,
+                           visible=False)
+    window.switch_to()
+    window.drawGenerated()
+    pixels = read_pixels(readback_array(size, size))
+    window.close()
+    return pixels
+
+def _render_single(shader_path, size):
+    '''Draw the whole view in one pass on a fresh context, the way the farm draws a tile'''
+    _headless_gl()
+    from offscreen import headless_context, Framebuffer, draw_region
+    from procviewer import ShaderController, read_shader_files
+    from shader import Shader
+    context = headless_context()
+    shader = Shader(*read_shader_files(shader_path))
+    controller = ShaderController(shader, shader_path)
+    framebuffer = Framebuffer(size, size)
+    framebuffer.bind()
+    draw_region(shader, controller, 0, 0, size, size)
+    pixels = framebuffer.read_pixels()
+    framebuffer.unbind()
+    context.close()
+    return bytes(pixels)
+
+_drawable = []
+
+def in_process(function, *args):
+    '''Call function in a fresh spawned process and return what it returns'''
+    pool = multiprocessing.get_context('spawn').Pool(1)
+    try:
+        return pool.apply(function, args)
+    finally:
+        pool.close()
+        pool.join()
+
+class GLCase(BaseCase):
+    '''Skips when there's no headless GL here, and removes the bindings files rendering writes'''
+
+    def setUp(self):
+        if not _drawable:
+            _drawable.append(in_process(_can_draw))
+        if not _drawable[0]:
+            self.skipTest("no headless GL context with fixed function drawing")
+        self.bindings_files = set(glob.glob('../*/*.bindings.json'))
+
+    def tearDown(self):
+        super(GLCase, self).tearDown()
+        for path in set(glob.glob('../*/*.bindings.json')) - self.bindings_files:
+            os.remove(path)
+
+    def assertSameImage(self, first, second):
+        difference = np.abs(first.astype(int) - second.astype(int))
+        self.assertLessEqual(difference.max(), 1, "mean difference {}".format(difference.mean()))
+
+class TestUniformBlockRender(GLCase):
+
+    def test_block_draws_the_same(self):
+        # The block is bound in the window's context, not pyglet's shadow context
+        shader = '../perlin_reference/proc_shader'
+        self.assertSameImage(in_process(_render_window, shader, 64, True),
+                             in_process(_render_window, shader, 64, False))
+
+class TestRenderFarm(GLCase):
+
+    def setUp(self):
+        super(TestRenderFarm, self).setUp()
+        handle, self.raw_path = tempfile.mkstemp(suffix=".rgba")
+        os.close(handle)
+
+    def tearDown(self):
+        super(TestRenderFarm, self).tearDown()
+        os.remove(self.raw_path)
+
+    def test_tiles_match_single_pass(self):
+        # Julia places itself by uv, so every worker's first tile has to get the quad's
+        # texture coordinates as well as the tiles after it
+        from render_farm import render_tiled
+        shader = '../Julia/julia'
+        single = np.frombuffer(in_process(_render_single, shader, 64), np.uint8)
+        render_tiled(shader, 64, 64, self.raw_path, processes=2, tile_size=16, progress=None)
+        with open(self.raw_path, 'rb') as raw_file:
+            tiled = np.frombuffer(raw_file.read(), np.uint8)
+        self.assertSameImage(tiled, single)
+
+if __name__ == '__main__':
+    unittest.main()
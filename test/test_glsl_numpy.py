@@ -0,0 +1,188 @@
+import unittest
+import os
+import math
+import random
+import numpy as np
+from test_base import *
+
+# Pull in the GLSL to NumPy compiler for testing
+from glsl_numpy import GLSLError, compile_fragment, preprocess, quad_texcoords, to_rgba8
+from julia_cpu import render_julia, escape_time, julia_colour
+from deep_zoom import reference_orbit
+
+def shader_source(path):
+    with open(os.path.join('..', path)) as source_file:
+        return source_file.read()
+
+def run(source, width=4, height=1, **uniforms):
+    return compile_fragment(source).render(width, height, uniforms)
+
+def python_noise(p, x, y, z):
+    '''Straight port of the reference Perlin noise in perlin_reference/proc_shader'''
+    def fade(t):
+        return t * t * t * (t * (t * 6 - 15) + 10)
+
+    def lerp(t, a, b):
+        return a + t * (b - a)
+
+    def grad(hsh, x, y, z):
+        h = hsh & 15
+        u = x if h < 8 else y
+        v = y if h < 4 else (x if h in (12, 14) else z)
+        return (u if h & 1 == 0 else -u) + (v if h & 2 == 0 else -v)
+
+    X, Y, Z = int(math.floor(x)) & 255, int(math.floor(y)) & 255, int(math.floor(z)) & 255
+    x, y, z = x - math.floor(x), y - math.floor(y), z - math.floor(z)
+    u, v, w = fade(x), fade(y), fade(z)
+    A = p[X] + Y
+    AA, AB = p[A] + Z, p[A + 1] + Z
+    B = p[X + 1] + Y
+    BA, BB = p[B] + Z, p[B + 1] + Z
+    return lerp(w, lerp(v, lerp(u, grad(p[AA], x, y, z), grad(p[BA], x - 1, y, z)),
+                           lerp(u, grad(p[AB], x, y - 1, z), grad(p[BB], x - 1, y - 1, z))),
+                   lerp(v, lerp(u, grad(p[AA + 1], x, y, z - 1), grad(p[BA + 1], x - 1, y, z - 1)),
+                           lerp(u, grad(p[AB + 1], x, y - 1, z - 1), grad(p[BB + 1], x - 1, y - 1, z - 1))))
+
+class TestPreprocess(BaseCase):
+
+    def test_defines_and_conditionals(self):
+        tokens = preprocess(
+            "#version 130\n#define size 4.0\n#ifdef size\nsize\n#else\nmissing\n#endif\n"
+            "#ifndef size\nmissing\n#endif\n")
+        self.assertEqual([t.text for t in tokens], ['4.0'])
+        self.assertEqual(tokens[0].line, 4)
+
+    def test_function_macros_rejected(self):
+        with self.assertRaises(GLSLError):
+            preprocess("#define twice(a) (a * 2)\n")
+
+class TestSemantics(BaseCase):
+
+    def test_integer_arithmetic(self):
+        color = run("""
+            void main() {
+              int a = -7;
+              gl_FragColor = vec4(float(a / 2), float(a % 2), float(1 << 4 | 3), float(-a >> 1));
+            }""")
+        self.assertEqual(color[0, 0].tolist(), [-3.0, -1.0, 19.0, 3.0])
+
+    def test_conversions_and_swizzles(self):
+        color = run("""
+            void main() {
+              float f = 0;
+              vec4 v = vec4(vec2(1.5, -2.5), 3, 0);
+              v.zw = v.yx;
+              f = v[3] + float(int(-2.7));
+              gl_FragColor = vec4(v.xyz, f);
+            }""")
+        self.assertEqual(color[0, 0].tolist(), [1.5, -2.5, -2.5, -0.5])
+
+    def test_divergent_loop(self):
+        # Each pixel breaks out of the loop after a different number of iterations
+        color = run("""
+            void main() {
+              int count = 0;
+              int limit = int(gl_FragCoord.x);
+              for (int i = 0; i < 10; ++i) {
+                if (i == 2)
+                  continue;
+                if (count >= limit)
+                  break;
+                count++;
+              }
+              int steps = 0;
+              do { steps += 1; } while (steps < limit);
+              gl_FragColor = vec4(float(count), float(steps), 0.0, 1.0);
+            }""", width=5)
+        self.assertEqual(color[0, :, 0].tolist(), [0.0, 1.0, 2.0, 3.0, 4.0])
+        self.assertEqual(color[0, :, 1].tolist(), [1.0, 1.0, 2.0, 3.0, 4.0])
+
+    def test_early_return(self):
+        color = run("""
+            uniform float edge = 2.0;
+            float side(float x) {
+              if (x < edge)
+                return -1.0;
+              return 1.0;
+            }
+            void main() {
+              gl_FragColor = vec4(side(gl_FragCoord.x), 0.0, 0.0, 1.0);
+              if (gl_FragCoord.x > 3.0)
+                return;
+              gl_FragColor.g = 1.0;
+            }""", edge=1.0)
+        self.assertEqual(color[0, :, 0].tolist(), [-1.0, 1.0, 1.0, 1.0])
+        self.assertEqual(color[0, :, 1].tolist(), [1.0, 1.0, 1.0, 0.0])
+
+    def test_uniform_arrays_clamp(self):
+        color = run("""
+            uniform int p[3];
+            void main() {
+              int i = int(gl_FragCoord.x) - 1;
+              gl_FragColor = vec4(float(p[i]), 0.0, 0.0, 1.0);
+            }""", p=[5, 6, 7])
+        self.assertEqual(color[0, :, 0].tolist(), [5.0, 5.0, 6.0, 7.0])
+
+    def test_derivatives(self):
+        # Derivatives are shared by each 2x2 quad, as on the GPU
+        color = run("""
+            void main() {
+              float f = gl_FragCoord.x * gl_FragCoord.x + 3.0 * gl_FragCoord.y;
+              gl_FragColor = vec4(dFdx(f), dFdy(f), fwidth(f), 1.0);
+            }""", width=4, height=2)
+        self.assertEqual(color[0, :, 0].tolist(), [2.0, 2.0, 6.0, 6.0])
+        self.assertEqual(color[1, :, 1].tolist(), [3.0, 3.0, 3.0, 3.0])
+        self.assertEqual(color[0, :, 2].tolist(), [5.0, 5.0, 9.0, 9.0])
+
+    def test_unsupported_source(self):
+        with self.assertRaises(GLSLError):
+            compile_fragment("struct S { float a; }; void main() {}")
+        with self.assertRaises(GLSLError):
+            compile_fragment("void main() { gl_FragColor = vec4(undeclared); }")
+
+class TestProjectShaders(BaseCase):
+
+    def test_julia_matches_cpu_renderer(self):
+        program = compile_fragment(shader_source('Julia/julia.f.glsl'))
+        c = (-1.373, 0.0045)
+        color = program.render(12, 10, {'x': c[0], 'y': c[1]}, {'uv': quad_texcoords(12, 10)})
+        expected = render_julia(12, 10, c, processes=1)
+        self.assertLessEqual(np.abs(to_rgba8(color).astype(int) - expected).max(), 1)
+
+    def test_perlin_matches_python(self):
+        program = compile_fragment(shader_source('perlin_reference/proc_shader.f.glsl'),
+                                   float_dtype=np.float64)
+        perm = list(range(256))
+        random.Random(3).shuffle(perm)
+        uniforms = {'p': perm * 2, 'octives': 1, 'freq': 1.0, 'x': 0.3, 'y': 1.7, 'z': 0.4,
+                    'zoom': 0.37}
+        color = program.render(6, 5, uniforms, profile=True)
+        for row in range(5):
+            for column in range(6):
+                noise = python_noise(perm * 2, 0.3 + (column + 0.5) * 0.37,
+                                     1.7 + (row + 0.5) * 0.37, 0.4)
+                self.assertAlmostEqual(color[row, column, 0], noise * 0.5 + 0.5, places=9)
+        # One noise evaluation per pixel with a single octave
+        self.assertEqual(program.profile['getHash'][:2], [1, 30])
+
+    def test_deep_zoom_perturbation(self):
+        program = compile_fragment(shader_source('Julia/julia_deep.f.glsl'), float_dtype=np.float64)
+        width, height, zoom, c = 16, 16, 0.25, (-0.8, 0.156)
+        orbit = reference_orbit((0, 0), c, 64, 30)
+        texture = np.zeros((1, 1024, 2))
+        texture[0, :len(orbit)] = orbit
+        uniforms = {'orbit': texture, 'orbit_info': (len(orbit), 0, width / 2.0, height / 2.0),
+                    'series_ab': (1, 0, 0, 0), 'series_cd': (0, 0, 1, 0), 'series_e': (0, 0),
+                    'x': c[0], 'y': c[1], 'zoom': zoom, 'max_iter_count': 64}
+        color = to_rgba8(program.render(width, height, uniforms))
+
+        # The same pixels iterated directly, with the colouring scaled as the shader does
+        fx = (np.arange(width) + 0.5 - width / 2.0) * zoom
+        fy = (np.arange(height) + 0.5 - height / 2.0) * zoom
+        sqr_z, sqr_dz = escape_time(np.tile(fx, height), np.repeat(fy, width), c, 64)
+        expected = julia_colour(sqr_z, sqr_dz * (zoom / 0.0078125) ** 2).reshape(height, width, 4)
+        # Only green carries the estimate, interior pixels mix with NaN which GL leaves undefined
+        self.assertLessEqual(np.abs(color[..., 1].astype(int) - expected[..., 1]).max(), 1)
+
+if __name__ == '__main__':
+    unittest.main()
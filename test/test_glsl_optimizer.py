@@ -0,0 +1,164 @@
+import unittest
+import random
+import numpy as np
+from test_base import *
+from test_glsl_numpy import shader_source
+
+# Pull in the optimiser for testing
+from glsl_optimizer import optimize_source, emit_expr, DEFAULT_PASSES, COMPARE_UNIFORMS
+from glsl_numpy import GLSLError, compile_fragment, quad_texcoords, to_rgba8, parse
+from procviewer import update_gradients
+
+def main_body(source):
+    '''The optimised statements of main, one per line'''
+    text = source.split("void main()\n{\n", 1)[1]
+    return [line.strip() for line in text.split("\n}\n", 1)[0].splitlines()]
+
+def expression(text):
+    return parse("void main() { " + text + "; }")[0].body.body[0].expr
+
+class TestPrinting(BaseCase):
+
+    def test_brackets_follow_precedence(self):
+        for text in ("(a + b) * c", "a - (b - c)", "a * b + c", "-(a + b)", "- -a",
+                     "a < b == (c == d)", "t ? a : b ? c : d", "v.xy[1]", "f(a, b = c)"):
+            self.assertEqual(emit_expr(expression(text)), text)
+
+    def test_float_literals_keep_a_point(self):
+        self.assertEqual(emit_expr(expression("1.")), "1.0")
+        self.assertEqual(emit_expr(expression("1e7")), "10000000.0")
+        self.assertEqual(emit_expr(expression("1e-5")), "1e-05")
+
+class TestFolding(BaseCase):
+
+    def fold(self, text, declarations="uniform float a;\nuniform int i;\n"):
+        source = "#version 130\n" + declarations + "void main() { gl_FragColor = vec4(" + text + "); }\n"
+        return main_body(optimize_source(source, ['fold']))[0]
+
+    def test_constants(self):
+        self.assertEqual(self.fold("2.0 * 3.0 + 1.0"), "gl_FragColor = vec4(7.0);")
+        self.assertEqual(self.fold("float(-7 / 2) + float(1 << 4)"), "gl_FragColor = vec4(13.0);")
+        self.assertEqual(self.fold("float(true && !false)"), "gl_FragColor = vec4(1.0);")
+        self.assertEqual(self.fold("2.0 > 1.0 ? 1.0 : a"), "gl_FragColor = vec4(1.0);")
+        # Nothing that isn't finite is folded
+        self.assertEqual(self.fold("1.0 / 0.0"), "gl_FragColor = vec4(1.0 / 0.0);")
+
+    def test_multiply_chains(self):
+        self.assertEqual(self.fold("a * 2.0 * 3.14159 / 256.0"),
+                         "gl_FragColor = vec4(a * {!r});".format(float(np.float32(2.0) * np.float32(3.14159)
+                                                                       / np.float32(256.0))))
+        self.assertEqual(self.fold("a / 2.0 / 4.0"), "gl_FragColor = vec4(a / 8.0);")
+        # Integer division doesn't reassociate
+        self.assertEqual(self.fold("float(i * 3 / 2)"), "gl_FragColor = vec4(float(i * 3 / 2));")
+
+    def test_identities_keep_types(self):
+        self.assertEqual(self.fold("a * 1.0 + 0.0"), "gl_FragColor = vec4(a);")
+        self.assertEqual(self.fold("i + 0.0"), "gl_FragColor = vec4(i + 0.0);")
+
+    def test_pow_expansion(self):
+        self.assertEqual(self.fold("pow(a, 3.0)"), "gl_FragColor = vec4(a * a * a);")
+        self.assertEqual(self.fold("pow(a, 1.0)"), "gl_FragColor = vec4(a);")
+        self.assertEqual(self.fold("pow(a, 2.5) + pow(a, 12.0)"),
+                         "gl_FragColor = vec4(pow(a, 2.5) + pow(a, 12.0));")
+
+class TestCommonSubexpressions(BaseCase):
+
+    def optimize(self, body, declarations="uniform float a;\nuniform float b;\n"):
+        source = "#version 130\n" + declarations + "void main() {\n" + body + "\n}\n"
+        return main_body(optimize_source(source, ['cse']))
+
+    def test_repeats_share_a_temporary(self):
+        self.assertEqual(self.optimize("float c = (a + b) * a;\n gl_FragColor = vec4(c, (a + b) * a, 0.0, 1.0);"), [
+            "float _cse0 = (a + b) * a;",
+            "float c = _cse0;",
+            "gl_FragColor = vec4(c, _cse0, 0.0, 1.0);",
+        ])
+
+    def test_writes_end_sharing(self):
+        lines = self.optimize("float c = a + 1.0;\n c = c * 2.0 + (a + 1.0);\n c += a + 1.0;\n"
+                              "gl_FragColor = vec4(c + (a + 1.0));")
+        self.assertEqual(lines[0], "float _cse0 = a + 1.0;")
+        self.assertEqual(lines[-1], "gl_FragColor = vec4(c + _cse0);")
+        lines = self.optimize("float c = a * b;\n c = c * b;\n gl_FragColor = vec4(c * b);")
+        # c * b reads c, which the statement between writes
+        self.assertEqual(lines, ["float c = a * b;", "c = c * b;", "gl_FragColor = vec4(c * b);"])
+
+    def test_calls_and_branches_are_barriers(self):
+        declarations = "uniform float a;\nfloat g;\nvoid bump() { g += 1.0; }\n"
+        lines = self.optimize("g = a;\n float c = g * a;\n bump();\n gl_FragColor = vec4(c, g * a, 0.0, 1.0);",
+                              declarations)
+        self.assertNotIn("_cse", "\n".join(lines))
+        # Only evaluated on one side of the condition
+        lines = self.optimize("gl_FragColor = vec4(a > 0.0 ? sqrt(a) : 0.0, a > 1.0 ? sqrt(a) : 1.0, 0.0, 1.0);")
+        self.assertNotIn("_cse", "\n".join(lines))
+
+class TestDeadCode(BaseCase):
+
+    def test_dead_code_stripped(self):
+        source = (
+            "#version 130\n"
+            "uniform float unused_uniform;\n"
+            "float unused_global = 2.0;\n"
+            "float unused(float v) { return v; }\n"
+            "float used(float v) { return v * 2.0; return v; }\n"
+            "void main() {\n"
+            "  float spare = 3.0;\n"
+            "  if (false) { gl_FragColor = vec4(0.0); return; }\n"
+            "  gl_FragColor = vec4(used(0.25));\n"
+            "  return;\n"
+            "  gl_FragColor = vec4(1.0);\n"
+            "}\n")
+        optimized = optimize_source(source, ['dead'])
+        self.assertEqual(optimized, "#version 130\nuniform float unused_uniform;\n"
+                                    "float used(float v)\n{\n  return v * 2.0;\n}\n\n"
+                                    "void main()\n{\n  gl_FragColor = vec4(used(0.25));\n  return;\n}\n")
+
+    def test_unsupported_source(self):
+        with self.assertRaises(GLSLError):
+            optimize_source("#version 130\nstruct S { float a; };\nvoid main() {}\n")
+
+class TestProjectShaders(BaseCase):
+
+    def assertSamePixels(self, path, width=16, height=16, passes=None, **uniforms):
+        '''The optimised shader renders the same RGBA bytes through the NumPy harness'''
+        source = shader_source(path)
+        optimized = optimize_source(source, passes)
+        images = []
+        for fragment in (source, optimized):
+            program = compile_fragment(fragment)
+            varyings = dict((name, quad_texcoords(width, height)) for name in program.varyings)
+            images.append(to_rgba8(program.render(width, height, uniforms, varyings)))
+        self.assertTrue(np.array_equal(images[0], images[1]))
+        # A solid fill would match whatever the optimiser did to the rest
+        self.assertGreater(len(np.unique(images[0].reshape(-1, 4), axis=0)), 1)
+        return optimized
+
+    def permutation(self):
+        table = list(range(256))
+        random.Random(7).shuffle(table)
+        return table * 2
+
+    def test_noise_shaders(self):
+        perlin = self.assertSamePixels('perlin_reference/proc_shader.f.glsl', p=self.permutation(), octives=3)
+        # The octave scale is worked out once for its three uses
+        self.assertIn("float _cse0 = float(1 << oct);", perlin)
+        grads = {'steps': 256, 'default': [None] * 512}
+        update_gradients(grads, {'default': self.permutation()})
+        # Inside the tile's bounds, the default view is all border
+        tile = dict(COMPARE_UNIFORMS['tiled/tile_shader'], perm=self.permutation(), grads=grads['default'])
+        self.assertSamePixels('tiled/tile_shader.f.glsl', **tile)
+        self.assertSamePixels('tiled/tile_shader.f.glsl', passes=DEFAULT_PASSES, **tile)
+        # Zoomed out, so the grid lines and blobs fall in the few pixels drawn
+        self.assertSamePixels('scrappy_grid/scrap_grid.f.glsl', p=self.permutation(), zoom=0.2, threshold=0.5)
+        self.assertSamePixels('blobs/blobs_shader.f.glsl', p=self.permutation(), zoom=0.2)
+        self.assertSamePixels('spike/working_shader.f.glsl', 8, 8, p=self.permutation(), octives=2)
+
+    def test_julia(self):
+        julia = self.assertSamePixels('Julia/julia.f.glsl', max_iter_count=64)
+        self.assertIn("sqr_Z = vec2(_cse0, _cse1);", julia)
+        # The viewer's passes leave out the temporaries
+        julia = self.assertSamePixels('Julia/julia.f.glsl', passes=DEFAULT_PASSES, max_iter_count=64)
+        self.assertNotIn("_cse", julia)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+from test_base import *
+
+# Pull in the GLSL source rewriting helpers for testing
+from glsl_source import (find_uniform, replace_uniform, insert_after_header, insert_at_main_start,
+                         replace_identifier, replace_indexing, varyings)
+
+SOURCE = """#version 130
+#extension GL_EXT_gpu_shader4 : enable
+uniform int p[512];         // permutation 256
+ uniform float zoom  = 0.02; // diff 0.0005
+varying vec2 uv;
+void main() {
+  gl_FragColor = vec4(float(p[p[1] + 2]), zoom, uv);
+}
+"""
+
+class TestUniforms(BaseCase):
+
+    def test_find_uniform(self):
+        match = find_uniform(SOURCE, 'zoom')
+        self.assertEqual(match.group('type'), 'float')
+        self.assertEqual(match.group('default').strip(), '0.02')
+        self.assertEqual(find_uniform(SOURCE, 'p').group('size'), '512')
+        self.assertIsNone(find_uniform(SOURCE, 'zoo'))
+
+    def test_replace_uniform(self):
+        source = replace_uniform(SOURCE, 'zoom', 'float zoom;')
+        self.assertIn("\n float zoom;\nvarying", source)
+        with self.assertRaises(ValueError):
+            replace_uniform(SOURCE, 'missing')
+
+class TestRewrites(BaseCase):
+
+    def test_header_and_main(self):
+        source = insert_after_header(SOURCE, "int added;\n")
+        self.assertIn("enable\nint added;\nuniform int p", source)
+        source = insert_at_main_start(SOURCE, "  int first;")
+        self.assertIn("void main() {\n  int first;\n  gl_FragColor", source)
+
+    def test_identifiers(self):
+        source = replace_identifier("uv + uv2 + a.uv + uv", 'uv', 'st')
+        self.assertEqual(source, "st + uv2 + a.uv + st")
+
+    def test_nested_indexing(self):
+        source = replace_indexing(SOURCE, 'p', lambda index: "table({})".format(index))
+        self.assertIn("float(table(table(1) + 2))", source)
+        self.assertIn("uniform int p[512]", SOURCE)
+
+    def test_varyings(self):
+        self.assertEqual(varyings(SOURCE), [('vec2', 'uv')])
+
+if __name__ == '__main__':
+    unittest.main()
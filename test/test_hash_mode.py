@@ -0,0 +1,98 @@
+import unittest
+import random
+import numpy as np
+from test_base import *
+from test_glsl_numpy import shader_source
+
+# Pull in the hash mode for testing
+from hash_mode import (hash_source, hashed_program, hashed_tables, table_key, permute, quality, avalanche,
+                       HASH_FUNCTIONS)
+from procviewer import ShaderController, update_permutation
+from glsl_numpy import compile_fragment
+
+def controller_for(path):
+    fragment = shader_source(path)
+    return fragment, ShaderController(Mock(vertex_shader="", fragment_shader=fragment), "blank/blank_shader")
+
+class TestHashSource(BaseCase):
+
+    def test_tables_replaced(self):
+        fragment, controller = controller_for('perlin_reference/proc_shader.f.glsl')
+        self.assertEqual(hashed_tables(controller.bindings, fragment), ['p'])
+        source = hash_source(fragment, controller.bindings)
+        self.assertNotIn('p[', source)
+        self.assertIn('uniform int hash_p;', source)
+        self.assertIn('int A    = hash_permute(hash_p, X, 256)+Y;', source)
+
+    def test_gradients_replaced(self):
+        fragment, controller = controller_for('tiled/tile_shader.f.glsl')
+        source = hash_source(fragment, controller.bindings)
+        self.assertNotIn('grads', source.replace('// grads', ''))
+        self.assertIn('hash_gradient(hash_permute(hash_perm, hash_permute(hash_perm, ', source)
+
+    def test_no_tables(self):
+        self.assertRaises(ValueError, hash_source, "#version 130\nuniform float x;\nvoid main() {}\n", {})
+
+class TestHashedNoise(BaseCase):
+
+    def setUp(self):
+        self.fragment, self.controller = controller_for('perlin_reference/proc_shader.f.glsl')
+        self.uniforms = {'octives': 4, 'zoom': 0.05}
+
+    def render(self, fragment, **uniforms):
+        return compile_fragment(fragment).render(32, 24, dict(self.uniforms, **uniforms))[..., 0]
+
+    def test_permute_matches_glsl(self):
+        source = ("#version 130\n" + HASH_FUNCTIONS + "uniform int key;\nvoid main() {\n"
+                  "  gl_FragColor = vec4(float(hash_permute(key, int(gl_FragCoord[0]) - 8, 256)), 0.0, 0.0, 1.0);\n}\n")
+        rendered = compile_fragment(source).render(40, 1, {'key': -123456789})
+        np.testing.assert_array_equal(rendered[0, :, 0], permute(-123456789, np.arange(40) - 8, 256))
+
+    def test_noise_like_the_tables(self):
+        table = self.controller.bindings['p']['default']
+        direct = self.render(self.fragment, p=table)
+        hashed = self.render(hash_source(self.fragment, self.controller.bindings), hash_p=table_key(table))
+        self.assertTrue(((hashed >= 0.0) & (hashed <= 1.0)).all())
+        self.assertAlmostEqual(hashed.std() / direct.std(), 1.0, delta=0.3)
+
+    def test_reshuffle_changes_key(self):
+        binding = self.controller.bindings['p']
+        before = table_key(binding['default'])
+        update_permutation(binding)
+        self.assertNotEqual(table_key(binding['default']), before)
+        hashed = hash_source(self.fragment, self.controller.bindings)
+        self.assertFalse(np.array_equal(self.render(hashed, hash_p=before),
+                                        self.render(hashed, hash_p=table_key(binding['default']))))
+
+class TestHashUploads(BaseCase):
+
+    def test_keys_uploaded(self):
+        fragment, controller = controller_for('tiled/tile_shader.f.glsl')
+        program = Mock()
+        self.assertIs(hashed_program(controller, program, ['perm']), program)
+        table = controller.bindings['perm']['default']
+        controller.upload_uniform('perm', table, program)
+        controller.upload_uniform('grads', controller.bindings['grads']['default'], program)
+        program.uniformi.assert_called_once_with('hash_perm', table_key(table))
+        self.assertEqual(program.uniform_vectorsf.call_count, 0)
+        # Programs reading the tables still get them
+        other = Mock()
+        controller.upload_uniform('perm', table, other)
+        other.uniformi.assert_called_once_with('perm', *table)
+
+class TestQuality(BaseCase):
+
+    def test_shuffle_and_hash(self):
+        table = list(range(256))
+        random.Random(5).shuffle(table)
+        shuffled = quality(table, 256)
+        self.assertEqual(shuffled['coverage'], 1.0)
+        self.assertEqual(shuffled['gradients'], 0.0)
+        hashed = quality(permute(table_key(table), np.arange(256), 256), 256)
+        self.assertGreater(hashed['coverage'], 0.55)
+        self.assertLess(abs(hashed['serial']), 0.2)
+        self.assertLess(hashed['gradients'], 2.5)
+        self.assertAlmostEqual(avalanche(), 0.5, delta=0.01)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import unittest
+import struct
+import tempfile
+import zlib
+import numpy as np
+import pyglet
+from test_base import *
+from test_png_writer import read_chunks
+from test_glsl_numpy import shader_source
+
+# Pull in the heightmap export for testing
+import offscreen
+import readback
+from heightmap import heightmap_source, split_bands, open_heightmap, render_heightmap
+from glsl_numpy import compile_fragment
+
+class TestHeightmapSource(BaseCase):
+
+    def test_define_after_version(self):
+        source = heightmap_source("#version 130\nvoid main() {}\n")
+        self.assertEqual(source, "#version 130\n#define HEIGHTMAP\nvoid main() {}\n")
+
+    def test_scrappy_height_is_continuous(self):
+        # The colour path thresholds the noise to 0 or 1, the height path keeps it
+        source = shader_source('scrappy_grid/scrap_grid.f.glsl')
+        uniforms = {'p': list(range(256)) * 2, 'x': 0.3, 'y': 0.7, 'z': 0.5, 'zoom': 0.05,
+                    'freq': 0.5, 'octives': 4, 'grid': 1.0, 'gridWeigth': 0.1, 'threshold': 0.5}
+        colour = compile_fragment(source).render(8, 8, uniforms)
+        height = compile_fragment(heightmap_source(source)).render(8, 8, uniforms)
+        self.assertEqual(set(np.unique(colour[..., 0])) - {0.0, 1.0}, set())
+        self.assertGreater(len(np.unique(height[..., 0])), 32)
+
+class TestBands(BaseCase):
+
+    def test_bands_cover_image_top_down(self):
+        bands = split_bands(5, 7, 3, 2)
+        self.assertEqual([(top, rows) for top, rows, _ in bands], [(0, 3), (3, 3), (6, 1)])
+        # The top band sits at the top of GL's bottom up coordinates
+        self.assertEqual(bands[0][2][0], (0, 4, 2, 2))
+        covered = [(x + i, y + j) for _, _, tiles in bands for x, y, w, h in tiles
+                   for i in range(w) for j in range(h)]
+        self.assertEqual(sorted(covered), sorted((x, y) for x in range(5) for y in range(7)))
+
+    def test_tiles_assembled_top_row_first(self):
+        drawn = []
+        def draw_region(shader, controller, x, y, width, height):
+            drawn.append((x, y))
+        def read_pixels(out, pixel_format, flip):
+            # Each height is its GL row * 100 + column
+            x, y = drawn[-1]
+            rows, columns = out.shape
+            heights = np.add.outer((y + np.arange(rows)) * 100.0, x + np.arange(columns))
+            return heights[::-1] if flip else heights
+        written = []
+        # The band buffer is reused, writers take what they need before returning
+        writer = Mock(write_rows=lambda top, rows: written.append((top, rows.copy())))
+        with patch.object(pyglet, 'gl', Mock()), patch.object(offscreen, 'Framebuffer'), \
+                patch.object(offscreen, 'draw_region', draw_region), \
+                patch.object(readback, 'read_pixels', read_pixels):
+            render_heightmap(Mock(), Mock(), 3, 5, writer, tile_size=2)
+        image = np.concatenate([rows for _, rows in written])
+        self.assertEqual([top for top, _ in written], [0, 2, 4])
+        expected = np.add.outer(np.arange(4, -1, -1) * 100.0, np.arange(3))
+        self.assertEqual(image.tolist(), expected.tolist())
+
+class TestExports(BaseCase):
+
+    def setUp(self):
+        self.paths = []
+
+    def tearDown(self):
+        super(TestExports, self).tearDown()
+        for path in self.paths:
+            os.remove(path)
+
+    def temp_path(self, suffix):
+        handle, path = tempfile.mkstemp(suffix=suffix)
+        os.close(handle)
+        self.paths.append(path)
+        return path
+
+    def write(self, path):
+        writer = open_heightmap(path, 3, 2, -1.0, 1.0)
+        writer.write_rows(0, np.array([[-1.0, 0.0, 1.0]], np.float32))
+        writer.write_rows(1, np.array([[2.0, 0.25, -0.5]], np.float32))
+        writer.close()
+
+    def test_npy(self):
+        path = self.temp_path(".npy")
+        self.write(path)
+        self.assertEqual(np.load(path).tolist(), [[-1.0, 0.0, 1.0], [2.0, 0.25, -0.5]])
+
+    def test_raw(self):
+        path = self.temp_path(".f32")
+        self.write(path)
+        self.assertEqual(np.fromfile(path, np.float32).tolist(), [-1.0, 0.0, 1.0, 2.0, 0.25, -0.5])
+
+    def test_png_16_bit(self):
+        path = self.temp_path(".png")
+        self.write(path)
+        _, chunks = read_chunks(path)
+        self.assertEqual(struct.unpack(">IIBB", chunks[0][1][:10]), (3, 2, 16, 0))
+        data = zlib.decompress(b"".join(data for kind, data in chunks if kind == b"IDAT"))
+        rows = [struct.unpack(">3H", data[1:7]), struct.unpack(">3H", data[8:14])]
+        self.assertEqual(rows, [(0, 32768, 65535), (65535, 40959, 16384)])
+
+if __name__ == '__main__':
+    unittest.main()
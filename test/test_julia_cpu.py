@@ -0,0 +1,56 @@
+import unittest
+import numpy as np
+from test_base import *
+
+# Pull in the cpu julia renderer for testing
+from julia_cpu import julia_uv, escape_time, julia_colour, render_julia
+
+C = (-1.373, 0.0045)
+
+def naive_pixel(z, c, max_iter):
+    '''Straight per pixel port of julia.f.glsl'''
+    dz = complex(1.0, 0.0)
+    for _ in range(max_iter):
+        if z.real * z.real + z.imag * z.imag > 1e7:
+            break
+        dz = 2.0 * z * dz + 1.0
+        z = z * z + c
+    return abs(z) ** 2, abs(dz) ** 2
+
+class TestJuliaUV(BaseCase):
+
+    def test_corners(self):
+        uv_x, uv_y = julia_uv(4, 4, range(4), np.float64)
+        # Bottom left pixel is near uv (2, 2), top right near (-2, -2)
+        self.assertEqual((uv_x[0], uv_y[0]), (1.5, 1.5))
+        self.assertEqual((uv_x[-1], uv_y[-1]), (-1.5, -1.5))
+        # uv.x follows the rows
+        self.assertEqual(uv_x[1], uv_x[0])
+        self.assertEqual(uv_y[4], uv_y[0])
+
+class TestEscapeTime(BaseCase):
+
+    def test_matches_naive_loop(self):
+        uv_x, uv_y = julia_uv(8, 8, range(8), np.float64)
+        sqr_z, sqr_dz = escape_time(uv_x, uv_y, C, 64)
+        for i in range(0, 64, 7):
+            expected = naive_pixel(complex(uv_x[i], uv_y[i]), complex(*C), 64)
+            self.assertAlmostEqual(sqr_z[i] / expected[0], 1.0, places=6)
+            self.assertAlmostEqual(sqr_dz[i] / expected[1], 1.0, places=6)
+
+    def test_colour(self):
+        rgba = julia_colour(np.array([1e8, 0.5]), np.array([1e4, 1.0]))
+        self.assertEqual(rgba[0].tolist(), [255, 255, 0, 255])
+        # Log of a small norm is negative, the shader's mix has no defined value there
+        self.assertEqual(rgba[1].tolist(), [255, 0, 0, 255])
+
+class TestRenderJulia(BaseCase):
+
+    def test_pool_matches_single_process(self):
+        single = render_julia(16, 12, C, 64, processes=1)
+        pooled = render_julia(16, 12, C, 64, processes=2, block_rows=5)
+        self.assertEqual(single.shape, (12, 16, 4))
+        self.assertTrue((single == pooled).all())
+
+if __name__ == '__main__':
+    unittest.main()
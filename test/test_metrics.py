@@ -0,0 +1,112 @@
+import unittest
+try:
+    from urllib.request import urlopen
+    from urllib.error import HTTPError
+except ImportError:
+    from urllib2 import urlopen, HTTPError
+from test_base import *
+
+# Pull in the metrics for testing
+from metrics import Registry, Counter, Histogram, timed, serve, clock, CONTENT_TYPE
+from procviewer import ShaderController, PARSE_SECONDS, SET_UNIFORMS_SECONDS, UNIFORM_UPLOADS
+
+class TestMetrics(BaseCase):
+
+    def test_counter(self):
+        counter = Counter('frames_total', "Frames")
+        counter.inc()
+        counter.inc(2)
+        self.assertEqual(counter.samples(), [('frames_total', '', 3)])
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram('frame_seconds', "Frames", (0.01, 0.1))
+        for value in (0.005, 0.01, 0.05, 2.0):
+            histogram.observe(value)
+        self.assertEqual(histogram.count, 4)
+        self.assertEqual(histogram.samples(), [
+            ('frame_seconds_bucket', '{le="0.01"}', 2),
+            ('frame_seconds_bucket', '{le="0.1"}', 3),
+            ('frame_seconds_bucket', '{le="+Inf"}', 4),
+            ('frame_seconds_sum', '', 2.065),
+            ('frame_seconds_count', '', 4),
+        ])
+
+    def test_registry_render(self):
+        registry = Registry('test_')
+        registry.counter('uploads_total', "Uploads").inc(5)
+        registry.histogram('draw_seconds', "Draws", (1.0,)).observe(0.5)
+        self.assertEqual(registry.render(), "\n".join([
+            '# HELP test_draw_seconds Draws',
+            '# TYPE test_draw_seconds histogram',
+            'test_draw_seconds_bucket{le="1.0"} 1',
+            'test_draw_seconds_bucket{le="+Inf"} 1',
+            'test_draw_seconds_sum 0.5',
+            'test_draw_seconds_count 1',
+            '# HELP test_uploads_total Uploads',
+            '# TYPE test_uploads_total counter',
+            'test_uploads_total 5',
+        ]) + "\n")
+
+    def test_registry_reuses_metrics(self):
+        registry = Registry()
+        self.assertIs(registry.counter('a_total', "A"), registry.counter('a_total', "A"))
+        self.assertRaises(ValueError, registry.histogram, 'a_total', "A")
+
+    def test_timed(self):
+        histogram = Histogram('call_seconds', "Calls")
+
+        @timed(histogram)
+        def fails():
+            '''Always fails'''
+            raise KeyError('fails')
+
+        self.assertRaises(KeyError, fails)
+        self.assertEqual(fails.__doc__, 'Always fails')
+        self.assertEqual(timed(histogram)(lambda value: value * 2)(4), 8)
+        self.assertEqual(histogram.count, 2)
+
+    def test_timing_overhead(self):
+        histogram = Histogram('call_seconds', "Calls")
+        wrapped = timed(histogram)(lambda: None)
+        started = clock()
+        for _ in range(10000):
+            wrapped()
+        # A few microseconds a call at most, against milliseconds a frame
+        self.assertLess((clock() - started) / 10000, 50e-6)
+
+class TestInstrumentation(BaseCase):
+
+    def test_controller(self):
+        parses = PARSE_SECONDS.count
+        viewer = ShaderController(Mock(vertex_shader="", fragment_shader="uniform float a = 1.0;"),
+                                  "blank/blank_shader")
+        self.assertEqual(PARSE_SECONDS.count, parses + 2)
+        frames, uploads = SET_UNIFORMS_SECONDS.count, UNIFORM_UPLOADS.value
+        viewer.set_uniforms()
+        self.assertEqual(SET_UNIFORMS_SECONDS.count, frames + 1)
+        self.assertEqual(UNIFORM_UPLOADS.value, uploads + 1)
+
+class TestEndpoint(BaseCase):
+
+    def setUp(self):
+        self.registry = Registry('test_')
+        self.registry.counter('scrapes_total', "Scrapes").inc()
+        self.server = serve(0, registry=self.registry)
+        self.url = "http://127.0.0.1:{}".format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_metrics(self):
+        response = urlopen(self.url + "/metrics", timeout=5)
+        self.assertEqual(response.headers['Content-Type'], CONTENT_TYPE)
+        self.assertIn("test_scrapes_total 1\n", response.read().decode('utf-8'))
+
+    def test_other_paths(self):
+        with self.assertRaises(HTTPError) as raised:
+            urlopen(self.url + "/", timeout=5)
+        self.assertEqual(raised.exception.code, 404)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+import random
+import numpy as np
+from test_base import *
+from test_glsl_numpy import shader_source
+
+# Pull in the noise volume for testing
+from noise_volume import NoiseVolume, perlin, volume, sample, fidelity, volume_source
+from procviewer import ShaderController, update_permutation
+from glsl_numpy import compile_fragment
+
+class TestVolumeNoise(BaseCase):
+
+    def setUp(self):
+        self.table = list(range(256))
+        random.Random(3).shuffle(self.table)
+        self.table *= 2
+
+    def test_perlin_matches_shader(self):
+        fragment = shader_source('perlin_reference/proc_shader.f.glsl').replace('void main()', 'void reference_main()')
+        fragment += ("\nvoid main() {\n  gl_FragColor = vec4(getHash(gl_FragCoord[0] * 0.37 - 3.0, "
+                     "gl_FragCoord[1] * 0.29 + 1.0, z), 0.0, 0.0, 1.0);\n}\n")
+        rendered = compile_fragment(fragment).render(24, 16, {'p': self.table, 'z': 0.7})[..., 0]
+        y, x = np.mgrid[0:16, 0:24] + 0.5
+        expected = perlin(x * 0.37 - 3.0, y * 0.29 + 1.0, np.full(x.shape, 0.7), self.table)
+        np.testing.assert_allclose(rendered, expected, atol=1e-5)
+
+    def test_volume_tiles(self):
+        data = volume(self.table, 16, 4)
+        points = np.random.RandomState(1).uniform(0.0, 4.0, (3, 50))
+        np.testing.assert_allclose(sample(data, *points, period=4), sample(data, *(points + 4.0), period=4),
+                                   atol=1e-6)
+        # Texel centres read back the texel
+        centre = (np.arange(16) + 0.5) / 4.0
+        np.testing.assert_allclose(sample(data, centre, centre[3], centre[5], period=4), data[5, 3, :],
+                                   atol=1e-6)
+        self.assertRaises(ValueError, perlin, points[0], points[1], points[2], self.table, 512)
+
+    def test_fidelity(self):
+        coarse, _ = fidelity(self.table, 32, 16, samples=2000, reference_period=16)
+        fine, worst = fidelity(self.table, 64, 16, samples=2000, reference_period=16)
+        self.assertLess(fine, coarse)
+        self.assertLess(fine, 0.05)
+        self.assertLess(worst, 0.25)
+        # getHash wraps every 256 cells, so the volume draws a different field
+        changed, _ = fidelity(self.table, 64, 16, samples=2000)
+        self.assertGreater(changed, 0.2)
+
+class TestVolumeSource(BaseCase):
+
+    def test_fetch_replaces_hash(self):
+        source = volume_source(shader_source('spike/working_shader.f.glsl'))
+        self.assertIn("uniform sampler3D noise_volume;", source)
+        self.assertIn("return textureLod(noise_volume, vec3(x, y, z) / 16.0, 0.0).r;", source)
+        self.assertNotIn("lerp(w, ", source)
+
+    def test_rejected(self):
+        self.assertRaises(ValueError, volume_source, "#version 130\nuniform int p[512];\nvoid main() {}\n")
+        self.assertRaises(ValueError, volume_source, shader_source('perlin_reference/proc_shader.f.glsl'),
+                          table='q')
+
+class TestNoiseVolume(BaseCase):
+
+    def setUp(self):
+        fragment = shader_source('perlin_reference/proc_shader.f.glsl')
+        self.controller = ShaderController(Mock(vertex_shader="", fragment_shader=fragment),
+                                           "blank/blank_shader")
+        self.noise = NoiseVolume(self.controller, size=8, period=4)
+        self.noise.upload = Mock()
+
+    def test_generated_when_shuffled(self):
+        self.assertTrue(self.noise.update())
+        self.assertFalse(self.noise.update())
+        self.assertEqual(self.noise.upload.call_args[0][0].shape, (8, 8, 8))
+        update_permutation(self.controller.bindings['p'])
+        self.assertTrue(self.noise.update())
+        self.assertEqual(self.noise.upload.call_count, 2)
+
+    def test_needs_a_table(self):
+        self.assertRaises(ValueError, NoiseVolume, self.controller, 'q')
+
+if __name__ == '__main__':
+    unittest.main()
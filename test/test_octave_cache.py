@@ -0,0 +1,91 @@
+import unittest
+import random
+import numpy as np
+from test_base import *
+from test_glsl_numpy import shader_source
+
+# Pull in the octave cache for testing
+from octave_cache import OctaveCache, supports_octave_cache, layer_source, compose_source, layer_key
+from procviewer import ShaderController, ShaderSource
+from glsl_numpy import compile_fragment
+
+class TestOctaveSources(BaseCase):
+
+    def setUp(self):
+        self.perlin = shader_source('perlin_reference/proc_shader.f.glsl')
+        table = list(range(256))
+        random.Random(1).shuffle(table)
+        self.uniforms = {'p': table * 2, 'octives': 4, 'freq': 0.6}
+
+    def render_layers(self, octaves, width, height):
+        program = compile_fragment(layer_source(self.perlin))
+        return np.stack([program.render(width, height, dict(self.uniforms, octave_layer=octave))[..., :1]
+                         for octave in range(octaves)])
+
+    def test_supported(self):
+        self.assertTrue(supports_octave_cache(self.perlin))
+        self.assertFalse(supports_octave_cache(shader_source('Julia/julia.f.glsl')))
+
+    def test_compose_matches_direct(self):
+        layers = self.render_layers(5, 24, 16)
+        compose = compile_fragment(compose_source(self.perlin))
+        direct = compile_fragment(self.perlin)
+        # The same layers serve other amplitudes and fewer octaves
+        for freq, octives in ((0.6, 4), (0.9, 4), (0.6, 5), (0.75, 2)):
+            uniforms = dict(self.uniforms, freq=freq, octives=octives)
+            np.testing.assert_array_equal(compose.render(24, 16, dict(uniforms, octave_layers=layers)),
+                                          direct.render(24, 16, uniforms))
+
+class TestOctaveCache(BaseCase):
+
+    def setUp(self):
+        fragment = shader_source('perlin_reference/proc_shader.f.glsl')
+        self.controller = ShaderController(Mock(vertex_shader="", fragment_shader=fragment),
+                                           "blank/blank_shader")
+        self.cache = OctaveCache(self.controller, ShaderSource("", fragment), 64, 64)
+        self.cache.allocate = Mock(side_effect=lambda layers: setattr(self.cache, 'capacity', layers))
+        self.cache.render_layers = Mock()
+
+    def set(self, name, value):
+        self.controller.bindings[name]['default'] = value
+
+    def test_layers_rendered_once(self):
+        self.assertEqual(self.cache.update(), 9)
+        self.cache.render_layers.assert_called_once_with(0, 9)
+        # Amplitudes and fewer octaves only recompose
+        self.set('freq', 0.5)
+        self.set('octives', 4)
+        self.assertEqual(self.cache.update(), 0)
+        self.set('octives', 9)
+        self.assertEqual(self.cache.update(), 0)
+        self.assertEqual(self.cache.render_layers.call_count, 1)
+
+    def test_new_octave_renders_one_layer(self):
+        self.cache.update()
+        self.set('octives', 10)
+        self.assertEqual(self.cache.update(), 10)
+        # Past the array, which is made over twice the size
+        self.cache.allocate.assert_called_with(18)
+        self.set('octives', 11)
+        self.assertEqual(self.cache.update(), 1)
+        self.cache.render_layers.assert_called_with(10, 11)
+
+    def test_moving_renders_again(self):
+        self.cache.update()
+        self.set('zoom', 0.01)
+        self.assertEqual(self.cache.update(), 9)
+        # Tables are shuffled in place
+        self.controller.bindings['p']['default'][0] += 1
+        self.assertEqual(self.cache.update(), 9)
+
+    def test_key(self):
+        key = layer_key(self.controller.bindings)
+        self.assertEqual(sorted(key), ['p', 'x', 'y', 'z', 'zoom'])
+        self.assertIsNot(key['p'], self.controller.bindings['p']['default'])
+
+    def test_unsupported(self):
+        source = ShaderSource("", shader_source('Julia/julia.f.glsl'))
+        self.assertRaises(ValueError, OctaveCache, self.controller, source, 64, 64)
+
+if __name__ == '__main__':
+    unittest.main()
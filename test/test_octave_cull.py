@@ -0,0 +1,70 @@
+import unittest
+from test_base import *
+from test_uniform_block import make_bindings
+
+# Pull in the octave culling for testing
+from octave_cull import octave_limit, culled_value, culled_names, cull_octaves, CULL_KEY
+from procviewer import ShaderController
+from specialize import specialized_names, SPECIALIZE_KEY
+
+class TestOctaveLimit(BaseCase):
+
+    def test_limit(self):
+        # Octave oct's cells are 1 / (zoom * 2^oct) pixels wide
+        self.assertEqual(octave_limit(0.02), 5)
+        self.assertEqual(octave_limit(0.25), 2)
+        self.assertEqual(octave_limit(-0.25), 2)
+        self.assertEqual(octave_limit(0.5), 1)
+        self.assertEqual(octave_limit(4.0), 1)
+        self.assertEqual(octave_limit(0.25, pixels=1.0), 3)
+
+    def test_culled_value(self):
+        bindings = make_bindings()
+        self.assertEqual(culled_value(bindings, 'octives', 9), 9)
+        self.assertTrue(cull_octaves(bindings))
+        self.assertEqual(culled_names(bindings), ['octives'])
+        self.assertEqual(culled_value(bindings, 'octives', 9), 1)
+        bindings['zoom']['default'] = 0.02
+        self.assertEqual(culled_value(bindings, 'octives', 9), 5)
+        self.assertEqual(culled_value(bindings, 'octives', 3), 3)
+        bindings['zoom']['default'] = 0.0
+        self.assertEqual(culled_value(bindings, 'octives', 9), 9)
+        self.assertFalse(cull_octaves(bindings, 'levels'))
+
+    def test_not_specialised(self):
+        bindings = make_bindings()
+        bindings['octives'][SPECIALIZE_KEY] = True
+        self.assertEqual(specialized_names(bindings), ['octives'])
+        cull_octaves(bindings)
+        self.assertEqual(specialized_names(bindings), [])
+
+class TestControllerCulling(BaseCase):
+
+    def setUp(self):
+        self.shader = Mock(vertex_shader="", fragment_shader="")
+        bindings = make_bindings()
+        bindings['zoom']['default'] = 0.02
+        bindings['octives'][CULL_KEY] = 'zoom'
+        self.viewer = ShaderController(self.shader, "blank/blank_shader", bindings)
+
+    def test_uploads_capped(self):
+        self.viewer.set_uniforms()
+        self.shader.uniformi.assert_any_call('octives', 5)
+        self.assertEqual(self.viewer.bindings['octives']['default'], 9)
+
+    def test_block_capped(self):
+        block = self.viewer.create_uniform_block()
+        block.upload = Mock()
+        self.viewer.set_uniforms()
+        self.assertEqual(block.unpack('octives'), 5)
+        self.viewer.bindings['zoom']['default'] = 0.001
+        self.viewer.set_uniforms()
+        self.assertEqual(block.unpack('octives'), 9)
+
+    def test_status(self):
+        # Statuses abbreviate lists of 3 or more
+        del self.viewer.bindings['offset']
+        self.assertIn("<b>octives</b>=5 of 9", list(self.viewer.get_statuses()))
+
+if __name__ == '__main__':
+    unittest.main()
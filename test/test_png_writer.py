@@ -0,0 +1,60 @@
+import unittest
+import struct
+import tempfile
+import zlib
+from test_base import *
+
+# Pull in the png writer for testing
+from png_writer import PNGWriter, write_png, GREY, RGBA
+
+def read_chunks(path):
+    with open(path, "rb") as png_file:
+        data = png_file.read()
+    chunks = []
+    pos = 8
+    while pos < len(data):
+        length, = struct.unpack(">I", data[pos:pos + 4])
+        chunks.append((data[pos + 4:pos + 8], data[pos + 8:pos + 8 + length]))
+        pos += 12 + length
+    return data[:8], chunks
+
+class TestPNGWriter(BaseCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".png")
+        os.close(handle)
+
+    def tearDown(self):
+        super(TestPNGWriter, self).tearDown()
+        os.remove(self.path)
+
+    def test_rgba_rows(self):
+        write_png(self.path, [bytes(range(8)), bytes(range(8, 16))], 2, 2)
+        signature, chunks = read_chunks(self.path)
+        self.assertEqual(signature, b"\x89PNG\r\n\x1a\n")
+        self.assertEqual(chunks[0][0], b"IHDR")
+        self.assertEqual(struct.unpack(">IIBB", chunks[0][1][:10]), (2, 2, 8, RGBA))
+        self.assertEqual(chunks[-1][0], b"IEND")
+        pixels = zlib.decompress(b"".join(data for kind, data in chunks if kind == b"IDAT"))
+        self.assertEqual(pixels, b"\0" + bytes(range(8)) + b"\0" + bytes(range(8, 16)))
+
+    def test_grey_16(self):
+        write_png(self.path, [struct.pack(">2H", 1, 65535)], 2, 1, GREY, 16)
+        signature, chunks = read_chunks(self.path)
+        self.assertEqual(struct.unpack(">IIBB", chunks[0][1][:10]), (2, 1, 16, GREY))
+
+    def test_bad_row(self):
+        writer = PNGWriter(self.path, 2, 1)
+        self.assertRaises(ValueError, writer.write_row, bytes(3))
+        writer.write_row(bytes(8))
+        self.assertRaises(ValueError, writer.write_row, bytes(8))
+        writer.close()
+
+    def test_missing_rows(self):
+        writer = PNGWriter(self.path, 2, 2)
+        writer.write_row(bytes(8))
+        self.assertRaises(ValueError, writer.close)
+        writer.png_file.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,12 @@
 import unittest
 import sys
 import json
+import math
 from test_base import *
 
 # from pyglet.window import key
 # Pull in the procviewer file for testing
-from procviewer import ShaderController, update_permutation
+from procviewer import ShaderController, update_permutation, update_gradients
 
 class TestTextureShaderInitBlank(BaseCase):
 
@@ -771,6 +772,13 @@ class TestSetUniforms(BaseCase):
         self.assertEqual(self.shader.uniformi.call_count, 0)
         self.shader.uniformf.assert_called_once_with('a_vec4', 1.0, 1.1, 1.2, 1.3)
 
+    def test_upload_to_other_shader(self):
+        self.viewer.bindings['a_float'] = {'type': 'float', 'default': 1.0}
+        other = Mock()
+        self.viewer.upload_uniform('a_float', 2.0, other)
+        other.uniformf.assert_called_once_with('a_float', 2.0)
+        self.assertEqual(self.shader.uniformf.call_count, 0)
+
 class TestGetHtmlHelps(BaseCase):
 
     def setUp(self):
@@ -881,6 +889,90 @@ class TestMouseScrollY(BaseCase):
         self.viewer.mouse_scroll_y(-2)
         self.assertEqual(self.viewer.mouse_scroll['default'], 20)
 
+class TestSharedBindings(BaseCase):
+
+    def setUp(self):
+        self.tearDown()
+        bindings = {'x': {'type': 'float', 'default': 1.0, 'diff': 0.5, 'inc_key': 113, 'dec_key': 97},
+                    'y': {'type': 'float', 'default': 2.0},
+                    'zoom': {'type': 'float', 'default': 0.5},
+                    'p': {'type': 'int', 'default': [1, 2, 3]}}
+        self.bindings = bindings
+        self.shader = Mock(vertex_shader="", fragment_shader="x + gl_FragCoord[0] * zoom")
+        self.viewer = ShaderController(self.shader, "blank/blank_shader", bindings)
+
+    def test_copied_and_not_saved(self):
+        self.assertEqual(self.viewer.bindings, self.bindings)
+        self.assertIsNot(self.viewer.bindings['x'], self.bindings['x'])
+        self.assertFalse(os.path.isfile("blank/blank_shader.bindings.json"))
+        self.assertIn(113, self.viewer.used_keys)
+
+    def test_upload_uniform(self):
+        self.viewer.upload_uniform('x', 4.0)
+        self.shader.uniformf.assert_called_with('x', 4.0)
+        self.viewer.set_uniforms()
+        self.shader.uniformi.assert_called_with('p', 1, 2, 3)
+        self.assertEqual(self.viewer.bindings['x']['default'], 1.0)
+
+    def test_tile_uniforms(self):
+        self.assertEqual(self.viewer.tile_uniforms(10, 0), {'x': 6.0})
+        self.assertEqual(self.viewer.tile_uniforms(2, 4), {'x': 2.0, 'y': 4.0})
+        # Shaders placed by their varyings only need the viewport moved
+        self.shader.fragment_shader = "uv"
+        self.assertEqual(self.viewer.tile_uniforms(2, 4), {})
+
+class TestGradientTables(BaseCase):
+
+    def setUp(self):
+        self.shader = Mock(vertex_shader="", fragment_shader=
+                           "uniform int perm[8];   // permutation 4 seed 3\n"
+                           "uniform vec2 grads[8]; // gradients 4 from perm\n")
+        self.viewer = ShaderController(self.shader, "blank/blank_shader")
+
+    def assertFollowsPermutation(self):
+        perm = self.viewer.bindings['perm']['default']
+        for i, (gx, gy) in enumerate(self.viewer.bindings['grads']['default']):
+            angle = math.pi * perm[i] / 2.0
+            self.assertAlmostEqual(gx, math.cos(angle))
+            self.assertAlmostEqual(gy, math.sin(angle))
+
+    def test_generated_from_permutation(self):
+        grads = self.viewer.bindings['grads']
+        self.assertEqual((grads['type'], grads['from'], grads['steps']), ('vec2', 'perm', 4))
+        self.assertEqual(len(grads['default']), 8)
+        self.assertNotIn('shuffle_key', grads)
+        self.assertFollowsPermutation()
+
+    def test_shuffle_regenerates(self):
+        shuffle_key = self.viewer.bindings['perm']['shuffle_key']
+        before = self.viewer.bindings['grads']['default']
+        self.assertTrue(self.viewer.binding_trigger(shuffle_key))
+        self.assertNotEqual(self.viewer.bindings['grads']['default'], before)
+        self.assertFollowsPermutation()
+
+    def test_reloaded_shuffle_key(self):
+        # Saved bindings keep their shuffle keys working
+        viewer = ShaderController(self.shader, "blank/blank_shader")
+        self.assertTrue(viewer.binding_trigger(viewer.bindings['perm']['shuffle_key']))
+
+    def test_needs_a_permutation(self):
+        self.tearDown()
+        shader = Mock(vertex_shader="", fragment_shader="uniform vec2 grads[8]; // gradients 4\n")
+        self.assertRaises(ValueError, ShaderController, shader, "blank/blank_shader", None)
+        shader.fragment_shader = "uniform vec2 plain[8];\n"
+        self.assertNotIn('plain', ShaderController(shader, "blank/blank_shader").bindings)
+
+    def test_uploaded_as_vectors(self):
+        self.viewer.set_uniforms()
+        self.shader.uniform_vectorsf.assert_called_once_with('grads', self.viewer.bindings['grads']['default'])
+
+    def test_update_gradients(self):
+        binding = {'steps': 8, 'default': [None] * 4}
+        update_gradients(binding, {'default': [0, 2, 12, 6]})
+        expected = [[1.0, 0.0], [0.0, 1.0], [-1.0, 0.0], [0.0, -1.0]]
+        self.assertTrue(all(math.hypot(gx - ex, gy - ey) < 1e-12
+                            for (gx, gy), (ex, ey) in zip(binding['default'], expected)))
+
 class TestStaticFunctions(BaseCase):
 
     def test_updatePermutation(self):
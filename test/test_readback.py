@@ -0,0 +1,57 @@
+import unittest
+import ctypes
+import numpy as np
+from test_base import *
+
+# Pull in the readback surface for testing
+import readback
+from readback import read_pixels, readback_array, pixel_shape
+
+def fake_read(x, y, width, height, gl_format, gl_type, pointer):
+    '''Fill the destination with increasing sample values, as glReadPixels would write them'''
+    channels = 1 if gl_format == 'red' else 4
+    dtype = np.float32 if gl_type == 'float' else np.uint8
+    samples = np.arange(width * height * channels).astype(dtype)
+    ctypes.memmove(pointer.value, samples.ctypes.data, samples.nbytes)
+
+class TestReadback(BaseCase):
+
+    def setUp(self):
+        patcher = patch.object(readback, 'gl', Mock(GL_RGBA='rgba', GL_RED='red',
+                                                    GL_UNSIGNED_BYTE='ubyte', GL_FLOAT='float'))
+        self.gl = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.gl.glReadPixels.side_effect = fake_read
+
+    def test_reads_into_given_array(self):
+        out = readback_array(3, 2)
+        pixels = read_pixels(out)
+        self.assertTrue(np.shares_memory(pixels, out))
+        self.assertEqual(out[1, 0].tolist(), [12, 13, 14, 15])
+        self.assertEqual(self.gl.glReadPixels.call_args[0][:6], (0, 0, 3, 2, 'rgba', 'ubyte'))
+
+    def test_flip_is_a_view(self):
+        out = readback_array(2, 3, 'R8')
+        pixels = read_pixels(out, pixel_format='R8', flip=True)
+        self.assertTrue(np.shares_memory(pixels, out))
+        self.assertEqual(pixels.tolist(), [[4, 5], [2, 3], [0, 1]])
+
+    def test_memoryview_target(self):
+        target = bytearray(2 * 2 * 4 * 4)
+        pixels = read_pixels(memoryview(target), width=2, height=2, pixel_format='RGBA32F')
+        self.assertEqual(pixels.shape, (2, 2, 4))
+        self.assertEqual(pixels.dtype, np.float32)
+        self.assertEqual(np.frombuffer(target, np.float32)[5], 5.0)
+
+    def test_wrong_size_rejected(self):
+        with self.assertRaises(ValueError):
+            read_pixels(np.empty((2, 2, 4), np.uint8), width=3, height=2)
+        with self.assertRaises(ValueError):
+            read_pixels(memoryview(bytes(16)), width=2, height=2, pixel_format='R32F')
+
+    def test_shapes(self):
+        self.assertEqual(pixel_shape(4, 3, 'R32F'), (3, 4))
+        self.assertEqual(readback_array(4, 3, 'RGBA32F').shape, (3, 4, 4))
+
+if __name__ == '__main__':
+    unittest.main()
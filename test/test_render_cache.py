@@ -0,0 +1,126 @@
+import os
+import unittest
+import shutil
+import struct
+import tempfile
+from test_base import *
+
+# Pull in the render cache file for testing
+from render_cache import RenderCache, hash_source, hash_bindings, make_key
+
+class TestCacheKeys(BaseCase):
+
+    def test_bindings_hash_ignores_keys(self):
+        bound = {'zoom': {'type': 'float', 'default': 0.02, 'inc_key': 113, 'dec_key': 97}}
+        rebound = {'zoom': {'type': 'float', 'default': 0.02, 'inc_key': 119, 'dec_key': 115}}
+        self.assertEqual(hash_bindings(bound), hash_bindings(rebound))
+
+    def test_bindings_hash_follows_values(self):
+        before = {'zoom': {'type': 'float', 'default': 0.02}}
+        after = {'zoom': {'type': 'float', 'default': 0.03}}
+        self.assertNotEqual(hash_bindings(before), hash_bindings(after))
+
+    def test_key_parts(self):
+        key = make_key(hash_source("a"), "b", (0, 0, 4, 4), (4, 4), 'RGBA8')
+        self.assertNotEqual(key, make_key(hash_source("a"), "b", (0, 0, 4, 4), (4, 4), 'R8'))
+        self.assertNotEqual(key, make_key(hash_source("a"), "b", (4, 0, 4, 4), (4, 4), 'RGBA8'))
+        self.assertEqual(key, make_key(hash_source("a"), "b", [0, 0, 4, 4], [4, 4], 'RGBA8'))
+
+    def test_unknown_format(self):
+        self.assertRaises(ValueError, make_key, "a", "b", (0, 0), (1, 1), 'RGB565')
+
+class TestRenderCache(BaseCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cache = RenderCache(self.path, max_bytes=1024, segment_bytes=256)
+
+    def tearDown(self):
+        super(TestRenderCache, self).tearDown()
+        self.cache.close()
+        shutil.rmtree(self.path)
+
+    def test_round_trip(self):
+        self.cache.put("key", bytes(range(64)), (4, 4), 'RGBA8')
+        view = self.cache.get("key")
+        self.assertEqual(view.shape, (4, 4, 4))
+        self.assertEqual(view.tobytes(), bytes(range(64)))
+
+    def test_float_view(self):
+        data = struct.pack("4f", 0.25, 0.5, 0.75, 1.0)
+        self.cache.put("height", data, (2, 2), 'R32F')
+        view = self.cache.get("height")
+        self.assertEqual(view.format, 'f')
+        self.assertEqual(view.tolist(), [[[0.25], [0.5]], [[0.75], [1.0]]])
+
+    def test_wrong_size(self):
+        self.assertRaises(ValueError, self.cache.put, "key", bytes(10), (4, 4), 'RGBA8')
+
+    def test_statistics(self):
+        self.assertIsNone(self.cache.get("missing"))
+        self.cache.put("key", bytes(16), (2, 2), 'RGBA8')
+        self.cache.get("key")
+        stats = self.cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['entries'], 1)
+        self.assertEqual(stats['live_bytes'], 16)
+
+    def test_shared_between_handles(self):
+        self.cache.put("key", bytes(range(16)), (2, 2), 'RGBA8')
+        other = RenderCache(self.path, max_bytes=1024, segment_bytes=256)
+        self.assertEqual(other.get("key").tobytes(), bytes(range(16)))
+        other.close()
+
+    def test_eviction_is_lru(self):
+        for n in range(4):
+            self.cache.put("key{}".format(n), bytes(256), (8, 8), 'RGBA8')
+        # Reading key0 makes key1 the least recently used
+        self.cache.get("key0")
+        self.cache.put("key4", bytes(256), (8, 8), 'RGBA8')
+        self.assertIn("key0", self.cache)
+        self.assertNotIn("key1", self.cache)
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+        self.assertLessEqual(self.cache.stats()['live_bytes'], 1024)
+
+    def test_views_outlive_eviction(self):
+        self.cache.put("key0", bytes(range(256)), (8, 8), 'RGBA8')
+        view = self.cache.get("key0")
+        for n in range(1, 6):
+            self.cache.put("key{}".format(n), bytes(256), (8, 8), 'RGBA8')
+        self.assertNotIn("key0", self.cache)
+        self.assertEqual(view.tobytes(), bytes(range(256)))
+
+    def segment_files_bytes(self):
+        return sum(os.path.getsize(os.path.join(self.path, name))
+                   for name in os.listdir(self.path) if name.startswith("seg_"))
+
+    def test_hot_entry_doesnt_pin_segments(self):
+        # Four 64 byte entries fill a segment, key0 stays hot as the rest cycle through
+        self.cache.put("key0", bytes(range(64)), (4, 4), 'RGBA8')
+        for n in range(1, 60):
+            self.cache.get("key0")
+            self.cache.put("key{}".format(n), bytes([n]) * 64, (4, 4), 'RGBA8')
+            self.assertLessEqual(self.segment_files_bytes(), 1024)
+        stats = self.cache.stats()
+        self.assertGreater(stats['compactions'], 0)
+        self.assertEqual(stats['disk_bytes'], self.segment_files_bytes())
+        self.assertEqual(self.cache.get("key0").tobytes(), bytes(range(64)))
+        self.assertEqual(self.cache.get("key59").tobytes(), bytes([59]) * 64)
+
+    def test_compaction_keeps_payloads(self):
+        for n in range(8):
+            self.cache.put("key{}".format(n), bytes([n]) * 64, (4, 4), 'RGBA8')
+        view = self.cache.get("key1")
+        before = self.cache.info("key1")['seg']
+        # Dropping three of the first segment's four entries leaves it to be compacted
+        for n in (0, 2, 3):
+            del self.cache.index['entries']["key{}".format(n)]
+        self.cache.compact()
+        self.assertNotEqual(self.cache.info("key1")['seg'], before)
+        for n in (1, 4, 5, 6, 7):
+            self.assertEqual(self.cache.get("key{}".format(n)).tobytes(), bytes([n]) * 64)
+        self.assertEqual(view.tobytes(), bytes([1]) * 64)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+import mmap
+import tempfile
+import zlib
+from test_base import *
+from test_png_writer import read_chunks
+
+# Pull in the tile render farm for testing
+from render_farm import split_tiles, create_output, write_tile, save_png
+
+class TestSplitTiles(BaseCase):
+
+    def test_tiles_cover_image_once(self):
+        tiles = split_tiles(10, 7, 4)
+        self.assertEqual(tiles[0], (0, 0, 4, 4))
+        self.assertEqual(tiles[-1], (8, 4, 2, 3))
+        covered = [(x + i, y + j) for x, y, w, h in tiles for i in range(w) for j in range(h)]
+        self.assertEqual(len(covered), 70)
+        self.assertEqual(len(set(covered)), 70)
+
+class TestTileOutput(BaseCase):
+
+    def setUp(self):
+        handle, self.raw_path = tempfile.mkstemp(suffix=".rgba")
+        os.close(handle)
+        handle, self.png_path = tempfile.mkstemp(suffix=".png")
+        os.close(handle)
+
+    def tearDown(self):
+        super(TestTileOutput, self).tearDown()
+        os.remove(self.raw_path)
+        os.remove(self.png_path)
+
+    def test_tiles_written_in_place(self):
+        create_output(self.raw_path, 3, 2)
+        with open(self.raw_path, "r+b") as raw_file:
+            output = mmap.mmap(raw_file.fileno(), 0)
+            # A right hand column tile, with a larger buffer than it needs
+            write_tile(output, 3, (2, 0, 1, 2), bytearray(range(1, 9)) + bytearray(8))
+            write_tile(output, 3, (0, 1, 2, 1), bytearray([9] * 8))
+            output.close()
+        with open(self.raw_path, "rb") as raw_file:
+            raw = raw_file.read()
+        self.assertEqual(raw, bytes(8) + bytes(range(1, 5)) + bytes([9] * 8) + bytes(range(5, 9)))
+
+        save_png(self.raw_path, self.png_path, 3, 2)
+        _, chunks = read_chunks(self.png_path)
+        pixels = zlib.decompress(b"".join(data for kind, data in chunks if kind == b"IDAT"))
+        # Top row first in the PNG
+        self.assertEqual(pixels, b"\0" + raw[12:] + b"\0" + raw[:12])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+import random
+import numpy as np
+from test_base import *
+from test_glsl_numpy import shader_source
+
+# Pull in the render graph for testing
+from render_graph import RenderGraph, Stage, PIPELINES, stage_source, declared_uniforms
+from procviewer import ShaderController, ShaderSource
+from glsl_numpy import compile_fragment
+
+class TestStageSources(BaseCase):
+
+    def setUp(self):
+        self.grid = shader_source('scrappy_grid/scrap_grid.f.glsl')
+        self.noise_stage, self.grid_stage = PIPELINES['scrappy_grid/scrap_grid']
+
+    def test_stage_source(self):
+        source = stage_source("#version 130\nvoid main() {}\n", self.grid_stage)
+        self.assertEqual(source, "#version 130\n#define STAGE_GRID\nuniform sampler2D stage_noise;\nvoid main() {}\n")
+
+    def test_uniforms_partitioned(self):
+        self.assertEqual(declared_uniforms(stage_source(self.grid, self.noise_stage)),
+                         ['x', 'y', 'zoom', 'p', 'z', 'octives', 'freq'])
+        self.assertEqual(declared_uniforms(stage_source(self.grid, self.grid_stage)),
+                         ['stage_noise', 'x', 'y', 'zoom', 'grid', 'gridWeigth', 'threshold'])
+
+    def test_stages_match_direct(self):
+        table = list(range(256))
+        random.Random(2).shuffle(table)
+        uniforms = {'p': table * 2, 'zoom': 0.02, 'grid': 0.2, 'gridWeigth': 0.05, 'threshold': 0.45}
+        noise = compile_fragment(stage_source(self.grid, self.noise_stage)).render(32, 24, uniforms)
+        composed = compile_fragment(stage_source(self.grid, self.grid_stage)).render(
+            32, 24, dict(uniforms, stage_noise=noise[..., :1]))
+        direct = compile_fragment(self.grid).render(32, 24, uniforms)
+        self.assertTrue(direct[..., 0].any())
+        np.testing.assert_array_equal(composed, direct)
+
+class TestRenderGraph(BaseCase):
+
+    def setUp(self):
+        fragment = shader_source('scrappy_grid/scrap_grid.f.glsl')
+        self.controller = ShaderController(Mock(vertex_shader="", fragment_shader=fragment),
+                                           "blank/blank_shader")
+        self.graph = RenderGraph(self.controller, ShaderSource("", fragment),
+                                 PIPELINES['scrappy_grid/scrap_grid'], 64, 64)
+        self.graph.run = Mock()
+
+    def set(self, name, value):
+        self.controller.bindings[name]['default'] = value
+
+    def test_only_changed_stages_run(self):
+        self.assertEqual(self.graph.update(), ['noise', 'grid'])
+        # The last stage draws to the window every frame
+        self.assertEqual(self.graph.update(), ['grid'])
+        self.set('threshold', 0.3)
+        self.assertEqual(self.graph.update(), ['grid'])
+        self.set('octives', 3)
+        self.assertEqual(self.graph.update(), ['noise', 'grid'])
+        # Tables are shuffled in place
+        self.controller.bindings['p']['default'][0] += 1
+        self.assertEqual(self.graph.update(), ['noise', 'grid'])
+        self.assertEqual(self.graph.run.call_args_list[-2:], [call(0), call(1)])
+
+    def test_downstream_of_a_change_runs(self):
+        source = ShaderSource("", "#version 130\nuniform float a = 1.0;\n"
+                              "#ifdef STAGE_SECOND\nuniform float b = 1.0;\n#endif\nvoid main() {}\n")
+        controller = ShaderController(Mock(vertex_shader="", fragment_shader=source.fragment_shader),
+                                      "blank/blank_shader")
+        graph = RenderGraph(controller, source, [Stage('first'), Stage('second', ['first']), Stage('last')], 8, 8)
+        graph.run = Mock()
+        graph.update()
+        controller.bindings['a']['default'] = 2.0
+        self.assertEqual(graph.update(), ['first', 'second', 'last'])
+        controller.bindings['b']['default'] = 2.0
+        self.assertEqual(graph.update(), ['second', 'last'])
+
+    def test_inputs_must_come_first(self):
+        source = ShaderSource("", "void main() {}")
+        self.assertRaises(ValueError, RenderGraph, self.controller, source, [Stage('grid', ['noise'])], 8, 8)
+        self.assertRaises(ValueError, Stage, 'noise', pixel_format='RGB565')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+import subprocess
+from test_base import *
+
+# Pull in the entry point for testing
+from run_procviewer import parse_args, StartupProfile, ControllerLoader, DEFAULT_SHADER
+from procviewer import ShaderController
+
+class TestArguments(BaseCase):
+
+    def test_defaults(self):
+        args = parse_args([])
+        self.assertEqual(args.shader, DEFAULT_SHADER)
+        self.assertEqual((args.width, args.height), (512, 512))
+        self.assertFalse(args.headless)
+        self.assertFalse(args.profile_startup)
+
+    def test_options(self):
+        args = parse_args(['tiled/tile_shader', '--width', '800', '--height', '600', '--headless',
+                           '--profile-startup', '--specialize', 'octives', 'tile'])
+        self.assertEqual(args.shader, 'tiled/tile_shader')
+        self.assertEqual((args.width, args.height), (800, 600))
+        self.assertTrue(args.headless)
+        self.assertTrue(args.profile_startup)
+        self.assertEqual(args.specialize, ['octives', 'tile'])
+
+class TestStartupProfile(BaseCase):
+
+    def test_report(self):
+        times = iter([0.0, 0.02, 0.1, 0.1005, 0.13, 0.15])
+        profile = StartupProfile(clock=lambda: next(times))
+        profile.mark('imports')
+        profile.mark('context')
+        profile.mark('bindings', background=0.012)
+        profile.add('compile', 0.02)
+        profile.add('link', 0.005)
+        profile.mark('window', 0.025)
+        profile.mark('first frame')
+        self.assertEqual(profile.report().splitlines(), [
+            "imports          20.0 ms",
+            "context          80.0 ms",
+            "bindings          0.5 ms  (12.0 ms in the background)",
+            "compile          20.0 ms",
+            "link              5.0 ms",
+            "window            4.5 ms",
+            "first frame      20.0 ms",
+            "total           150.0 ms",
+        ])
+
+class TestControllerLoader(BaseCase):
+
+    def test_loads_on_a_thread(self):
+        loader = ControllerLoader("blank/blank_shader", ShaderController)
+        loader.start()
+        controller = loader.result()
+        self.assertIsInstance(controller, ShaderController)
+        self.assertEqual(controller.bindings, {})
+        self.assertTrue(os.path.isfile("blank/blank_shader.bindings.json"))
+
+    def test_errors_reach_the_caller(self):
+        loader = ControllerLoader("blank/missing_shader", ShaderController)
+        loader.start()
+        self.assertRaises(IOError, loader.result)
+
+class TestImports(BaseCase):
+
+    def test_no_gl_on_import(self):
+        # Importing pyglet.gl creates a GL context, the entry point leaves that to main()
+        script = "import sys, run_procviewer, procviewer; print(sorted(m for m in sys.modules if 'pyglet' in m))"
+        output = subprocess.check_output([sys.executable, "-c", script], cwd="..")
+        self.assertEqual(output.decode('utf-8').strip(), "[]")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+import random
+import numpy as np
+from test_base import *
+from test_glsl_numpy import shader_source
+
+# Pull in the noise bases for testing
+from simplex import basis_source
+from glsl_numpy import compile_fragment
+
+PROBE = ("\nvoid main() {\n"
+         "  gl_FragColor = vec4(getHash(gl_FragCoord[0] * 0.37, gl_FragCoord[1] * 0.37, z), 0.0, 0.0, 1.0);\n"
+         "}\n")
+
+def probe_source():
+    '''The reference's noise functions, drawing getHash over the pixels'''
+    source = shader_source('perlin_reference/proc_shader.f.glsl')
+    return source.replace('void main()', 'void reference_main()') + PROBE
+
+class TestBasisSource(BaseCase):
+
+    def setUp(self):
+        self.source = probe_source()
+        self.table = list(range(256))
+        random.Random(3).shuffle(self.table)
+
+    def render(self, basis, z=0.5, table=None):
+        uniforms = {'p': (table or self.table) * 2, 'z': z}
+        return compile_fragment(basis_source(self.source, basis)).render(24, 16, uniforms)[..., 0]
+
+    def test_perlin_unchanged(self):
+        self.assertEqual(basis_source(self.source, 'perlin'), self.source)
+
+    def test_simplex_in_range(self):
+        for basis in ('simplex', 'simplex2'):
+            noise = self.render(basis)
+            self.assertTrue((np.abs(noise) <= 1.0).all())
+            self.assertGreater(noise.std(), 0.05)
+
+    def test_reseeding_changes_simplex(self):
+        shuffled = list(self.table)
+        random.Random(4).shuffle(shuffled)
+        self.assertFalse(np.array_equal(self.render('simplex'), self.render('simplex', table=shuffled)))
+
+    def test_perlin2_is_the_z_slice(self):
+        np.testing.assert_allclose(self.render('perlin2'), self.render('perlin', z=0.0), atol=1e-6)
+
+    def test_rejected(self):
+        self.assertRaises(ValueError, basis_source, self.source, 'value')
+        self.assertRaises(ValueError, basis_source, "#version 130\nuniform int p[512];\nvoid main() {}\n")
+        self.assertRaises(ValueError, basis_source, self.source.replace('uniform int p[512];', ''))
+        self.assertRaises(ValueError, basis_source, self.source, table='q')
+
+if __name__ == '__main__':
+    unittest.main()
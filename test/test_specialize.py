@@ -0,0 +1,138 @@
+import unittest
+import numpy as np
+from test_base import *
+from test_glsl_numpy import shader_source
+
+# Pull in the specialisation for testing
+from specialize import specialized_names, glsl_literal, specialize_source, Specializer
+from procviewer import ShaderController
+from uniform_block import is_block_member
+from glsl_numpy import compile_fragment
+
+def make_bindings():
+    return {
+        'octives': {'type': 'int', 'default': 5, 'specialize': True},
+        'freq': {'type': 'float', 'default': 0.5, 'specialize': True},
+        'zoom': {'type': 'float', 'default': 0.02},
+        'p': {'type': 'int', 'default': [0, 1], 'specialize': True},
+    }
+
+class TestSpecializeSource(BaseCase):
+
+    def test_names_and_literals(self):
+        self.assertEqual(specialized_names(make_bindings()), ['freq', 'octives'])
+        self.assertEqual(glsl_literal(2, 'float'), '2.0')
+        self.assertEqual(glsl_literal(1e-05, 'float'), '1e-05')
+        self.assertEqual(glsl_literal(3.0, 'int'), '3')
+        self.assertEqual(glsl_literal(0, 'bool'), 'false')
+
+    def test_constants_replace_uniforms(self):
+        source = "uniform int octives = 9;\n uniform float zoom = 0.1; // diff 0.01\nvoid main() {}\n"
+        source = specialize_source(source, make_bindings(), ['octives', 'freq'])
+        self.assertEqual(source, "const int octives = 5;\n uniform float zoom = 0.1; // diff 0.01\nvoid main() {}\n")
+
+    def test_specialised_perlin_matches_generic(self):
+        source = shader_source('perlin_reference/proc_shader.f.glsl')
+        bindings = {'octives': {'type': 'int', 'default': 3}, 'freq': {'type': 'float', 'default': 0.75}}
+        uniforms = {'p': list(range(256)) * 2, 'x': 0.3, 'y': 0.7, 'z': 0.5, 'zoom': 0.05,
+                    'octives': 3, 'freq': 0.75}
+        generic = compile_fragment(source).render(4, 4, uniforms)
+        specialized_source = specialize_source(source, bindings, ['octives', 'freq'])
+        self.assertIn("const int octives = 3;", specialized_source)
+        specialized = compile_fragment(specialized_source).render(4, 4, dict(uniforms, octives=0, freq=0.0))
+        self.assertTrue(np.array_equal(generic, specialized))
+
+    def test_specialised_stay_out_of_block(self):
+        self.assertFalse(is_block_member(make_bindings()['octives']))
+        self.assertTrue(is_block_member(make_bindings()['zoom']))
+
+class FakeProgram(object):
+
+    def __init__(self, fragment_shader, error=None):
+        self.fragment_shader = fragment_shader
+        self.is_ready = False
+        self.error = error
+        self.deleted = False
+
+    def ready(self):
+        return self.is_ready
+
+    def finish(self):
+        if self.error:
+            raise ValueError(self.error)
+
+    def delete(self):
+        self.deleted = True
+
+class TestSpecializer(BaseCase):
+
+    def setUp(self):
+        self.controller = ShaderController(Mock(vertex_shader="", fragment_shader=""),
+                                           "blank/blank_shader", make_bindings())
+        self.generic = Mock()
+        self.compiled = []
+        self.prepared = []
+        self.specializer = Specializer(self.controller, "", "uniform int octives;\nuniform float freq;\n",
+                                       self.generic, self.compile, self.prepared.append,
+                                       max_variants=2, settle=1.0)
+        self.now = 0.0
+        self.specializer.clock = lambda: self.now
+
+    def compile(self, vertex_shader, fragment_shader):
+        program = FakeProgram(fragment_shader)
+        self.compiled.append(program)
+        return program
+
+    def test_generic_until_variant_ready(self):
+        self.assertIs(self.specializer.program(), self.generic)
+        self.assertEqual(self.compiled, [])
+        self.now = 1.0
+        self.assertIs(self.specializer.program(), self.generic)
+        self.assertEqual(len(self.compiled), 1)
+        self.assertIn("const int octives = 5;", self.compiled[0].fragment_shader)
+        self.assertIs(self.specializer.program(), self.generic)
+        self.compiled[0].is_ready = True
+        self.assertIs(self.specializer.program(), self.compiled[0])
+        self.assertEqual(self.prepared, [self.compiled[0]])
+        self.assertEqual(len(self.compiled), 1)
+
+    def test_variants_cached_by_values(self):
+        for octives in (5, 6, 5):
+            self.controller.bindings['octives']['default'] = octives
+            self.specializer.program()
+            self.now += 1.0
+            self.specializer.program()
+            self.compiled[-1].is_ready = True
+        self.assertEqual(len(self.compiled), 2)
+        self.assertIs(self.specializer.program(), self.compiled[0])
+        # A third tuple of values pushes out the least recently used
+        self.controller.bindings['freq']['default'] = 0.25
+        self.now += 1.0
+        self.specializer.program()
+        self.now += 1.0
+        self.specializer.program()
+        self.assertTrue(self.compiled[1].deleted)
+        self.assertFalse(self.compiled[0].deleted)
+
+    def test_failed_variant_falls_back(self):
+        self.specializer.compile_shader = lambda vertex, fragment: FakeProgram(fragment, "bad")
+        self.specializer.program()
+        self.now = 1.0
+        self.specializer.program()
+        self.specializer.variants[(0.5, 5)][0].is_ready = True
+        self.assertIs(self.specializer.program(), self.generic)
+        self.assertIs(self.specializer.program(), self.generic)
+
+class TestUseShader(BaseCase):
+
+    def test_switching_program_uploads_arrays_again(self):
+        controller = ShaderController(Mock(vertex_shader="", fragment_shader=""), "blank/blank_shader",
+                                      make_bindings())
+        controller.uploaded = {'p': controller.bindings['p']['default']}
+        other = Mock()
+        controller.use_shader(other)
+        self.assertIs(controller.shader, other)
+        self.assertEqual(controller.uploaded, {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import unittest
+import copy
+from test_base import *
+
+# Pull in the uniform block store for testing
+from uniform_block import UniformBlock, BlockBinding, block_layout
+from procviewer import ShaderController
+
+def make_bindings():
+    return {
+        'zoom': {'type': 'float', 'default': 0.5, 'diff': 0.25, 'inc_key': 113, 'dec_key': 97},
+        'colour': {'type': 'vec3', 'default': [1.0, 0.5, 0.25]},
+        'octives': {'type': 'int', 'default': 9, 'diff': 1, 'inc_key': 119, 'dec_key': 115},
+        'p': {'type': 'int', 'default': [3, 1, 2], 'loop': 3, 'seed': 1, 'shuffle_key': 101},
+        'bound': {'type': 'bool', 'default': True, 'toggle_key': 114},
+        'offset': {'type': 'vec2', 'default': [0.0, 1.0]},
+        'x': {'type': 'float', 'default': 1.0},
+    }
+
+class TestBlockLayout(BaseCase):
+
+    def test_std140_offsets(self):
+        layout, size = block_layout(make_bindings())
+        # vec3 aligns to 16 bytes, vec2 to 8, and the int array stays out of the block
+        self.assertEqual(layout, [('zoom', 'float', 0), ('colour', 'vec3', 16),
+                                  ('octives', 'int', 28), ('bound', 'bool', 32),
+                                  ('offset', 'vec2', 40), ('x', 'float', 48)])
+        self.assertEqual(size, 64)
+
+    def test_pack_and_write_through(self):
+        bindings = make_bindings()
+        block = UniformBlock(bindings)
+        block.wrap_bindings()
+        self.assertIsInstance(bindings['zoom'], BlockBinding)
+        self.assertNotIsInstance(bindings['p'], BlockBinding)
+        self.assertEqual(block.unpack('colour'), [1.0, 0.5, 0.25])
+        self.assertEqual(block.unpack('bound'), True)
+
+        block.dirty = False
+        bindings['octives']['default'] += 2
+        self.assertEqual(block.unpack('octives'), 11)
+        self.assertTrue(block.dirty)
+
+        block.override('x', 4.0)
+        self.assertEqual(block.unpack('x'), 4.0)
+        block.restore()
+        self.assertEqual(block.unpack('x'), 1.0)
+
+        # Copies don't carry the block with them
+        self.assertIs(type(copy.deepcopy(bindings)['zoom']), dict)
+
+    def test_rewrite_source(self):
+        bindings = {'zoom': {'type': 'float', 'default': 0.5}, 'p': {'type': 'int', 'default': [0, 1]}}
+        block = UniformBlock(bindings)
+        source = ("#version 130\n\nuniform int p[2];\n uniform float zoom  = 0.02; // diff 0.0005\n"
+                  "void main() {}\n")
+        rewritten = block.rewrite_source(source)
+        lines = rewritten.split('\n')
+        self.assertEqual(lines[0], "#version 130")
+        self.assertEqual(lines[1], "#extension GL_ARB_uniform_buffer_object : enable")
+        self.assertIn("layout(std140) uniform ProcBindings {\n  float zoom;\n};", rewritten)
+        self.assertIn("uniform int p[2];", rewritten)
+        self.assertNotIn("uniform float zoom", rewritten)
+
+class TestControllerBlock(BaseCase):
+
+    def setUp(self):
+        self.shader = Mock(vertex_shader="", fragment_shader="")
+        self.viewer = ShaderController(self.shader, "blank/blank_shader", make_bindings())
+        self.block = self.viewer.create_uniform_block()
+        self.block.upload = Mock()
+
+    def test_key_and_mouse_write_through(self):
+        self.viewer.binding_trigger(113)
+        self.assertEqual(self.block.unpack('zoom'), 0.75)
+        self.viewer.binding_trigger(114)
+        self.assertEqual(self.block.unpack('bound'), False)
+        self.viewer.mouse_drag(1, 0)
+        self.assertEqual(self.block.unpack('x'), 0.25)
+
+    def test_set_uniforms_uploads_block_once(self):
+        self.viewer.set_uniforms()
+        self.block.upload.assert_called_once_with()
+        # Only the array goes through per uniform calls, and only when replaced
+        self.shader.uniformi.assert_called_once_with('p', 3, 1, 2)
+        self.assertFalse(self.shader.uniformf.called)
+        self.viewer.set_uniforms()
+        self.assertEqual(self.shader.uniformi.call_count, 1)
+        self.viewer.bindings['p']['default'] = [1, 2, 3]
+        self.viewer.set_uniforms()
+        self.assertEqual(self.shader.uniformi.call_count, 2)
+
+    def test_overrides_last_one_draw(self):
+        self.viewer.upload_uniform('x', 9.0)
+        self.assertEqual(self.block.unpack('x'), 9.0)
+        self.viewer.set_uniforms()
+        self.assertEqual(self.block.unpack('x'), 1.0)
+        self.assertEqual(self.viewer.bindings['x']['default'], 1.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import unittest
+import threading
+import numpy as np
+from test_base import *
+
+# Pull in the chunked world for testing
+from world import ChunkWorld, chunk_origin, prefetch_order
+
+def numpy_factory(calls=None, gate=None):
+    '''Render factory whose pixels are world y * 1000 + world x'''
+    def factory():
+        def render(x, y, size):
+            if gate is not None:
+                gate.wait()
+            if calls is not None:
+                calls.append((x, y))
+            return np.add.outer((y + np.arange(size)) * 1000, x + np.arange(size))
+        return render
+    return factory
+
+class TestChunkLayout(BaseCase):
+
+    def test_origin(self):
+        self.assertEqual(chunk_origin(0, 0, 16, 2), (-2, -2))
+        self.assertEqual(chunk_origin(-1, 3, 16, 2), (-18, 46))
+
+    def test_prefetch_ahead_first(self):
+        order = prefetch_order(0, 0, 1, move_x=5)
+        chunks = [chunk for _, chunk in order]
+        self.assertEqual(len(chunks), 8 + 3)
+        self.assertEqual(sorted(chunks[:3]), [(1, -1), (1, 0), (1, 1)])
+        self.assertEqual(sorted(chunks[-3:]), [(2, -1), (2, 0), (2, 1)])
+        self.assertNotIn((-2, 0), chunks)
+        self.assertNotIn((0, 0), chunks)
+
+class TestChunkWorld(BaseCase):
+
+    def setUp(self):
+        self.calls = []
+        self.world = ChunkWorld(numpy_factory(self.calls), chunk_size=8, border=2, cache_chunks=4)
+
+    def tearDown(self):
+        super(TestChunkWorld, self).tearDown()
+        self.world.close()
+
+    def test_borders_overlap_neighbours(self):
+        here = self.world.chunk(0, 0)
+        right = self.world.chunk(1, 0)
+        above = self.world.chunk(0, 1)
+        self.assertEqual(here.shape, (12, 12))
+        self.assertEqual(here[0, 0], -2 * 1000 - 2)
+        self.assertTrue(np.array_equal(here[:, 8:], right[:, :4]))
+        self.assertTrue(np.array_equal(here[8:, :], above[:4, :]))
+
+    def test_lru_cache(self):
+        for chunk_x in range(4):
+            self.world.chunk(chunk_x, 0)
+        self.world.chunk(0, 0)
+        self.world.chunk(4, 0)
+        # (1, 0) was least recently used, (0, 0) was kept
+        self.world.chunk(0, 0)
+        self.world.chunk(1, 0)
+        self.assertEqual(len(self.calls), 6)
+        self.assertEqual(self.world.stats['evicted'], 2)
+        self.assertEqual(self.world.stats['hits'], 2)
+
+    def test_hint_prefetches(self):
+        futures = self.world.hint(0, 0, move_y=-1)
+        for future in futures:
+            future.result()
+        rendered = len(self.calls)
+        self.assertEqual(rendered, 11)
+        self.world.cache_chunks = 16
+        self.world.chunk(0, -2)
+        self.assertEqual(len(self.calls), rendered)
+
+    def test_render_errors_reach_caller(self):
+        world = ChunkWorld(lambda: None)
+        try:
+            with self.assertRaises(TypeError):
+                world.chunk(0, 0)
+        finally:
+            world.close()
+
+class TestDemandOrdering(BaseCase):
+
+    def test_demand_jumps_prefetch_queue(self):
+        calls = []
+        gate = threading.Event()
+        world = ChunkWorld(numpy_factory(calls, gate), chunk_size=4, border=0, cache_chunks=32)
+        try:
+            world.hint(0, 0, move_x=1)
+            demanded = world.request(-5, -5)
+            gate.set()
+            demanded.result()
+            # At most the chunk the render thread had already taken comes first
+            self.assertLessEqual(calls.index((-20, -20)), 1)
+        finally:
+            world.close()
+
+if __name__ == '__main__':
+    unittest.main()
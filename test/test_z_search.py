@@ -0,0 +1,67 @@
+import unittest
+import random
+import numpy as np
+from test_base import *
+from test_glsl_numpy import shader_source
+
+# Pull in the z search for testing
+from z_search import search_source, counting_source, evaluations, level_step
+
+class TestSearchSources(BaseCase):
+
+    def test_search_source(self):
+        self.assertEqual(search_source("#version 130\nvoid main() {}"),
+                         "#version 130\n#define Z_SEARCH\nvoid main() {}")
+        self.assertEqual(search_source("#version 130\nvoid main() {}", 4),
+                         "#version 130\n#define Z_SEARCH\n#define Z_SEARCH_SLOPE 4.0\nvoid main() {}")
+
+    def test_counting(self):
+        source = ("#version 130\nfloat getSumFreq(float v);\n"
+                  "void main() {\n"
+                  "  gl_FragColor = vec4(getSumFreq(gl_FragCoord[0]) + getSumFreq(1.0), 0.0, 0.0, 1.0);\n"
+                  "}\n"
+                  "float getSumFreq(float v) { return v; }\n")
+        z, calls = evaluations(source, {}, 2, 1)
+        np.testing.assert_array_equal(z, [[1.5, 2.5]])
+        np.testing.assert_array_equal(calls, [[2, 2]])
+        self.assertRaises(ValueError, counting_source, source, 'missing')
+
+    def test_level_step(self):
+        self.assertEqual(level_step({'zdiff': {'default': 0.01}}), 0.01)
+        self.assertEqual(level_step({'levels': {'default': 4}}), 0.25)
+        self.assertEqual(level_step({'levels': {'default': 0}}), 1.0)
+
+class TestHeightShaders(BaseCase):
+
+    def setUp(self):
+        table = list(range(256))
+        random.Random(1).shuffle(table)
+        self.uniforms = {'p': table * 2, 'zoom': 0.05}
+
+    def assertSameZ(self, path, **uniforms):
+        '''The search finds the linear search's z, bit for bit, with fewer noise evaluations'''
+        source = shader_source(path)
+        uniforms = dict(self.uniforms, **uniforms)
+        linear_z, linear = evaluations(source, uniforms, 16, 12)
+        searched_z, searched = evaluations(search_source(source), uniforms, 16, 12)
+        np.testing.assert_array_equal(searched_z, linear_z)
+        self.assertTrue((searched <= linear).all())
+        return linear.mean(), searched.mean()
+
+    def test_spike(self):
+        linear, searched = self.assertSameZ('spike/working_shader.f.glsl')
+        self.assertLess(searched, linear)
+
+    def test_blobs(self):
+        self.assertSameZ('blobs/blobs_shader.f.glsl')
+        self.assertSameZ('blobs/blobs_shader.f.glsl', levels=0)
+
+    def test_live_bindings(self):
+        # The skips follow the bindings, rather than a slope measured at their defaults
+        self.assertSameZ('spike/working_shader.f.glsl', freq=0.85)
+        self.assertSameZ('spike/working_shader.f.glsl', freq=0.6, octives=5)
+        self.assertSameZ('blobs/blobs_shader.f.glsl', levels=40)
+        self.assertSameZ('blobs/blobs_shader.f.glsl', levels=40, freq=0.85)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,236 @@
+''' The viewer window: draws a shader full size, with its key bindings listed over it.
+    Optional features import what they need when first used, to keep startup short. '''
+
+from __future__ import print_function
+import os
+import time
+import pyglet
+from pyglet import gl
+from pyglet.window import key
+from procviewer import ShaderController, ShaderSource, read_shader_files
+from shader import Shader
+from specialize import Specializer, pending_compiler, specialized_names, SPECIALIZE_KEY
+from offscreen import draw_shader
+from metrics import REGISTRY, timed, serve
+from fragment_build import FragmentOptions, build_fragment
+
+SHEET_COLUMNS = 4
+SHEET_ROWS = 4
+
+FRAME_SECONDS = REGISTRY.histogram('frame_seconds', "Seconds of CPU time to issue a generated frame")
+SAVE_SECONDS = REGISTRY.histogram('save_seconds', "Seconds to render, read back and write a PNG")
+
+class TextureWindow(pyglet.window.Window):
+    '''
+    Concrete draw window. This uses the ShaderController to load and operate the shader at the path
+    passed to the constructor.
+    '''
+
+    def __init__(self, shader_path, controller_class=ShaderController, uniform_block=None,
+                 specialize=(), metrics_port=None, width=512, height=512, controller=None, visible=True,
+                 octave_cache=False, render_graph=False, cull_octaves=False, fragment_options=None):
+        '''
+        Load and attempt to run the shader at shader_path.
+        controller_class can replace the ShaderController for shaders that need extra state.
+        uniform_block packs the scalar bindings into one uniform buffer, it defaults to
+        whether GL_ARB_uniform_buffer_object is available.
+        specialize names bindings to compile in as constants, as well as any marked
+        "specialize" in the bindings file.
+        metrics_port serves the metrics on http://127.0.0.1:metrics_port/metrics.
+        controller is a controller already built on the shader's source, for callers that
+        parse the bindings while the GL context is created. controller_class is then unused.
+        octave_cache draws shaders with octave layer and compose paths from cached octaves.
+        render_graph draws shaders with a pipeline in render_graph.PIPELINES stage by stage.
+        cull_octaves skips the octives too fine to see at the zoom, as bindings marked
+        "cull" in the bindings file do.
+        fragment_options are the FragmentOptions to rewrite the fragment source with.
+        '''
+        self.w = width
+        self.h = height
+        self.metrics_server = serve(metrics_port) if metrics_port is not None else None
+
+        # Load shader code, the controller parses it before it's compiled
+        if controller is None:
+            controller = controller_class(ShaderSource(*read_shader_files(shader_path)), shader_path)
+        source = controller.shader
+        self.source = source
+        self.contact_sheet = None
+        self.shader_controller = controller
+        # Keep values changed from the keys and mouse, without waiting on the disk
+        controller.enable_autosave()
+        for name in specialize:
+            self.shader_controller.bindings[name][SPECIALIZE_KEY] = True
+        if cull_octaves:
+            from octave_cull import cull_octaves as mark_culled
+            if not mark_culled(self.shader_controller.bindings):
+                print("no octives and zoom bindings to cull in {}".format(shader_path))
+
+        if uniform_block is None:
+            uniform_block = gl.gl_info.have_extension('GL_ARB_uniform_buffer_object')
+        block = self.shader_controller.create_uniform_block() if uniform_block else None
+        built = build_fragment(controller, source.fragment_shader, fragment_options or FragmentOptions(),
+                               block, keep_tables=octave_cache or render_graph)
+        for reason in built.skipped:
+            print("{}: {}".format(shader_path, reason))
+        fragmentshader = built.fragment
+        hashed = built.hashed
+        self.noise_volume = built.noise_volume
+
+        self.shader = Shader(source.vertex_shader, fragmentshader)
+        self.shader_controller.shader = self.shader
+        if block is not None:
+            block.bind(self.shader.handle)
+        if hashed:
+            from hash_mode import hashed_program
+            hashed_program(self.shader_controller, self.shader, hashed)
+        self.specializer = None
+        if specialized_names(self.shader_controller.bindings):
+            compile_shader = pending_compiler()
+            if hashed:
+                compile_shader = lambda vertex, fragment, compile_shader=compile_shader: hashed_program(
+                    self.shader_controller, compile_shader(vertex, fragment), hashed)
+            self.specializer = Specializer(self.shader_controller, source.vertex_shader, fragmentshader,
+                                           self.shader, compile_shader,
+                                           block.attach if block is not None else None)
+        self.octave_cache = None
+        if octave_cache:
+            from octave_cache import OctaveCache
+            try:
+                self.octave_cache = OctaveCache(self.shader_controller, source, self.w, self.h)
+            except ValueError as error:
+                print("no octave cache for {}: {}".format(shader_path, error))
+        self.render_graph = None
+        if render_graph:
+            from render_graph import RenderGraph, PIPELINES
+            if shader_path in PIPELINES:
+                self.render_graph = RenderGraph(self.shader_controller, source, PIPELINES[shader_path],
+                                                self.w, self.h)
+            else:
+                print("no render graph for {}".format(shader_path))
+        super(TextureWindow, self).__init__(caption=shader_path, width=self.w, height=self.h,
+                                            visible=visible)
+
+        # pyglet.text and the fonts take longer to load than the rest of the window,
+        # so the labels are made when the GUI is first drawn
+        self.helpLabels = None
+
+    def create_key_help_labels(self):
+        '''
+        Create the help labels to display overlaying the drawn shader
+        '''
+        self.helpLabels = []
+        y = self.height
+        for labelText in self.shader_controller.get_html_help(key):
+            self.helpLabels.append(pyglet.text.HTMLLabel(
+                    "<font face='Courier New' color='white'>{}</font>".format(labelText),
+                    x=0, y=y,
+                    anchor_x='left', anchor_y='top'))
+            y -= 20
+        self.helpLabels.append(pyglet.text.HTMLLabel(
+                "<font face='Courier New' color='white'><b>TAB</b>:contact sheet</font>",
+                x=0, y=y,
+                anchor_x='left', anchor_y='top'))
+    
+    def updateStatusLabels(self):
+        self.statusLabels = []
+        y = 20
+        label = 0
+        for labelText in self.shader_controller.get_statuses():
+            # Create a new label if we need one (suddenly)
+            if label >= len(self.statusLabels):
+                self.statusLabels.append(pyglet.text.HTMLLabel("",
+                    x=0, y=y,
+                    anchor_x='left', anchor_y='top'))
+            # Modify an existing label to give it status text
+            self.statusLabels[label].text = "<font face='Courier New' color='white'>{}</font>".format(labelText)
+            y += 20
+            label += 1
+
+    def on_close(self):
+        self.shader_controller.close()
+        super(TextureWindow, self).on_close()
+
+    def on_mouse_drag(self, x, y, dx, dy, buttons, modifiers):
+        self.shader_controller.mouse_drag(dx, dy)
+
+    def on_mouse_scroll(self, x, y, scroll_x, scroll_y):
+        self.shader_controller.mouse_scroll_y(scroll_y)
+
+    def on_mouse_press(self, x, y, button, modifiers):
+        if self.contact_sheet is not None:
+            # Keep the clicked variation and go back to the single view
+            self.contact_sheet.adopt(self.contact_sheet.cell_at(x, y))
+            self.toggle_contact_sheet()
+
+    def on_key_release(self, symbol, modifiers):
+        if symbol == key.TAB:
+            self.toggle_contact_sheet()
+            return
+        self.shader_controller.binding_trigger(symbol)
+
+    def toggle_contact_sheet(self):
+        '''
+        Switch to a grid of variations of the current bindings, drawn in one pass, or back.
+        '''
+        if self.contact_sheet is not None:
+            self.contact_sheet.delete()
+            self.contact_sheet = None
+            return
+        from contact_sheet import ContactSheet, default_axes, grid_variations
+        across, down = default_axes(self.shader_controller.bindings)
+        if across is None:
+            print("no bindings to vary in a contact sheet")
+            return
+        variations = grid_variations(self.shader_controller.bindings, SHEET_COLUMNS, SHEET_ROWS, across, down)
+        self.contact_sheet = ContactSheet(self.shader_controller, self.source, SHEET_COLUMNS, SHEET_ROWS,
+                                          variations, self.w, self.h)
+
+    @timed(SAVE_SECONDS)
+    def saveFromShader(self, filePath=None):
+        from readback import read_pixels, readback_array
+        from png_writer import write_png
+        # Save without any GUI elements
+        self.drawGenerated()
+        pixels = read_pixels(readback_array(self.w, self.h), flip=True)
+        if filePath is None:
+            scriptPath = os.path.dirname(os.path.realpath(__file__))
+            filePath = scriptPath + "/TESTSAVE_" + time.strftime("%Y%m%d_%H%M%S") + ".png"
+        print ("saved to {}".format(filePath))
+        write_png(filePath, pixels, self.w, self.h)
+
+    def on_draw(self):
+        self.drawGenerated()
+        self.updateStatusLabels()
+        self.drawGUI()
+        
+    @timed(FRAME_SECONDS)
+    def drawGenerated(self):
+        if self.contact_sheet is not None:
+            self.contact_sheet.draw()
+            return
+        if self.octave_cache is not None:
+            self.octave_cache.draw()
+            return
+        if self.render_graph is not None:
+            self.render_graph.draw()
+            return
+        shader = self.shader
+        if self.specializer is not None:
+            shader = self.specializer.program()
+            self.shader_controller.use_shader(shader)
+        if self.noise_volume is not None:
+            shader.bind()
+            self.noise_volume.bind(shader)
+        draw_shader(shader, self.shader_controller)
+
+    def drawGUI(self):
+        gl.glMatrixMode(gl.GL_PROJECTION)
+        gl.glLoadIdentity()
+        gl.glOrtho(0, self.w, 0, self.h, -1, 1)
+
+        if self.helpLabels is None:
+            self.create_key_help_labels()
+        for label in self.helpLabels:
+            label.draw()
+        for label in self.statusLabels:
+            label.draw()
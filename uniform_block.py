@@ -0,0 +1,188 @@
+''' This packs a shader's scalar and vector bindings into one std140 uniform block.
+    The bindings stay dicts, but writing a 'default' writes through to the block's
+    buffer, and the whole block is uploaded with one call when it has changed. '''
+
+import copy
+import ctypes
+import struct
+from pyglet import gl
+from glsl_source import find_uniform, replace_uniform, insert_after_header
+from metrics import REGISTRY
+
+BLOCK_UPLOADS = REGISTRY.counter('uniform_block_uploads_total', "Uniform block buffer uploads")
+
+# std140 base alignment, size and struct code for each member type
+STD140 = {
+    'float': (4, 4, 'f'), 'vec2': (8, 8, '2f'), 'vec3': (16, 12, '3f'), 'vec4': (16, 16, '4f'),
+    'int': (4, 4, 'i'), 'ivec2': (8, 8, '2i'), 'ivec3': (16, 12, '3i'), 'ivec4': (16, 16, '4i'),
+    'bool': (4, 4, 'I'),
+}
+BLOCK_NAME = 'ProcBindings'
+
+def components(var_type):
+    return int(var_type[-1]) if var_type[-1].isdigit() else 1
+
+def is_block_member(binding):
+    '''
+    Only single scalars and vectors go in the block, arrays stay plain uniforms.
+    Specialised bindings become constants in some programs, so they stay out too.
+    '''
+    var_type = binding.get('type')
+    if var_type not in STD140 or binding.get('specialize'):
+        return False
+    default = binding.get('default')
+    if isinstance(default, (list, tuple)):
+        return len(default) == components(var_type) > 1
+    return components(var_type) == 1
+
+def block_layout(bindings):
+    '''
+    Return the std140 layout of the block members in bindings, as a list of
+    (name, type, offset) in declaration order, and the block size.
+    '''
+    layout = []
+    offset = 0
+    for name, binding in bindings.items():
+        if not is_block_member(binding):
+            continue
+        alignment, size, _ = STD140[binding['type']]
+        offset = -(-offset // alignment) * alignment
+        layout.append((name, binding['type'], offset))
+        offset += size
+    # Blocks are padded to a vec4
+    return layout, -(-offset // 16) * 16
+
+class BlockBinding(dict):
+    ''' A binding whose 'default' is also held in a UniformBlock '''
+
+    def __init__(self, block, name, binding):
+        super(BlockBinding, self).__init__(binding)
+        self.block = block
+        self.name = name
+
+    def __setitem__(self, key, value):
+        super(BlockBinding, self).__setitem__(key, value)
+        if key == 'default':
+            self.block.pack(self.name, value)
+
+    def __deepcopy__(self, memo):
+        # Copies are plain bindings, a block belongs to one controller
+        return copy.deepcopy(dict(self), memo)
+
+class UniformBlock(object):
+    '''
+    std140 buffer holding the scalar and vector bindings of a ShaderController.
+    wrap_bindings() replaces those bindings with BlockBindings that write into it.
+    '''
+
+    def __init__(self, bindings, name=BLOCK_NAME):
+        self.name = name
+        self.layout, self.size = block_layout(bindings)
+        self.members = dict((member, (var_type, offset)) for member, var_type, offset in self.layout)
+        self.data = (ctypes.c_ubyte * max(self.size, 16))()
+        self.dirty = True
+        self.overridden = set()
+        self.buffer = None
+        self.binding_point = 0
+        self.bindings = bindings
+
+    def wrap_bindings(self):
+        '''
+        Replace the member bindings with BlockBindings, packing their values.
+        Returns a dict from the id of each replaced binding to its replacement.
+        '''
+        replaced = {}
+        for member in self.members:
+            binding = self.bindings[member]
+            wrapped = BlockBinding(self, member, binding)
+            self.bindings[member] = wrapped
+            replaced[id(binding)] = wrapped
+            self.pack(member, binding['default'])
+        return replaced
+
+    def pack(self, member, value):
+        '''Write a member's value into the buffer'''
+        var_type, offset = self.members[member]
+        if not isinstance(value, (list, tuple)):
+            value = [value]
+        code = STD140[var_type][2]
+        if var_type == 'bool':
+            value = [1 if v else 0 for v in value]
+        struct.pack_into('=' + code, self.data, offset, *value)
+        self.dirty = True
+
+    def unpack(self, member):
+        '''Read a member's value back from the buffer'''
+        var_type, offset = self.members[member]
+        values = struct.unpack_from('=' + STD140[var_type][2], self.data, offset)
+        if var_type == 'bool':
+            values = [bool(v) for v in values]
+        return values[0] if len(values) == 1 else list(values)
+
+    def override(self, member, value):
+        '''Pack a value without changing the binding, until the next restore'''
+        self.pack(member, value)
+        self.overridden.add(member)
+
+    def restore(self):
+        '''Put back binding values replaced by override'''
+        for member in self.overridden:
+            self.pack(member, self.bindings[member]['default'])
+        self.overridden.clear()
+
+    def declaration(self):
+        '''Return the GLSL declaration of the block'''
+        lines = ["layout(std140) uniform {} {{".format(self.name)]
+        for member, var_type, _ in self.layout:
+            lines.append("  {} {};".format(var_type, member))
+        lines.append("};")
+        return "\n".join(lines) + "\n"
+
+    def rewrite_source(self, source):
+        '''
+        Return shader source with the plain declarations of the members replaced by the
+        block, which is inserted after the #version and #extension lines.
+        '''
+        if not self.layout:
+            return source
+        for member, _, _ in self.layout:
+            if find_uniform(source, member) is not None:
+                source = replace_uniform(source, member)
+        header = "#extension GL_ARB_uniform_buffer_object : enable\n" + self.declaration()
+        return insert_after_header(source, header)
+
+    def bind(self, program, binding_point=0):
+        '''
+        Create the GL buffer and attach it to the block of the linked program. The
+        buffer goes on the binding point at each upload, as binding points belong to
+        a context and this may run before the drawing context exists.
+        '''
+        buffer_id = gl.GLuint(0)
+        gl.glGenBuffers(1, ctypes.byref(buffer_id))
+        self.buffer = buffer_id.value
+        gl.glBindBuffer(gl.GL_UNIFORM_BUFFER, self.buffer)
+        gl.glBufferData(gl.GL_UNIFORM_BUFFER, len(self.data), None, gl.GL_DYNAMIC_DRAW)
+        self.binding_point = binding_point
+        self.attach(program, binding_point)
+        self.dirty = True
+
+    def attach(self, program, binding_point=0):
+        '''Point another linked program's block at the binding point the buffer is on'''
+        index = gl.glGetUniformBlockIndex(program, self.name.encode('ascii'))
+        gl.glUniformBlockBinding(program, index, binding_point)
+
+    def upload(self):
+        '''
+        Put the buffer on its binding point in the current context, and upload the
+        whole block if anything changed since the last upload.
+        '''
+        if self.buffer is None:
+            return False
+        gl.glBindBufferBase(gl.GL_UNIFORM_BUFFER, self.binding_point, self.buffer)
+        if not self.dirty:
+            return False
+        gl.glBindBuffer(gl.GL_UNIFORM_BUFFER, self.buffer)
+        gl.glBufferSubData(gl.GL_UNIFORM_BUFFER, 0, len(self.data), self.data)
+        self.dirty = False
+        BLOCK_UPLOADS.inc()
+        return True
@@ -0,0 +1,194 @@
+''' Streams an unbounded world as square chunks addressed by integer chunk coordinates,
+    for shaders that place pixels with gl_FragCoord and the x and y bindings (tile,
+    perlin, spike...). Each chunk carries a border of pixels shared with its
+    neighbours, so chunks stitch without seams. Chunks are rendered on one background
+    thread that owns the GL context, kept in an LRU cache, and prefetched around a
+    position and ahead of a movement hint. '''
+
+from __future__ import print_function
+import itertools
+import threading
+import collections
+from concurrent.futures import Future
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+from procviewer import ShaderController, ShaderSource, read_shader_files
+from heightmap import heightmap_source
+
+# Requests made while someone waits go ahead of any prefetching
+DEMAND = 0
+
+def chunk_origin(chunk_x, chunk_y, chunk_size, border):
+    '''Return the world pixel at the bottom left of a chunk, border included'''
+    return chunk_x * chunk_size - border, chunk_y * chunk_size - border
+
+def prefetch_order(chunk_x, chunk_y, radius, move_x=0, move_y=0):
+    '''
+    Return (priority, chunk) for the chunks within radius of chunk_x, chunk_y and of the
+    chunk one step along the movement. Nearer chunks come first, and at the same
+    distance the chunks ahead do. The centre chunk is left out.
+    '''
+    move_x = (move_x > 0) - (move_x < 0)
+    move_y = (move_y > 0) - (move_y < 0)
+    order = []
+    for dx in range(-radius - 1, radius + 2):
+        for dy in range(-radius - 1, radius + 2):
+            distance = max(abs(dx), abs(dy))
+            ahead = max(abs(dx - move_x), abs(dy - move_y)) <= radius and dx * move_x + dy * move_y > 0
+            if distance and (distance <= radius or ahead):
+                order.append((DEMAND + 1 + 2 * distance - ahead, (chunk_x + dx, chunk_y + dy)))
+    return sorted(order)
+
+class ChunkWorld(object):
+    '''
+    Chunks of chunk_size + 2 * border pixels square, bottom row first, so chunk[j, i]
+    is world pixel (chunk_x * chunk_size - border + i, chunk_y * chunk_size - border + j).
+    render_factory is called once on the render thread and returns a function
+    render(x, y, size) that draws the size x size pixels with bottom left x, y.
+    '''
+
+    def __init__(self, render_factory, chunk_size=256, border=8, cache_chunks=64, prefetch_radius=1):
+        self.chunk_size = chunk_size
+        self.border = border
+        self.cache_chunks = cache_chunks
+        self.prefetch_radius = prefetch_radius
+        self.cache = collections.OrderedDict()
+        self.pending = {}
+        self.stats = {'hits': 0, 'misses': 0, 'rendered': 0, 'evicted': 0}
+        self.lock = threading.Lock()
+        self.requests = queue.PriorityQueue()
+        self.order = itertools.count()
+        self.thread = threading.Thread(target=self._run, args=(render_factory,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def request(self, chunk_x, chunk_y, priority=DEMAND):
+        '''Return a Future for a chunk, queueing it for rendering if it isn't cached'''
+        key = (chunk_x, chunk_y)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                future = Future()
+                future.set_result(self.cache[key])
+                return future
+            future = self.pending.get(key)
+            if future is None:
+                future = self.pending[key] = Future()
+            elif priority != DEMAND:
+                return future
+        # A chunk already queued for prefetching is queued again ahead of it
+        self.requests.put((priority, next(self.order), key))
+        return future
+
+    def chunk(self, chunk_x, chunk_y):
+        '''Return a chunk, waiting for it to render if it isn't cached'''
+        with self.lock:
+            self.stats['hits' if (chunk_x, chunk_y) in self.cache else 'misses'] += 1
+        return self.request(chunk_x, chunk_y).result()
+
+    def chunks(self, coordinates):
+        '''Yield the chunks for an iterable of (chunk_x, chunk_y), in order'''
+        for chunk_x, chunk_y in coordinates:
+            yield self.chunk(chunk_x, chunk_y)
+
+    def hint(self, chunk_x, chunk_y, move_x=0, move_y=0):
+        '''
+        Prefetch the chunks around chunk_x, chunk_y, and further out in the direction
+        of (move_x, move_y). Returns the Futures of the prefetched chunks.
+        '''
+        return [self.request(x, y, priority)
+                for priority, (x, y) in prefetch_order(chunk_x, chunk_y, self.prefetch_radius,
+                                                       move_x, move_y)]
+
+    def close(self):
+        '''Stop the render thread after the chunk it is on, cancelling the rest'''
+        self.requests.put((DEMAND - 1, next(self.order), None))
+        self.thread.join()
+        with self.lock:
+            for future in self.pending.values():
+                future.cancel()
+            self.pending.clear()
+
+    def _store(self, key, pixels):
+        with self.lock:
+            self.cache[key] = pixels
+            while len(self.cache) > self.cache_chunks:
+                self.cache.popitem(last=False)
+                self.stats['evicted'] += 1
+            self.stats['rendered'] += 1
+            return self.pending.pop(key, None)
+
+    def _run(self, render_factory):
+        '''Render thread, the only one that touches the GL context'''
+        render = error = None
+        try:
+            render = render_factory()
+        except Exception as failure:
+            error = failure
+        size = self.chunk_size + 2 * self.border
+        while True:
+            _, _, key = self.requests.get()
+            if key is None:
+                break
+            with self.lock:
+                future = self.pending.get(key)
+            if future is None or future.done():
+                # Already rendered for an earlier request
+                continue
+            try:
+                if error is not None:
+                    raise error
+                x, y = chunk_origin(key[0], key[1], self.chunk_size, self.border)
+                pixels = render(x, y, size)
+            except Exception as failure:
+                with self.lock:
+                    self.pending.pop(key, None)
+                future.set_exception(failure)
+                continue
+            self._store(key, pixels)
+            future.set_result(pixels)
+
+def shader_renderer(shader_path, pixel_format='R32F', controller_class=ShaderController, headless=True):
+    '''
+    Return a render factory for ChunkWorld drawing the shader at shader_path with its
+    saved bindings. R32F chunks hold the height from the HEIGHTMAP path (see
+    heightmap.py), RGBA8 chunks hold the colours.
+    '''
+    vertex_shader, fragment_shader = read_shader_files(shader_path)
+    if 'gl_FragCoord' not in fragment_shader:
+        raise ValueError("{} isn't placed by gl_FragCoord, so can't be split into chunks".format(shader_path))
+    bindings = controller_class(ShaderSource(vertex_shader, fragment_shader), shader_path).bindings
+    if pixel_format == 'R32F':
+        fragment_shader = heightmap_source(fragment_shader)
+
+    def render_factory():
+        import pyglet
+        # Has to be chosen before pyglet.gl is first imported
+        pyglet.options['headless'] = headless
+        from pyglet import gl
+        from shader import Shader
+        from offscreen import headless_context, Framebuffer, draw_shader
+        from readback import readback_array
+
+        context = headless_context()
+        shader = Shader(vertex_shader, fragment_shader)
+        controller = controller_class(shader, shader_path, bindings)
+        internal_format = gl.GL_R32F if pixel_format == 'R32F' else gl.GL_RGBA8
+        framebuffers = {}
+
+        def render(x, y, size):
+            if size not in framebuffers:
+                framebuffers[size] = Framebuffer(size, size, internal_format)
+            framebuffer = framebuffers[size]
+            framebuffer.bind()
+            # Shaders place pixels by gl_FragCoord, so moving x and y moves the chunk
+            draw_shader(shader, controller, controller.tile_uniforms(x, y))
+            framebuffer.unbind()
+            return framebuffer.read_into(readback_array(size, size, pixel_format), pixel_format)
+
+        # The hidden window has to live as long as the context is used
+        render.context = context
+        return render
+    return render_factory
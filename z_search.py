@@ -0,0 +1,158 @@
+''' The faster z search of the height shaders (spike, blobs). Their default path walks
+    down from zmax a level at a time until the noise reaches the threshold, evaluating
+    the noise at every level. Under Z_SEARCH they walk the same levels but only
+    evaluate where the shortfall, how far the last evaluation fell short, could have
+    closed. How fast it can close is Z_SEARCH_SLOPE times the shader's
+    shortfallScale(), the rate if every octave's noise changed by one per unit of its
+    own z, from the live bindings. The octaves never all change that fast at once, but
+    one octave alone can change three times as fast, so a bound skips nothing and the
+    fraction is measured from the noise instead. A skip that lands past the threshold
+    walks back to the first level that reached it, so the z only differs where the
+    noise crosses the threshold and back within one skip. This measures the fraction,
+    and compares the two paths: noise evaluations per pixel and the z found, through
+    the NumPy harness, and frame times on the compute path when there is one. '''
+
+from __future__ import print_function
+import re
+import argparse
+import numpy as np
+from glsl_source import insert_after_header
+
+SEARCH_DEFINE = 'Z_SEARCH'
+SEARCH_SHADERS = ('spike/working_shader', 'blobs/blobs_shader')
+# The function evaluating the noise, counted per pixel
+NOISE_FUNCTION = 'getSumFreq'
+# The z between the levels the slope is measured over. The shortfall is seen to change
+# faster the closer the levels are, so this is finer than the shaders' own.
+MEASURE_STEP = 0.005
+
+def search_source(fragment, slope=None):
+    '''Return fragment source taking the faster search, with the shader's slope unless given'''
+    header = "#define {}\n".format(SEARCH_DEFINE)
+    if slope is not None:
+        header += "#define {}_SLOPE {!r}\n".format(SEARCH_DEFINE, float(slope))
+    return insert_after_header(fragment, header)
+
+def probe_source(fragment):
+    '''
+    Return fragment source drawing the shortfall at the z_search_probe uniform's z to red,
+    and the shortfall's scale to green
+    '''
+    fragment = re.sub(r'\bvoid\s+main\s*\(\s*\)', 'void z_search_main()', search_source(fragment))
+    return fragment + ("\n\nuniform float z_search_probe;\n\nvoid main() {\n"
+                       "  gl_FragColor = vec4(shortfall(x + gl_FragCoord[0] * zoom, y + gl_FragCoord[1] * zoom,"
+                       " z_search_probe), shortfallScale(), 0.0, 1.0);\n}\n")
+
+def counting_source(fragment, function=NOISE_FUNCTION):
+    '''Return fragment source that writes the number of calls to function to green'''
+    definition = re.search(r'\b' + function + r'\s*\([^)]*\)\s*\{', fragment)
+    if definition is None:
+        raise ValueError("no {} defined".format(function))
+    fragment = fragment[:definition.end()] + "\n  z_search_calls += 1;" + fragment[definition.end():]
+    fragment = re.sub(r'\bvoid\s+main\s*\(\s*\)', 'void z_search_main()', fragment)
+    fragment = insert_after_header(fragment, "int z_search_calls = 0;\n")
+    return fragment + ("\n\nvoid main() {\n  z_search_main();\n"
+                       "  gl_FragColor = vec4(gl_FragColor.r, float(z_search_calls), gl_FragColor.ba);\n}\n")
+
+def level_step(bindings):
+    '''The z between levels: zdiff, or 1 / levels for blobs'''
+    if 'zdiff' in bindings:
+        return bindings['zdiff']['default']
+    levels = bindings['levels']['default']
+    return 1.0 / levels if levels > 0 else 1.0
+
+def load(shader_path):
+    from procviewer import ShaderController, ShaderSource, read_shader_files
+    from glsl_numpy import bindings_uniforms
+
+    source = ShaderSource(*read_shader_files(shader_path))
+    controller = ShaderController(source, shader_path)
+    return source, controller, bindings_uniforms(controller.bindings)
+
+def measure_slope(shader_path, width, height, step=MEASURE_STEP):
+    '''
+    Return the most the shortfall changes between neighbouring levels step apart per
+    unit of z, as a fraction of its scale, over a width x height view through the
+    NumPy harness.
+    '''
+    from glsl_numpy import compile_fragment
+
+    source, controller, uniforms = load(shader_path)
+    program = compile_fragment(probe_source(source.fragment_shader))
+    zmax = controller.bindings['zmax']['default']
+    zmin = controller.bindings['zmin']['default']
+    probes = [program.render(width, height, dict(uniforms, z_search_probe=zmax - level * step))
+              for level in range(max(int(np.ceil((zmax - zmin) / step)), 0) + 1)]
+    if len(probes) < 2:
+        return 0.0
+    shortfalls = np.array([probe[..., 0] for probe in probes])
+    return float((np.abs(np.diff(shortfalls, axis=0)).max(axis=0) / (step * probes[0][..., 1])).max())
+
+def evaluations(fragment, uniforms, width, height):
+    '''Render fragment through the NumPy harness, returning the z and the noise evaluations per pixel'''
+    from glsl_numpy import compile_fragment
+
+    rendered = compile_fragment(counting_source(fragment)).render(width, height, uniforms)
+    return rendered[..., 0], rendered[..., 1]
+
+def compare(shader_path, width, height, slope=None):
+    '''
+    Render the shader both ways, returning the noise evaluations per pixel of each
+    and the difference between the z found, in levels.
+    '''
+    source, controller, uniforms = load(shader_path)
+    linear_z, linear = evaluations(source.fragment_shader, uniforms, width, height)
+    searched_z, searched = evaluations(search_source(source.fragment_shader, slope), uniforms, width, height)
+    return linear, searched, np.abs(searched_z - linear_z) / level_step(controller.bindings)
+
+def time_compute(shader_path, size, frames, slope=None):
+    '''Seconds per size x size frame of the linear and the faster search on the compute path'''
+    from compute import ComputeKernel, time_frames
+
+    source, controller, uniforms = load(shader_path)
+    seconds = []
+    for fragment in (source.fragment_shader, search_source(source.fragment_shader, slope)):
+        kernel = ComputeKernel(fragment, controller, size, size)
+        seconds.append(time_frames(kernel.run, frames))
+        kernel.delete()
+    return seconds
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the linear and the faster z search.")
+    parser.add_argument('shaders', nargs='*', default=list(SEARCH_SHADERS))
+    parser.add_argument('--size', type=int, default=64, help="size of the NumPy renders")
+    parser.add_argument('--slope', type=float, help="fraction of the scale to search with, rather than the shader's own")
+    parser.add_argument('--measure', action='store_true', help="print the slope measured over each render")
+    parser.add_argument('--gpu-size', type=int, default=512, help="size of the compute renders")
+    parser.add_argument('--frames', type=int, default=10, help="compute frames to time, 0 for none")
+    args = parser.parse_args(argv)
+
+    print("{:<24} {:>12} {:>12} {:>10} {:>10}".format('shader', 'linear', 'search', 'same', 'worst'))
+    for shader_path in args.shaders:
+        if args.measure:
+            print("{:<24} slope {:.2f}".format(shader_path, measure_slope(shader_path, args.size, args.size)))
+        linear, searched, levels = compare(shader_path, args.size, args.size, args.slope)
+        print("{:<24} {:>12.1f} {:>12.1f} {:>9.1f}% {:>10.0f}".format(
+            shader_path, linear.mean(), searched.mean(), 100.0 * (levels < 0.5).mean(), levels.max()))
+    print("noise evaluations per pixel, pixels at the same level and the worst difference in levels")
+
+    if args.frames <= 0:
+        return
+    import pyglet
+    # Has to be chosen before pyglet.gl is first imported
+    pyglet.options['headless'] = True
+    from offscreen import headless_context
+    from compute import have_compute
+    context = headless_context()
+    if not have_compute():
+        print("no compute shaders to time the search with")
+    else:
+        print("{:<24} {:>12} {:>12} {:>8}".format('shader', 'linear ms', 'search ms', 'speedup'))
+        for shader_path in args.shaders:
+            linear, searched = time_compute(shader_path, args.gpu_size, args.frames, args.slope)
+            print("{:<24} {:>12.2f} {:>12.2f} {:>7.2f}x".format(
+                shader_path, linear * 1000.0, searched * 1000.0, linear / searched))
+    context.close()
+
+if __name__ == '__main__':
+    main()